@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+##############################################################################
+# Tracking of end-to-end alert latency.
+#
+# Each new shift found by the monitor carries timestamps for when it was
+# first observed, persisted, dispatched and acknowledged by the
+# notification provider.  This module keeps rolling percentiles of the
+# resulting latencies per notification channel, and checks them against
+# a service level objective (SLO).
+##############################################################################
+
+import time
+import collections
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Percentiles reported for each channel.
+PERCENTILES = (50, 95, 99)
+
+##############################################################################
+# Methods
+##############################################################################
+
+def nearestRankPercentile(sortedValues, p):
+    """
+    Returns the p-th percentile of a non-empty sorted list of values,
+    using the nearest-rank method.
+    """
+
+    rank = max(1, -(-p * len(sortedValues) // 100))
+    return sortedValues[int(rank) - 1]
+
+##############################################################################
+# Classes
+##############################################################################
+
+class RollingPercentiles:
+    """
+    Keeps the most recent samples of a measurement, bounded both by count
+    and by age, and computes percentiles over them.
+    """
+
+    def __init__(self, maxSamples=1000, windowSeconds=7 * 24 * 60 * 60):
+        self.maxSamples = maxSamples
+        self.windowSeconds = windowSeconds
+
+        # Deque of (timestamp, value) tuples, oldest first.
+        self.samples = collections.deque(maxlen=maxSamples)
+
+    def add(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.samples.append((timestamp, value))
+
+    def _expire(self, now):
+        cutoff = now - self.windowSeconds
+        while len(self.samples) > 0 and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def percentile(self, p, now=None):
+        """
+        Returns the p-th percentile (nearest-rank) of the samples in the
+        window, or None if there are no samples.
+        """
+
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        if len(self.samples) == 0:
+            return None
+
+        values = sorted(value for (timestamp, value) in self.samples)
+        return nearestRankPercentile(values, p)
+
+    def summary(self, now=None):
+        """
+        Returns a dict with keys 'count', 'max', and 'p50', 'p95', 'p99'.
+        Values are None if there are no samples.
+        """
+
+        if now is None:
+            now = time.time()
+        self._expire(now)
+
+        values = sorted(value for (timestamp, value) in self.samples)
+        rv = {"count": len(values), "max": None}
+        for p in PERCENTILES:
+            rv["p" + str(p)] = None
+        if len(values) == 0:
+            return rv
+
+        rv["max"] = values[-1]
+        for p in PERCENTILES:
+            rv["p" + str(p)] = nearestRankPercentile(values, p)
+        return rv
+
+
+class AlertLatencyTracker:
+    """
+    Keeps rolling latency percentiles per notification channel.
+
+    For a channel, the latency of a shift is the number of seconds from
+    when the monitor first observed the shift as available to when the
+    channel's provider acknowledged the notification.
+
+    The 'detection' series holds the number of seconds between the
+    previous poll of the shift's page and the poll that observed it.
+    The slot opened somewhere in that window, so adding it to a channel's
+    latency bounds the time from the slot opening to delivery.
+    """
+
+    def __init__(self, sloSeconds, sloPercentile=95,
+                 maxSamples=1000, windowSeconds=7 * 24 * 60 * 60):
+        self.sloSeconds = sloSeconds
+        self.sloPercentile = sloPercentile
+        self.maxSamples = maxSamples
+        self.windowSeconds = windowSeconds
+
+        # Dict of series name to RollingPercentiles.
+        self.series = {}
+
+    def _getSeries(self, name):
+        if name not in self.series:
+            self.series[name] = RollingPercentiles(self.maxSamples,
+                                                   self.windowSeconds)
+        return self.series[name]
+
+    def recordShift(self, shift):
+        """
+        Records the latencies of a shift whose notifications were sent.
+
+        Returns:
+        dict of series name to float latency seconds recorded for this shift.
+        """
+
+        latencies = {}
+        if shift.observedTimestamp is None:
+            return latencies
+
+        if shift.previousObservedTimestamp is not None:
+            latencies["detection"] = \
+                shift.observedTimestamp - shift.previousObservedTimestamp
+
+        for (channel, ackTimestamp) in shift.acknowledgedTimestamps.items():
+            latencies[channel] = ackTimestamp - shift.observedTimestamp
+
+        for (name, latency) in latencies.items():
+            self._getSeries(name).add(latency)
+        return latencies
+
+    def summaries(self):
+        """
+        Returns a dict of series name to the series' summary dict
+        (see RollingPercentiles.summary()).
+        """
+
+        now = time.time()
+        rv = {}
+        for (name, series) in sorted(self.series.items()):
+            rv[name] = series.summary(now)
+        return rv
+
+    def getBreachedChannels(self):
+        """
+        Returns a list of the channel names whose SLO percentile latency
+        is above the SLO.  The 'detection' series is not a channel and is
+        not checked.
+        """
+
+        breached = []
+        key = "p" + str(self.sloPercentile)
+        for (name, summary) in self.summaries().items():
+            if name == "detection":
+                continue
+            if summary[key] is not None and summary[key] > self.sloSeconds:
+                breached.append(name)
+        return breached
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+##############################################################################
+# Benchmarks for the parse, diff and persist stages of the monitor.
+#
+# Runs getShiftsFromHtml() from lcplparse.py, and
+# getNewShiftsAvailableForSignup() and updateActiveUrlsFromHtml() from
+# lcplstore.py, against the captured page in data/ and against larger
+# synthetic variants of it, using a scratch database.  Reports throughput,
+# peak memory and database statements per cycle.  Also measures the time
+# taken to import each module of the monitor in a fresh interpreter.  Can
+# save and compare against a baseline to catch regressions.
+#
+# Usage:
+#   python3 src/benchmark.py                  (run and compare to baseline)
+#   python3 src/benchmark.py --save-baseline  (run and save as baseline)
+##############################################################################
+
+import sys
+import os
+import json
+import time
+import optparse
+import tempfile
+import subprocess
+import tracemalloc
+
+import lcplcommon
+import lcplparse
+import lcplstore
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Captured SignUpGenius page used as the benchmark fixture.
+FIXTURE_FILENAME = \
+    os.path.abspath(os.path.join(lcplcommon.DATA_DIR,
+                                 "4090d4aaeaf2ba7f58-page8"))
+
+# Default file path of the saved baseline results.
+BASELINE_FILENAME = \
+    os.path.abspath(os.path.join(lcplcommon.DATA_DIR,
+                                 "benchmark_baseline.json"))
+
+# Row multipliers of the synthetic variants.  1 is the fixture itself.
+DEFAULT_ROW_MULTIPLIERS = [1, 5, 20]
+
+# Results where higher is better, and where lower is better.
+HIGHER_IS_BETTER = ["parsePagesPerSecond",
+                    "parseRowsPerSecond",
+                    "persistRowsPerSecond",
+                    "updateUrlsPagesPerSecond"]
+LOWER_IS_BETTER = ["peakMemoryBytes",
+                   "dbStatementsFirstCycle",
+                   "dbStatementsPerCycle",
+                   "importSeconds"]
+
+# Modules whose import time is measured, cheapest first.  Importing
+# lcplpagesubs imports the whole monitor.
+STARTUP_MODULES = ["lcplcommon",
+                   "lcplparse",
+                   "lcplstore",
+                   "lcplnotify",
+                   "lcplfetch",
+                   "lcplsource",
+                   "lcplpagesubs"]
+
+##############################################################################
+# Classes
+##############################################################################
+
+class StatementCounter:
+    """
+    Counts the SQL statements executed on a sqlite3 connection.
+    """
+
+    def __init__(self, conn):
+        self.count = 0
+        conn.set_trace_callback(self._callback)
+
+    def _callback(self, statement):
+        self.count += 1
+
+    def reset(self):
+        count = self.count
+        self.count = 0
+        return count
+
+##############################################################################
+# Methods
+##############################################################################
+
+def readFixture():
+    with open(FIXTURE_FILENAME, "r", encoding="UTF-8") as f:
+        return f.read()
+
+
+def makeSyntheticPage(html, rowMultiplier):
+    """
+    Returns a copy of the fixture page whose shifts table has its data
+    rows repeated rowMultiplier times.  In the repeated copies, every
+    other "Already filled" slot is turned into a "Sign Up" slot, so that
+    both statuses are parsed.
+    """
+
+    if rowMultiplier <= 1:
+        return html
+
+    tableStart = html.find('class="SUGtableouter"')
+    headerEnd = html.find("</tr>", tableStart) + len("</tr>")
+    tableEnd = html.rfind("</table>")
+    rowsHtml = html[headerEnd:tableEnd]
+
+    parts = [html[:tableEnd]]
+    for i in range(1, rowMultiplier):
+        copyHtml = rowsHtml
+        if i % 2 == 1:
+            copyHtml = copyHtml.replace(
+                '<span class="SUGsignups">Already filled</span>',
+                '<span class="SUGbutton">Sign Up</span>')
+        parts.append(copyHtml)
+    parts.append(html[tableEnd:])
+    return "".join(parts)
+
+
+def initializeScratchDatabase(dirname):
+    """
+    Initializes a new database in the given directory.
+    """
+
+    lcplstore.initializeDatabase(os.path.join(dirname, "benchmark.db"))
+
+
+def benchmarkVariant(html, url, numIterations):
+    """
+    Benchmarks the parse, diff/persist and URL update stages on one page.
+
+    Returns:
+    dict of result name to value.
+    """
+
+    htmlTup = (url, html, time.time())
+    counter = StatementCounter(lcplstore.conn)
+
+    # First cycle: every row is new, so every row is inserted.
+    shifts = lcplparse.getShiftsFromHtml(htmlTup)
+    counter.reset()
+    startTime = time.perf_counter()
+    lcplstore.getNewShiftsAvailableForSignup(shifts)
+    lcplstore.updateActiveUrlsFromHtml(htmlTup, False)
+    firstCycleSeconds = time.perf_counter() - startTime
+    dbStatementsFirstCycle = counter.reset()
+
+    parseSeconds = 0.0
+    persistSeconds = 0.0
+    updateUrlsSeconds = 0.0
+    for i in range(numIterations):
+        startTime = time.perf_counter()
+        shifts = lcplparse.getShiftsFromHtml(htmlTup)
+        parseSeconds += time.perf_counter() - startTime
+
+        startTime = time.perf_counter()
+        lcplstore.getNewShiftsAvailableForSignup(shifts)
+        persistSeconds += time.perf_counter() - startTime
+
+        startTime = time.perf_counter()
+        lcplstore.updateActiveUrlsFromHtml(htmlTup, False)
+        updateUrlsSeconds += time.perf_counter() - startTime
+    dbStatementsPerCycle = counter.reset() / numIterations
+
+    # Peak memory of one more cycle, measured separately since tracing
+    # slows everything down.
+    tracemalloc.start()
+    shifts = lcplparse.getShiftsFromHtml(htmlTup)
+    lcplstore.getNewShiftsAvailableForSignup(shifts)
+    lcplstore.updateActiveUrlsFromHtml(htmlTup, False)
+    peakMemoryBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    lcplstore.conn.set_trace_callback(None)
+
+    numRows = len(shifts)
+    return {
+        "pageBytes": len(html.encode("UTF-8")),
+        "rows": numRows,
+        "parsePagesPerSecond": numIterations / parseSeconds,
+        "parseRowsPerSecond": numIterations * numRows / parseSeconds,
+        "persistRowsPerSecond": numIterations * numRows / persistSeconds,
+        "updateUrlsPagesPerSecond": numIterations / updateUrlsSeconds,
+        "firstCycleSeconds": firstCycleSeconds,
+        "dbStatementsFirstCycle": dbStatementsFirstCycle,
+        "dbStatementsPerCycle": dbStatementsPerCycle,
+        "peakMemoryBytes": peakMemoryBytes,
+        }
+
+
+def runBenchmarks(rowMultipliers, numIterations):
+    """
+    Runs the benchmark for the fixture and each synthetic variant.
+
+    Returns:
+    dict of variant name to its results dict.
+    """
+
+    fixtureHtml = readFixture()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="lcplpagesubs-bench-") as dirname:
+        initializeScratchDatabase(dirname)
+        try:
+            for rowMultiplier in rowMultipliers:
+                name = "page8-x" + str(rowMultiplier)
+                url = lcplcommon.baseUrl + "benchmark-" + name
+                html = makeSyntheticPage(fixtureHtml, rowMultiplier)
+                results[name] = benchmarkVariant(html, url, numIterations)
+        finally:
+            lcplstore.closeDatabase()
+    return results
+
+
+def measureImportSeconds(moduleName):
+    """
+    Returns the float number of seconds taken to import the given module
+    in a fresh interpreter, not counting the interpreter's own startup.
+    """
+
+    code = "import time\n" + \
+        "startTime = time.perf_counter()\n" + \
+        "import " + moduleName + "\n" + \
+        "print(time.perf_counter() - startTime)\n"
+    output = subprocess.check_output([sys.executable, "-c", code],
+                                     cwd=lcplcommon.SRC_DIR)
+    return float(output.decode("UTF-8").strip())
+
+
+def runStartupBenchmarks(numIterations):
+    """
+    Measures the import time of each module in STARTUP_MODULES, taking the
+    fastest of numIterations runs to filter out noise.
+
+    Returns:
+    dict of variant name to its results dict.
+    """
+
+    results = {}
+    for moduleName in STARTUP_MODULES:
+        importSeconds = min(measureImportSeconds(moduleName)
+                            for i in range(numIterations))
+        results["import-" + moduleName] = {"importSeconds": importSeconds}
+    return results
+
+
+def compareToBaseline(results, baseline, tolerance):
+    """
+    Compares results against a baseline.
+
+    Returns:
+    list of str, each describing a regression beyond the tolerance.
+    """
+
+    regressions = []
+    for (name, variantResults) in sorted(results.items()):
+        baselineResults = baseline.get(name)
+        if baselineResults is None:
+            continue
+        for key in HIGHER_IS_BETTER:
+            if key in baselineResults and \
+                    variantResults[key] < baselineResults[key] * (1 - tolerance):
+                regressions.append(name + ": " + key + " dropped from " +
+                                   "{:.1f} to {:.1f}".format(
+                                       baselineResults[key],
+                                       variantResults[key]))
+        for key in LOWER_IS_BETTER:
+            if key in baselineResults and \
+                    variantResults[key] > baselineResults[key] * (1 + tolerance):
+                regressions.append(name + ": " + key + " rose from " +
+                                   "{:.1f} to {:.1f}".format(
+                                       baselineResults[key],
+                                       variantResults[key]))
+    return regressions
+
+
+def printResults(results):
+    lineFormat = "{:<12} {:>6} {:>9} {:>10} {:>11} {:>11} {:>9} {:>9} {:>10}"
+    print(lineFormat.format("variant", "rows", "KB", "pages/s", "rows/s",
+                            "persist/s", "db/1st", "db/cyc", "peak KB"))
+    for (name, r) in results.items():
+        if "rows" not in r:
+            continue
+        print(lineFormat.format(name,
+                                r["rows"],
+                                r["pageBytes"] // 1024,
+                                "{:.1f}".format(r["parsePagesPerSecond"]),
+                                "{:.1f}".format(r["parseRowsPerSecond"]),
+                                "{:.1f}".format(r["persistRowsPerSecond"]),
+                                r["dbStatementsFirstCycle"],
+                                "{:.1f}".format(r["dbStatementsPerCycle"]),
+                                r["peakMemoryBytes"] // 1024))
+
+    print("")
+    print("{:<24} {:>10}".format("startup", "import ms"))
+    for (name, r) in results.items():
+        if "importSeconds" not in r:
+            continue
+        print("{:<24} {:>10.1f}".format(name, r["importSeconds"] * 1000))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--iterations", type="int", default=5,
+                      help="Timed iterations per variant [default %default]")
+    parser.add_option("-m", "--multipliers", default=",".join(
+                          str(m) for m in DEFAULT_ROW_MULTIPLIERS),
+                      help="Comma-separated row multipliers of the " +
+                           "synthetic variants [default %default]")
+    parser.add_option("-b", "--baseline", default=BASELINE_FILENAME,
+                      help="Baseline results file [default %default]")
+    parser.add_option("-s", "--save-baseline", action="store_true",
+                      help="Save the results as the new baseline")
+    parser.add_option("-t", "--tolerance", type="float", default=0.2,
+                      help="Allowed fractional regression against the " +
+                           "baseline [default %default]")
+    parser.add_option("-l", "--log-level", default="WARNING",
+                      help="Level of the 'main' and 'html' loggers while " +
+                           "benchmarking.  Production runs at DEBUG " +
+                           "[default %default]")
+    options, _ = parser.parse_args()
+
+    logLevel = options.log_level.upper()
+    lcplcommon.log.setLevel(logLevel)
+    lcplcommon.htmlLog.setLevel(logLevel)
+
+    rowMultipliers = [int(m) for m in options.multipliers.split(",")]
+    results = runBenchmarks(rowMultipliers, options.iterations)
+    results.update(runStartupBenchmarks(options.iterations))
+    printResults(results)
+
+    if options.save_baseline:
+        with open(options.baseline, "w", encoding="UTF-8") as f:
+            json.dump({"logLevel": logLevel, "results": results},
+                      f, indent=2, sort_keys=True)
+        print("Saved baseline to: " + options.baseline)
+        return 0
+
+    if not os.path.isfile(options.baseline):
+        print("No baseline to compare against.  " +
+              "Run with --save-baseline to create one.")
+        return 0
+
+    with open(options.baseline, "r", encoding="UTF-8") as f:
+        baseline = json.load(f)
+    if baseline.get("logLevel") != logLevel:
+        print("Warning: baseline was recorded with log level " +
+              str(baseline.get("logLevel")) + ", not " + logLevel + ".")
+
+    regressions = compareToBaseline(results, baseline.get("results", {}),
+                                    options.tolerance)
+    if len(regressions) > 0:
+        print("Regressions against baseline " + options.baseline + ":")
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+
+    print("No regressions against baseline " + options.baseline + ".")
+    return 0
+
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+##############################################################################
+# Opt-in profiling of the monitor's poll cycles.
+#
+# Every Nth poll cycle is run under cProfile.  The raw profile is written
+# as a .pstats file to a rotating directory, and a summary of the hottest
+# functions is written to a JSON file for the status server to show.
+##############################################################################
+
+import os
+import glob
+import time
+import datetime
+import cProfile
+import pstats
+import monitorstate
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Name of the summary file written in the profile output directory.
+SUMMARY_FILENAME = "summary.json"
+
+##############################################################################
+# Classes
+##############################################################################
+
+class CycleProfiler:
+    """
+    Profiles every Nth poll cycle with cProfile.
+
+    Usage:
+        if profiler.shouldProfile(cycleNumber):
+            profiler.start(cycleNumber)
+        ... run the cycle ...
+        profiler.stop()
+    """
+
+    def __init__(self, outputDir, everyNCycles=0, maxFiles=20,
+                 numTopFunctions=25):
+        """
+        Arguments:
+        outputDir       - str containing the directory to write to.
+        everyNCycles    - int.  Every Nth cycle is profiled.
+                          0 disables profiling.
+        maxFiles        - int maximum number of .pstats files kept.
+        numTopFunctions - int number of functions listed in the summary.
+        """
+
+        self.outputDir = outputDir
+        self.everyNCycles = everyNCycles
+        self.maxFiles = maxFiles
+        self.numTopFunctions = numTopFunctions
+
+        self.profile = None
+        self.cycleNumber = None
+        self.startTime = None
+
+    def isEnabled(self):
+        return self.everyNCycles > 0
+
+    def isActive(self):
+        return self.profile is not None
+
+    def shouldProfile(self, cycleNumber):
+        return self.isEnabled() and cycleNumber % self.everyNCycles == 0
+
+    def start(self, cycleNumber):
+        self.cycleNumber = cycleNumber
+        self.startTime = time.time()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stops profiling, writes the .pstats file and the summary file,
+        and removes the oldest .pstats files beyond maxFiles.
+
+        Returns:
+        str containing the path of the .pstats file written,
+        or None if profiling was not active.
+        """
+
+        if self.profile is None:
+            return None
+
+        profile = self.profile
+        profile.disable()
+        self.profile = None
+        elapsedSeconds = time.time() - self.startTime
+
+        os.makedirs(self.outputDir, exist_ok=True)
+        utcDttm = datetime.datetime.utcnow()
+        pstatsFilename = os.path.join(
+            self.outputDir,
+            "cycle-" + utcDttm.strftime("%Y%m%dT%H%M%S") + "-" +
+            str(self.cycleNumber).zfill(8) + ".pstats")
+        profile.dump_stats(pstatsFilename)
+
+        summary = {
+            "cycleNumber": self.cycleNumber,
+            "utcDttm": utcDttm.isoformat(),
+            "pstatsFilename": pstatsFilename,
+            "elapsedSeconds": elapsedSeconds,
+            "topFunctions": getTopFunctions(profile, self.numTopFunctions),
+            }
+        monitorstate.writeJsonFileAtomically(
+            os.path.join(self.outputDir, SUMMARY_FILENAME), summary)
+
+        self._rotate()
+        return pstatsFilename
+
+    def _rotate(self):
+        filenames = sorted(glob.glob(os.path.join(self.outputDir,
+                                                  "cycle-*.pstats")))
+        for filename in filenames[:-self.maxFiles]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+##############################################################################
+# Methods
+##############################################################################
+
+def getTopFunctions(profile, numTopFunctions):
+    """
+    Returns a list of dicts describing the functions with the most
+    self time in the given cProfile.Profile, hottest first.
+    """
+
+    stats = pstats.Stats(profile)
+    rows = []
+    for ((filename, lineNumber, funcName), (primitiveCalls, numCalls,
+                                            totalSeconds, cumulativeSeconds,
+                                            callers)) in stats.stats.items():
+        rows.append({
+            "function": os.path.basename(filename) + ":" +
+                        str(lineNumber) + "(" + funcName + ")",
+            "calls": numCalls,
+            "totalSeconds": totalSeconds,
+            "cumulativeSeconds": cumulativeSeconds,
+            })
+
+    rows.sort(key=lambda row: row["totalSeconds"], reverse=True)
+    return rows[:numTopFunctions]
+
+
+def readSummary(outputDir):
+    """
+    Returns the summary dict of the latest profiled cycle, or None.
+    """
+
+    return monitorstate.readJsonFile(os.path.join(outputDir,
+                                                  SUMMARY_FILENAME))
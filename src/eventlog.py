@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+##############################################################################
+# Append-only log of the events published by the monitor.
+#
+# The monitor appends an event for every change of a shift's status (see
+# lcplstore.getNewShiftsAvailableForSignup()), and the status server streams
+# them to clients (see serverstatus.py), so downstream tools learn about
+# changes without polling the database or parsing logs.
+#
+# Events are JSON objects, one per line, in segment files of a directory.
+# Each event has an int 'id', increasing by one from 1, which clients resume
+# from.  A segment is named after the id of its first event, zero-padded so
+# that segments sort by name, and a new segment is started once the last
+# one is SEGMENT_MAX_BYTES long.  Old segments are pruned as a whole.
+#
+# Several writers (workers) can append to the same log: appends hold an
+# exclusive lock on a lock file in the directory.  Readers take no lock, and
+# only read complete lines.
+#
+# Usage:
+#   python3 src/eventlog.py data/lcplpagesubs.events           (stats)
+#   python3 src/eventlog.py --after=100 data/lcplpagesubs.events
+##############################################################################
+
+import os
+import sys
+import json
+import time
+import fcntl
+import optparse
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Default number of bytes after which a new segment is started.
+SEGMENT_MAX_BYTES = 1024 * 1024
+
+# Suffix of segment file names, and name of the lock file.
+SEGMENT_SUFFIX = ".jsonl"
+LOCK_FILENAME = ".lock"
+
+# Number of bytes read back from the end of a segment to find its last
+# event.  Must be larger than the longest event.
+TAIL_READ_BYTES = 64 * 1024
+
+##############################################################################
+# Classes
+##############################################################################
+
+class EventLog:
+    """
+    Append-only log of JSON events in a directory of segment files.
+    """
+
+    def __init__(self, dirname, segmentMaxBytes=SEGMENT_MAX_BYTES):
+        """
+        Arguments:
+        dirname         - str path of the directory of the segments.  It is
+                          created when the first events are appended.
+        segmentMaxBytes - int number of bytes after which a new segment is
+                          started.
+        """
+
+        self.dirname = dirname
+        self.segmentMaxBytes = segmentMaxBytes
+
+    def getSegmentIds(self):
+        """
+        Returns the sorted list of int ids of the first event of each
+        segment.
+        """
+
+        try:
+            filenames = os.listdir(self.dirname)
+        except FileNotFoundError:
+            return []
+        segmentIds = []
+        for filename in filenames:
+            if filename.endswith(SEGMENT_SUFFIX) and \
+                    filename[:-len(SEGMENT_SUFFIX)].isdigit():
+                segmentIds.append(int(filename[:-len(SEGMENT_SUFFIX)]))
+        segmentIds.sort()
+        return segmentIds
+
+    def getSegmentFilename(self, segmentId):
+        """
+        Returns the str path of the segment starting at the given event id.
+        """
+
+        return os.path.join(self.dirname,
+                            "{:020d}".format(segmentId) + SEGMENT_SUFFIX)
+
+    def getFirstId(self):
+        """
+        Returns the int id of the oldest event kept, or the id the next
+        event will get if the log is empty.
+        """
+
+        segmentIds = self.getSegmentIds()
+        if len(segmentIds) == 0:
+            return 1
+        return segmentIds[0]
+
+    def getLastId(self):
+        """
+        Returns the int id of the latest event, or 0 if there is none.
+        """
+
+        segmentIds = self.getSegmentIds()
+        if len(segmentIds) == 0:
+            return 0
+        lastId = self._getLastIdOfSegment(segmentIds[-1])
+        if lastId is None:
+            return segmentIds[-1] - 1
+        return lastId
+
+    def _getLastIdOfSegment(self, segmentId):
+        """
+        Returns the int id of the last complete event of the given segment,
+        or None if it has none.
+        """
+
+        with open(self.getSegmentFilename(segmentId), "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_READ_BYTES))
+            data = f.read()
+        lines = data.split(b"\n")
+        # The last element is the incomplete line after the last newline.
+        for line in reversed(lines[:-1]):
+            try:
+                return int(json.loads(line)["id"])
+            except (ValueError, KeyError, TypeError):
+                continue
+        return None
+
+    def append(self, events):
+        """
+        Appends the given events, setting the 'id' of each.
+
+        Arguments:
+        events - list of JSON-serializable dicts.
+
+        Returns:
+        int id of the last event appended, or of the latest event if the
+        list is empty.
+        """
+
+        if len(events) == 0:
+            return self.getLastId()
+
+        os.makedirs(self.dirname, exist_ok=True)
+        with open(os.path.join(self.dirname, LOCK_FILENAME), "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                segmentIds = self.getSegmentIds()
+                lastId = self.getLastId()
+                segmentId = None
+                if len(segmentIds) > 0:
+                    segmentId = segmentIds[-1]
+                    filename = self.getSegmentFilename(segmentId)
+                    self._truncateIncompleteLine(filename)
+                    if os.path.getsize(filename) >= self.segmentMaxBytes:
+                        segmentId = None
+                if segmentId is None:
+                    segmentId = lastId + 1
+
+                lines = []
+                for event in events:
+                    lastId += 1
+                    event["id"] = lastId
+                    lines.append(json.dumps(event, sort_keys=True) + "\n")
+                with open(self.getSegmentFilename(segmentId), "a",
+                          encoding="UTF-8") as f:
+                    f.write("".join(lines))
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+        return lastId
+
+    def _truncateIncompleteLine(self, filename):
+        """
+        Removes an incomplete last line from the given segment, left by a
+        writer that died in the middle of an append.
+        """
+
+        with open(filename, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            f.seek(max(0, size - TAIL_READ_BYTES))
+            data = f.read()
+            f.truncate(size - len(data) + data.rfind(b"\n") + 1)
+
+    def read(self, afterId, maxNumEvents=100):
+        """
+        Returns a list of at most maxNumEvents dicts of the events with ids
+        greater than afterId, oldest first.
+        """
+
+        return EventLogReader(self, afterId).readEvents(maxNumEvents)
+
+    def prune(self, retentionSeconds, now=None):
+        """
+        Removes the segments last written more than retentionSeconds ago.
+        The latest segment is always kept.
+
+        Returns:
+        int number of segments removed.
+        """
+
+        if now is None:
+            now = time.time()
+        numSegments = 0
+        for segmentId in self.getSegmentIds()[:-1]:
+            filename = self.getSegmentFilename(segmentId)
+            try:
+                if os.path.getmtime(filename) < now - retentionSeconds:
+                    os.remove(filename)
+                    numSegments += 1
+            except FileNotFoundError:
+                pass
+        return numSegments
+
+    def getStats(self):
+        """
+        Returns a dict of stats about the log.
+        """
+
+        segmentIds = self.getSegmentIds()
+        numBytes = 0
+        for segmentId in segmentIds:
+            numBytes += os.path.getsize(self.getSegmentFilename(segmentId))
+        return {
+            "segments": len(segmentIds),
+            "bytes": numBytes,
+            "firstId": self.getFirstId(),
+            "lastId": self.getLastId(),
+            }
+
+
+class EventLogReader:
+    """
+    Cursor over an EventLog, reading the events after a given id and then
+    following the log as events are appended.  Keeps its place as a segment
+    and a byte position, so following the log only reads the new bytes.
+    """
+
+    def __init__(self, eventLog, afterId):
+        """
+        Arguments:
+        eventLog - EventLog to read.
+        afterId  - int id of the last event already seen.  Reading starts
+                   at the next one.
+        """
+
+        self.eventLog = eventLog
+        self.lastId = afterId
+        self.segmentId = None
+        self.position = 0
+
+        # Number of events after afterId that were pruned before they could
+        # be read.
+        self.numMissedEvents = 0
+
+    def _seek(self):
+        """
+        Positions the cursor at the start of the segment holding the event
+        after lastId, or the oldest segment if that event was pruned.
+        Returns False if the log has no segments yet.
+        """
+
+        segmentIds = self.eventLog.getSegmentIds()
+        if len(segmentIds) == 0:
+            return False
+        self.segmentId = segmentIds[0]
+        for segmentId in segmentIds:
+            if segmentId <= self.lastId + 1:
+                self.segmentId = segmentId
+        self.position = 0
+        if self.segmentId > self.lastId + 1:
+            self.numMissedEvents += self.segmentId - self.lastId - 1
+            self.lastId = self.segmentId - 1
+        return True
+
+    def _readLines(self, maxNumEvents):
+        """
+        Returns a list of the events of the current segment after the
+        current position, up to maxNumEvents, moving the position past the
+        complete lines read.
+        """
+
+        events = []
+        filename = self.eventLog.getSegmentFilename(self.segmentId)
+        with open(filename, "rb") as f:
+            f.seek(self.position)
+            while len(events) < maxNumEvents:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                self.position += len(line)
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("id", 0) > self.lastId:
+                    self.lastId = event["id"]
+                    events.append(event)
+        return events
+
+    def readEvents(self, maxNumEvents=100):
+        """
+        Returns a list of at most maxNumEvents dicts of the events appended
+        after the last one read, oldest first.  Returns an empty list if
+        there are none yet.
+        """
+
+        if self.segmentId is None and not self._seek():
+            return []
+
+        events = []
+        while len(events) < maxNumEvents:
+            try:
+                newEvents = self._readLines(maxNumEvents - len(events))
+                if len(newEvents) > 0:
+                    events.extend(newEvents)
+                    continue
+
+                # Once a later segment exists, nothing more is appended to
+                # this one.  Read it once more, since lines may have been
+                # appended since the read above, before moving on.
+                laterSegmentIds = [segmentId for segmentId in
+                                   self.eventLog.getSegmentIds()
+                                   if segmentId > self.segmentId]
+                if len(laterSegmentIds) == 0:
+                    break
+                newEvents = self._readLines(maxNumEvents - len(events))
+                if len(newEvents) > 0:
+                    events.extend(newEvents)
+                    continue
+                self.segmentId = laterSegmentIds[0]
+                self.position = 0
+            except FileNotFoundError:
+                # The segment was pruned.
+                if not self._seek():
+                    break
+        return events
+
+##############################################################################
+# Main
+##############################################################################
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] EVENT_LOG_DIR")
+    parser.add_option("-a", "--after", type="int", default=None,
+                      help="Print the events after this id")
+    parser.add_option("-n", "--limit", type="int", default=100,
+                      help="Print at most this many events [default %default]")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 2
+
+    eventLog = EventLog(args[0])
+    if options.after is None:
+        print(json.dumps(eventLog.getStats(), indent=2, sort_keys=True))
+        return 0
+    for event in eventLog.read(options.after, options.limit):
+        print(json.dumps(event, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+##############################################################################
+# Archive of fetched pages, for recording and replaying monitor runs, and
+# for keeping snapshots of pages for later investigation.
+#
+# An archive is a sqlite database file.  Each distinct page body is stored
+# once, zlib-compressed and keyed by its SHA-256 hash, and every fetch is
+# recorded as a small row pointing at its body, with an optional reason
+# (e.g. why a snapshot of the page was taken).
+##############################################################################
+
+import zlib
+import time
+import sqlite3
+import hashlib
+import datetime
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# zlib compression level used for page bodies.
+COMPRESSION_LEVEL = 6
+
+##############################################################################
+# Classes
+##############################################################################
+
+class FetchRecord:
+    def __init__(self):
+        self.cycle = None
+        self.url = None
+        self.fetchTimestamp = None
+        self.statusCode = None
+        self.sha256 = None
+        self.reason = None
+
+    def __str__(self):
+        rv = "FetchRecord(cycle=" + str(self.cycle) + "," + \
+                "url=" + str(self.url) + "," + \
+                "fetchTimestamp=" + str(self.fetchTimestamp) + "," + \
+                "statusCode=" + str(self.statusCode) + "," + \
+                "sha256=" + str(self.sha256) + "," + \
+                "reason=" + str(self.reason) + ")"
+        return rv
+
+
+class FetchArchive:
+    """
+    Content-deduplicated, compressed archive of fetched pages.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("create table if not exists bodies " +
+            "(sha256 text primary key, " +
+            "body blob)")
+        self.cursor.execute("create table if not exists fetches " +
+            "(cycle integer, " +
+            "url text, " +
+            "fetch_utc_dttm text, " +
+            "fetch_timestamp real, " +
+            "status_code integer, " +
+            "sha256 text, " +
+            "reason text)")
+
+        # Archives written before the 'reason' column existed.
+        self.cursor.execute("pragma table_info(fetches)")
+        columnNames = [tup[1] for tup in self.cursor.fetchall()]
+        if "reason" not in columnNames:
+            self.cursor.execute("alter table fetches add column reason text")
+
+        self.cursor.execute("create index if not exists " +
+            "fetches_cycle_idx on fetches (cycle)")
+        self.cursor.execute("create index if not exists " +
+            "fetches_url_idx on fetches (url, fetch_timestamp)")
+        self.cursor.execute("create index if not exists " +
+            "fetches_timestamp_idx on fetches (fetch_timestamp)")
+        self.cursor.execute("create index if not exists " +
+            "fetches_sha256_idx on fetches (sha256)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def putBody(self, body):
+        """
+        Stores a page body, if not already stored.
+
+        Arguments:
+        body - str containing the page body.
+
+        Returns:
+        str containing the SHA-256 hex digest of the body.
+        """
+
+        data = body.encode("UTF-8")
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.cursor.execute("select 1 from bodies where sha256 = ?",
+                            (sha256,))
+        if self.cursor.fetchone() is None:
+            self.cursor.execute("insert into bodies values (?, ?)",
+                                (sha256,
+                                 zlib.compress(data, COMPRESSION_LEVEL)))
+        return sha256
+
+    def getBody(self, sha256):
+        """
+        Returns the str page body with the given hash, or None.
+        """
+
+        self.cursor.execute("select body from bodies where sha256 = ?",
+                            (sha256,))
+        tup = self.cursor.fetchone()
+        if tup is None:
+            return None
+        return zlib.decompress(tup[0]).decode("UTF-8")
+
+    def addFetch(self, cycle, url, fetchTimestamp, statusCode, body,
+                 reason=None):
+        """
+        Records a fetch and its body.
+
+        Returns:
+        str containing the SHA-256 hex digest of the body.
+        """
+
+        sha256 = self.putBody(body)
+        fetchUtcDttm = \
+            datetime.datetime.utcfromtimestamp(fetchTimestamp).isoformat()
+        self.cursor.execute("insert into fetches " +
+                            "(cycle, url, fetch_utc_dttm, fetch_timestamp, " +
+                            "status_code, sha256, reason) " +
+                            "values (?, ?, ?, ?, ?, ?, ?)",
+                            (cycle, url, fetchUtcDttm, fetchTimestamp,
+                             statusCode, sha256, reason))
+        self.conn.commit()
+        return sha256
+
+    def _toFetchRecords(self, tups):
+        records = []
+        for tup in tups:
+            record = FetchRecord()
+            record.cycle = tup[0]
+            record.url = tup[1]
+            record.fetchTimestamp = tup[2]
+            record.statusCode = tup[3]
+            record.sha256 = tup[4]
+            record.reason = tup[5]
+            records.append(record)
+        return records
+
+    def getCycles(self):
+        """
+        Returns a sorted list of the int cycle numbers in the archive.
+        """
+
+        self.cursor.execute("select distinct cycle from fetches " +
+                            "order by cycle asc")
+        return [tup[0] for tup in self.cursor.fetchall()]
+
+    def getFetchesForCycle(self, cycle):
+        """
+        Returns a list of FetchRecord of the given cycle, in fetch order.
+        """
+
+        self.cursor.execute("select cycle, url, fetch_timestamp, " +
+                            "status_code, sha256, reason from fetches " +
+                            "where cycle = ? " +
+                            "order by fetch_timestamp asc",
+                            (cycle,))
+        return self._toFetchRecords(self.cursor.fetchall())
+
+    def getLatestFetch(self, url, beforeTimestamp=None, successOnly=True):
+        """
+        Returns the latest FetchRecord of the URL, optionally only those
+        fetched at or before beforeTimestamp, or None.
+        """
+
+        sql = "select cycle, url, fetch_timestamp, status_code, sha256, " + \
+            "reason from fetches where url = ?"
+        values = [url]
+        if beforeTimestamp is not None:
+            sql += " and fetch_timestamp <= ?"
+            values.append(beforeTimestamp)
+        if successOnly:
+            sql += " and status_code >= 200 and status_code < 300"
+        sql += " order by fetch_timestamp desc limit 1"
+        self.cursor.execute(sql, values)
+        records = self._toFetchRecords(self.cursor.fetchall())
+        if len(records) == 0:
+            return None
+        return records[0]
+
+    def getFetches(self, url=None, reason=None, startTimestamp=None,
+                   endTimestamp=None, limit=100):
+        """
+        Returns a list of FetchRecord matching all the given filters,
+        latest first.
+
+        Arguments:
+        url            - str.  Only fetches of this URL.
+        reason         - str.  Only fetches recorded with this reason.
+        startTimestamp - float.  Only fetches at or after this time.time().
+        endTimestamp   - float.  Only fetches at or before this time.time().
+        limit          - int maximum number of records returned.
+        """
+
+        sql = "select cycle, url, fetch_timestamp, status_code, sha256, " + \
+            "reason from fetches where 1 = 1"
+        values = []
+        if url is not None:
+            sql += " and url = ?"
+            values.append(url)
+        if reason is not None:
+            sql += " and reason = ?"
+            values.append(reason)
+        if startTimestamp is not None:
+            sql += " and fetch_timestamp >= ?"
+            values.append(startTimestamp)
+        if endTimestamp is not None:
+            sql += " and fetch_timestamp <= ?"
+            values.append(endTimestamp)
+        sql += " order by fetch_timestamp desc limit ?"
+        values.append(limit)
+        self.cursor.execute(sql, values)
+        return self._toFetchRecords(self.cursor.fetchall())
+
+    def prune(self, retentionSeconds, now=None):
+        """
+        Deletes the fetches older than retentionSeconds, and the bodies no
+        longer referenced by any fetch.
+
+        Returns:
+        tuple of (int number of fetches deleted, int number of bodies deleted).
+        """
+
+        if now is None:
+            now = time.time()
+        self.cursor.execute("delete from fetches where fetch_timestamp < ?",
+                            (now - retentionSeconds,))
+        numFetches = self.cursor.rowcount
+        self.cursor.execute("delete from bodies where sha256 not in " +
+                            "(select sha256 from fetches)")
+        numBodies = self.cursor.rowcount
+        self.conn.commit()
+        return (numFetches, numBodies)
+
+    def getStats(self):
+        """
+        Returns a dict with the number of fetches, distinct bodies, and
+        compressed body bytes in the archive.
+        """
+
+        self.cursor.execute("select count(*) from fetches")
+        numFetches = self.cursor.fetchone()[0]
+        self.cursor.execute("select count(*), " +
+                            "coalesce(sum(length(body)), 0) from bodies")
+        (numBodies, compressedBytes) = self.cursor.fetchone()
+        return {"numFetches": numFetches,
+                "numBodies": numBodies,
+                "compressedBytes": compressedBytes}
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == "__main__":
+    import sys
+    import optparse
+
+    parser = optparse.OptionParser(
+        usage="%prog [options] <archive filename>")
+    parser.add_option("-u", "--url",
+                      help="List the fetches of this URL")
+    parser.add_option("-r", "--reason",
+                      help="List the fetches recorded with this reason")
+    parser.add_option("-n", "--limit", type="int", default=20,
+                      help="Maximum number of fetches listed " +
+                           "[default %default]")
+    parser.add_option("-b", "--body",
+                      help="Print the page body with this SHA-256 hash")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_usage()
+        sys.exit(2)
+
+    archive = FetchArchive(args[0])
+    if options.body is not None:
+        body = archive.getBody(options.body)
+        if body is None:
+            print("No body with hash: " + options.body)
+            sys.exit(1)
+        print(body)
+    elif options.url is not None or options.reason is not None:
+        for record in archive.getFetches(options.url, options.reason,
+                                         limit=options.limit):
+            print(datetime.datetime.utcfromtimestamp(
+                      record.fetchTimestamp).isoformat() + " " +
+                  str(record.reason) + " " + str(record.statusCode) + " " +
+                  record.sha256 + " " + record.url)
+    else:
+        stats = archive.getStats()
+        cycles = archive.getCycles()
+        print("Cycles: " + str(len(cycles)))
+        print("Fetches: " + str(stats["numFetches"]))
+        print("Distinct bodies: " + str(stats["numBodies"]))
+        print("Compressed body bytes: " + str(stats["compressedBytes"]))
+    archive.close()
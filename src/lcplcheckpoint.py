@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+##############################################################################
+# Checkpoint of the working state of the monitor, for warm restarts.
+#
+# The monitor keeps state in memory that makes a poll cycle cheap: the HTTP
+# validators and fingerprints of the pages processed (see lcplfetch.py), the
+# latest status of each shift (see lcplstore.py), the time each page was
+# last observed (see lcplparse.py), and when each sheet was last polled.
+# The state is written to a JSON file periodically and on shutdown, and
+# read back on startup, so a restarted monitor does not re-download and
+# re-parse every page and re-read the status of every shift.
+#
+# The cached pages and statuses are only restored if the database has not
+# been written since the checkpoint (see lcplstore.getDatabaseWatermark()).
+##############################################################################
+
+import os
+import time
+import monitorstate
+from lcplcommon import log, DATA_DIR, WORKER_ID, REPLAY_ARCHIVE_FILENAME
+import lcplfetch
+import lcplparse
+import lcplstore
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Version of the checkpoint file layout.  Checkpoints of another version
+# are ignored.
+CHECKPOINT_VERSION = 1
+
+# File path of the checkpoint file.  Each worker (see
+# lcplcommon.WORKER_ID) has its own.  Can be overridden with the
+# environment variable LCPL_PAGE_SUBS_CHECKPOINT_FILENAME, and set to an
+# empty string to disable checkpoints.  Replay runs never use one.
+CHECKPOINT_FILENAME = \
+    os.environ.get("LCPL_PAGE_SUBS_CHECKPOINT_FILENAME",
+                   os.path.join(DATA_DIR,
+                                "lcplpagesubs." +
+                                ("" if WORKER_ID is None else
+                                 WORKER_ID + ".") +
+                                "checkpoint.json"))
+if REPLAY_ARCHIVE_FILENAME is not None:
+    CHECKPOINT_FILENAME = ""
+
+# Number of seconds between two checkpoints written during the run.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_CHECKPOINT_INTERVAL_SECONDS.
+CHECKPOINT_INTERVAL_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_CHECKPOINT_INTERVAL_SECONDS", "300"))
+
+# time.time() the last checkpoint was written, or None until the checkpoint
+# has been loaded.  See the method loadCheckpoint() below.
+lastCheckpointTimestamp = None
+
+##############################################################################
+# Methods
+##############################################################################
+
+def loadCheckpoint(lastPollTimestampBySheetId):
+    """
+    Restores the working state from the checkpoint file, if there is one.
+    Must be called once the database is initialized.
+
+    Arguments:
+    lastPollTimestampBySheetId - dict of sheet ID to the time.time() the
+                                 sheet was last polled, updated in place.
+    """
+
+    global lastCheckpointTimestamp
+
+    lastCheckpointTimestamp = time.time()
+    if not CHECKPOINT_FILENAME:
+        return
+
+    startTime = time.perf_counter()
+    checkpoint = monitorstate.readStateFile(CHECKPOINT_FILENAME)
+    if checkpoint is None:
+        log.info("No checkpoint to restore from: " + CHECKPOINT_FILENAME)
+        return
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        log.info("Ignoring checkpoint of another version: " + \
+                 str(checkpoint.get("version")))
+        return
+
+    lastPollTimestampBySheetId.update(
+        checkpoint.get("lastPollTimestampBySheetId", {}))
+    lcplparse.lastObservedTimestampByUrl.update(
+        checkpoint.get("lastObservedTimestampByUrl", {}))
+
+    if checkpoint.get("databaseWatermark") != \
+            lcplstore.getDatabaseWatermark():
+        log.info("The database was written since the checkpoint of " + \
+                 str(checkpoint.get("utcDttm")) + ".  Only the poll " + \
+                 "schedule is restored.")
+        return
+
+    lcplfetch.restoreCacheState(checkpoint.get("fetch", {}))
+    lcplstore.restoreCacheState(checkpoint.get("store", {}))
+    log.info("Restored checkpoint of " + str(checkpoint.get("utcDttm")) + \
+             " (" + str(len(lcplfetch.pageFingerprintByUrl)) + " pages, " + \
+             str(len(lcplstore.latestShiftStatusByKey)) + " shifts) " + \
+             "in {:.3f} seconds.".format(time.perf_counter() - startTime))
+
+
+def saveCheckpoint(lastPollTimestampBySheetId):
+    """
+    Writes the working state to the checkpoint file.  Does nothing until
+    loadCheckpoint() has been called, so that a monitor that fails during
+    startup does not overwrite a good checkpoint.
+
+    Arguments:
+    lastPollTimestampBySheetId - dict of sheet ID to the time.time() the
+                                 sheet was last polled.
+    """
+
+    global lastCheckpointTimestamp
+
+    if not CHECKPOINT_FILENAME or lastCheckpointTimestamp is None or \
+            lcplstore.conn is None:
+        return
+
+    startTime = time.perf_counter()
+    lastCheckpointTimestamp = time.time()
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "utcDttm": time.strftime("%Y-%m-%dT%H:%M:%S",
+                                 time.gmtime(lastCheckpointTimestamp)),
+        "databaseWatermark": lcplstore.getDatabaseWatermark(),
+        "lastPollTimestampBySheetId": lastPollTimestampBySheetId,
+        "lastObservedTimestampByUrl": lcplparse.lastObservedTimestampByUrl,
+        "fetch": lcplfetch.getCacheState(),
+        "store": lcplstore.getCacheState(),
+        }
+    try:
+        monitorstate.writeJsonFileAtomically(CHECKPOINT_FILENAME, checkpoint)
+    except (OSError, TypeError, ValueError) as e:
+        log.warning("Could not write the checkpoint file: " + str(e))
+        return
+    log.debug("Wrote checkpoint in {:.3f} seconds.".format(
+        time.perf_counter() - startTime))
+
+
+def saveCheckpointIfDue(lastPollTimestampBySheetId):
+    """
+    Writes the working state to the checkpoint file, if the last checkpoint
+    is older than CHECKPOINT_INTERVAL_SECONDS.
+    """
+
+    if lastCheckpointTimestamp is not None and \
+            time.time() - lastCheckpointTimestamp >= \
+            CHECKPOINT_INTERVAL_SECONDS:
+        saveCheckpoint(lastPollTimestampBySheetId)
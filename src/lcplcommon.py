@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+##############################################################################
+# Settings, loggers and helpers shared by the modules of the monitor.
+#
+# The monitor is split into a library and a thin entry point:
+#
+#   lcplcommon.py   - settings, loggers, metrics registry, shutdown().
+#   lcplfetch.py    - fetching pages (and recording and replaying them).
+#   lcplsource.py   - the backends pages are read from (HTML or JSON).
+#   lcplparse.py    - parsing shifts and nav tab URLs out of pages.
+#   lcplstore.py    - the sqlite database of URLs and shifts.
+#   lcplnotify.py   - SMS, email and admin notifications.
+#   lcplcheckpoint.py - checkpoint of the working state, for warm restarts.
+#   lcplstats.py    - hourly and daily statistics rolled up from the shifts.
+#   lcplcontrol.py  - control socket, for tuning the running monitor.
+#   lcplpagesubs.py - the entry point, with the poll loop.
+#
+# Importing any of the library modules has no side effects: it does not
+# change the working directory, configure logging, or import the SDKs of
+# the notification providers.
+##############################################################################
+
+import sys
+import os
+import copy
+import time
+import queue
+import random
+import logging
+import logging.config
+import logging.handlers
+import metrics
+import eventlog
+import fetcharchive
+
+##############################################################################
+# Global variables
+##############################################################################
+
+__version__ = "1.2.0"
+__date__ = "Sat Jul  1 16:56:44 EDT 2017"
+
+
+# Application Name
+APP_NAME = "Page Shifts Monitor For LCPL"
+
+# Application Version obtained from subversion revision.
+APP_VERSION = __version__
+
+# Application Date obtain from last subversion commit date.
+APP_DATE = __date__
+
+# Location of the source directory, based on this module file.
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Directory where various data resides.  e.g. sqlite database.
+DATA_DIR = \
+    os.path.abspath(os.path.join(SRC_DIR,
+                                 ".." + os.sep + "data"))
+
+# File path of the sqlite database.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_DATABASE_FILENAME, e.g. for runs against a local
+# stand-in server (see sugsim.py).
+DATABASE_FILENAME = \
+    os.path.abspath(os.environ.get("LCPL_PAGE_SUBS_DATABASE_FILENAME",
+                                   os.path.join(DATA_DIR,
+                                                "lcpl_page_shifts.db")))
+
+# Directory where log files will be written.
+LOG_DIR = \
+    os.path.abspath(os.path.join(SRC_DIR,
+                                 ".." + os.sep + "logs"))
+
+# Location of the config file for logging.
+LOG_CONFIG_FILE = \
+    os.path.abspath(os.path.join(SRC_DIR,
+                                 ".." + os.sep +
+                                 "conf" + os.sep +
+                                 "logging.conf"))
+
+# Name of the histogram timing each stage of a poll cycle.
+STAGE_SECONDS_METRIC = "lcplpagesubs_stage_seconds"
+
+# Number of seconds a process waits on a database locked by another process
+# before giving up.
+DATABASE_BUSY_TIMEOUT_SECONDS = 30
+
+# Name of this worker, when several monitor processes share the database
+# and split the URLs between them (see lcplstore.claimUrlLeases()).  Set with
+# the environment variable LCPL_PAGE_SUBS_WORKER_ID, to a name unique to each
+# process and stable across its restarts.  When unset, this process polls
+# every URL.
+WORKER_ID = os.environ.get("LCPL_PAGE_SUBS_WORKER_ID")
+
+# Number of seconds a worker keeps its URLs without renewing its leases.
+# Leases are renewed once per poll cycle, so this must be longer than a
+# whole cycle plus the longest poll interval (see pollschedule.py).  The
+# URLs of a worker that dies are taken over by the others once its leases
+# expire.  Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_URL_LEASE_SECONDS.
+URL_LEASE_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_URL_LEASE_SECONDS", "300"))
+
+# Number of seconds slept between poll cycles.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_POLL_INTERVAL_SECONDS.
+POLL_INTERVAL_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_POLL_INTERVAL_SECONDS", "60"))
+
+# Number of seconds between the response for a page and the next request,
+# at startup.  The delay then adapts to the web server: it shrinks while
+# requests succeed, down to FETCH_MIN_DELAY_SECONDS, and grows when the web
+# server asks to slow down (HTTP 429 or 503), up to FETCH_MAX_DELAY_SECONDS
+# (see ratecontrol.py).  Can be overridden with the environment variables
+# LCPL_PAGE_SUBS_FETCH_DELAY_SECONDS, LCPL_PAGE_SUBS_FETCH_MIN_DELAY_SECONDS
+# and LCPL_PAGE_SUBS_FETCH_MAX_DELAY_SECONDS.
+FETCH_DELAY_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_FETCH_DELAY_SECONDS", "2"))
+FETCH_MIN_DELAY_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_FETCH_MIN_DELAY_SECONDS", "0.5"))
+FETCH_MAX_DELAY_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_FETCH_MAX_DELAY_SECONDS", "120"))
+
+# Whether the delay between requests adapts to the web server.  If
+# disabled, by setting the environment variable
+# LCPL_PAGE_SUBS_FETCH_RATE_CONTROL_ENABLED to 0, the delay stays at
+# FETCH_DELAY_SECONDS, and only the Retry-After of responses is honored.
+FETCH_RATE_CONTROL_ENABLED = \
+    os.environ.get("LCPL_PAGE_SUBS_FETCH_RATE_CONTROL_ENABLED", "1") != "0"
+
+# Longest Retry-After of a response honored, in seconds.  Longer ones are
+# shortened to it.  Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_FETCH_MAX_RETRY_AFTER_SECONDS.
+FETCH_MAX_RETRY_AFTER_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_FETCH_MAX_RETRY_AFTER_SECONDS",
+                         "3600"))
+
+# Maximum number of bytes of a page body.  A longer page is not processed
+# (it is fetched again next cycle).  Can be overridden with the environment
+# variable LCPL_PAGE_SUBS_FETCH_MAX_BODY_BYTES.
+FETCH_MAX_BODY_BYTES = \
+    int(os.environ.get("LCPL_PAGE_SUBS_FETCH_MAX_BODY_BYTES",
+                       str(8 * 1024 * 1024)))
+
+# Whether to stop reading an HTML page once its shifts table and nav tabs
+# have been received (see lcplparse.HtmlPageEndScanner).  Can be disabled
+# by setting the environment variable
+# LCPL_PAGE_SUBS_FETCH_EARLY_STOP_ENABLED to 0.
+FETCH_EARLY_STOP_ENABLED = \
+    os.environ.get("LCPL_PAGE_SUBS_FETCH_EARLY_STOP_ENABLED", "1") != "0"
+
+# Whether to pause polling around 4:30 am local time (see the main loop).
+# Can be disabled by setting the environment variable
+# LCPL_PAGE_SUBS_NIGHTLY_PAUSE_ENABLED to 0.
+NIGHTLY_PAUSE_ENABLED = \
+    os.environ.get("LCPL_PAGE_SUBS_NIGHTLY_PAUSE_ENABLED", "1") != "0"
+
+# File path of an archive that every fetched page is recorded into
+# (see fetcharchive.py).  Set with the environment variable
+# LCPL_PAGE_SUBS_RECORD_ARCHIVE to enable recording.
+RECORD_ARCHIVE_FILENAME = os.environ.get("LCPL_PAGE_SUBS_RECORD_ARCHIVE")
+
+# File path of a recorded archive to replay instead of fetching pages from
+# the web.  Set with the environment variable LCPL_PAGE_SUBS_REPLAY_ARCHIVE
+# to enable replay mode.  Replay runs as fast as possible, without sleeps.
+REPLAY_ARCHIVE_FILENAME = os.environ.get("LCPL_PAGE_SUBS_REPLAY_ARCHIVE")
+
+# File path of a JSON-lines file that notifications are appended to,
+# instead of being sent by SMS or email.  Set with the environment variable
+# LCPL_PAGE_SUBS_NOTIFICATION_SINK.
+NOTIFICATION_SINK_FILENAME = os.environ.get("LCPL_PAGE_SUBS_NOTIFICATION_SINK")
+
+# In replay mode, notifications always go to a sink, and unless a database
+# was given explicitly, a fresh database next to the archive is used.
+replayUsesOwnDatabase = False
+if REPLAY_ARCHIVE_FILENAME is not None:
+    if NOTIFICATION_SINK_FILENAME is None:
+        NOTIFICATION_SINK_FILENAME = \
+            REPLAY_ARCHIVE_FILENAME + ".notifications.jsonl"
+    if "LCPL_PAGE_SUBS_DATABASE_FILENAME" not in os.environ:
+        DATABASE_FILENAME = REPLAY_ARCHIVE_FILENAME + ".replay.db"
+        replayUsesOwnDatabase = True
+
+# File path of the snapshot store, an archive (see fetcharchive.py) that
+# keeps the pages captured on anomalies, each distinct page once, so they can
+# be looked up later without scanning the HTML log.  Can be overridden with
+# the environment variable LCPL_PAGE_SUBS_SNAPSHOT_STORE, and set to an empty
+# string to log the captured HTML to the 'html' logger instead.
+SNAPSHOT_STORE_FILENAME = \
+    os.environ.get("LCPL_PAGE_SUBS_SNAPSHOT_STORE",
+                   os.path.join(DATA_DIR, "lcplpagesubs.snapshots.db"))
+if REPLAY_ARCHIVE_FILENAME is not None and \
+        "LCPL_PAGE_SUBS_SNAPSHOT_STORE" not in os.environ:
+    SNAPSHOT_STORE_FILENAME = REPLAY_ARCHIVE_FILENAME + ".snapshots.db"
+
+# Number of days snapshots are kept for.  Can be overridden with the
+# environment variable LCPL_PAGE_SUBS_SNAPSHOT_RETENTION_DAYS.
+SNAPSHOT_RETENTION_DAYS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_SNAPSHOT_RETENTION_DAYS", "30"))
+
+# Number of seconds between two prunings of the snapshot store.
+SNAPSHOT_PRUNE_INTERVAL_SECONDS = 3600
+
+# Whether every fetched page is snapshotted (with reason 'fetch'), and not
+# only the pages of anomalies.  Enable by setting the environment variable
+# LCPL_PAGE_SUBS_SNAPSHOT_ALL_FETCHES to 1.
+SNAPSHOT_ALL_FETCHES = \
+    os.environ.get("LCPL_PAGE_SUBS_SNAPSHOT_ALL_FETCHES", "0") == "1"
+
+# Directory of the event log (see eventlog.py), which every change of a
+# shift's status is appended to, for the event stream of the status server.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_EVENT_LOG_DIR, and set to an empty string to disable the
+# event log.  Replay runs only publish events if it is set.
+EVENT_LOG_DIR = \
+    os.environ.get("LCPL_PAGE_SUBS_EVENT_LOG_DIR",
+                   os.path.join(DATA_DIR, "lcplpagesubs.events"))
+if REPLAY_ARCHIVE_FILENAME is not None and \
+        "LCPL_PAGE_SUBS_EVENT_LOG_DIR" not in os.environ:
+    EVENT_LOG_DIR = ""
+
+# Number of days events are kept for.  Can be overridden with the
+# environment variable LCPL_PAGE_SUBS_EVENT_RETENTION_DAYS.
+EVENT_RETENTION_DAYS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_EVENT_RETENTION_DAYS", "30"))
+
+# Number of seconds between two prunings of the event log.
+EVENT_LOG_PRUNE_INTERVAL_SECONDS = 3600
+
+# Number of seconds between two rollups of the shift history into the
+# hourly and daily statistics (see lcplstats.py).  Can be overridden with
+# the environment variable LCPL_PAGE_SUBS_AGGREGATION_INTERVAL_SECONDS, and
+# set to 0 to disable them.
+AGGREGATION_INTERVAL_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_AGGREGATION_INTERVAL_SECONDS", "300"))
+
+# ID of the sheet registered on the very first load of the application
+# (when the 'sheets' database table is empty), which watches 'seedUrl'.
+# More sheets can be registered with lcplsheets.py.
+DEFAULT_SHEET_ID = "default"
+
+# Seed URL on the very first load of the application
+# (when the 'urls' database table has not been created yet).
+# The 'seedUrl' should be the earliest in time (left-most tab URL).
+# Both can be overridden with the environment variables
+# LCPL_PAGE_SUBS_BASE_URL and LCPL_PAGE_SUBS_SEED_URL, e.g. to run against
+# a local stand-in server (see sugsim.py).
+baseUrl = os.environ.get("LCPL_PAGE_SUBS_BASE_URL",
+                         "http://www.signupgenius.com/go/")
+seedUrl = os.environ.get("LCPL_PAGE_SUBS_SEED_URL",
+                         baseUrl + "4090d4aaeaf2ba7f58-page24")
+
+# Backend the pages are read from (see lcplsource.py).  'html' scrapes the
+# signup pages.  'json' reads the slots of each page from the JSON API at
+# SOURCE_API_URL, and falls back to the HTML page of a URL whenever the API
+# fails for it.  Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_SOURCE.
+SOURCE_BACKEND = os.environ.get("LCPL_PAGE_SUBS_SOURCE", "html")
+
+# URL of the JSON API, which the page name and '/slots' are appended to,
+# from the environment variable LCPL_PAGE_SUBS_SOURCE_API_URL.  There is no
+# default: the layout of the pages of the JSON API (see
+# lcplparse.parseJson()) is the one served by the local stand-in server
+# (see sugsim.py), and has not been checked against the API of
+# SignUpGenius, so the json backend is for runs against the stand-in server
+# until it has been.  The json backend needs it to be set.
+SOURCE_API_URL = os.environ.get("LCPL_PAGE_SUBS_SOURCE_API_URL")
+
+# Number of seconds a URL is read from its HTML page after the JSON API
+# failed for it, before the API is tried again.  Can be overridden with the
+# environment variable LCPL_PAGE_SUBS_SOURCE_FALLBACK_SECONDS.
+SOURCE_FALLBACK_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_SOURCE_FALLBACK_SECONDS", "600"))
+
+# Whether the file handlers of the 'main' and 'html' loggers are run on
+# background threads, fed through queues, so that formatting and disk
+# writes are off the poll loop.  Can be disabled by setting the environment
+# variable LCPL_PAGE_SUBS_QUEUE_LOGGING_ENABLED to 0.
+QUEUE_LOGGING_ENABLED = \
+    os.environ.get("LCPL_PAGE_SUBS_QUEUE_LOGGING_ENABLED", "1") != "0"
+
+# Fraction of anomalies (e.g. a page without the shifts table) whose HTML is
+# captured to the 'html' logger.  See captureHtml() below.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_HTML_CAPTURE_SAMPLE_RATE.
+HTML_CAPTURE_SAMPLE_RATE = \
+    float(os.environ.get("LCPL_PAGE_SUBS_HTML_CAPTURE_SAMPLE_RATE", "1.0"))
+
+# Minimum number of seconds between two captures for the same reason and URL.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_HTML_CAPTURE_INTERVAL_SECONDS.
+HTML_CAPTURE_INTERVAL_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_HTML_CAPTURE_INTERVAL_SECONDS",
+                         "3600"))
+
+# Maximum number of characters of HTML captured to the 'html' logger, when
+# there is no snapshot store.  Longer pages are truncated.  Can be
+# overridden with the environment variable
+# LCPL_PAGE_SUBS_HTML_CAPTURE_MAX_CHARS.
+HTML_CAPTURE_MAX_CHARS = \
+    int(os.environ.get("LCPL_PAGE_SUBS_HTML_CAPTURE_MAX_CHARS", "262144"))
+
+# For logging.
+# Handlers are only attached by configureLogging(), which the entry point
+# calls.  Until then, messages go nowhere.
+log = logging.getLogger("main")
+htmlLog = logging.getLogger("html")
+
+# List of logging.handlers.QueueListener running the file handlers.
+# See the method startQueueLogging() below.
+logQueueListeners = []
+
+# Dict of (reason, url) to the time.time() its HTML was last captured.
+# See the method captureHtml() below.
+lastHtmlCaptureTimestamps = {}
+
+# Snapshot store, and the time.time() it was last pruned.
+# See the method initializeSnapshotStore() below.
+snapshotStore = None
+lastSnapshotPruneTimestamp = None
+
+# Event log, and the time.time() it was last pruned.
+# See the method initializeEventLog() below.
+eventLog = None
+lastEventLogPruneTimestamp = None
+
+# Counters and histograms of this process.
+# The entry point writes them to a file once per cycle.
+metricsRegistry = metrics.MetricsRegistry()
+
+# Functions run by shutdown() before exiting, each called with the return
+# code.  See registerShutdownHook() below.
+shutdownHooks = []
+
+##############################################################################
+# Classes
+##############################################################################
+
+class Sheet:
+    """
+    A SignUpGenius sheet watched by the monitor, as registered in the
+    'sheets' database table.
+    """
+
+    def __init__(self):
+        self.sheetId = None
+        self.seedUrl = None
+
+        # URL that the page names in the nav tabs are relative to.
+        self.baseUrl = None
+
+        # Number of seconds between polls of this sheet, or None for
+        # POLL_INTERVAL_SECONDS.
+        self.pollIntervalSeconds = None
+
+        # Lists of str phone numbers and email addresses alerted about this
+        # sheet, or None for the ones given by the environment variables.
+        self.smsRecipients = None
+        self.emailRecipients = None
+
+        self.isActive = True
+
+    def __str__(self):
+        rv = "Sheet(sheetId=" + str(self.sheetId) + "," + \
+                "seedUrl=" + str(self.seedUrl) + "," + \
+                "pollIntervalSeconds=" + str(self.pollIntervalSeconds) + "," + \
+                "smsRecipients=" + str(self.smsRecipients) + "," + \
+                "emailRecipients=" + str(self.emailRecipients) + ")"
+        return rv
+
+
+class Shift:
+    def __init__(self):
+        self.sheetId = DEFAULT_SHEET_ID
+        self.url = None
+        self.rowNumber = None
+        self.status = None
+
+        # Timestamps (as returned by time.time()) used for tracking
+        # alert latency.
+        self.observedTimestamp = None
+        self.previousObservedTimestamp = None
+        self.persistedTimestamp = None
+
+        # Key identifying the status change that made this shift available,
+        # so that it is alerted only once (see lcplstore.claimAlertEvents()).
+        self.alertEventKey = None
+
+        # Timestamps of the alert of this shift being dispatched and
+        # acknowledged.  The dicts are keyed by channel ('sms', 'email').
+        self.dispatchedTimestamps = {}
+        self.acknowledgedTimestamps = {}
+
+    def __str__(self):
+        rv = "Shift(url=" + str(self.url) + "," + \
+                "rowNumber=" + str(self.rowNumber) + "," + \
+                "status=" + str(self.status) + ")"
+        return rv
+
+
+class DeferredFormattingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting of records, and of their
+    tracebacks, to the handlers on the listener thread.  The stock
+    QueueHandler formats each record on the logging thread.  Only the
+    message is merged with its arguments here, since these may change
+    after the logging call.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+##############################################################################
+# Methods
+##############################################################################
+
+def configureLogging():
+    """
+    Loads the logging config file.
+
+    The logging config file specifies the log filenames relative to the
+    source directory, so we chdir to SRC_DIR while loading it, and then
+    chdir back.  The handlers keep absolute paths to their files.
+    """
+
+    cwd = os.getcwd()
+    os.chdir(SRC_DIR)
+    try:
+        logging.config.fileConfig(LOG_CONFIG_FILE)
+    finally:
+        os.chdir(cwd)
+
+    if QUEUE_LOGGING_ENABLED:
+        startQueueLogging([log, htmlLog])
+
+
+def startQueueLogging(loggers):
+    """
+    Moves the handlers of each given logger behind a
+    DeferredFormattingQueueHandler, and runs them on a QueueListener
+    thread.  Logging calls then only merge the message and put the record
+    on a queue; formatting and writing happen on the listener thread.
+
+    Each logger gets its own queue and listener, so that records still only
+    reach the handlers of the logger they were logged to.
+    """
+
+    for logger in loggers:
+        handlers = list(logger.handlers)
+        if len(handlers) == 0:
+            continue
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+        logQueue = queue.SimpleQueue()
+        logger.addHandler(DeferredFormattingQueueHandler(logQueue))
+        listener = logging.handlers.QueueListener(logQueue, *handlers,
+                                                  respect_handler_level=True)
+        listener.start()
+        logQueueListeners.append(listener)
+
+
+def stopQueueLogging():
+    """
+    Stops the QueueListener threads, after they have written out every
+    record already queued.
+    """
+
+    while len(logQueueListeners) > 0:
+        logQueueListeners.pop(0).stop()
+
+
+def initializeSnapshotStore():
+    """
+    Opens the snapshot store, if one is configured, and prunes the
+    snapshots older than SNAPSHOT_RETENTION_DAYS.
+    """
+
+    global snapshotStore
+
+    if SNAPSHOT_STORE_FILENAME:
+        log.info("Keeping page snapshots in: " + SNAPSHOT_STORE_FILENAME)
+        snapshotStore = fetcharchive.FetchArchive(SNAPSHOT_STORE_FILENAME)
+        pruneSnapshotStoreIfDue()
+
+
+def closeSnapshotStore():
+    """
+    Closes the snapshot store, if open.
+    """
+
+    global snapshotStore
+
+    if snapshotStore is not None:
+        snapshotStore.close()
+        snapshotStore = None
+
+
+def pruneSnapshotStoreIfDue():
+    """
+    Deletes the snapshots older than SNAPSHOT_RETENTION_DAYS, and the page
+    bodies no longer referenced, at most once per
+    SNAPSHOT_PRUNE_INTERVAL_SECONDS.
+    """
+
+    global lastSnapshotPruneTimestamp
+
+    if snapshotStore is None:
+        return
+
+    now = time.time()
+    if lastSnapshotPruneTimestamp is not None and \
+            now - lastSnapshotPruneTimestamp < SNAPSHOT_PRUNE_INTERVAL_SECONDS:
+        return
+    lastSnapshotPruneTimestamp = now
+
+    numFetches, numBodies = \
+        snapshotStore.prune(SNAPSHOT_RETENTION_DAYS * 86400, now)
+    if numFetches > 0 or numBodies > 0:
+        log.info("Pruned " + str(numFetches) + " snapshots and " + \
+                 str(numBodies) + " page bodies older than " + \
+                 str(SNAPSHOT_RETENTION_DAYS) + " days.")
+
+
+def initializeEventLog():
+    """
+    Opens the event log, if one is configured, and prunes the events older
+    than EVENT_RETENTION_DAYS.
+    """
+
+    global eventLog
+
+    if EVENT_LOG_DIR:
+        log.info("Publishing events to: " + EVENT_LOG_DIR)
+        eventLog = eventlog.EventLog(EVENT_LOG_DIR)
+        pruneEventLogIfDue()
+
+
+def pruneEventLogIfDue():
+    """
+    Deletes the segments of the event log older than EVENT_RETENTION_DAYS,
+    at most once per EVENT_LOG_PRUNE_INTERVAL_SECONDS.
+    """
+
+    global lastEventLogPruneTimestamp
+
+    if eventLog is None:
+        return
+
+    now = time.time()
+    if lastEventLogPruneTimestamp is not None and \
+            now - lastEventLogPruneTimestamp < EVENT_LOG_PRUNE_INTERVAL_SECONDS:
+        return
+    lastEventLogPruneTimestamp = now
+
+    try:
+        numSegments = eventLog.prune(EVENT_RETENTION_DAYS * 86400, now)
+    except OSError as e:
+        log.warning("Could not prune the event log: " + str(e))
+        return
+    if numSegments > 0:
+        log.info("Pruned " + str(numSegments) + " event log segments " + \
+                 "older than " + str(EVENT_RETENTION_DAYS) + " days.")
+
+
+def publishEvents(events):
+    """
+    Appends the given events to the event log, if there is one.  Failures
+    are logged, and the events dropped, so that the poll loop goes on.
+
+    Arguments:
+    events - list of JSON-serializable dicts.
+    """
+
+    if eventLog is None or len(events) == 0:
+        return
+    try:
+        lastId = eventLog.append(events)
+    except (OSError, TypeError, ValueError) as e:
+        log.warning("Could not publish " + str(len(events)) + \
+                    " events: " + str(e))
+        return
+    metricsRegistry.incrementCounter("lcplpagesubs_events_published_total",
+                                     len(events))
+    log.debug("Published " + str(len(events)) + " events, up to id " + \
+              str(lastId) + ".")
+
+
+def snapshotPage(reason, url, html, statusCode=None, fetchTimestamp=None,
+                 cycle=None):
+    """
+    Stores a page in the snapshot store.
+
+    Arguments:
+    reason         - str describing why the page is kept, e.g. 'noMainTable'.
+    url            - str containing the URL of the page.
+    html           - str containing the HTML text of the page.
+    statusCode     - int HTTP status code of the response, if known.
+    fetchTimestamp - float time.time() the page was fetched.
+                     Defaults to now.
+    cycle          - int number of the poll cycle, if known.
+
+    Returns:
+    str containing the SHA-256 hex digest of the page, or None if there is
+    no snapshot store.
+    """
+
+    if snapshotStore is None:
+        return None
+    if fetchTimestamp is None:
+        fetchTimestamp = time.time()
+    return snapshotStore.addFetch(cycle, url, fetchTimestamp, statusCode,
+                                  html, reason)
+
+
+def captureHtml(reason, url, html, level=logging.INFO, force=False,
+                fetchTimestamp=None):
+    """
+    Captures the HTML of a page on an anomaly.
+
+    The page is kept in the snapshot store, and the 'html' logger only gets
+    a line with its hash (look it up with fetcharchive.py).  Without a
+    snapshot store, the HTML itself is logged, truncated to
+    HTML_CAPTURE_MAX_CHARS.
+
+    Captures are sampled (HTML_CAPTURE_SAMPLE_RATE), and limited to one per
+    HTML_CAPTURE_INTERVAL_SECONDS for the same reason and URL.
+
+    Arguments:
+    reason         - str describing the anomaly, e.g. 'noMainTable'.
+    url            - str containing the URL of the page.
+    html           - str containing the HTML text of the page.
+    level          - int logging level of the capture.
+    force          - bool.  If True, the page is captured regardless of
+                     sampling and of the interval, e.g. right before
+                     shutting down.
+    fetchTimestamp - float time.time() the page was fetched, if known.
+
+    Returns:
+    bool True if the page was captured.
+    """
+
+    if not htmlLog.isEnabledFor(level):
+        return False
+
+    now = time.time()
+    key = (reason, url)
+    if not force:
+        lastTimestamp = lastHtmlCaptureTimestamps.get(key)
+        if lastTimestamp is not None and \
+                now - lastTimestamp < HTML_CAPTURE_INTERVAL_SECONDS:
+            return False
+        if random.random() >= HTML_CAPTURE_SAMPLE_RATE:
+            return False
+    lastHtmlCaptureTimestamps[key] = now
+
+    sha256 = snapshotPage(reason, url, html, fetchTimestamp=fetchTimestamp)
+    if sha256 is not None:
+        htmlLog.log(level, "Captured HTML (reason " + reason + ") of URL " + \
+                    url + " as snapshot " + sha256 + " (" + \
+                    str(len(html)) + " characters) in " + \
+                    SNAPSHOT_STORE_FILENAME)
+        return True
+
+    capturedHtml = html
+    if len(html) > HTML_CAPTURE_MAX_CHARS:
+        capturedHtml = html[:HTML_CAPTURE_MAX_CHARS] + \
+            "\n[... truncated " + str(len(html) - HTML_CAPTURE_MAX_CHARS) + \
+            " of " + str(len(html)) + " characters]"
+    htmlLog.log(level, "Captured HTML (reason " + reason + ") of URL " + \
+                url + ": " + capturedHtml)
+    return True
+
+
+def registerShutdownHook(hook):
+    """
+    Registers a function to be called with the return code by shutdown().
+    Hooks are called in the order they were registered.
+    """
+
+    shutdownHooks.append(hook)
+
+
+def shutdown(rc):
+    """
+    Exits the script, but first runs the shutdown hooks and flushes all
+    logging handles, etc.
+    """
+
+    # Each hook is removed before it runs, so that a hook that fails and
+    # calls shutdown() again does not run twice.
+    while len(shutdownHooks) > 0:
+        hook = shutdownHooks.pop(0)
+        hook(rc)
+
+    log.info("Shutdown (rc=" + str(rc) + ").")
+    stopQueueLogging()
+    logging.shutdown()
+    sys.exit(rc)
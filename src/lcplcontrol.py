@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+##############################################################################
+# Local control interface of the monitor, for inspecting and changing its
+# settings while it runs, without a restart.
+#
+# The monitor listens on a Unix socket, readable and writable only by its
+# user.  A client (see lcplctl.py) sends one request per connection, as a
+# line of JSON, and reads back one line of JSON:
+#
+#   {"command": "get"}                              -> {"ok": true, "knobs":
+#                                                       {...}, ...}
+#   {"command": "set", "name": "pollIntervalSeconds", "value": "30"}
+#   {"command": "pause", "url": "https://..."}
+#
+# Knobs (settings that can be read and set) and commands are registered by
+# the monitor (see lcplpagesubs.initializeControl()).  Requests are read by
+# a thread of their own, and reads are answered right away, but every change
+# is queued and applied by the poll loop between poll cycles (see
+# applyPendingRequests()), so a cycle never sees a change half-way.  The
+# poll loop sleeps in waitForRequests(), so a change sent while it sleeps
+# is applied at once.  The client gets its reply once the change has been
+# applied.
+##############################################################################
+
+import os
+import json
+import queue
+import socket
+import threading
+import socketserver
+from lcplcommon import log, metricsRegistry
+from lcplcommon import DATA_DIR, WORKER_ID, REPLAY_ARCHIVE_FILENAME
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# File path of the control socket.  Each worker (see lcplcommon.WORKER_ID)
+# has its own.  Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_CONTROL_SOCKET, and set to an empty string to disable the
+# control interface.  Replay runs only listen if it is set.
+CONTROL_SOCKET_FILENAME = \
+    os.environ.get("LCPL_PAGE_SUBS_CONTROL_SOCKET",
+                   os.path.join(DATA_DIR,
+                                "lcplpagesubs." +
+                                ("" if WORKER_ID is None else
+                                 WORKER_ID + ".") +
+                                "control.sock"))
+if REPLAY_ARCHIVE_FILENAME is not None and \
+        "LCPL_PAGE_SUBS_CONTROL_SOCKET" not in os.environ:
+    CONTROL_SOCKET_FILENAME = ""
+
+# Number of seconds a client waits for its change to be applied.  A change
+# that is not applied by then (the poll cycle is still running) is still
+# applied after the cycle.
+REPLY_TIMEOUT_SECONDS = 30
+
+# Maximum number of bytes of a request.
+MAX_REQUEST_BYTES = 64 * 1024
+
+# Dict of knob name to Knob, and of command name to Command.
+knobsByName = {}
+commandsByName = {}
+
+# Queue of the PendingRequests to apply between poll cycles, and the event
+# set when one is queued, to wake the poll loop.
+pendingRequests = queue.Queue()
+requestEvent = threading.Event()
+
+# Control socket server, while listening.
+server = None
+
+##############################################################################
+# Classes
+##############################################################################
+
+class Knob:
+    """
+    Setting of the monitor that can be read and changed.
+    """
+
+    def __init__(self, name, description, parseValue, getValue, setValue,
+                 isScheduleChange=False):
+        """
+        Arguments:
+        name             - str name of the knob.
+        description      - str one-line description.
+        parseValue       - function of a str value, returning the value to
+                           set.  Raises ValueError for an invalid value.
+                           Called by the control thread.
+        getValue         - function returning the current value, as a
+                           JSON-serializable object.  Called by the control
+                           thread, so it must only read.
+        setValue         - function of a parsed value, setting it.  Called
+                           by the poll loop, between cycles.
+        isScheduleChange - bool.  If True, setting the knob changes when
+                           the next poll cycle is due.
+        """
+
+        self.name = name
+        self.description = description
+        self.parseValue = parseValue
+        self.getValue = getValue
+        self.setValue = setValue
+        self.isScheduleChange = isScheduleChange
+
+
+class Command:
+    """
+    Action on the monitor, applied between poll cycles.
+    """
+
+    def __init__(self, name, description, apply, isScheduleChange=False):
+        """
+        Arguments:
+        name             - str name of the command.
+        description      - str one-line description.
+        apply            - function of the dict request, returning a dict
+                           added to the reply.  Raises ValueError for an
+                           invalid request.  Called by the poll loop,
+                           between cycles.
+        isScheduleChange - bool.  If True, the command changes when the
+                           next poll cycle is due.
+        """
+
+        self.name = name
+        self.description = description
+        self.apply = apply
+        self.isScheduleChange = isScheduleChange
+
+
+class PendingRequest:
+    """
+    Change queued by the control thread for the poll loop.
+    """
+
+    def __init__(self, commandName, description, apply, isScheduleChange):
+        self.commandName = commandName
+        self.description = description
+        self.apply = apply
+        self.isScheduleChange = isScheduleChange
+        self.reply = None
+        self.doneEvent = threading.Event()
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one request from a client, and writes back the reply.
+    """
+
+    def handle(self):
+        line = self.rfile.readline(MAX_REQUEST_BYTES)
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object.")
+            reply = handleRequest(request)
+        except ValueError as e:
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(reply, sort_keys=True) +
+                          "\n").encode("UTF-8"))
+
+
+class ControlServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+##############################################################################
+# Methods
+##############################################################################
+
+def registerKnob(knob):
+    knobsByName[knob.name] = knob
+
+
+def registerCommand(command):
+    commandsByName[command.name] = command
+
+
+def getKnobValues():
+    """
+    Returns a dict of knob name to current value.
+    """
+
+    return dict((name, knob.getValue())
+                for (name, knob) in sorted(knobsByName.items()))
+
+
+def handleRequest(request):
+    """
+    Returns the dict reply to the given dict request.  Reads are answered
+    right away.  Changes are queued for the poll loop, and the reply is
+    returned once applied, or after REPLY_TIMEOUT_SECONDS.  Runs in a
+    thread of the control server.
+
+    Raises ValueError on an invalid request.
+    """
+
+    commandName = request.get("command")
+    if commandName == "get":
+        return {"ok": True, "knobs": getKnobValues()}
+    if commandName == "help":
+        return {"ok": True,
+                "knobs": dict((name, knob.description)
+                              for (name, knob) in knobsByName.items()),
+                "commands": dict((name, command.description)
+                                 for (name, command) in
+                                 commandsByName.items())}
+
+    if commandName == "set":
+        knob = knobsByName.get(request.get("name"))
+        if knob is None:
+            raise ValueError("Unknown knob: " + str(request.get("name")) +
+                             ".  Expected one of: " +
+                             ", ".join(sorted(knobsByName)))
+        if "value" not in request:
+            raise ValueError("Missing 'value'.")
+        value = knob.parseValue(str(request["value"]))
+
+        def applySet(knob=knob, value=value):
+            previousValue = knob.getValue()
+            knob.setValue(value)
+            return {"name": knob.name, "previousValue": previousValue,
+                    "value": knob.getValue()}
+
+        pendingRequest = PendingRequest(commandName,
+                                        "set " + knob.name + " " +
+                                        str(value), applySet,
+                                        knob.isScheduleChange)
+    elif commandName in commandsByName:
+        command = commandsByName[commandName]
+        pendingRequest = PendingRequest(
+            commandName, command.name + " " + json.dumps(request, sort_keys=True),
+            lambda: command.apply(request), command.isScheduleChange)
+    else:
+        raise ValueError("Unknown command: " + str(commandName) + ".  " +
+                         "Expected one of: " +
+                         ", ".join(["get", "help", "set"] +
+                                   sorted(commandsByName)))
+
+    pendingRequests.put(pendingRequest)
+    requestEvent.set()
+    if not pendingRequest.doneEvent.wait(REPLY_TIMEOUT_SECONDS):
+        return {"ok": True, "isPending": True,
+                "message": "Queued, and applied after the current poll " +
+                           "cycle."}
+    return pendingRequest.reply
+
+
+def applyPendingRequests():
+    """
+    Applies the queued changes, in the order they were received.  Called by
+    the poll loop, between poll cycles.  The metrics are only updated here,
+    on the thread of the poll loop, which also reads them.
+
+    Returns:
+    bool True if a change applied changes when the next cycle is due.
+    """
+
+    isScheduleChanged = False
+    while True:
+        try:
+            pendingRequest = pendingRequests.get_nowait()
+        except queue.Empty:
+            break
+        metricsRegistry.incrementCounter(
+            "lcplpagesubs_control_requests_total",
+            labels={"command": pendingRequest.commandName})
+        try:
+            reply = {"ok": True}
+            reply.update(pendingRequest.apply() or {})
+            log.info("Applied control request: " + pendingRequest.description)
+            if pendingRequest.isScheduleChange:
+                isScheduleChanged = True
+        except ValueError as e:
+            reply = {"ok": False, "error": str(e)}
+            log.warning("Rejected control request: " + \
+                        pendingRequest.description + ": " + str(e))
+        except Exception as e:
+            # A failing change must not stop the monitor, nor leave the
+            # client without a reply.
+            reply = {"ok": False, "error": type(e).__name__ + ": " + str(e)}
+            log.error("Failed to apply control request: " + \
+                      pendingRequest.description + ": " + reply["error"])
+        pendingRequest.reply = reply
+        pendingRequest.doneEvent.set()
+    return isScheduleChanged
+
+
+def waitForRequests(numSeconds):
+    """
+    Sleeps the given number of seconds, or until a change is queued.
+
+    Returns:
+    bool True if a change was queued.
+    """
+
+    if numSeconds <= 0:
+        return requestEvent.is_set()
+    isSet = requestEvent.wait(numSeconds)
+    requestEvent.clear()
+    return isSet
+
+
+def initializeControlSocket():
+    """
+    Starts listening on the control socket, if one is configured, in a
+    thread of its own.  A socket file left by a monitor that did not shut
+    down cleanly is replaced, but not the socket of a running monitor.
+    """
+
+    global server
+
+    if not CONTROL_SOCKET_FILENAME:
+        log.info("No control socket.")
+        return
+
+    if os.path.exists(CONTROL_SOCKET_FILENAME):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(CONTROL_SOCKET_FILENAME)
+            log.warning("Another monitor is listening on the control " + \
+                        "socket, so not listening on it: " + \
+                        CONTROL_SOCKET_FILENAME)
+            return
+        except OSError:
+            os.remove(CONTROL_SOCKET_FILENAME)
+        finally:
+            probe.close()
+
+    # The socket is created readable and writable only by this user, so
+    # that no other user can connect to it, even right after the bind.  The
+    # umask is process-wide, so it is only changed for the bind.
+    previousUmask = os.umask(0o177)
+    try:
+        server = ControlServer(CONTROL_SOCKET_FILENAME, ControlRequestHandler)
+    except OSError as e:
+        log.warning("Could not listen on the control socket " + \
+                    CONTROL_SOCKET_FILENAME + ": " + str(e))
+        return
+    finally:
+        os.umask(previousUmask)
+
+    thread = threading.Thread(target=server.serve_forever,
+                              name="lcplcontrol", daemon=True)
+    thread.start()
+    log.info("Listening for control requests on: " + CONTROL_SOCKET_FILENAME)
+
+
+def closeControlSocket():
+    """
+    Stops listening on the control socket, and removes it.
+    """
+
+    global server
+
+    if server is None:
+        return
+    server.shutdown()
+    server.server_close()
+    try:
+        os.remove(CONTROL_SOCKET_FILENAME)
+    except OSError:
+        pass
+    server = None
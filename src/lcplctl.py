@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+##############################################################################
+# Command line client of the control interface of a running monitor (see
+# lcplcontrol.py).
+#
+# Usage:
+#   python3 src/lcplctl.py status
+#   python3 src/lcplctl.py help
+#   python3 src/lcplctl.py get [NAME]
+#   python3 src/lcplctl.py set pollIntervalSeconds 30
+#   python3 src/lcplctl.py set logLevel INFO
+#   python3 src/lcplctl.py poll-now [SHEET_ID]
+#   python3 src/lcplctl.py pause "http://www.signupgenius.com/go/XXX-page3"
+#   python3 src/lcplctl.py resume "http://www.signupgenius.com/go/XXX-page3"
+#   python3 src/lcplctl.py profile-next
+#
+# Changes are applied by the monitor between poll cycles.  The reply of the
+# monitor is printed as JSON.  The exit code is 1 if the monitor rejected
+# the request, and 2 if it could not be reached.
+##############################################################################
+
+import sys
+import json
+import socket
+import optparse
+import lcplcontrol
+
+##############################################################################
+# Methods
+##############################################################################
+
+def sendRequest(socketFilename, request, timeoutSeconds):
+    """
+    Sends the given dict request to the monitor listening on the given
+    socket, and returns its dict reply.
+
+    Raises OSError if the monitor cannot be reached, and ValueError on an
+    invalid reply.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeoutSeconds)
+        sock.connect(socketFilename)
+        sock.sendall((json.dumps(request) + "\n").encode("UTF-8"))
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    finally:
+        sock.close()
+    if len(line) == 0:
+        raise ValueError("No reply from the monitor.")
+    return json.loads(line)
+
+
+def getRequest(parser, args):
+    """
+    Returns the dict request for the given command line arguments.
+    """
+
+    command = args[0]
+    if command in ["status", "help", "profile-next"] and len(args) == 1:
+        return {"command": command}
+    if command == "get" and len(args) in [1, 2]:
+        return {"command": "get"}
+    if command == "set" and len(args) == 3:
+        return {"command": "set", "name": args[1], "value": args[2]}
+    if command == "poll-now" and len(args) in [1, 2]:
+        request = {"command": "poll-now"}
+        if len(args) == 2:
+            request["sheetId"] = args[1]
+        return request
+    if command in ["pause", "resume"] and len(args) == 2:
+        return {"command": command, "url": args[1]}
+    parser.error("Invalid command: " + " ".join(args))
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage="%prog [options] status | help | get [NAME] | " +
+              "set NAME VALUE | poll-now [SHEET_ID] | pause URL | " +
+              "resume URL | profile-next")
+    parser.add_option("--socket",
+                      default=lcplcontrol.CONTROL_SOCKET_FILENAME,
+                      help="File path of the control socket of the " +
+                           "monitor [default: LCPL_PAGE_SUBS_CONTROL_SOCKET, " +
+                           "or data/lcplpagesubs.control.sock]")
+    parser.add_option("--timeout", type="float",
+                      default=lcplcontrol.REPLY_TIMEOUT_SECONDS + 5,
+                      help="Seconds to wait for the reply [default: %default]")
+    options, args = parser.parse_args()
+
+    if len(args) == 0:
+        parser.print_help()
+        sys.exit(2)
+    if not options.socket:
+        parser.error("The control socket is disabled; set --socket")
+    request = getRequest(parser, args)
+
+    try:
+        reply = sendRequest(options.socket, request, options.timeout)
+    except (OSError, ValueError) as e:
+        print("Could not reach the monitor on " + options.socket + ": " +
+              str(e), file=sys.stderr)
+        sys.exit(2)
+
+    if args[0] == "get" and len(args) == 2 and reply.get("ok"):
+        if args[1] not in reply["knobs"]:
+            print("Unknown knob: " + args[1] + ".  Expected one of: " +
+                  ", ".join(sorted(reply["knobs"])), file=sys.stderr)
+            sys.exit(1)
+        reply = {"ok": True, "name": args[1], "value": reply["knobs"][args[1]]}
+
+    print(json.dumps(reply, indent=2, sort_keys=True))
+    sys.exit(0 if reply.get("ok") else 1)
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+##############################################################################
+# Incremental export of the shift history to columnar files, for analysis
+# away from the monitor's database.
+#
+# Each row of table 'shifts' is a status transition of a shift.  The rows
+# added since the last export are appended to Parquet (or Arrow IPC) files,
+# partitioned by month (UTC) and URL, in the Hive layout read by pyarrow,
+# pandas, DuckDB, Spark, etc.:
+#
+#   <export dir>/shift_transitions/month=2026-10/url_key=<hash>/
+#       part-<first rowid>-<last rowid>.parquet
+#
+# with the columns:
+#   source_rowid  - int64 rowid of the row in table 'shifts'.
+#   utc_timestamp - timestamp (int64 microseconds, UTC) of the transition.
+#   sheet_id      - dictionary-encoded str.
+#   url           - dictionary-encoded str.
+#   row_number    - int32 row of the shift on its page.
+#   status        - dictionary-encoded str status the shift changed to.
+#
+# The rowid of the last row exported (the high-water mark) is kept in
+# export_state.json in the export directory, and only rows after it are
+# read, so each run only writes the rows added since the last one.  Each
+# batch of rows is written before the mark is moved past it, and files
+# left by an interrupted run (past the mark) are removed by the next run,
+# so no row is exported twice.  The database is opened read-only.
+#
+# Needs pyarrow (pip install pyarrow), which the monitor itself does not.
+#
+# Usage:
+#   python3 src/lcplexport.py
+#   python3 src/lcplexport.py --format=arrow --export-dir=/tmp/export
+#   python3 src/lcplexport.py --rebuild --database=data/lcpl_page_shifts.db
+#
+# To read the export:
+#   import pyarrow.dataset
+#   dataset = pyarrow.dataset.dataset("data/lcplpagesubs.export/" +
+#                                     "shift_transitions",
+#                                     format="parquet", partitioning="hive")
+#   table = dataset.to_table(filter=pyarrow.dataset.field("month") ==
+#                            "2026-10")
+##############################################################################
+
+import os
+import sys
+import glob
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import optparse
+import datetime
+import urllib.parse
+import monitorstate
+from lcplcommon import log, DATA_DIR, DATABASE_FILENAME
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Directory of the export.  Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_EXPORT_DIR.
+EXPORT_DIR = os.environ.get("LCPL_PAGE_SUBS_EXPORT_DIR",
+                            os.path.join(DATA_DIR, "lcplpagesubs.export"))
+
+# Version of the export layout.  An export of another version is not
+# appended to; run with --rebuild.
+EXPORT_VERSION = 1
+
+# Name of the dataset directory, and of the state file, in the export
+# directory.
+DATASET_DIRNAME = "shift_transitions"
+STATE_FILENAME = "export_state.json"
+
+# File formats, by name, and the extension of their files.
+FILE_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Maximum number of rows read and written per batch.
+EXPORT_BATCH_ROWS = 100000
+
+# Number of hex digits of the SHA-1 of a URL naming its partition.
+URL_KEY_LENGTH = 16
+
+# Maximum number of seconds to wait for the database while the monitor is
+# writing to it.
+DATABASE_READ_TIMEOUT_SECONDS = 30
+
+##############################################################################
+# Classes
+##############################################################################
+
+class ExportError(Exception):
+    """
+    Raised when the export cannot be done, e.g. pyarrow is missing or the
+    export directory holds an export of another format or version.
+    """
+
+    pass
+
+##############################################################################
+# Methods
+##############################################################################
+
+def importPyarrow():
+    """
+    Returns the pyarrow module, imported on first use, since only the
+    exporter needs it.
+
+    Raises ExportError if pyarrow is not installed.
+    """
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+    except ImportError as e:
+        raise ExportError("The export needs pyarrow " + \
+                          "(pip install pyarrow): " + str(e))
+    return pyarrow
+
+
+def getSchema(pa):
+    """
+    Returns the pyarrow schema of the exported files.
+    """
+
+    return pa.schema([
+        ("source_rowid", pa.int64()),
+        ("utc_timestamp", pa.timestamp("us", tz="UTC")),
+        ("sheet_id", pa.dictionary(pa.int32(), pa.string())),
+        ("url", pa.dictionary(pa.int32(), pa.string())),
+        ("row_number", pa.int32()),
+        ("status", pa.dictionary(pa.int32(), pa.string())),
+        ])
+
+
+def getUrlKey(url):
+    """
+    Returns the str partition key of the given URL: a prefix of its SHA-1,
+    since URLs do not make portable directory names.
+    """
+
+    return hashlib.sha1(url.encode("UTF-8")).hexdigest()[:URL_KEY_LENGTH]
+
+
+def getPartFilename(exportDir, month, urlKey, firstRowid, lastRowid,
+                    fileFormat):
+    """
+    Returns the str path of the file of the given rows of a partition.
+    """
+
+    return os.path.join(exportDir, DATASET_DIRNAME, "month=" + month,
+                        "url_key=" + urlKey,
+                        "part-" + str(firstRowid).zfill(12) + "-" +
+                        str(lastRowid).zfill(12) +
+                        FILE_EXTENSIONS[fileFormat])
+
+
+def getPartFirstRowid(filename):
+    """
+    Returns the int first rowid of the part file of the given path, or None
+    if it is not a part file.
+    """
+
+    name = os.path.basename(filename)
+    if name.startswith("."):
+        name = name[1:]
+    fields = name.split(".")[0].split("-")
+    if len(fields) != 3 or fields[0] != "part" or not fields[1].isdigit():
+        return None
+    return int(fields[1])
+
+
+def openReadOnlyDatabase(filename):
+    """
+    Returns a read-only sqlite3 connection to the database of the given
+    path.
+
+    Raises ExportError if the database does not exist.
+    """
+
+    if not os.path.isfile(filename):
+        raise ExportError("No database: " + filename)
+    uri = "file:" + urllib.parse.quote(filename) + "?mode=ro"
+    return sqlite3.connect(uri, uri=True,
+                           timeout=DATABASE_READ_TIMEOUT_SECONDS)
+
+
+def loadExportState(exportDir, fileFormat):
+    """
+    Returns the dict state of the export in the given directory, or a new
+    one if there is none yet.
+
+    Raises ExportError if the export is of another format or version.
+    """
+
+    state = monitorstate.readJsonFile(os.path.join(exportDir,
+                                                   STATE_FILENAME))
+    if state is None:
+        return {"version": EXPORT_VERSION, "format": fileFormat,
+                "lastRowid": 0, "numRows": 0, "urlsByKey": {}}
+    if state.get("version") != EXPORT_VERSION:
+        raise ExportError("The export in " + exportDir + " is of " + \
+                          "version " + str(state.get("version")) + \
+                          ", not " + str(EXPORT_VERSION) + \
+                          ".  Run with --rebuild.")
+    if state.get("format") != fileFormat:
+        raise ExportError("The export in " + exportDir + " is in " + \
+                          str(state.get("format")) + " format, not " + \
+                          fileFormat + ".  Run with --format=" + \
+                          str(state.get("format")) + ", or --rebuild.")
+    return state
+
+
+def saveExportState(exportDir, state):
+    os.makedirs(exportDir, exist_ok=True)
+    state["updUtcDttm"] = datetime.datetime.utcnow().isoformat()
+    monitorstate.writeJsonFileAtomically(os.path.join(exportDir,
+                                                      STATE_FILENAME), state)
+
+
+def removeUnfinishedParts(exportDir, lastRowid):
+    """
+    Removes the part files of rows past the given high-water mark, and all
+    temporary files, left by an interrupted export.
+
+    Returns:
+    int number of files removed.
+    """
+
+    numRemoved = 0
+    partitionDir = os.path.join(exportDir, DATASET_DIRNAME, "month=*",
+                                "url_key=*")
+    for filename in glob.glob(os.path.join(partitionDir, "part-*")) + \
+            glob.glob(os.path.join(partitionDir, ".part-*.tmp")):
+        firstRowid = getPartFirstRowid(filename)
+        if filename.endswith(".tmp") or \
+                (firstRowid is not None and firstRowid > lastRowid):
+            log.info("Removing a file of an interrupted export: " + filename)
+            os.remove(filename)
+            numRemoved += 1
+    return numRemoved
+
+
+def readNewRows(conn, lastRowid, batchRows):
+    """
+    Returns a list of the rows of table 'shifts' after the given rowid, in
+    rowid order, at most batchRows of them.  Each row is a tuple (rowid,
+    crte_utc_dttm, sheet_id, url, row_number, status).
+    """
+
+    cursor = conn.cursor()
+    cursor.execute("select rowid, crte_utc_dttm, sheet_id, url, " +
+                   "row_number, status from shifts where rowid > ? " +
+                   "order by rowid limit ?", (lastRowid, batchRows))
+    return cursor.fetchall()
+
+
+def getRowNumber(rowNumber):
+    """
+    Returns the int row number of the given value of column row_number
+    (stored as text), or None if it is not a number.
+    """
+
+    try:
+        return int(rowNumber)
+    except (TypeError, ValueError):
+        return None
+
+
+def buildTable(pa, rows):
+    """
+    Returns a pyarrow Table of the given rows (as returned by
+    readNewRows()), in the schema of getSchema().
+    """
+
+    # The crte_utc_dttm are ISO 8601 in UTC, which Arrow parses.
+    arrays = [
+        pa.array([row[0] for row in rows], pa.int64()),
+        pa.array([row[1] for row in rows], pa.string()).cast(
+            pa.timestamp("us")).cast(pa.timestamp("us", tz="UTC")),
+        pa.array([row[2] for row in rows], pa.string()).dictionary_encode(),
+        pa.array([row[3] for row in rows], pa.string()).dictionary_encode(),
+        pa.array([getRowNumber(row[4]) for row in rows], pa.int32()),
+        pa.array([row[5] for row in rows], pa.string()).dictionary_encode(),
+        ]
+    return pa.Table.from_arrays(arrays, schema=getSchema(pa))
+
+
+def writePart(pa, table, filename, fileFormat):
+    """
+    Writes the given Table to a file of the given path and format.  The
+    file is written under a temporary name and then renamed, so that
+    readers never see a partial file.
+    """
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmpFilename = os.path.join(os.path.dirname(filename),
+                               "." + os.path.basename(filename) + ".tmp")
+    if fileFormat == "parquet":
+        pa.parquet.write_table(table, tmpFilename, compression="zstd")
+    else:
+        pa.feather.write_feather(table, tmpFilename, compression="zstd")
+    os.replace(tmpFilename, filename)
+
+
+def exportNewRows(conn, exportDir, fileFormat="parquet",
+                  batchRows=EXPORT_BATCH_ROWS):
+    """
+    Appends the rows of table 'shifts' added since the last export to the
+    export in the given directory, and moves its high-water mark.
+
+    Arguments:
+    conn       - sqlite3 connection to the monitor's database.
+    exportDir  - str containing the directory of the export.
+    fileFormat - str "parquet" or "arrow".
+    batchRows  - int maximum number of rows read and written per batch.
+
+    Returns:
+    tuple (int number of rows exported, int number of files written).
+
+    Raises ExportError if the export cannot be done.
+    """
+
+    if fileFormat not in FILE_EXTENSIONS:
+        raise ExportError("Unknown format: " + fileFormat + ".  " + \
+                          "Expected one of: " + \
+                          ", ".join(sorted(FILE_EXTENSIONS)))
+    pa = importPyarrow()
+    state = loadExportState(exportDir, fileFormat)
+    removeUnfinishedParts(exportDir, state["lastRowid"])
+
+    numRows = 0
+    numFiles = 0
+    while True:
+        rows = readNewRows(conn, state["lastRowid"], batchRows)
+        if len(rows) == 0:
+            break
+
+        # Rows of each partition, in rowid order.
+        rowsByPartition = {}
+        urlKeysByUrl = {}
+        for row in rows:
+            urlKey = urlKeysByUrl.get(row[3])
+            if urlKey is None:
+                urlKey = getUrlKey(row[3])
+                urlKeysByUrl[row[3]] = urlKey
+                state["urlsByKey"][urlKey] = row[3]
+            partition = (row[1][:7], urlKey)
+            rowsByPartition.setdefault(partition, []).append(row)
+
+        for ((month, urlKey), partitionRows) in \
+                sorted(rowsByPartition.items()):
+            filename = getPartFilename(exportDir, month, urlKey,
+                                       partitionRows[0][0],
+                                       partitionRows[-1][0], fileFormat)
+            writePart(pa, buildTable(pa, partitionRows), filename,
+                      fileFormat)
+            numFiles += 1
+
+        state["lastRowid"] = rows[-1][0]
+        state["numRows"] += len(rows)
+        saveExportState(exportDir, state)
+        numRows += len(rows)
+        log.info("Exported rows up to rowid " + str(state["lastRowid"]) + \
+                 " (" + str(numRows) + " rows so far).")
+        if len(rows) < batchRows:
+            break
+
+    return (numRows, numFiles)
+
+
+def removeExport(exportDir):
+    """
+    Removes the export in the given directory: its dataset directory and
+    state file.  Other files in the directory are left alone.
+    """
+
+    shutil.rmtree(os.path.join(exportDir, DATASET_DIRNAME),
+                  ignore_errors=True)
+    stateFilename = os.path.join(exportDir, STATE_FILENAME)
+    if os.path.exists(stateFilename):
+        os.remove(stateFilename)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--database", default=DATABASE_FILENAME,
+                      help="File path of the database " +
+                           "[default: LCPL_PAGE_SUBS_DATABASE_FILENAME, " +
+                           "or data/lcpl_page_shifts.db]")
+    parser.add_option("--export-dir", default=EXPORT_DIR,
+                      help="Directory of the export " +
+                           "[default: LCPL_PAGE_SUBS_EXPORT_DIR, " +
+                           "or data/lcplpagesubs.export]")
+    parser.add_option("--format", default="parquet",
+                      help="Format of the files: parquet or arrow " +
+                           "(Arrow IPC) [default: %default]")
+    parser.add_option("--batch-rows", type="int", default=EXPORT_BATCH_ROWS,
+                      help="Rows read and written per batch " +
+                           "[default: %default]")
+    parser.add_option("--rebuild", action="store_true", default=False,
+                      help="Remove the export, and export the whole " +
+                           "history again")
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s - %(message)s")
+
+    startTime = time.perf_counter()
+    try:
+        conn = openReadOnlyDatabase(os.path.abspath(options.database))
+        try:
+            if options.rebuild:
+                removeExport(options.export_dir)
+            numRows, numFiles = exportNewRows(conn, options.export_dir,
+                                              options.format,
+                                              options.batch_rows)
+        finally:
+            conn.close()
+    except (ExportError, sqlite3.Error) as e:
+        print("Export failed: " + str(e), file=sys.stderr)
+        return 1
+    print("Exported " + str(numRows) + " rows to " + str(numFiles) +
+          " files in " +
+          "{:.3f} seconds.".format(time.perf_counter() - startTime))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
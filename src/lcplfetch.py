@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+##############################################################################
+# Fetching of SignUpGenius pages over HTTP.
+#
+# Fetched pages can be recorded into an archive, and an archive can be
+# replayed instead of fetching from the web (see fetcharchive.py).
+#
+# Pages are fetched with conditional GETs, and a page identical to the one
+# last processed for its URL (by fingerprint) is not returned, so it is not
+# parsed again.  Requests share one HTTP session, so connections to the web
+# server are reused between pages and cycles.  Pages can be fetched from
+# another URL than their own, e.g. the JSON API (see lcplsource.py).
+#
+# Bodies are streamed and decoded as they are received.  Reading an HTML
+# page stops once the parts that are parsed have been received, a body
+# longer than FETCH_MAX_BODY_BYTES is not processed, and only the start of
+# the body of an error response is read, logged and emailed.
+#
+# Requests are spaced by a delay that adapts to the web server (see
+# ratecontrol.py).  A response asking to slow down (HTTP 429, or 503) makes
+# every later request wait longer, and its Retry-After is honored; such a
+# response is retried, like a server error, instead of shutting down.
+##############################################################################
+
+import os
+import time
+import codecs
+import hashlib
+import requests
+from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError
+import metrics
+import fetcharchive
+import ratecontrol
+from lcplcommon import log, metricsRegistry, shutdown
+from lcplcommon import APP_NAME, STAGE_SECONDS_METRIC
+from lcplcommon import FETCH_DELAY_SECONDS, FETCH_MIN_DELAY_SECONDS
+from lcplcommon import FETCH_MAX_DELAY_SECONDS, FETCH_RATE_CONTROL_ENABLED
+from lcplcommon import FETCH_MAX_RETRY_AFTER_SECONDS
+from lcplcommon import FETCH_MAX_BODY_BYTES, FETCH_EARLY_STOP_ENABLED
+from lcplcommon import RECORD_ARCHIVE_FILENAME, REPLAY_ARCHIVE_FILENAME
+from lcplcommon import NOTIFICATION_SINK_FILENAME, SNAPSHOT_ALL_FETCHES
+import lcplcommon
+import lcplnotify
+import lcplparse
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Number of seconds after which an unused connection is assumed closed by
+# the web server, and is opened again by prewarmConnection().
+PREWARM_IDLE_SECONDS = 30
+
+# Number of bytes read from a response at a time.
+FETCH_CHUNK_BYTES = 16 * 1024
+
+# Maximum number of bytes of the rest of a page read, and dropped, after
+# reading stopped early, so that the connection can be reused.  If the rest
+# is longer, the connection is closed instead.
+FETCH_DRAIN_MAX_BYTES = 32 * 1024
+
+# Maximum number of bytes read of the body of an error response, and of
+# characters of a body included in logs and emails.
+ERROR_BODY_MAX_BYTES = 16 * 1024
+ERROR_BODY_MAX_CHARS = 2000
+
+# Number of seconds waited before retrying after a server error (or a 503
+# without Retry-After) or a connection error.
+SERVER_ERROR_RETRY_SECONDS = 60
+
+# HTTP status codes of the responses retried (see fetchPage()).
+RETRIED_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# HTTP session, keeping connections to the web server open between requests.
+session = requests.Session()
+
+# Adaptive delay between requests, shared by all fetches.
+rateController = ratecontrol.AdaptiveRateController(
+    FETCH_DELAY_SECONDS, FETCH_MIN_DELAY_SECONDS, FETCH_MAX_DELAY_SECONDS,
+    maxRetryAfterSeconds=FETCH_MAX_RETRY_AFTER_SECONDS,
+    isAdaptive=FETCH_RATE_CONTROL_ENABLED)
+
+# time.time() of the last request made with the session.
+lastRequestTimestamp = None
+
+# Archives for record and replay modes.
+# See the method initializeFetchArchives() below.
+recordArchive = None
+replayArchive = None
+replayCycles = []
+replayCycleIndex = 0
+
+# Dict of URL to dict of the HTTP validators ('etag', 'lastModified') of
+# the last processed page of that URL, sent with the next request for it.
+httpValidatorsByUrl = {}
+
+# Dict of URL to the str SHA-256 fingerprint of the last processed page of
+# that URL.
+pageFingerprintByUrl = {}
+
+# Dict of URL to dict of the fingerprint and validators of a fetched page,
+# until the page is processed.  See the method commitPage() below.
+pendingPageStateByUrl = {}
+
+##############################################################################
+# Classes
+##############################################################################
+
+class FetchFailedError(Exception):
+    """
+    Raised by fetchPage() when a fetch fails and the caller asked to fall
+    back to another source instead of retrying.
+    """
+
+    pass
+
+
+class ResponseTooLargeError(Exception):
+    """
+    Raised by readResponseBody() when a body is longer than allowed.
+    """
+
+    pass
+
+##############################################################################
+# Methods
+##############################################################################
+
+def initializeFetchArchives():
+    """
+    Opens the archive to record fetched pages into, and the archive to
+    replay pages from, if either is configured.  In replay mode, the seed
+    URL is taken from the first recorded cycle.
+    """
+
+    global recordArchive
+    global replayArchive
+    global replayCycles
+
+    if RECORD_ARCHIVE_FILENAME is not None:
+        log.info("Recording fetched pages to archive: " + \
+                 RECORD_ARCHIVE_FILENAME)
+        recordArchive = fetcharchive.FetchArchive(RECORD_ARCHIVE_FILENAME)
+
+    if REPLAY_ARCHIVE_FILENAME is not None:
+        if not os.path.isfile(REPLAY_ARCHIVE_FILENAME):
+            log.error("Replay archive does not exist: " + \
+                      REPLAY_ARCHIVE_FILENAME)
+            shutdown(1)
+
+        databaseFilename = lcplcommon.DATABASE_FILENAME
+        if lcplcommon.replayUsesOwnDatabase and \
+                os.path.isfile(databaseFilename):
+            log.info("Removing database of previous replay: " + \
+                     databaseFilename)
+            os.remove(databaseFilename)
+
+        log.info("Replaying fetched pages from archive: " + \
+                 REPLAY_ARCHIVE_FILENAME)
+        replayArchive = fetcharchive.FetchArchive(REPLAY_ARCHIVE_FILENAME)
+        replayCycles = replayArchive.getCycles()
+        log.info("Archive has " + str(len(replayCycles)) + " cycles: " + \
+                 str(replayArchive.getStats()))
+        if len(replayCycles) == 0:
+            log.error("Replay archive has no recorded fetches.")
+            shutdown(1)
+
+        # Page URLs found in the recorded pages are resolved against the
+        # base URL, so it must match the one used while recording.
+        seedUrl = replayArchive.getFetchesForCycle(replayCycles[0])[0].url
+        lcplcommon.seedUrl = seedUrl
+        lcplcommon.baseUrl = seedUrl[:seedUrl.rfind("/") + 1]
+        log.info("Replay seed URL is: " + lcplcommon.seedUrl)
+        log.info("Replay base URL is: " + lcplcommon.baseUrl)
+
+    if NOTIFICATION_SINK_FILENAME is not None:
+        log.info("Notifications will be written to sink: " + \
+                 NOTIFICATION_SINK_FILENAME)
+
+
+def closeFetchArchives():
+    """
+    Closes the record and replay archives, if open.
+    """
+
+    global recordArchive
+    global replayArchive
+
+    if recordArchive is not None:
+        recordArchive.close()
+        recordArchive = None
+    if replayArchive is not None:
+        replayArchive.close()
+        replayArchive = None
+
+
+def commitPage(url):
+    """
+    Records that the page last fetched for the given URL has been
+    processed, so that the next fetch of the same page is skipped.
+    """
+
+    pageState = pendingPageStateByUrl.pop(url, None)
+    if pageState is None:
+        return
+    pageFingerprintByUrl[url] = pageState["fingerprint"]
+    validators = {}
+    for name in ["etag", "lastModified"]:
+        if pageState.get(name) is not None:
+            validators[name] = pageState[name]
+    if len(validators) > 0:
+        httpValidatorsByUrl[url] = validators
+    else:
+        httpValidatorsByUrl.pop(url, None)
+
+
+def forgetPage(url):
+    """
+    Forgets the last processed page of the given URL, so that its next
+    fetch is processed in full, e.g. after another worker polled it.
+    """
+
+    httpValidatorsByUrl.pop(url, None)
+    pageFingerprintByUrl.pop(url, None)
+    pendingPageStateByUrl.pop(url, None)
+
+
+def recordUnchangedPage(url, responseTimestamp):
+    """
+    Records that the page of the given URL was fetched and found unchanged.
+    """
+
+    log.debug("Page is unchanged since it was last processed: " + url)
+    lcplparse.lastObservedTimestampByUrl[url] = responseTimestamp
+    metricsRegistry.incrementCounter("lcplpagesubs_unchanged_pages_total")
+
+
+def getCacheState():
+    """
+    Returns a JSON-serializable dict of the validators and fingerprints of
+    the processed pages, for a checkpoint (see lcplcheckpoint.py).
+    """
+
+    return {
+        "httpValidatorsByUrl": httpValidatorsByUrl,
+        "pageFingerprintByUrl": pageFingerprintByUrl,
+        }
+
+
+def restoreCacheState(state):
+    """
+    Restores the validators and fingerprints of the processed pages from a
+    dict returned by getCacheState().
+    """
+
+    httpValidatorsByUrl.clear()
+    httpValidatorsByUrl.update(state.get("httpValidatorsByUrl", {}))
+    pageFingerprintByUrl.clear()
+    pageFingerprintByUrl.update(state.get("pageFingerprintByUrl", {}))
+
+
+def prewarmConnection(url):
+    """
+    Opens a connection to the host of the given URL (resolving its name and
+    doing the TLS handshake) with a HEAD request, if the session has been
+    idle for PREWARM_IDLE_SECONDS, so that the next poll does not wait on
+    it.  Failures are only logged; the poll itself retries.  Nothing is
+    sent while the web server has asked to wait (see ratecontrol.py).
+    """
+
+    global lastRequestTimestamp
+
+    if isReplaying() or (lastRequestTimestamp is not None and \
+            time.time() - lastRequestTimestamp < PREWARM_IDLE_SECONDS):
+        return
+    if rateController.isBlocked():
+        return
+
+    log.debug("Prewarming the connection for URL: " + url)
+    try:
+        session.head(url, allow_redirects=False, timeout=10)
+        metricsRegistry.incrementCounter(
+            "lcplpagesubs_prewarm_requests_total")
+    except RequestException as e:
+        log.debug("Prewarming the connection failed: " + str(e))
+    lastRequestTimestamp = time.time()
+
+
+def isReplaying():
+    """
+    Returns True if pages are replayed from an archive instead of fetched.
+    """
+
+    return replayArchive is not None
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "getHtmlPages"})
+def getHtmlPages(urls, cycle=0):
+    """
+    Returns a list of tuples, for the pages that changed since they were
+    last processed.  Each tuple contains the following:
+      - str containing the URL
+      - str containing the contents of a HTML page.
+      - float containing the time.time() the response was received.
+
+    Call commitPage() once a returned page has been processed.
+
+    Arguments:
+    urls  - list of str, each str containing a URL.
+    cycle - int number of the poll cycle, recorded with each fetch
+            when recording to an archive.
+    """
+
+    checkUrls(urls)
+
+    if replayArchive is not None:
+        return getHtmlPagesFromReplayArchive(urls)
+
+    htmls = []
+
+    for url in urls:
+        tup = fetchPage(url, cycle)
+        if tup is not None:
+            htmls.append(tup)
+
+    return htmls
+
+
+def checkUrls(urls):
+    """
+    Shuts down if the given list of URLs to fetch is not a list.
+    """
+
+    if urls is None:
+        log.error("Input parameter 'urls' may not be None.")
+        shutdown(1)
+    if not isinstance(urls, list):
+        log.error("Input parameter 'urls' must be of type list.  " + \
+                  "urls is: " + str(urls))
+        shutdown(1)
+
+
+def readResponseBody(r, maxBytes, canStopEarly=False,
+                     isTruncationAllowed=False):
+    """
+    Reads the body of the given streamed response, decoding it as it is
+    received, and closes the response.
+
+    Arguments:
+    r                   - requests.Response of a request made with
+                          stream=True.
+    maxBytes            - int maximum number of bytes of the body.
+    canStopEarly        - bool.  If True, the body is an HTML page, and
+                          reading stops once its parsed parts have been
+                          received (see lcplparse.HtmlPageEndScanner).
+    isTruncationAllowed - bool.  If True, a body longer than maxBytes is
+                          cut there instead of raising
+                          ResponseTooLargeError.
+
+    Returns:
+    tuple (str text, int number of bytes read, bool True if the text is
+    not the whole body).
+    """
+
+    try:
+        decoder = codecs.getincrementaldecoder(r.encoding or "UTF-8")(
+            errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("UTF-8")(errors="replace")
+    scanner = None
+    if canStopEarly:
+        scanner = lcplparse.HtmlPageEndScanner()
+
+    textParts = []
+    numBytes = 0
+    try:
+        chunks = r.iter_content(FETCH_CHUNK_BYTES)
+        for chunk in chunks:
+            if numBytes + len(chunk) > maxBytes:
+                if not isTruncationAllowed:
+                    raise ResponseTooLargeError(
+                        "Body longer than " + str(maxBytes) + " bytes")
+                textParts.append(decoder.decode(chunk[:maxBytes - numBytes]))
+                numBytes = maxBytes
+                return ("".join(textParts), numBytes, True)
+            numBytes += len(chunk)
+            text = decoder.decode(chunk)
+            if scanner is None:
+                textParts.append(text)
+                continue
+            endOffset = scanner.feed(text)
+            if endOffset is not None:
+                numBytes += drainResponse(chunks)
+                return (scanner.text[:endOffset], numBytes, True)
+
+        text = decoder.decode(b"", final=True)
+        if scanner is None:
+            textParts.append(text)
+            return ("".join(textParts), numBytes, False)
+        scanner.feed(text)
+        return (scanner.text, numBytes, False)
+    finally:
+        # Returns the connection to the pool if the body was read to its
+        # end, and closes it otherwise.
+        r.close()
+
+
+def drainResponse(chunks):
+    """
+    Reads the rest of a response from the given iterator of its chunks, up
+    to FETCH_DRAIN_MAX_BYTES, so that its connection can be reused.
+
+    Returns:
+    int number of bytes read.
+    """
+
+    numBytes = 0
+    for chunk in chunks:
+        numBytes += len(chunk)
+        if numBytes > FETCH_DRAIN_MAX_BYTES:
+            break
+    return numBytes
+
+
+def getTruncatedText(text, maxChars=ERROR_BODY_MAX_CHARS):
+    """
+    Returns the given str cut to maxChars characters, noting the cut, for
+    logs and emails.
+    """
+
+    if len(text) <= maxChars:
+        return text
+    return text[:maxChars] + " ... [truncated, " + \
+        str(len(text) - maxChars) + " more characters]"
+
+
+def fetchPage(url, cycle=0, requestUrl=None, isFailureAllowed=False):
+    """
+    Fetches the page of the given URL, once the rate controller allows it,
+    retrying on server and connection errors and on responses asking to
+    slow down.  Any other failure is emailed to the admin, and shuts down.
+
+    Returns a tuple (URL, page text, time.time() the response was
+    received), as in getHtmlPages(), or None if the page is unchanged since
+    it was last processed, or longer than FETCH_MAX_BODY_BYTES.
+
+    Arguments:
+    url              - str containing the URL of the page.  Pages are
+                       recorded and cached under this URL.
+    cycle            - int number of the poll cycle, recorded with the
+                       fetch when recording to an archive.
+    requestUrl       - str containing the URL actually requested, e.g. the
+                       JSON API URL of the page (see lcplsource.py).
+                       Defaults to url.
+    isFailureAllowed - bool.  If True, no retries are made, and any
+                       response that is not a 2xx or 304, any body
+                       longer than FETCH_MAX_BODY_BYTES, and any
+                       RequestException, raise FetchFailedError instead,
+                       so that the caller can fall back to another source.
+    """
+
+    global lastRequestTimestamp
+
+    if requestUrl is None:
+        requestUrl = url
+
+    shouldTryAgain = True
+    while shouldTryAgain:
+        shouldTryAgain = False
+        try:
+            log.info("Fetching webpage from URL: " + requestUrl)
+            headers = {}
+            validators = httpValidatorsByUrl.get(url, {})
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "lastModified" in validators:
+                headers["If-Modified-Since"] = validators["lastModified"]
+            waitSeconds = rateController.waitForTurn()
+            if waitSeconds > 0:
+                metricsRegistry.incrementCounter(
+                    "lcplpagesubs_fetch_wait_seconds_total", waitSeconds)
+            fetchStartTime = time.perf_counter()
+            r = session.get(requestUrl, headers=headers, stream=True)
+            if 200 <= r.status_code < 300:
+                isHtml = "html" in r.headers.get("Content-Type", "")
+                text, numBytes, isPartial = \
+                    readResponseBody(r, FETCH_MAX_BODY_BYTES,
+                                     FETCH_EARLY_STOP_ENABLED and isHtml)
+                if isPartial:
+                    metricsRegistry.incrementCounter(
+                        "lcplpagesubs_fetch_early_stops_total")
+            else:
+                text, numBytes, isPartial = \
+                    readResponseBody(r, ERROR_BODY_MAX_BYTES,
+                                     isTruncationAllowed=True)
+            responseTimestamp = time.time()
+            lastRequestTimestamp = responseTimestamp
+            if recordArchive is not None:
+                recordArchive.addFetch(cycle, url, responseTimestamp,
+                                       r.status_code, text)
+            if SNAPSHOT_ALL_FETCHES:
+                lcplcommon.snapshotPage("fetch", url, text,
+                                        r.status_code, responseTimestamp,
+                                        cycle)
+            metricsRegistry.observeHistogram(
+                "lcplpagesubs_fetch_seconds",
+                time.perf_counter() - fetchStartTime)
+            metricsRegistry.incrementCounter(
+                "lcplpagesubs_http_responses_total",
+                labels={"code": str(r.status_code)})
+            metricsRegistry.incrementCounter(
+                "lcplpagesubs_fetched_bytes_total", numBytes)
+            metricsRegistry.observeHistogram(
+                "lcplpagesubs_fetched_page_bytes", numBytes,
+                buckets=metrics.DEFAULT_SIZE_BUCKETS)
+            log.debug("HTTP status code: " + str(r.status_code))
+            retryAfterSeconds = \
+                ratecontrol.parseRetryAfter(r.headers.get("Retry-After"))
+            if rateController.recordResponse(r.status_code,
+                                             retryAfterSeconds):
+                log.warning("Web server asked to slow down (HTTP status " + \
+                            "code " + str(r.status_code) + ", Retry-After " + \
+                            str(r.headers.get("Retry-After")) + ").  " + \
+                            "Delay between requests is now " + \
+                            str(rateController.getDelaySeconds()) + \
+                            " seconds.")
+                metricsRegistry.incrementCounter(
+                    "lcplpagesubs_fetch_pushbacks_total",
+                    labels={"code": str(r.status_code)})
+            metricsRegistry.setGauge("lcplpagesubs_fetch_delay_seconds",
+                                     rateController.getDelaySeconds())
+            if r.status_code == 304:
+                recordUnchangedPage(url, responseTimestamp)
+            elif 200 <= r.status_code < 300:
+                # The same fingerprint as the archive's (see
+                # fetcharchive.py), over the text actually processed.
+                fingerprint = \
+                    hashlib.sha256(text.encode("UTF-8")).hexdigest()
+                pendingPageStateByUrl[url] = {
+                    "fingerprint": fingerprint,
+                    "etag": r.headers.get("ETag"),
+                    "lastModified": r.headers.get("Last-Modified"),
+                    }
+                if fingerprint == pageFingerprintByUrl.get(url):
+                    commitPage(url)
+                    recordUnchangedPage(url, responseTimestamp)
+                else:
+                    tup = (url, text, responseTimestamp)
+                    return tup
+            elif isFailureAllowed:
+                raise FetchFailedError("HTTP status code " + \
+                                       str(r.status_code) + " for URL: " + \
+                                       requestUrl)
+            elif r.status_code in RETRIED_STATUS_CODES:
+                log.warn("URL: " + url)
+                log.warn("Unexpected HTTP status code: " + str(r.status_code))
+                log.warn("Response text is: " + getTruncatedText(text))
+
+                metricsRegistry.incrementCounter(
+                    "lcplpagesubs_fetch_retries_total",
+                    labels={"reason": "http_" + str(r.status_code)})
+                shouldTryAgain = True
+                if r.status_code != 429 and retryAfterSeconds is None:
+                    rateController.pauseFor(SERVER_ERROR_RETRY_SECONDS)
+                numSeconds = rateController.getSecondsUntilNextRequest()
+                log.info("Retry in " + str(numSeconds) + " seconds ...")
+            else:
+                log.error("URL: " + url)
+                log.error("Unexpected HTTP status code: " + str(r.status_code))
+                log.error("Response text is: " + getTruncatedText(text))
+
+                emailSubject = \
+                    "Admin Notification for Application '" + APP_NAME + "' "
+                endl = "<br />"
+                emailBodyHtml = "Hi," + endl + endl + \
+                    "This is a notification to the site Admin that " + \
+                    "application '" + APP_NAME + \
+                    "' encountered an unexpected HTTP status code.  " + \
+                    "Please investigate at your earliest convenience.  " + \
+                    "Thank you." + \
+                    endl + endl + \
+                    "URL was: " + url + \
+                    endl + endl + \
+                    "Unexpected HTTP status code: " + str(r.status_code) + \
+                    endl + endl + \
+                    "Response text was: " + getTruncatedText(text) + \
+                    endl + endl + \
+                    "-" + APP_NAME
+
+                lcplnotify.sendAdminNotificationEmail(emailSubject,
+                                                      emailBodyHtml)
+                shutdown(1)
+
+        except ResponseTooLargeError as e:
+            metricsRegistry.incrementCounter(
+                "lcplpagesubs_fetch_oversize_total")
+            if isFailureAllowed:
+                raise FetchFailedError(str(e) + " for URL: " + requestUrl)
+            log.error("Not processing the page, fetched again next " + \
+                      "cycle: " + str(e) + " for URL: " + requestUrl)
+            return None
+
+        except ConnectionError as e:
+            if isFailureAllowed:
+                raise FetchFailedError("ConnectionError for URL: " + \
+                                       requestUrl + ": " + str(e))
+            log.error("Caught ConnectionError: " + str(e))
+
+            metricsRegistry.incrementCounter(
+                "lcplpagesubs_fetch_retries_total",
+                labels={"reason": "connection_error"})
+            shouldTryAgain = True
+            rateController.pauseFor(SERVER_ERROR_RETRY_SECONDS)
+            numSeconds = rateController.getSecondsUntilNextRequest()
+            log.info("Retry in " + str(numSeconds) + " seconds ...")
+
+        except RequestException as e:
+            if isFailureAllowed:
+                raise FetchFailedError("RequestException for URL: " + \
+                                       requestUrl + ": " + str(e))
+            log.error("URL: " + url)
+            log.error("Caught RequestException: " + str(e))
+
+            emailSubject = \
+                "Admin Notification for Application '" + APP_NAME + "' "
+            endl = "<br />"
+            emailBodyHtml = "Hi," + endl + endl + \
+                "This is a notification to the site Admin that " + \
+                "application '" + APP_NAME + \
+                "' encountered an unexpected RequestException.  " + \
+                "Please investigate at your earliest convenience.  " + \
+                "Thank you." + \
+                endl + endl + \
+                "URL was: " + url + \
+                endl + endl + \
+                "RequestException was: " + str(e) + \
+                endl + endl + \
+                "-" + APP_NAME
+
+            lcplnotify.sendAdminNotificationEmail(emailSubject,
+                                                  emailBodyHtml)
+            shutdown(1)
+
+    return None
+
+
+def getHtmlPagesFromReplayArchive(urls):
+    """
+    Replay mode version of getHtmlPages().  Returns the pages of the next
+    recorded cycle for the given URLs, in the same format as
+    getHtmlPages().  A URL not fetched in that cycle gets its latest page
+    recorded before it.  Shuts down cleanly once all cycles are replayed.
+
+    Arguments:
+    urls - list of str, each str containing a URL.
+    """
+
+    global replayCycleIndex
+
+    if replayCycleIndex >= len(replayCycles):
+        log.info("Done replaying all " + str(len(replayCycles)) + \
+                 " cycles of the archive.")
+        shutdown(0)
+
+    cycle = replayCycles[replayCycleIndex]
+    replayCycleIndex += 1
+    log.info("Replaying cycle " + str(cycle) + " (" + \
+             str(replayCycleIndex) + " of " + str(len(replayCycles)) + ")")
+
+    records = replayArchive.getFetchesForCycle(cycle)
+    cycleTimestamp = max(record.fetchTimestamp for record in records)
+
+    # Last successful fetch of each URL in this cycle.
+    recordByUrl = {}
+    for record in records:
+        if 200 <= record.statusCode < 300:
+            recordByUrl[record.url] = record
+
+    htmls = []
+    for url in urls:
+        record = recordByUrl.get(url)
+        if record is None:
+            record = replayArchive.getLatestFetch(url, cycleTimestamp)
+        if record is None:
+            log.warning("No recorded page for URL: " + url)
+            continue
+
+        metricsRegistry.incrementCounter(
+            "lcplpagesubs_http_responses_total",
+            labels={"code": str(record.statusCode)})
+        responseTimestamp = time.time()
+        if record.sha256 == pageFingerprintByUrl.get(url):
+            recordUnchangedPage(url, responseTimestamp)
+            continue
+
+        html = replayArchive.getBody(record.sha256)
+        metricsRegistry.incrementCounter(
+            "lcplpagesubs_fetched_bytes_total", len(html.encode("UTF-8")))
+        pendingPageStateByUrl[url] = {"fingerprint": record.sha256}
+        htmls.append((url, html, responseTimestamp))
+
+    return htmls
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+##############################################################################
+# Notifications of the monitor: SMS alerts via Twilio, email alerts and
+# admin emails via AWS SES, or lines in a notification sink file instead.
+# Also tracks the end-to-end latency of the alerts.
+#
+# The provider SDKs (boto3, twilio) are imported on first use rather than
+# at import time, since boto3 alone takes hundreds of milliseconds to import.
+##############################################################################
+
+import os
+import json
+import time
+import datetime
+import alertlatency
+from lcplcommon import log, metricsRegistry, shutdown
+from lcplcommon import APP_NAME, STAGE_SECONDS_METRIC
+from lcplcommon import NOTIFICATION_SINK_FILENAME, DEFAULT_SHEET_ID
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Service level objective for the number of seconds from first observing a
+# new shift to the notification provider acknowledging the alert.
+# Can be overridden with the environment variable
+# LCPL_PAGE_SUBS_ALERT_LATENCY_SLO_SECONDS.
+ALERT_LATENCY_SLO_SECONDS = \
+    float(os.environ.get("LCPL_PAGE_SUBS_ALERT_LATENCY_SLO_SECONDS", "180"))
+
+# Percentile of alert latency that is compared against the SLO.
+ALERT_LATENCY_SLO_PERCENTILE = 95
+
+# Minimum number of seconds between admin emails about a breached SLO.
+ALERT_LATENCY_SLO_EMAIL_INTERVAL_SECONDS = 24 * 60 * 60
+
+# These globals are extracted from environment variables.
+# See the method initializeTwilio() below.
+twilioAccountSid = None
+twilioAuthToken = None
+sourcePhoneNumber = None
+destinationPhoneNumber = None
+
+# These globals are for sending out admin emails.
+# See the method initializeAdminEmailAddresses() below.
+adminFromEmailAddress = None
+adminToEmailAddress = None
+adminErrorEmailSendingEnabled = True
+
+# This global is for sending out alert email addresses.
+# See the method initializeAlertEmailAddresses() below.
+alertToEmailAddresses = None
+
+# Rolling percentiles of the end-to-end alert latency, per channel.
+# See the method recordAlertLatencies() below.
+alertLatencyTracker = \
+    alertlatency.AlertLatencyTracker(ALERT_LATENCY_SLO_SECONDS,
+                                     ALERT_LATENCY_SLO_PERCENTILE)
+
+# Dict of channel name to the time.time() an admin email was last sent
+# about that channel breaching the alert latency SLO.
+lastSloBreachEmailTimestamps = {}
+
+##############################################################################
+# Methods
+##############################################################################
+
+def initializeTwilio():
+    """
+    Initializes Twilio by obtaining the account and auth token variables from
+    environment variables.  These must be set prior to running this script.
+    """
+
+    global twilioAccountSid
+    global twilioAuthToken
+    global sourcePhoneNumber
+    global destinationPhoneNumber
+
+    twilioAccountSid = os.environ.get("TWILIO_ACCOUNT_SID")
+    twilioAuthToken = os.environ.get("TWILIO_AUTH_TOKEN")
+    sourcePhoneNumber = os.environ.get("TWILIO_SRC_PHONE_NUMBER")
+    destinationPhoneNumber = os.environ.get("TWILIO_DEST_PHONE_NUMBER")
+
+    if twilioAccountSid is None:
+        log.error("Environment variable was not set: TWILIO_ACCOUNT_SID")
+        shutdown(1)
+
+    if twilioAuthToken is None:
+        log.error("Environment variable was not set: TWILIO_AUTH_TOKEN")
+        shutdown(1)
+
+    if sourcePhoneNumber is None:
+        log.error("Environment variable was not set: TWILIO_SRC_PHONE_NUMBER")
+        shutdown(1)
+    else:
+        log.info("Source phone number is: " + sourcePhoneNumber)
+
+    if destinationPhoneNumber is None:
+        log.error("Environment variable was not set: TWILIO_DEST_PHONE_NUMBER")
+        shutdown(1)
+    else:
+        log.info("Destination phone number is: " + destinationPhoneNumber)
+
+def initializeAdminEmailAddresses():
+    """
+    Initializes the capability of sending admin emails by obtaining the
+    TO and FROM email addresses from environment variables.
+    These must be set prior to running this script.
+    """
+
+    global adminFromEmailAddress
+    global adminToEmailAddress
+
+    # This is a single email address.
+    adminFromEmailAddress = os.environ.get("LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
+    adminToEmailAddress = os.environ.get("LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
+
+    if adminFromEmailAddress is None:
+        log.error("Environment variable was not set: LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
+        shutdown(1)
+    else:
+        log.info("adminFromEmailAddress is: " + adminFromEmailAddress)
+
+
+    if adminToEmailAddress is None:
+        log.error("Environment variable was not set: LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
+        shutdown(1)
+    else:
+        log.info("adminToEmailAddress is: " + adminToEmailAddress)
+
+
+def initializeAlertEmailAddresses():
+    """
+    Initializes the capability of sending alert emails by obtaining the
+    TO and FROM email addresses from environment variables.
+    These must be set prior to running this script.
+    """
+
+    global alertToEmailAddresses
+
+    # This is a comma-separated-value string of email addresses.
+    alertToEmailAddressesStr = os.environ.get("LCPL_PAGE_SUBS_ALERT_EMAIL_ADDRESSES")
+
+    if alertToEmailAddressesStr is None:
+        log.error("Environment variable was not set: LCPL_PAGE_SUBS_ALERT_EMAIL_ADDRESSES")
+        shutdown(1)
+    else:
+        alertToEmailAddresses = alertToEmailAddressesStr.split(",")
+        log.info("alertToEmailAddresses is: " + str(alertToEmailAddresses))
+
+
+def writeNotificationToSink(channel, recipients, subject, body):
+    """
+    Appends a notification to the notification sink file as one line
+    of JSON, instead of sending it.
+    """
+
+    record = {
+        "utcDttm": datetime.datetime.utcnow().isoformat(),
+        "channel": channel,
+        "recipients": [r for r in (recipients or []) if r is not None],
+        "subject": subject,
+        "body": body,
+        }
+    log.info("Writing " + channel + " notification to sink: " + \
+             NOTIFICATION_SINK_FILENAME)
+    with open(NOTIFICATION_SINK_FILENAME, "a", encoding="UTF-8") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def sendAdminNotificationEmail(emailSubject = "", emailBodyHtml = ""):
+    global adminErrorEmailSendingEnabled
+    global adminFromEmailAddress
+    global adminToEmailAddress
+
+    if NOTIFICATION_SINK_FILENAME is not None:
+        if adminErrorEmailSendingEnabled == True:
+            writeNotificationToSink("adminEmail", [adminToEmailAddress],
+                                    emailSubject, emailBodyHtml)
+        return
+
+    if adminErrorEmailSendingEnabled == True and \
+            adminFromEmailAddress is not None and \
+            adminToEmailAddress is not None:
+
+        import boto3
+        from botocore.exceptions import EndpointConnectionError
+
+        fromEmailAddress = adminFromEmailAddress
+        toEmailAddress = adminToEmailAddress
+
+        log.info("Sending notice email to administrator (" + \
+                 str(toEmailAddress) + \
+                 ").")
+        log.debug("emailSubject: " + emailSubject + \
+                ", emailBodyHtml: " + emailBodyHtml)
+
+        shouldTryAgain = True
+        while shouldTryAgain:
+            shouldTryAgain = False
+            try:
+                client = boto3.client('ses')
+                response = client.send_email(
+                    Destination={
+                        'ToAddresses': [toEmailAddress],
+                        'CcAddresses': [],
+                        'BccAddresses': []
+                        },
+                    Message={
+                        'Subject': {
+                            'Data': emailSubject,
+                            'Charset': 'UTF-8'
+                        },
+                        'Body': {
+                            'Html': {
+                                'Data': emailBodyHtml,
+                                'Charset': 'UTF-8'
+                                }
+                            }
+                        },
+                    Source=fromEmailAddress,
+                    )
+
+                log.info("Sending email done.")
+                log.info("Response from AWS is: " + str(response))
+            except EndpointConnectionError as e:
+                log.error("Caught EndpointConnectionError: " + str(e))
+
+                shouldTryAgain = True
+                numSeconds = 60
+                log.info("Retry in " + str(numSeconds) + " seconds ...")
+                time.sleep(numSeconds)
+
+
+def getSheetLabel(sheet):
+    """
+    Returns a str naming the given sheet in notifications, or an empty str
+    for the default sheet (or no sheet).
+    """
+
+    if sheet is None or sheet.sheetId == DEFAULT_SHEET_ID:
+        return ""
+    return " (" + sheet.sheetId + ")"
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "sendEmailNotificationMessage"})
+def sendEmailNotificationMessage(newShiftsAvailableForSignup, sheet=None):
+    """
+    Sends out an email notifying the alert email addresses that there are
+    new shifts available for signup.
+
+    Arguments:
+    newShiftsAvailableForSignup - list of Shift objects.
+    sheet - Sheet object the shifts belong to.  Its email recipients, if
+            set, are notified instead of the alert email addresses.
+    """
+
+    global adminFromEmailAddress
+    global alertToEmailAddresses
+    fromEmailAddress = adminFromEmailAddress
+    toEmailAddresses = alertToEmailAddresses
+    if sheet is not None and sheet.emailRecipients is not None:
+        toEmailAddresses = sheet.emailRecipients
+
+    emailSubject = "Application '" + APP_NAME + "' new shifts notification" + \
+        getSheetLabel(sheet)
+
+    endl = "<br />"
+    emailBodyHtml = "Hi," + endl + endl + \
+        "This is a notification from application '" + \
+        APP_NAME + "' that there "
+    if len(newShiftsAvailableForSignup) == 1:
+        emailBodyHtml += "is " + str(len(newShiftsAvailableForSignup)) + \
+            " new shift available for signup.  "
+    else:
+        emailBodyHtml += "are " + str(len(newShiftsAvailableForSignup)) + \
+            " new shifts available for signup.  "
+    emailBodyHtml += "Please visit the below URL(s) to see them:" + endl + endl
+
+    # Extract unique URLs in a sorted list.
+    urls = []
+    for shift in newShiftsAvailableForSignup:
+        if shift.url not in urls:
+            urls.append(shift.url)
+    urls.sort()
+
+    emailBodyHtml += "<table>" + endl
+    for url in urls:
+        emailBodyHtml += "  <tr>" + endl
+        emailBodyHtml += "    <td>" + endl
+        emailBodyHtml += "      <a href='" + url + "'>" + url + "</a>" + endl
+        emailBodyHtml += "    </td>" + endl
+        emailBodyHtml += "  </tr>" + endl
+    emailBodyHtml += "</table>" + endl
+
+    emailBodyHtml += endl
+    emailBodyHtml += "-" + APP_NAME
+
+    log.info("Sending notice email to: " + str(toEmailAddresses))
+
+    dispatchTimestamp = time.time()
+    for shift in newShiftsAvailableForSignup:
+        shift.dispatchedTimestamps["email"] = dispatchTimestamp
+
+    if NOTIFICATION_SINK_FILENAME is not None:
+        writeNotificationToSink("email", toEmailAddresses,
+                                emailSubject, emailBodyHtml)
+        ackTimestamp = time.time()
+        for shift in newShiftsAvailableForSignup:
+            shift.acknowledgedTimestamps["email"] = ackTimestamp
+        metricsRegistry.incrementCounter("lcplpagesubs_alerts_sent_total",
+                                         labels={"channel": "email"})
+        return
+
+    import boto3
+    from botocore.exceptions import EndpointConnectionError
+
+    shouldTryAgain = True
+    while shouldTryAgain:
+        shouldTryAgain = False
+        try:
+            client = boto3.client('ses')
+            response = client.send_email(
+                Destination={
+                    'ToAddresses': [],
+                    'CcAddresses': [],
+                    'BccAddresses': toEmailAddresses
+                    },
+                Message={
+                    'Subject': {
+                        'Data': emailSubject,
+                        'Charset': 'UTF-8'
+                    },
+                    'Body': {
+                        'Html': {
+                            'Data': emailBodyHtml,
+                            'Charset': 'UTF-8'
+                            }
+                        }
+                    },
+                Source=fromEmailAddress,
+                )
+
+            log.info("Sending email done.")
+            log.info("Response from AWS is: " + str(response))
+            ackTimestamp = time.time()
+            for shift in newShiftsAvailableForSignup:
+                shift.acknowledgedTimestamps["email"] = ackTimestamp
+            metricsRegistry.incrementCounter("lcplpagesubs_alerts_sent_total",
+                                             labels={"channel": "email"})
+        except EndpointConnectionError as e:
+            log.error("Caught EndpointConnectionError: " + str(e))
+
+            metricsRegistry.incrementCounter(
+                "lcplpagesubs_notify_retries_total",
+                labels={"channel": "email"})
+            shouldTryAgain = True
+            numSeconds = 60
+            log.info("Retry in " + str(numSeconds) + " seconds ...")
+            time.sleep(numSeconds)
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "sendTextNotificationMessage"})
+def sendTextNotificationMessage(newShiftsAvailableForSignup, sheet=None):
+    """
+    Sends out a text message notifying the user that there are
+    new shifts available for signup.
+
+    If the given Sheet object has SMS recipients, the text message is sent
+    to each of them instead of to the destination phone number.
+
+    # To send a message to a Verizon Wireless phone from a personal computer,
+    # enter the person's mobile number followed by @vtext.com in the “to” field
+    # of your e-mail message – for example, 5551234567@vtext.com. Type an e-mail
+    # message as you would normally and send it. For more information, please
+    # visit www.vtext.com. Jul 25, 2007
+    """
+
+    endl = "\n"
+    msg = endl + "LCPL Page Shift Update" + getSheetLabel(sheet) + ": " + endl
+    if len(newShiftsAvailableForSignup) == 1:
+        msg += "There is " + str(len(newShiftsAvailableForSignup)) + \
+            " new shift available for signup." + endl
+    else:
+        msg += "There are " + str(len(newShiftsAvailableForSignup)) + \
+            " new shifts available for signup." + endl
+
+    # Send text message via Twilio.
+    global twilioAccountSid
+    global twilioAuthToken
+    global sourcePhoneNumber
+    global destinationPhoneNumber
+
+    destinationPhoneNumbers = [destinationPhoneNumber]
+    if sheet is not None and sheet.smsRecipients is not None:
+        destinationPhoneNumbers = sheet.smsRecipients
+
+    if NOTIFICATION_SINK_FILENAME is not None:
+        dispatchTimestamp = time.time()
+        for shift in newShiftsAvailableForSignup:
+            shift.dispatchedTimestamps["sms"] = dispatchTimestamp
+        writeNotificationToSink("sms", destinationPhoneNumbers, None, msg)
+        ackTimestamp = time.time()
+        for shift in newShiftsAvailableForSignup:
+            shift.acknowledgedTimestamps["sms"] = ackTimestamp
+        metricsRegistry.incrementCounter("lcplpagesubs_alerts_sent_total",
+                                         labels={"channel": "sms"})
+        return
+
+    if twilioAccountSid is None or twilioAccountSid.strip() == "":
+        log.error("twilioAccountSid may not be empty.")
+        shutdown(1)
+
+    if twilioAuthToken is None or twilioAuthToken.strip() == "":
+        log.error("twilioAuthToken may not be empty.")
+        shutdown(1)
+
+    from twilio.rest import Client
+    from twilio.base.exceptions import TwilioException
+    from twilio.base.exceptions import TwilioRestException
+
+    try:
+        client = Client(twilioAccountSid, twilioAuthToken)
+
+        dispatchTimestamp = time.time()
+        for shift in newShiftsAvailableForSignup:
+            shift.dispatchedTimestamps["sms"] = dispatchTimestamp
+
+        for toPhoneNumber in destinationPhoneNumbers:
+            log.info("Sending text message from phone number " +
+                        sourcePhoneNumber + " to phone number " +
+                        toPhoneNumber + " with message body: " + msg)
+            client.messages.create(from_=sourcePhoneNumber,
+                                   to=toPhoneNumber,
+                                   body=msg)
+
+        ackTimestamp = time.time()
+        for shift in newShiftsAvailableForSignup:
+            shift.acknowledgedTimestamps["sms"] = ackTimestamp
+
+        log.info("Sending text message done.")
+        metricsRegistry.incrementCounter("lcplpagesubs_alerts_sent_total",
+                                         labels={"channel": "sms"})
+
+    except TwilioRestException as e:
+        log.error("Caught TwilioRestException: " + str(e))
+        shutdown(1)
+    except TwilioException as e:
+        log.error("Caught TwilioException: " + str(e))
+        shutdown(1)
+    except BaseException as e:
+        log.error("Caught BaseException: " + str(e))
+        shutdown(1)
+
+
+def recordAlertLatencies(newShiftsAvailableForSignup):
+    """
+    Records the end-to-end alert latencies of the given shifts, whose
+    notifications have been sent.  The latencies and the rolling
+    percentiles are logged, and published to the metrics.  If a channel
+    breaches the alert latency SLO, the admin is notified by email (at
+    most once per ALERT_LATENCY_SLO_EMAIL_INTERVAL_SECONDS per channel).
+
+    Arguments:
+    newShiftsAvailableForSignup - list of Shift objects.
+
+    Returns:
+    dict describing the SLO, the latency percentiles per channel, and the
+    breached channels, for the monitor state.
+    """
+
+    for shift in newShiftsAvailableForSignup:
+        latencies = alertLatencyTracker.recordShift(shift)
+        for (name, latency) in latencies.items():
+            metricsRegistry.observeHistogram(
+                "lcplpagesubs_alert_latency_seconds", latency,
+                {"channel": name})
+
+        if shift.observedTimestamp is None:
+            continue
+
+        def relative(timestamp):
+            if timestamp is None:
+                return "None"
+            return "+{:.3f}s".format(timestamp - shift.observedTimestamp)
+
+        msg = "Alert timeline for " + str(shift) + ": observed at " + \
+            datetime.datetime.utcfromtimestamp(
+                shift.observedTimestamp).isoformat() + " UTC"
+        if shift.previousObservedTimestamp is not None:
+            msg += " (previous poll {:.3f}s earlier)".format(
+                shift.observedTimestamp - shift.previousObservedTimestamp)
+        msg += ", persisted " + relative(shift.persistedTimestamp)
+        for channel in sorted(shift.dispatchedTimestamps.keys()):
+            msg += ", " + channel + " dispatched " + \
+                relative(shift.dispatchedTimestamps[channel]) + \
+                ", " + channel + " acknowledged " + \
+                relative(shift.acknowledgedTimestamps.get(channel))
+        log.info(msg)
+
+    summaries = alertLatencyTracker.summaries()
+    for (name, summary) in summaries.items():
+        log.info("Alert latency percentiles for '" + name + "': " + \
+                 str(summary))
+
+    breachedChannels = alertLatencyTracker.getBreachedChannels()
+
+    for channel in breachedChannels:
+        summary = summaries[channel]
+        log.warning("Alert latency SLO breached for channel '" + channel + \
+                    "': p" + str(ALERT_LATENCY_SLO_PERCENTILE) + " is " + \
+                    str(summary["p" + str(ALERT_LATENCY_SLO_PERCENTILE)]) + \
+                    " seconds, SLO is " + str(ALERT_LATENCY_SLO_SECONDS) + \
+                    " seconds.")
+
+        now = time.time()
+        lastEmailTimestamp = lastSloBreachEmailTimestamps.get(channel)
+        if lastEmailTimestamp is not None and \
+                now - lastEmailTimestamp < \
+                ALERT_LATENCY_SLO_EMAIL_INTERVAL_SECONDS:
+            continue
+        lastSloBreachEmailTimestamps[channel] = now
+
+        emailSubject = \
+            "Admin Notification for Application '" + APP_NAME + "' "
+        endl = "<br />"
+        emailBodyHtml = "Hi," + endl + endl + \
+            "This is a notification to the site Admin that " + \
+            "application '" + APP_NAME + \
+            "' is breaching its alert latency SLO for channel '" + \
+            channel + "'.  " + \
+            "Please investigate at your earliest convenience.  " + \
+            "Thank you." + \
+            endl + endl + \
+            "SLO: p" + str(ALERT_LATENCY_SLO_PERCENTILE) + " <= " + \
+            str(ALERT_LATENCY_SLO_SECONDS) + " seconds" + \
+            endl + endl + \
+            "Current latency percentiles: " + str(summary) + \
+            endl + endl + \
+            "-" + APP_NAME
+        sendAdminNotificationEmail(emailSubject, emailBodyHtml)
+
+    return {
+        "sloSeconds": ALERT_LATENCY_SLO_SECONDS,
+        "sloPercentile": ALERT_LATENCY_SLO_PERCENTILE,
+        "summaries": summaries,
+        "breachedChannels": breachedChannels,
+        }
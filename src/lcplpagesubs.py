@@ -1,192 +1,172 @@
 #!/usr/bin/env python3
 ##############################################################################
-
+# Entry point of the monitor: polls the SignUpGenius pages of the
+# registered sheets, and notifies about shifts that become available for
+# signup.
+#
+# The work is done by the library modules (see lcplcommon.py).  This module
+# only wires them together into the poll loop, and publishes the monitor
+# state and metrics that the status server reads.
 ##############################################################################
 
+import time
+
+# Time this module started loading, for measuring the startup time.
+moduleLoadStartTime = time.perf_counter()
+
 import sys
 import os
 import datetime
 import logging
-import logging.handlers
-import logging.config
-import re
-import sqlite3
-import requests
-from requests.exceptions import RequestException
-from requests.exceptions import ConnectionError
-import time
-import boto3
-import botocore
-from botocore.exceptions import EndpointConnectionError
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException
-from twilio.base.exceptions import TwilioRestException
-from bs4 import BeautifulSoup
+import monitorstate
+import cycleprofiler
+import pollschedule
+from lcplcommon import log, metricsRegistry, shutdown
+from lcplcommon import APP_NAME, APP_VERSION, DATA_DIR, LOG_DIR
+from lcplcommon import STAGE_SECONDS_METRIC, POLL_INTERVAL_SECONDS
+from lcplcommon import NIGHTLY_PAUSE_ENABLED, NOTIFICATION_SINK_FILENAME
+import lcplcommon
+import lcplfetch
+import lcplsource
+import lcplparse
+import lcplstore
+import lcplnotify
+import lcplcheckpoint
+import lcplstats
+import lcplcontrol
 
 ##############################################################################
 # Global variables
 ##############################################################################
 
-__version__ = "1.2.0"
-__date__ = "Sat Jul  1 16:56:44 EDT 2017"
-
-
-# Application Name
-APP_NAME = "Page Shifts Monitor For LCPL"
-
-# Application Version obtained from subversion revision.
-APP_VERSION = __version__
-
-# Application Date obtain from last subversion commit date.
-APP_DATE = __date__
-
-# Location of the source directory, based on this script file.
-SRC_DIR = os.path.abspath(sys.path[0])
+# File path of the monitor state file, which is read by the status server.
+MONITOR_STATE_FILENAME = \
+    os.path.abspath(os.path.join(DATA_DIR,
+                                 "lcplpagesubs.state.json"))
 
-# Directory where various data resides.  e.g. sqlite database.
-DATA_DIR = \
-    os.path.abspath(os.path.join(SRC_DIR,
-                                 ".." + os.sep + "data"))
+# Maximum number of recent warnings and errors kept in the monitor state.
+MAX_RECENT_ERRORS = 20
 
-# File path of the sqlite database.
-DATABASE_FILENAME = \
+# File path of the metrics snapshot file, which is read by the status server.
+METRICS_FILENAME = \
     os.path.abspath(os.path.join(DATA_DIR,
-                                 "lcpl_page_shifts.db"))
-
-# Directory where log files will be written.
-LOG_DIR = \
-    os.path.abspath(os.path.join(SRC_DIR,
-                                 ".." + os.sep + "logs"))
-
-# Location of the config file for logging.
-LOG_CONFIG_FILE = \
-    os.path.abspath(os.path.join(SRC_DIR,
-                                 ".." + os.sep +
-                                 "conf" + os.sep +
-                                 "logging.conf"))
-
-# Seed URL on the very first load of the application
-# (when the 'urls' database table has not been created yet).
-# The 'seedUrl' should be the earliest in time (left-most tab URL).
-baseUrl = "http://www.signupgenius.com/go/"
-seedUrl = baseUrl + "4090d4aaeaf2ba7f58-page24"
-
-# For logging.
-# Logging config file specifies the log filename relative to the current
-# directory, so we need to chdir to the SRC_DIR before loading the logging
-# config.
-os.chdir(SRC_DIR)
-logging.config.fileConfig(LOG_CONFIG_FILE)
-log = logging.getLogger("main")
-htmlLog = logging.getLogger("html")
-
-
-# These globals are extracted from environment variables.
-# See the method initializeTwilio() below.
-twilioAccountSid = None
-twilioAuthToken = None
-sourcePhoneNumber = None
-destinationPhoneNumber = None
-
-# These globals are for sending out admin emails.
-# See the method initializeAdminEmailAddresses() below.
-adminFromEmailAddress = None
-adminToEmailAddress = None
-adminErrorEmailSendingEnabled = True
-
-# This global is for sending out alert email addresses.
-# See the method initializeAlertEmailAddresses() below.
-alertToEmailAddresses = None
+                                 "lcplpagesubs.metrics.json"))
+
+# Directory where profiles of poll cycles are written.
+PROFILE_DIR = \
+    os.path.abspath(os.path.join(LOG_DIR, "profiles"))
+
+# Every Nth poll cycle is run under cProfile when this is greater than 0.
+# Can be set with the environment variable
+# LCPL_PAGE_SUBS_PROFILE_EVERY_N_CYCLES.
+PROFILE_EVERY_N_CYCLES = \
+    int(os.environ.get("LCPL_PAGE_SUBS_PROFILE_EVERY_N_CYCLES", "0"))
+
+# Whether poll intervals follow the time-of-week profile of when shifts
+# became available (see pollschedule.py): shorter around the usual release
+# times, longer otherwise, for the same total number of requests.  Can be
+# disabled by setting the environment variable
+# LCPL_PAGE_SUBS_BURST_POLLING_ENABLED to 0.
+BURST_POLLING_ENABLED = \
+    os.environ.get("LCPL_PAGE_SUBS_BURST_POLLING_ENABLED", "1") != "0"
+
+# Smallest and largest factors applied to the poll interval by the profile.
+# Can be overridden with the environment variables
+# LCPL_PAGE_SUBS_BURST_MIN_INTERVAL_FACTOR and
+# LCPL_PAGE_SUBS_BURST_MAX_INTERVAL_FACTOR.
+BURST_MIN_INTERVAL_FACTOR = \
+    float(os.environ.get("LCPL_PAGE_SUBS_BURST_MIN_INTERVAL_FACTOR", "0.25"))
+BURST_MAX_INTERVAL_FACTOR = \
+    float(os.environ.get("LCPL_PAGE_SUBS_BURST_MAX_INTERVAL_FACTOR", "4.0"))
+
+# Number of days of shift history the profile is built from, and number of
+# seconds between two rebuilds of the profile.
+RELEASE_PROFILE_LOOKBACK_DAYS = 56
+RELEASE_PROFILE_REBUILD_INTERVAL_SECONDS = 24 * 60 * 60
+
+# Number of seconds before a burst poll that the connection to the web
+# server is prewarmed (see lcplfetch.prewarmConnection()).
+PREWARM_LEAD_SECONDS = 2
+
+# Monitor health record, published to MONITOR_STATE_FILENAME.
+# See the method initializeMonitorState() below.
+monitorState = {}
+
+# Dict of sheet ID to the time.time() its last poll cycle ended.
+# See the method getDueSheets() below.
+lastPollTimestampBySheetId = {}
+
+# Set of the URLs this worker polled in the last cycle, or None before the
+# first cycle.  The cached pages and statuses of a URL that another worker
+# polled in the meantime are forgotten.
+previousOwnedUrls = None
+
+# Time-of-week profile of when shifts became available, and the time.time()
+# it was last built.  See the method rebuildReleaseTimeProfileIfDue() below.
+releaseTimeProfile = pollschedule.ReleaseTimeProfile(BURST_MIN_INTERVAL_FACTOR,
+                                                     BURST_MAX_INTERVAL_FACTOR)
+releaseTimeProfileTimestamp = None
+
+# Profiler for poll cycles.  Disabled unless PROFILE_EVERY_N_CYCLES > 0.
+cycleProfiler = cycleprofiler.CycleProfiler(PROFILE_DIR,
+                                            PROFILE_EVERY_N_CYCLES)
+
+# Set of the URLs paused with the control interface (see lcplcontrol.py).
+# Paused URLs are not polled, until resumed.
+pausedUrls = set()
+
+# Whether the control interface asked for the next cycle to start right
+# away, and for the next cycle to be profiled.
+isPollNowRequested = False
+isProfileNextCycleRequested = False
 
 ##############################################################################
 # Classes
 ##############################################################################
 
-class Shift:
-    def __init__(self):
-        self.url = None
-        self.rowNumber = None
-        self.status = None
+class MonitorStateErrorHandler(logging.Handler):
+    """
+    Logging handler that keeps the most recent warning and error messages
+    in the monitor state, so that they show up on the status server.
+    """
+
+    def __init__(self, level=logging.WARNING):
+        super().__init__(level)
 
-    def __str__(self):
-        rv = "Shift(url=" + str(self.url) + "," + \
-                "rowNumber=" + str(self.rowNumber) + "," + \
-                "status=" + str(self.status) + ")"
-        return rv
+    def emit(self, record):
+        try:
+            recentErrors = monitorState.setdefault("recentErrors", [])
+            recentErrors.append({
+                "utcDttm": datetime.datetime.utcfromtimestamp(
+                    record.created).isoformat(),
+                "level": record.levelname,
+                "message": record.getMessage()[:500],
+                })
+            del recentErrors[:-MAX_RECENT_ERRORS]
+        except Exception:
+            self.handleError(record)
 
 ##############################################################################
 # Methods
 ##############################################################################
 
-def sendAdminNotificationEmail(emailSubject = "", emailBodyHtml = ""):
-    global adminErrorEmailSendingEnabled
-    global adminFromEmailAddress
-    global adminToEmailAddress
-    
-    if adminErrorEmailSendingEnabled == True and \
-            adminFromEmailAddress is not None and \
-            adminToEmailAddress is not None:
-
-        fromEmailAddress = adminFromEmailAddress
-        toEmailAddress = adminToEmailAddress
-        
-        log.info("Sending notice email to administrator (" + \
-                 str(toEmailAddress) + \
-                 ").")
-        log.debug("emailSubject: " + emailSubject + \
-                ", emailBodyHtml: " + emailBodyHtml)
-
-        shouldTryAgain = True
-        while shouldTryAgain:
-            shouldTryAgain = False
-            try:
-                client = boto3.client('ses')
-                response = client.send_email(
-                    Destination={
-                        'ToAddresses': [toEmailAddress],
-                        'CcAddresses': [],
-                        'BccAddresses': []
-                        },
-                    Message={
-                        'Subject': {
-                            'Data': emailSubject,
-                            'Charset': 'UTF-8'
-                        },
-                        'Body': {
-                            'Html': {
-                                'Data': emailBodyHtml,
-                                'Charset': 'UTF-8'
-                                }
-                            }
-                        },
-                    Source=fromEmailAddress,
-                    )
-                
-                log.info("Sending email done.")
-                log.info("Response from AWS is: " + str(response))
-            except EndpointConnectionError as e:
-                log.error("Caught EndpointConnectionError: " + str(e))
-                
-                shouldTryAgain = True
-                numSeconds = 60
-                log.info("Retry in " + str(numSeconds) + " seconds ...")
-                time.sleep(numSeconds)
-                
-                
-def shutdown(rc):
+def onShutdown(rc):
     """
-    Exits the script, but first flushes all logging handles, etc.
+    Shutdown hook of the monitor (see lcplcommon.shutdown()).  Closes the
+    control socket, writes a checkpoint, releases the URL leases of this
+    worker, closes the database, archives and snapshot store, emails the
+    admin on a non-zero return code, and publishes the final monitor state
+    and metrics.
     """
 
-    global adminErrorEmailSendingEnabled
-    global conn
+    lcplcontrol.closeControlSocket()
+    lcplcheckpoint.saveCheckpoint(lastPollTimestampBySheetId)
+    lcplstore.releaseUrlLeases()
+    lcplstore.closeDatabase()
+    lcplfetch.closeFetchArchives()
+    lcplcommon.closeSnapshotStore()
 
-    if conn is not None:
-        log.info("Closing database connection ...")
-        conn.close()
-        log.info("Done closing database connection.")
-
-    if rc != 0 and adminErrorEmailSendingEnabled == True:
+    if rc != 0 and lcplnotify.adminErrorEmailSendingEnabled == True:
         emailSubject = \
             "Shutdown Notification for Application '" + APP_NAME + "' "
         endl = "<br />"
@@ -198,827 +178,800 @@ def shutdown(rc):
             endl + endl
         emailBodyHtml += "-" + APP_NAME
 
-        sendAdminNotificationEmail(emailSubject, emailBodyHtml)
-        
-    log.info("Shutdown (rc=" + str(rc) + ").")
-    logging.shutdown()
-    sys.exit(rc)
+        lcplnotify.sendAdminNotificationEmail(emailSubject, emailBodyHtml)
+
+    if len(monitorState) > 0:
+        monitorState["phase"] = "shutdown"
+        monitorState["shutdownUtcDttm"] = \
+            datetime.datetime.utcnow().isoformat()
+        monitorState["shutdownRc"] = rc
+        monitorState["nextCycleDueUtcDttm"] = None
+        publishMonitorState()
+        publishMetrics()
 
-    
-def initializeDatabase():
+
+def initializeMonitorState():
+    """
+    Initializes the monitor state record that is published to the
+    state file, and starts recording warnings and errors into it.  The
+    shutdown recorded by the previous run, if it shut down cleanly, is
+    kept as the previous shutdown.
+    """
+
+    global monitorState
+
+    previousState = monitorstate.readStateFile(MONITOR_STATE_FILENAME)
+    if previousState is None:
+        previousState = {}
+
+    monitorState = {
+        "appName": APP_NAME,
+        "appVersion": APP_VERSION,
+        "pid": os.getpid(),
+        "workerId": lcplcommon.WORKER_ID,
+        "startupUtcDttm": datetime.datetime.utcnow().isoformat(),
+        "startupSeconds": None,
+        "shutdownUtcDttm": None,
+        "shutdownRc": None,
+        "previousShutdownUtcDttm": previousState.get("shutdownUtcDttm"),
+        "previousShutdownRc": previousState.get("shutdownRc"),
+        "phase": "starting",
+        "cycleCount": 0,
+        "currentCycleStartUtcDttm": None,
+        "lastCycleStartUtcDttm": None,
+        "lastCycleEndUtcDttm": None,
+        "lastCycleDurationSeconds": None,
+        "lastCycleStageSeconds": {},
+        "lastCycleUrls": [],
+        "lastCycleNumHtmlPages": None,
+        "lastCycleNumNewShifts": None,
+        "nextCycleDueUtcDttm": None,
+        "heartbeatUtcDttm": None,
+        "recentErrors": [],
+        "alertLatency": None,
+        "pollIntervalFactor": None,
+        "burstWindows": [],
+        }
+
+    log.addHandler(MonitorStateErrorHandler())
+    publishMonitorState()
+
+
+def publishMonitorState():
     """
-    Initializes the database (creating tables as needed).
-    Globals 'conn' and 'cursor' are set for future use.
+    Writes the current monitor state to the state file.
+    The file is replaced atomically, so readers never see a partial write.
     """
-    
-    global conn
-    global cursor
-    conn = sqlite3.connect(DATABASE_FILENAME)
-    cursor = conn.cursor()
-    cursor.execute("create table if not exists shifts " +
-        "(crte_utc_dttm text, " +
-        "url text, " +
-        "row_number text, " +
-        "status text)")
-    conn.commit()
-    cursor.execute("create table if not exists urls " +
-        "(crte_utc_dttm text, " +
-        "upd_utc_dttm text, " +
-        "url text, " +
-        "active_ind text)")
-    conn.commit()
-
-    # If the 'urls' table is empty, then add a seed URL.
-    activeInd = "1"
-    values = (activeInd,)
-    cursor.execute("select * from urls where " + \
-                   "active_ind = ?",
-                   values)
-    tups = cursor.fetchall()
-    log.debug("Fetched " + str(len(tups)) + " rows from the database.")
-    
-    if len(tups) == 0:
-        log.info("Seeding active URLs with initial URL: " + seedUrl)
-        
-        crteUtcDttm = datetime.datetime.utcnow().isoformat()
-        updUtcDttm = crteUtcDttm
-        activeInd = "1"
-        values = (crteUtcDttm, updUtcDttm, seedUrl, activeInd)
-        cursor.execute("insert into urls values (?, ?, ?, ?)",
-                       values)
-        conn.commit()
-        log.debug("Done.")
-        
-    
-def initializeTwilio():
+
+    monitorState["heartbeatUtcDttm"] = datetime.datetime.utcnow().isoformat()
+    try:
+        monitorstate.writeStateFile(MONITOR_STATE_FILENAME, monitorState)
+    except (OSError, TypeError, ValueError) as e:
+        log.warning("Could not write the monitor state file: " + str(e))
+
+
+def initializeMetrics():
     """
-    Initializes Twilio by obtaining the account and auth token variables from 
-    environment variables.  These must be set prior to running this script.
+    Describes the metrics recorded by the monitor, for the /metrics
+    route of the status server.
     """
 
-    global twilioAccountSid
-    global twilioAuthToken
-    global sourcePhoneNumber
-    global destinationPhoneNumber
-
-    twilioAccountSid = os.environ.get("TWILIO_ACCOUNT_SID")
-    twilioAuthToken = os.environ.get("TWILIO_AUTH_TOKEN")
-    sourcePhoneNumber = os.environ.get("TWILIO_SRC_PHONE_NUMBER")
-    destinationPhoneNumber = os.environ.get("TWILIO_DEST_PHONE_NUMBER")
-
-    if twilioAccountSid is None:
-        log.error("Environment variable was not set: TWILIO_ACCOUNT_SID")
-        shutdown(1)
-
-    if twilioAuthToken is None:
-        log.error("Environment variable was not set: TWILIO_AUTH_TOKEN")
-        shutdown(1)
-
-    if sourcePhoneNumber is None:
-        log.error("Environment variable was not set: TWILIO_SRC_PHONE_NUMBER")
-        shutdown(1)
-    else:
-        log.info("Source phone number is: " + sourcePhoneNumber)
-
-    if destinationPhoneNumber is None:
-        log.error("Environment variable was not set: TWILIO_DEST_PHONE_NUMBER")
-        shutdown(1)
-    else:
-        log.info("Destination phone number is: " + destinationPhoneNumber)
-
-def initializeAdminEmailAddresses():
+    descriptions = [
+        (STAGE_SECONDS_METRIC, "histogram",
+         "Seconds spent per call of each stage of a poll cycle."),
+        ("lcplpagesubs_startup_seconds", "gauge",
+         "Seconds from loading the entry point module to the start of " +
+         "the first poll cycle."),
+        ("lcplpagesubs_cycle_seconds", "histogram",
+         "Seconds taken by a whole poll cycle, excluding the sleep."),
+        ("lcplpagesubs_cycles_total", "counter",
+         "Number of poll cycles completed."),
+        ("lcplpagesubs_fetch_seconds", "histogram",
+         "Seconds taken by each HTTP request for a page."),
+        ("lcplpagesubs_fetched_page_bytes", "histogram",
+         "Size in bytes of each fetched page body."),
+        ("lcplpagesubs_fetched_bytes_total", "counter",
+         "Total bytes of page bodies fetched."),
+        ("lcplpagesubs_unchanged_pages_total", "counter",
+         "Fetched pages skipped because they are unchanged since they " +
+         "were last processed."),
+        ("lcplpagesubs_http_responses_total", "counter",
+         "HTTP responses received, by status code."),
+        ("lcplpagesubs_fetch_retries_total", "counter",
+         "Page fetches retried, by reason."),
+        ("lcplpagesubs_source_pages_total", "counter",
+         "Changed pages processed, by the backend they were read with " +
+         "('html' or 'json')."),
+        ("lcplpagesubs_source_fallbacks_total", "counter",
+         "Pages read from HTML because the JSON API failed for them."),
+        ("lcplpagesubs_db_writes_total", "counter",
+         "Rows inserted or updated in the database, by table."),
+        ("lcplpagesubs_events_published_total", "counter",
+         "Events of shift status changes appended to the event log."),
+        ("lcplpagesubs_new_shifts_total", "counter",
+         "New shifts found available for signup."),
+        ("lcplpagesubs_alerts_sent_total", "counter",
+         "Alert notifications sent, by channel."),
+        ("lcplpagesubs_notify_retries_total", "counter",
+         "Notification sends retried, by channel."),
+        ("lcplpagesubs_poll_interval_factor", "gauge",
+         "Factor applied to the poll interval by the time-of-week " +
+         "release time profile.  Below 1 during bursts."),
+        ("lcplpagesubs_prewarm_requests_total", "counter",
+         "HEAD requests made to open a connection before a burst poll."),
+        ("lcplpagesubs_active_urls", "gauge",
+         "Number of URLs polled in the last cycle."),
+        ("lcplpagesubs_alert_latency_seconds", "histogram",
+         "Seconds from first observing a new shift to the provider " +
+         "acknowledging its alert, by channel.  Channel 'detection' is " +
+         "the time between the two polls the shift opened between."),
+        ]
+    for (name, metricType, helpText) in descriptions:
+        metricsRegistry.describe(name, metricType, helpText)
+
+
+def publishMetrics():
     """
-    Initializes the capability of sending admin emails by obtaining the 
-    TO and FROM email addresses from environment variables.  
-    These must be set prior to running this script.
+    Writes a snapshot of the metrics to the metrics file.
     """
 
-    global adminFromEmailAddress
-    global adminToEmailAddress
+    try:
+        metricsRegistry.writeToFile(METRICS_FILENAME)
+    except (OSError, TypeError, ValueError) as e:
+        log.warning("Could not write the metrics file: " + str(e))
+
 
-    # This is a single email address.
-    adminFromEmailAddress = os.environ.get("LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
-    adminToEmailAddress = os.environ.get("LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
+def recordStartupTime():
+    """
+    Records the number of seconds taken from loading this module to the
+    end of initialization, in the log, the monitor state and the metrics.
+    """
 
-    if adminFromEmailAddress is None:
-        log.error("Environment variable was not set: LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
-        shutdown(1)
-    else:
-        log.info("adminFromEmailAddress is: " + adminFromEmailAddress)
-        
+    startupSeconds = time.perf_counter() - moduleLoadStartTime
+    log.info("Startup took {:.3f} seconds.".format(startupSeconds))
+    monitorState["startupSeconds"] = startupSeconds
+    metricsRegistry.setGauge("lcplpagesubs_startup_seconds", startupSeconds)
 
-    if adminToEmailAddress is None:
-        log.error("Environment variable was not set: LCPL_PAGE_SUBS_ADMIN_EMAIL_ADDRESS")
-        shutdown(1)
-    else:
-        log.info("adminToEmailAddress is: " + adminToEmailAddress)
 
-        
-def initializeAlertEmailAddresses():
+def rebuildReleaseTimeProfileIfDue():
     """
-    Initializes the capability of sending alert emails by obtaining the 
-    TO and FROM email addresses from environment variables.  
-    These must be set prior to running this script.
+    Rebuilds the time-of-week profile of when shifts became available from
+    the shift history, at most once per
+    RELEASE_PROFILE_REBUILD_INTERVAL_SECONDS, and records the current poll
+    interval factor.
     """
 
-    global alertToEmailAddresses
+    global releaseTimeProfileTimestamp
 
-    # This is a comma-separated-value string of email addresses.
-    alertToEmailAddressesStr = os.environ.get("LCPL_PAGE_SUBS_ALERT_EMAIL_ADDRESSES")
+    if not BURST_POLLING_ENABLED or lcplfetch.isReplaying():
+        return
 
-    if alertToEmailAddressesStr is None:
-        log.error("Environment variable was not set: LCPL_PAGE_SUBS_ALERT_EMAIL_ADDRESSES")
-        shutdown(1)
-    else:
-        alertToEmailAddresses = alertToEmailAddressesStr.split(",")
-        log.info("alertToEmailAddresses is: " + str(alertToEmailAddresses))
+    now = time.time()
+    if releaseTimeProfileTimestamp is None or \
+            now - releaseTimeProfileTimestamp >= \
+            RELEASE_PROFILE_REBUILD_INTERVAL_SECONDS:
+        releaseTimeProfileTimestamp = now
+        startTime = time.perf_counter()
+        releaseTimeProfile.build(lcplstore.getSignUpEventTimestamps(
+            RELEASE_PROFILE_LOOKBACK_DAYS * 24 * 60 * 60))
+        burstWindows = releaseTimeProfile.getBurstWindows()
+        log.info("Built the release time profile from " + \
+                 str(releaseTimeProfile.numEvents) + " events in " + \
+                 "{:.3f} seconds.  ".format(time.perf_counter() - startTime) + \
+                 "Fastest polled windows: " + str(burstWindows))
+        monitorState["burstWindows"] = burstWindows
 
-def getUrls():
+    factor = releaseTimeProfile.getIntervalFactor(now)
+    monitorState["pollIntervalFactor"] = factor
+    metricsRegistry.setGauge("lcplpagesubs_poll_interval_factor", factor)
+
+
+def getPollIntervalSeconds(sheet, now=None):
     """
-    Returns a list of str, each str containing a URL.
+    Returns the float number of seconds between polls of the given sheet,
+    at time.time() 'now' (defaults to the current time).
     """
-        
-    urls = []
-    
-    ######################
-    # Old style way of hard-coding URLs.
-    if False:
-        urls = [
-            #"http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page5",
-            #"http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page6",
-            "http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page7",
-            "http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page8",
-            "http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page11",
-            "http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page12",
-            "http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page13",
-            ]
-        return urls
-    ######################
-            
-    # Get list of active URLs from the database.
-    activeInd = "1"
-    values = (activeInd,)
-    cursor.execute("select * from urls where " + \
-                   "active_ind = ? " + \
-                   "order by crte_utc_dttm asc",
-                   values)
-    tups = cursor.fetchall()
-    log.debug("Fetched " + str(len(tups)) + \
-              " rows from the 'urls' database table.")
-    
-    if len(tups) == 0:
-        log.error("No active URLs were found in the database.  " + \
-                  "Please investigate.")
-        shutdown(1)
-
-    for tup in tups:
-        log.debug("Looking at 'urls' row: " + str(tup))
-        crteUtcDttm = tup[0]
-        updUtcDttm = tup[1]
-        url = tup[2]
-        activeInd = tup[3]
-
-        urls.append(url)
-
-    #log.debug("List of active URLs is: " + str(urls))
-    return urls
-
-
-def getHtmlPages(urls):
+
+    numSeconds = POLL_INTERVAL_SECONDS
+    if sheet.pollIntervalSeconds is not None:
+        numSeconds = sheet.pollIntervalSeconds
+    if BURST_POLLING_ENABLED:
+        if now is None:
+            now = time.time()
+        numSeconds *= releaseTimeProfile.getIntervalFactor(now)
+    return numSeconds
+
+
+def getDueSheets(sheets, now):
+    """
+    Returns the list of Sheet objects, out of the given ones, that are due
+    to be polled at time.time() 'now'.  In replay mode, every sheet is due.
     """
-    Returns a list of tuples.  
-    Each tuple contains the following:
-      - str containing the URL
-      - str containing the contents of a HTML page.
 
-    Arguments:
-    urls - list of str, each str containing a URL.
+    dueSheets = []
+    for sheet in sheets:
+        lastPollTimestamp = lastPollTimestampBySheetId.get(sheet.sheetId)
+        if lcplfetch.isReplaying() or lastPollTimestamp is None or \
+                now >= lastPollTimestamp + getPollIntervalSeconds(sheet, now):
+            dueSheets.append(sheet)
+    return dueSheets
+
+
+def getSecondsUntilNextPoll(sheets, now):
+    """
+    Returns the float number of seconds from time.time() 'now' until the
+    next of the given sheets is due to be polled.
     """
 
-    if urls is None:
-        log.error("Input parameter 'urls' may not be None.")
-        shutdown(1)
-    if not isinstance(urls, list):
-        log.error("Input parameter 'urls' must be of type list.  " + \
-                  "urls is: " + str(urls))
-        shutdown(1)
-            
-    htmls = []
-
-    ######################
-    # Temporary code for just reading straight from a file.
-    if False:
-        html = None
-        filename = \
-            os.path.abspath(os.path.join(DATA_DIR,"4090d4aaeaf2ba7f58-page8"))
-        with open(filename, "r") as f:
-            html = f.read()
-        if html is None:
-            log.error("Error: No html data.")
-            shutdown(1)
-        else:
-            htmls.append(html)
-            return htmls
-    ######################
-    
-    for url in urls:
-        shouldTryAgain = True
-        while shouldTryAgain:
-            shouldTryAgain = False
-            try:
-                log.info("Fetching webpage from URL: " + url)
-                r = requests.get(url)
-                log.debug("HTTP status code: " + str(r.status_code))
-                numSeconds = 2
-                time.sleep(numSeconds)
-                if 200 <= r.status_code < 300:
-                    html = r.text
-                    tup = (url, html)
-                    htmls.append(tup)
-                elif r.status_code in [500, 502, 503, 504]:
-                    log.warn("URL: " + url)
-                    log.warn("Unexpected HTTP status code: " + str(r.status_code))
-                    log.warn("Response text is: " + str(r.text))
-    
-                    shouldTryAgain = True
-                    numSeconds = 60
-                    log.info("Retry in " + str(numSeconds) + " seconds ...")
-                    time.sleep(numSeconds)
-                else:
-                    log.error("URL: " + url)
-                    log.error("Unexpected HTTP status code: " + str(r.status_code))
-                    log.error("Response text is: " + str(r.text))
-                    
-                    emailSubject = \
-                        "Admin Notification for Application '" + APP_NAME + "' "
-                    endl = "<br />"
-                    emailBodyHtml = "Hi," + endl + endl + \
-                        "This is a notification to the site Admin that " + \
-                        "application '" + APP_NAME + \
-                        "' encountered an unexpected HTTP status code.  " + \
-                        "Please investigate at your earliest convenience.  " + \
-                        "Thank you." + \
-                        endl + endl + \
-                        "URL was: " + url + \
-                        endl + endl + \
-                        "Unexpected HTTP status code: " + str(r.status_code) + \
-                        endl + endl + \
-                        "Response text was: " + str(r.text) + \
-                        endl + endl + \
-                        "-" + APP_NAME
-                    
-                    sendAdminNotificationEmail(emailSubject, emailBodyHtml)
-                    shutdown(1)
-                    
-            except ConnectionError as e:
-                log.error("Caught ConnectionError: " + str(e))
-                
-                shouldTryAgain = True
-                numSeconds = 60
-                log.info("Retry in " + str(numSeconds) + " seconds ...")
-                time.sleep(numSeconds)
-                
-            except RequestException as e:
-                log.error("URL: " + url)
-                log.error("Caught RequestException: " + str(e))
-                
-                emailSubject = \
-                    "Admin Notification for Application '" + APP_NAME + "' "
-                endl = "<br />"
-                emailBodyHtml = "Hi," + endl + endl + \
-                    "This is a notification to the site Admin that " + \
-                    "application '" + APP_NAME + \
-                    "' encountered an unexpected RequestException.  " + \
-                    "Please investigate at your earliest convenience.  " + \
-                    "Thank you." + \
-                    endl + endl + \
-                    "URL was: " + url + \
-                    endl + endl + \
-                    "RequestException was: " + str(e) + \
-                    endl + endl + \
-                    "-" + APP_NAME
-                    
-                sendAdminNotificationEmail(emailSubject, emailBodyHtml)
-                shutdown(1)
-
-    return htmls
-
-
-def updateActiveUrlsFromHtml(htmlTup, isFirstURL):
+    numSeconds = None
+    for sheet in sheets:
+        lastPollTimestamp = lastPollTimestampBySheetId.get(sheet.sheetId, now)
+        sheetNumSeconds = lastPollTimestamp + \
+            getPollIntervalSeconds(sheet, now) - now
+        if numSeconds is None or sheetNumSeconds < numSeconds:
+            numSeconds = sheetNumSeconds
+    if numSeconds is None:
+        numSeconds = POLL_INTERVAL_SECONDS
+    return max(0, numSeconds)
+
+
+def getSecondsUntilNextCycle(sheets, now):
     """
-    Reads the input html str, and from the contents, does the following:
+    Returns the float number of seconds from time.time() 'now' until the
+    next poll cycle: until the next of the given sheets is due, or until
+    the nightly pause is over.  In replay mode, the next cycle is due
+    right away.
+    """
+
+    # We have been getting HTTP 504 errors at around 4:30 am
+    # each morning, which causes our application to quit
+    # due to the conservative error-handling code which
+    # I have written.
+    #
+    # This code below is to have the script not make any HTTP requests
+    # to the web server around this time period.
+    #
+    if lcplfetch.isReplaying():
+        return 0
+    localNow = datetime.datetime.fromtimestamp(now)
+    if NIGHTLY_PAUSE_ENABLED and localNow.hour == 4 and localNow.minute > 25:
+        return 60 * 70
+    return getSecondsUntilNextPoll(sheets, now)
+
+
+def sleepUntilNextPoll(numSeconds, url, sheets):
+    """
+    Sleeps the given number of seconds.  If the next poll is a burst poll,
+    the connection to the web server is prewarmed shortly before it.
 
-      - Determines the URLs that should be active.
-      - Determines the URLs that should not be active.
-      - Update the database table 'urls' to be representative of the 
-        desired active and inactive URLs.
+    Requests of the control interface (see lcplcontrol.py) are applied
+    while sleeping.  If they change the schedule, the time of the next
+    poll is recomputed, and a requested poll-now ends the sleep.
 
     Arguments:
+    numSeconds - float number of seconds to sleep.
+    url        - str containing a URL of the next poll, or None.
+    sheets     - list of the Sheet objects polled.
+    """
+
+    global isPollNowRequested
+
+    log.debug("Sleeping for " + str(numSeconds) + " seconds ...")
+    nextPollTimestamp = time.time() + numSeconds
+    isPrewarmed = False
+    while True:
+        if lcplcontrol.applyPendingRequests():
+            if isPollNowRequested:
+                isPollNowRequested = False
+                log.info("Polling now, as requested.")
+                return
+            now = time.time()
+            nextPollTimestamp = now + getSecondsUntilNextCycle(sheets, now)
+            log.info("Rescheduled the next poll cycle in " + \
+                     str(nextPollTimestamp - now) + " seconds.")
+            monitorState["nextCycleDueUtcDttm"] = \
+                datetime.datetime.utcfromtimestamp(
+                    nextPollTimestamp).isoformat()
+            publishMonitorState()
+
+        numSeconds = nextPollTimestamp - time.time()
+        if numSeconds <= 0:
+            return
+        if BURST_POLLING_ENABLED and url is not None and not isPrewarmed and \
+                releaseTimeProfile.getIntervalFactor(nextPollTimestamp) < 1.0:
+            if numSeconds > PREWARM_LEAD_SECONDS:
+                if lcplcontrol.waitForRequests(numSeconds -
+                                               PREWARM_LEAD_SECONDS):
+                    continue
+                lcplfetch.prewarmConnection(url)
+            isPrewarmed = True
+            continue
+        lcplcontrol.waitForRequests(numSeconds)
 
-    htmlTup - tuple containing two entries.  
-        First entry is the URL
-        Second entry is the HTML text to parse.
 
-    isFirstURL - bool containing True if it is the 
-                 first URL being analyzed in the list.
+def forgetUrlsPolledElsewhere(ownedUrls):
     """
-    
-    url = htmlTup[0]
-    html = htmlTup[1]
-
-    log.debug("URL is: " + url)
-    
-    soup = BeautifulSoup(html, 'html5lib')
-    mainTable = soup.find("table", {"class" : "SUGtableouter"})
-    navTabs = soup.find("ul", {"class" : "nav-tabs"})
-    
-    if (mainTable == None or navTabs == None) and isFirstURL == True:
-        # URL should be set to inactive.
-        #
-        # Could not find a HTML table with class SUGtableouter
-        # which is our main table which contains all the shifts.
-        # Since this is the first URL for this iteration of
-        # parsing URLs, this URL will be marked as inactive in
-        # future loops.  If further investigation is desired,
-        # please see the HTML log for the HTML encountered.
-        #
-        log.debug("URL is active and should be inactive.")
-        log.info("Setting URL to inactive: " + url)
-        htmlLog.info("HTML text is: " + html)
-        updUtcDttm = datetime.datetime.utcnow().isoformat()
-        activeInd = "0"
-        values = (updUtcDttm, activeInd, url)
-        cursor.execute("update urls set upd_utc_dttm = ?, active_ind = ? " + \
-                       "where url = ?",
-                        values)
-        conn.commit()
-        log.info("Done setting URL to inactive.")
-    
-    elif mainTable is not None:
-        # URL is still active.
-        log.debug("Found mainTable, therefore this URL is still active.")
-        log.debug("Now examining URLs in the nav tabs ...")
-        
-        # Get URLs from the page.
-        navTabs = soup.find("ul", {"class" : "nav-tabs"})
-        if navTabs == None:
-            log.error("Could not find a <ul> element with CSS class " + \
-                      "'nav-tabs' when one was expected.  " + \
-                      "Please investigate further.  " + \
-                      "HTML will be logged to the HTML log.")
-            htmlLog.error("HTML text is: " + html)
-            shutdown(1)
-        else:
-            aElements = []
-            for li in navTabs.findAll("li", recursive=False):
-                htmlLog.debug("A <li> of navTabs is: " + li.prettify())
-                for a in li.findAll("a", recursive=False):
-                    htmlLog.debug("A <a> of <li> is: " + a.prettify())
-                    aElements.append(a)
-
-            for a in aElements:
-                htmlLog.debug("Looking at <a>: " + a.prettify())
-                onClickValue = a["onclick"]
-
-                if onClickValue.find("checkFormChanges") == -1:
-                    log.error("Could not find the expected javascript " + \
-                              "method name in the 'onclick' attribute.  " + \
-                              "Please investigate further.  " + \
-                              "Logging HTML to the HTML log.")
-                    htmlLog.error(html)
-                    shutdown(1)
-                    
-                splittedValues = onClickValue.split("'")
-                if len(splittedValues) == 3:
-                    pageName = splittedValues[1]
-                    navTabUrl = baseUrl + pageName
-                    log.debug("URL assembled from the nav tab is: " + navTabUrl)
-
-                    values = (navTabUrl,)
-                    
-                    cursor.execute("select * from urls where " + \
-                                   "url = ? " + \
-                                   "order by upd_utc_dttm desc limit 1",
-                                   values)
-
-                    tups = cursor.fetchall()
-                    
-                    if len(tups) == 0:
-                        # Initial time seeing this URL.
-                        log.debug("Initial time seeing this URL.")
-                        log.info("Setting URL to active: " + navTabUrl)
-                        crteUtcDttm = datetime.datetime.utcnow().isoformat()
-                        updUtcDttm = crteUtcDttm
-                        activeInd = "1"
-                        values = (crteUtcDttm, updUtcDttm, navTabUrl, activeInd)
-                        cursor.execute("insert into urls values (?, ?, ?, ?)",
-                                       values)
-                        conn.commit()
-                        log.info("Done setting URL to active.")
-                        
-                    elif len(tups) == 1:
-                        # URL was stored previously.
-                        log.debug("URL was stored previously.")
-                        tup = tups[0]
-                        activeIndColumn = 3
-                        activeInd = tup[activeIndColumn]
-                        if str(activeInd) == "1":
-                            log.debug("URL is active and should stay active.")
-                        elif str(activeInd) == "0":
-                            log.debug("URL is inactive and should be active.")
-                            log.info("Setting URL to active: " + navTabUrl)
-                            
-                            updUtcDttm = datetime.datetime.utcnow().isoformat()
-                            activeInd = "1"
-                            values = (updUtcDttm, activeInd, navTabUrl)
-                            cursor.execute("update urls set " + \
-                                            "upd_utc_dttm = ?, " + \
-                                            "active_ind = ? " + \
-                                            "where url = ?",
-                                            values)
-                            conn.commit()
-                            log.info("Done setting URL to active.")
-                        else:
-                            log.error("Unknown activeInd encountered: " + 
-                                        str(activeInd))
-                            shutdown(1)
-                    else:
-                        log.error("Unexpected number of rows for urls.  " + \
-                                  "len(tups) == " + str(len(tups)))
-                        shutdown(1)
-
-    else:
-        log.debug("After examining the HTML for this page, we determined " + \
-                  "there's no need to take any action updating any URLs " + \
-                  "to active status or to inactive status.")
-        
-    
-def getShiftsFromHtml(htmlTup, isFirstURL=False):
+    Forgets the cached pages and shift statuses of the URLs that this
+    worker polls now, but did not poll in the last cycle, since another
+    worker may have polled them in the meantime.
+
+    Arguments:
+    ownedUrls - set of str containing the URLs this worker polls now.
+    """
+
+    global previousOwnedUrls
+
+    if previousOwnedUrls is not None:
+        for url in ownedUrls - previousOwnedUrls:
+            lcplfetch.forgetPage(url)
+            lcplstore.forgetLatestStatuses(url)
+    previousOwnedUrls = ownedUrls
+
+
+def getUrlsToPoll(dueSheets, ownedUrls):
     """
-    Reads the input html str, and extracts the shifts.
+    Returns the URLs of the pages to fetch this cycle.  Pages are fetched
+    and parsed once, even when several sheets share them.
+
+    The earliest active URL of each sheet is always processed in full,
+    even if its page is unchanged: it is deactivated once its page has no
+    shifts table or tabs (see lcplstore.updateActiveUrls()), but it may
+    only have become the earliest after its page went dead, e.g. when two
+    tabs in a row expired at once.
 
     Arguments:
-    htmlTup - tuple containing two entries.  
-        First entry is the URL
-        Second entry is the HTML text to parse.
+    dueSheets - list of the Sheets due for a poll.
+    ownedUrls - set of str containing the URLs this worker polls.
 
     Returns:
-    list of Shift objects
+    tuple (dict of sheet ID to the list of str active URLs of the sheet,
+           earliest first,
+           dict of URL to the list of the Sheets sharing its page,
+           list of str URLs to fetch).
     """
-    
-    shifts = []
-    
-    url = htmlTup[0]
-    html = htmlTup[1]
-    
-    soup = BeautifulSoup(html, 'html5lib')
-    mainTable = soup.find("table", {"class" : "SUGtableouter"})
-    if mainTable == None:
-        log.warn("Could not find a HTML table with class SUGtableouter, " + \
-                 "which is our main table which contains all the shifts." + \
-                 "  Please see the HTML log for the HTML encountered.")
-        htmlLog.warn("HTML text is: " + html)
-        log.warn("Returning an empty list of shifts for this HTML page.")
-        return shifts
-    
-    #htmlLog.debug("mainTable is: " + mainTable.prettify())
-    mainTableBody = mainTable.find("tbody")
-
-    lastDateText = None
-    lastLocationText = None
-    
-    currRow = 0
-    for tr in mainTableBody.findAll("tr", recursive=False):
-        htmlLog.debug("A <tr> of mainTableBody is: " + tr.prettify())
-        log.debug("There are " + str(len(tr.findAll("td"))) + \
-                  " <td> inside this <tr>")
-        log.debug("There are " + str(len(tr.findAll("span"))) + \
-                  " <span> inside this <tr>")
-            
-        if currRow == 0:
-            log.debug("Skipping first row.")
-            currRow += 1
-            continue
-        else:
-            log.debug("Not first row.  Parsing...")
-            currRow += 1
-
-        trLowered = tr.prettify().lower()
-
-        # Status.
-        if re.search("already filled", trLowered, re.IGNORECASE):
-            statusText = "ALREADY FILLED"
-        elif re.search("sign up", trLowered, re.IGNORECASE):
-            statusText = "SIGN UP"
-        else:
-            log.error("Unexpected span text: " + spanText)
-            htmlLog.error("<tr> contents is: " + tr.prettify())
-            htmlLog.error("HTML text is: " + html)
-            shutdown(1)
-        log.debug("statusText == " + statusText)
-
-        shift = Shift()
-        shift.url = url
-        shift.rowNumber = currRow
-        shift.status = statusText
-    
-        shifts.append(shift)
-        log.debug("Created a Shift.  " + \
-                  "There are now " + str(len(shifts)) + " shifts.")
-
-    log.debug("Found " + str(len(shifts)) + " total shifts.")
-    return shifts
-
-
-def getNewShiftsAvailableForSignup(currShifts):
+
+    urlsBySheetId = {}
+    sheetsByUrl = {}
+    urls = []
+    for sheet in dueSheets:
+        urlsBySheetId[sheet.sheetId] = lcplstore.getUrls(sheet.sheetId)
+        if len(urlsBySheetId[sheet.sheetId]) > 0:
+            lcplfetch.forgetPage(urlsBySheetId[sheet.sheetId][0])
+        for url in urlsBySheetId[sheet.sheetId]:
+            if url not in ownedUrls or url in pausedUrls:
+                continue
+            if url not in sheetsByUrl:
+                sheetsByUrl[url] = []
+                urls.append(url)
+            sheetsByUrl[url].append(sheet)
+    return (urlsBySheetId, sheetsByUrl, urls)
+
+
+def processPages(htmlPages, urlsBySheetId, sheetsByUrl):
     """
-    This method iterates through the current shifts and 
-    returns the new shifts that are available for signup.
+    Records the shifts found in the fetched pages, and updates the active
+    URLs of their sheets.
 
-    Arguments: 
-    currShifts - list of Shift objects containing the current shifts.
+    Arguments:
+    htmlPages     - list of the page tuples returned by
+                    lcplsource.getPages().
+    urlsBySheetId - dict returned by getUrlsToPoll().
+    sheetsByUrl   - dict returned by getUrlsToPoll().
 
     Returns:
-    list of Shift objects that are the new shifts available for signup.
+    list of the Shifts newly available for signup.
     """
 
-    global conn
-    global cursor
     newShiftsAvailableForSignup = []
-    
-    for shift in currShifts:
-        
-        values = (shift.url, 
-                  shift.rowNumber)
-        
-        cursor.execute("select * from shifts where " + \
-                "url = ? " + \
-                "and row_number = ? " + \
-                "order by crte_utc_dttm desc limit 1",
-                values)
-
-        tups = cursor.fetchall()
-        
-        if len(tups) == 0:
-            # Initial status.
-            log.debug("shift.status is: " + shift.status)
-            if re.search("sign up", shift.status, re.IGNORECASE):
-                newShiftsAvailableForSignup.append(shift)
-
-            crteUtcDttm = datetime.datetime.utcnow().isoformat()
-            values = (crteUtcDttm,
-                    shift.url,
-                    shift.rowNumber,
-                    shift.status)
-            cursor.execute("insert into shifts values (?, ?, ?, ?)",
-                           values)
-            conn.commit()
-    
-        elif len(tups) == 1:
-            # Status was stored previously for this shift.
-            # Compare status.
-            tup = tups[0]
-            statusColumn = 3
-            oldStatus = tup[statusColumn]
-            if shift.status != oldStatus:
-                log.info("Status changed from " + oldStatus + \
-                         " to " + shift.status + " for: " + \
-                         str(shift))
-                         
-                if re.search("sign up", shift.status, re.IGNORECASE):
-                    newShiftsAvailableForSignup.append(shift)
-
-                crteUtcDttm = datetime.datetime.utcnow().isoformat()
-                values = (crteUtcDttm,
-                        shift.url,
-                        shift.rowNumber,
-                        shift.status)
-                cursor.execute("insert into shifts values (?, ?, ?, ?)",
-                               values)
-                conn.commit()
-        else:
-            log.error("Unexpected number of rows for shift.  " + \
-                      "numRows == " + numRows + ", shift == " + str(shift))
-            shutdown(1)
+
+    for i in range(len(htmlPages)):
+        htmlPage = htmlPages[i]
+        url = htmlPage[0]
+
+        source = lcplsource.getSourceForPage(htmlPage)
+        parsedPage = source.parsePage(htmlPage)
+        metricsRegistry.incrementCounter("lcplpagesubs_source_pages_total",
+                                         labels={"source": source.name})
+
+        # Observed once per page, so that the shifts of every sheet sharing
+        # it are bounded by the previous fetch of the page.
+        previousObservedTimestamp = lcplparse.recordObservedTimestamp(htmlPage)
+
+        for sheet in sheetsByUrl[url]:
+            log.info("Getting shifts from " + source.name.upper() + \
+                     " page (i == " + \
+                     str(i) + ") (url == " + url + ") " + \
+                     "(sheet == " + sheet.sheetId + ")...")
+
+            shifts = source.getShifts(htmlPage, sheet.sheetId, parsedPage,
+                                      previousObservedTimestamp)
+
+            newShiftsAvailableForSignup.extend(\
+                lcplstore.getNewShiftsAvailableForSignup(shifts))
+
+            log.info("Checking in this HTML page for any changes " + \
+                     "to what URLs are active (i == " + \
+                     str(i) + ") (url == " + url + ")...")
+
+            # Only the earliest active URL of the sheet is deactivated when
+            # its shifts table is gone, whichever worker polls it.
+            isFirstUrl = None
+            if url == urlsBySheetId[sheet.sheetId][0]:
+                isFirstUrl = True
+            else:
+                isFirstUrl = False
+
+            source.updateActiveUrls(htmlPage, isFirstUrl, sheet, parsedPage)
+
+        lcplfetch.commitPage(url)
+
+        # Events are published page by page, so that consumers of the event
+        # stream learn about changes right away.
+        lcplcommon.publishEvents(lcplstore.popStatusChangeEvents())
 
     return newShiftsAvailableForSignup
 
 
-def sendEmailNotificationMessage(newShiftsAvailableForSignup):
-    global adminFromEmailAddress
-    global alertToEmailAddresses
-    fromEmailAddress = adminFromEmailAddress
-    toEmailAddresses = alertToEmailAddresses
-    
-    emailSubject = "Application '" + APP_NAME + "' new shifts notification"
-    
-    endl = "<br />"
-    emailBodyHtml = "Hi," + endl + endl + \
-        "This is a notification from application '" + \
-        APP_NAME + "' that there "
-    if len(newShiftsAvailableForSignup) == 1:
-        emailBodyHtml += "is " + str(len(newShiftsAvailableForSignup)) + \
-            " new shift available for signup.  "
-    else:
-        emailBodyHtml += "are " + str(len(newShiftsAvailableForSignup)) + \
-            " new shifts available for signup.  "
-    emailBodyHtml += "Please visit the below URL(s) to see them:" + endl + endl
-
-    # Extract unique URLs in a sorted list.
-    urls = []
-    for shift in newShiftsAvailableForSignup:
-        if shift.url not in urls:
-            urls.append(shift.url)
-    urls.sort()
-    
-    emailBodyHtml += "<table>" + endl
-    for url in urls:
-        emailBodyHtml += "  <tr>" + endl
-        emailBodyHtml += "    <td>" + endl
-        emailBodyHtml += "      <a href='" + url + "'>" + url + "</a>" + endl
-        emailBodyHtml += "    </td>" + endl
-        emailBodyHtml += "  </tr>" + endl
-    emailBodyHtml += "</table>" + endl
-
-    emailBodyHtml += endl
-    emailBodyHtml += "-" + APP_NAME
-
-    log.info("Sending notice email to: " + str(toEmailAddresses))
-        
-    shouldTryAgain = True
-    while shouldTryAgain:
-        shouldTryAgain = False
-        try:
-            client = boto3.client('ses')
-            response = client.send_email(
-                Destination={
-                    'ToAddresses': [],
-                    'CcAddresses': [],
-                    'BccAddresses': toEmailAddresses
-                    },
-                Message={
-                    'Subject': {
-                        'Data': emailSubject,
-                        'Charset': 'UTF-8'
-                    },
-                    'Body': {
-                        'Html': {
-                            'Data': emailBodyHtml,
-                            'Charset': 'UTF-8'
-                            }
-                        }
-                    },
-                Source=fromEmailAddress,
-                )
-                
-            log.info("Sending email done.")
-            log.info("Response from AWS is: " + str(response))
-        except EndpointConnectionError as e:
-            log.error("Caught EndpointConnectionError: " + str(e))
-                
-            shouldTryAgain = True
-            numSeconds = 60
-            log.info("Retry in " + str(numSeconds) + " seconds ...")
-            time.sleep(numSeconds)
-                
-    
-def sendTextNotificationMessage(newShiftsAvailableForSignup):
+def recordCycleStart():
     """
-    Sends out a text message notifying the user that there are 
-    new shifts available for signup.
-
-    # To send a message to a Verizon Wireless phone from a personal computer,
-    # enter the person's mobile number followed by @vtext.com in the “to” field
-    # of your e-mail message – for example, 5551234567@vtext.com. Type an e-mail
-    # message as you would normally and send it. For more information, please
-    # visit www.vtext.com. Jul 25, 2007
+    Records the start of a poll cycle in the monitor state.
+
+    Returns:
+    float containing the cycle start time, as returned by time.time().
     """
 
-    endl = "\n"
-    msg = endl + "LCPL Page Shift Update: " + endl
-    if len(newShiftsAvailableForSignup) == 1:
-        msg += "There is " + str(len(newShiftsAvailableForSignup)) + \
-            " new shift available for signup." + endl
-    else:
-        msg += "There are " + str(len(newShiftsAvailableForSignup)) + \
-            " new shifts available for signup." + endl
-    
-    # Send text message via Twilio.
-    global twilioAccountSid
-    global twilioAuthToken
-    global sourcePhoneNumber
-    global destinationPhoneNumber
-
-    if twilioAccountSid is None or twilioAccountSid.strip() == "":
-        log.error("twilioAccountSid may not be empty.")
-        shutdown(1)
-
-    if twilioAuthToken is None or twilioAuthToken.strip() == "":
-        log.error("twilioAuthToken may not be empty.")
-        shutdown(1)
+    cycleStartTime = time.time()
+    monitorState["phase"] = "polling"
+    monitorState["cycleCount"] += 1
+    monitorState["currentCycleStartUtcDttm"] = \
+        datetime.datetime.utcfromtimestamp(cycleStartTime).isoformat()
+    publishMonitorState()
+    return cycleStartTime
 
-    try:
-        client = Client(twilioAccountSid, twilioAuthToken)
-    
-        log.info("Sending text message from phone number " +
-                    sourcePhoneNumber + " to phone number " +
-                    destinationPhoneNumber + " with message body: " + msg)
-
-        client.messages.create(from_=sourcePhoneNumber,
-                               to=destinationPhoneNumber,
-                               body=msg)
-        
-        log.info("Sending text message done.")
-        
-    except TwilioRestException as e:
-        log.error("Caught TwilioRestException: " + str(e))
-        shutdown(1)
-    except TwilioException as e:
-        log.error("Caught TwilioException: " + str(e))
-        shutdown(1)
-    except BaseException as e:
-        log.error("Caught BaseException: " + str(e))
-        shutdown(1)
-        
 
+def recordCycleEnd(cycleStartTime, stageSeconds, urls, numHtmlPages,
+                   numNewShifts, numSecondsUntilNextCycle):
+    """
+    Records the end of a poll cycle in the monitor state, and publishes it.
 
-##############################################################################
-# Main
-##############################################################################
+    Arguments:
+    cycleStartTime - float as returned by recordCycleStart().
+    stageSeconds   - dict of stage name to float seconds spent in that stage.
+    urls           - list of str containing the URLs polled.
+    numHtmlPages   - int number of HTML pages fetched.
+    numNewShifts   - int number of new shifts available for signup.
+    numSecondsUntilNextCycle - int number of seconds that will be slept
+                               before the next cycle.
+    """
+
+    cycleEndTime = time.time()
+    monitorState["phase"] = "sleeping"
+    monitorState["lastCycleStartUtcDttm"] = \
+        monitorState["currentCycleStartUtcDttm"]
+    monitorState["currentCycleStartUtcDttm"] = None
+    monitorState["lastCycleEndUtcDttm"] = \
+        datetime.datetime.utcfromtimestamp(cycleEndTime).isoformat()
+    monitorState["lastCycleDurationSeconds"] = cycleEndTime - cycleStartTime
+    monitorState["lastCycleStageSeconds"] = stageSeconds
+    monitorState["lastCycleUrls"] = urls
+    monitorState["lastCycleNumHtmlPages"] = numHtmlPages
+    monitorState["lastCycleNumNewShifts"] = numNewShifts
+    monitorState["nextCycleDueUtcDttm"] = \
+        datetime.datetime.utcfromtimestamp(
+            cycleEndTime + numSecondsUntilNextCycle).isoformat()
+    publishMonitorState()
+
+    metricsRegistry.observeHistogram("lcplpagesubs_cycle_seconds",
+                                     cycleEndTime - cycleStartTime)
+    metricsRegistry.incrementCounter("lcplpagesubs_cycles_total")
+    metricsRegistry.incrementCounter("lcplpagesubs_new_shifts_total",
+                                     numNewShifts)
+    metricsRegistry.setGauge("lcplpagesubs_active_urls", len(urls))
+    publishMetrics()
+
+
+def parseNonNegativeFloat(value):
+    numSeconds = float(value)
+    if not numSeconds >= 0:
+        raise ValueError("Expected a number >= 0: " + value)
+    return numSeconds
+
+
+def parseNonNegativeInt(value):
+    number = int(value)
+    if number < 0:
+        raise ValueError("Expected an integer >= 0: " + value)
+    return number
+
+
+def parseSourceBackend(value):
+    if value not in lcplsource.sourcesByName:
+        raise ValueError("Unknown source backend: " + value + ".  " + \
+                         "Expected one of: " + \
+                         ", ".join(sorted(lcplsource.sourcesByName)))
+    if value == lcplsource.JsonSource.name and not lcplsource.SOURCE_API_URL:
+        raise ValueError("The '" + value + "' backend needs the " + \
+                         "environment variable " + \
+                         "LCPL_PAGE_SUBS_SOURCE_API_URL.")
+    return value
+
+
+def parseLogLevel(value):
+    if value.upper() not in ["DEBUG", "INFO", "WARNING", "ERROR",
+                             "CRITICAL"]:
+        raise ValueError("Unknown log level: " + value)
+    return value.upper()
+
+
+def parseBool(value):
+    if value.lower() in ["1", "true", "on", "yes"]:
+        return True
+    if value.lower() in ["0", "false", "off", "no"]:
+        return False
+    raise ValueError("Expected a boolean (1 or 0): " + value)
+
+
+def setPollIntervalSeconds(numSeconds):
+    global POLL_INTERVAL_SECONDS
+
+    POLL_INTERVAL_SECONDS = numSeconds
+    lcplcommon.POLL_INTERVAL_SECONDS = numSeconds
+
+
+def setSourceBackend(name):
+    lcplsource.SOURCE_BACKEND = name
+    lcplsource.initializeSource()
+
+
+def applyPollNow(request):
+    """
+    Control command: polls right away, without waiting for the sheets to
+    be due.  If the request has a "sheetId", only that sheet is made due.
+    """
+
+    global isPollNowRequested
+
+    sheetId = request.get("sheetId")
+    if sheetId is None:
+        lastPollTimestampBySheetId.clear()
+    elif sheetId in lastPollTimestampBySheetId:
+        del lastPollTimestampBySheetId[sheetId]
+    elif sheetId not in [sheet.sheetId for sheet in lcplstore.getSheets()]:
+        raise ValueError("Unknown sheet ID: " + str(sheetId))
+    isPollNowRequested = True
+    return {}
+
+
+def applyPauseUrl(request):
+    """
+    Control command: stops polling the URL of the request, until resumed.
+    """
+
+    url = request.get("url")
+    if not url:
+        raise ValueError("Missing 'url'.")
+    pausedUrls.add(url)
+    monitorState["pausedUrls"] = sorted(pausedUrls)
+    return {"pausedUrls": sorted(pausedUrls)}
+
+
+def applyResumeUrl(request):
+    """
+    Control command: resumes polling the URL of the request.
+    """
+
+    url = request.get("url")
+    if url not in pausedUrls:
+        raise ValueError("URL is not paused: " + str(url))
+    pausedUrls.discard(url)
+    monitorState["pausedUrls"] = sorted(pausedUrls)
+    return {"pausedUrls": sorted(pausedUrls)}
+
+
+def applyProfileNextCycle(request):
+    """
+    Control command: profiles the next poll cycle (see cycleprofiler.py).
+    """
+
+    global isProfileNextCycleRequested
+
+    isProfileNextCycleRequested = True
+    return {}
+
+
+def applyStatus(request):
+    """
+    Control command: returns the knobs, the paused URLs, and where the
+    monitor is in its poll loop.
+    """
+
+    return {"knobs": lcplcontrol.getKnobValues(),
+            "pausedUrls": sorted(pausedUrls),
+            "cycleCount": monitorState.get("cycleCount"),
+            "nextCycleDueUtcDttm": monitorState.get("nextCycleDueUtcDttm"),
+            "lastPollTimestampBySheetId": dict(lastPollTimestampBySheetId)}
+
+
+def initializeControl():
+    """
+    Registers the knobs and commands of the control interface, and starts
+    listening on the control socket (see lcplcontrol.py).
+    """
+
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "pollIntervalSeconds",
+        "Seconds between polls of a sheet without its own interval.",
+        parseNonNegativeFloat, lambda: POLL_INTERVAL_SECONDS,
+        setPollIntervalSeconds, isScheduleChange=True))
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "fetchDelaySeconds",
+        "Seconds between a response and the next request (adapts to " + \
+        "the web server).",
+        parseNonNegativeFloat, lcplfetch.rateController.getDelaySeconds,
+        lcplfetch.rateController.setDelaySeconds))
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "fetchEarlyStopEnabled",
+        "Whether reading an HTML page stops after the parsed elements.",
+        parseBool, lambda: lcplfetch.FETCH_EARLY_STOP_ENABLED,
+        lambda value: setattr(lcplfetch, "FETCH_EARLY_STOP_ENABLED", value)))
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "sourceBackend",
+        "Backend pages are read from: " + \
+        ", ".join(sorted(lcplsource.sourcesByName)) + ".",
+        parseSourceBackend, lambda: lcplsource.SOURCE_BACKEND,
+        setSourceBackend))
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "logLevel",
+        "Level of the main log.",
+        parseLogLevel, lambda: logging.getLevelName(log.level),
+        log.setLevel))
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "htmlLogLevel",
+        "Level of the HTML log.",
+        parseLogLevel,
+        lambda: logging.getLevelName(logging.getLogger("html").level),
+        logging.getLogger("html").setLevel))
+    lcplcontrol.registerKnob(lcplcontrol.Knob(
+        "profileEveryNCycles",
+        "Every Nth poll cycle is profiled.  0 disables profiling.",
+        parseNonNegativeInt, lambda: cycleProfiler.everyNCycles,
+        lambda value: setattr(cycleProfiler, "everyNCycles", value)))
+
+    lcplcontrol.registerCommand(lcplcontrol.Command(
+        "poll-now",
+        "Polls right away (only the sheet of 'sheetId', if given).",
+        applyPollNow, isScheduleChange=True))
+    lcplcontrol.registerCommand(lcplcontrol.Command(
+        "pause",
+        "Stops polling the URL of 'url', until resumed.",
+        applyPauseUrl))
+    lcplcontrol.registerCommand(lcplcontrol.Command(
+        "resume",
+        "Resumes polling the URL of 'url'.",
+        applyResumeUrl))
+    lcplcontrol.registerCommand(lcplcontrol.Command(
+        "profile-next",
+        "Profiles the next poll cycle.",
+        applyProfileNextCycle))
+    lcplcontrol.registerCommand(lcplcontrol.Command(
+        "status",
+        "Shows the knobs, the paused URLs and the poll schedule.",
+        applyStatus))
+
+    lcplcontrol.initializeControlSocket()
+
+
+def main():
+    global isProfileNextCycleRequested
+
+    lcplcommon.configureLogging()
 
-if __name__ == "__main__":
     log.info("##########################################################")
     log.info("# Starting " + APP_NAME + \
              " (" + sys.argv[0] + "), version " + APP_VERSION)
     log.info("##########################################################")
 
-    initializeAdminEmailAddresses()
-    initializeAlertEmailAddresses()
-    initializeDatabase()
-    initializeTwilio()
-    
+    lcplcommon.registerShutdownHook(onShutdown)
+    initializeMonitorState()
+    initializeMetrics()
+    lcplfetch.initializeFetchArchives()
+    lcplcommon.initializeSnapshotStore()
+    lcplcommon.initializeEventLog()
+    if NOTIFICATION_SINK_FILENAME is None:
+        lcplnotify.initializeAdminEmailAddresses()
+        lcplnotify.initializeAlertEmailAddresses()
+        lcplnotify.initializeTwilio()
+    lcplsource.initializeSource()
+    lcplstore.initializeDatabase()
+    lcplcheckpoint.loadCheckpoint(lastPollTimestampBySheetId)
+    initializeControl()
+    recordStartupTime()
+
     while True:
         try:
+            cycleStartTime = recordCycleStart()
+            stageSeconds = {}
+
+            if cycleProfiler.shouldProfile(monitorState["cycleCount"]) or \
+                    isProfileNextCycleRequested:
+                isProfileNextCycleRequested = False
+                log.info("Profiling this cycle (cycle " + \
+                         str(monitorState["cycleCount"]) + ") ...")
+                cycleProfiler.start(monitorState["cycleCount"])
+
+            rebuildReleaseTimeProfileIfDue()
+
+            stageStartTime = time.time()
             log.info("Fetching HTML pages ...")
-            urls = getUrls()
-            htmlPages = getHtmlPages(urls)
+            sheets = lcplstore.getSheets()
+            dueSheets = getDueSheets(sheets, cycleStartTime)
+            ownedUrls = set(lcplstore.claimUrlLeases(lcplstore.getUrls()))
+            forgetUrlsPolledElsewhere(ownedUrls)
+
+            urlsBySheetId, sheetsByUrl, urls = \
+                getUrlsToPoll(dueSheets, ownedUrls)
+
+            htmlPages = lcplsource.getPages(urls, monitorState["cycleCount"])
             log.info("Fetching HTML pages done.  " + \
                      "Got " + str(len(htmlPages)) + " HTML pages total.")
-            
-            newShiftsAvailableForSignup = []
-
-            for i in range(len(htmlPages)):
-                htmlPage = htmlPages[i]
-                url = htmlPage[0]
-                
-                log.info("Getting shifts from HTML page (i == " + \
-                         str(i) + ") (url == " + url + ")...")
-                         
-                shifts = getShiftsFromHtml(htmlPage)
-            
-                newShiftsAvailableForSignup.extend(\
-                    getNewShiftsAvailableForSignup(shifts))
-                
-                log.info("Checking in this HTML page for any changes " + \
-                         "to what URLs are active (i == " + \
-                         str(i) + ") (url == " + url + ")...")
-
-                isFirstUrl = None
-                if i == 0:
-                    isFirstUrl = True
-                else:
-                    isFirstUrl = False
-                    
-                updateActiveUrlsFromHtml(htmlPage, isFirstUrl)
-                
+            stageSeconds["fetch"] = time.time() - stageStartTime
+
+            stageStartTime = time.time()
+            newShiftsAvailableForSignup = \
+                processPages(htmlPages, urlsBySheetId, sheetsByUrl)
+            stageSeconds["process"] = time.time() - stageStartTime
+
             log.info("There are " + str(len(newShiftsAvailableForSignup)) + \
                      " new shifts available for signup since we last checked.")
-            
+
+            stageStartTime = time.time()
+            newShiftsAvailableForSignup = \
+                lcplstore.claimAlertEvents(newShiftsAvailableForSignup)
             if len(newShiftsAvailableForSignup) > 0:
-                sendTextNotificationMessage(newShiftsAvailableForSignup)
-                sendEmailNotificationMessage(newShiftsAvailableForSignup)
-            
-            # We have been getting HTTP 504 errors at around 4:30 am
-            # each morning, which causes our application to quit
-            # due to the conservative error-handling code which
-            # I have written.
-            #
-            # This code below is to have the script not make any HTTP requests 
-            # to the web server around this time period.
-            #
-            now = datetime.datetime.now()
-            if now.hour == 4 and now.minute > 25:
-                numSeconds = 60 * 70
-                log.debug("Sleeping for " + str(numSeconds) + " seconds ...")
-                time.sleep(numSeconds)
-            else:
-                numSeconds = 60
-                log.debug("Sleeping for " + str(numSeconds) + " seconds ...")
-                time.sleep(numSeconds)
+                for sheet in dueSheets:
+                    sheetShifts = [shift for shift in
+                                   newShiftsAvailableForSignup
+                                   if shift.sheetId == sheet.sheetId]
+                    if len(sheetShifts) == 0:
+                        continue
+                    lcplnotify.sendTextNotificationMessage(sheetShifts,
+                                                           sheet)
+                    lcplnotify.sendEmailNotificationMessage(sheetShifts,
+                                                            sheet)
+                monitorState["alertLatency"] = \
+                    lcplnotify.recordAlertLatencies(
+                        newShiftsAvailableForSignup)
+            stageSeconds["notify"] = time.time() - stageStartTime
+
+            if cycleProfiler.isActive():
+                pstatsFilename = cycleProfiler.stop()
+                log.info("Wrote profile of this cycle to: " + pstatsFilename)
+
+            cycleEndTimestamp = time.time()
+            for sheet in dueSheets:
+                lastPollTimestampBySheetId[sheet.sheetId] = cycleEndTimestamp
+
+            numSeconds = getSecondsUntilNextCycle(sheets, cycleEndTimestamp)
+
+            lcplcommon.pruneSnapshotStoreIfDue()
+            lcplcommon.pruneEventLogIfDue()
+            lcplstats.aggregateIfDue()
+            lcplcheckpoint.saveCheckpointIfDue(lastPollTimestampBySheetId)
+            recordCycleEnd(cycleStartTime, stageSeconds, urls,
+                           len(htmlPages), len(newShiftsAvailableForSignup),
+                           numSeconds)
+
+            sleepUntilNextPoll(numSeconds, urls[0] if len(urls) > 0 else None,
+                               sheets)
 
         except KeyboardInterrupt:
             log.info("Caught KeyboardInterrupt.  Shutting down cleanly ...")
             shutdown(0)
-        
+
 
 ##############################################################################
+# Main
+##############################################################################
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+##############################################################################
+# Parsing of SignUpGenius pages: the shifts in the main table, and the URLs
+# of the other pages of the sheet in the nav tabs.  Pages read from the JSON
+# API (see lcplsource.py) are parsed into the same shifts and URLs.
+#
+# bs4 is imported on first use rather than at import time, since it (with
+# html5lib) is slow to import and not every user of this module parses.
+##############################################################################
+
+import re
+import time
+import json
+import logging
+from lcplcommon import log, htmlLog, metricsRegistry, shutdown
+from lcplcommon import STAGE_SECONDS_METRIC, Shift, captureHtml
+from lcplcommon import DEFAULT_SHEET_ID
+import lcplcommon
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Dict of URL to the time.time() its page was last fetched and parsed.
+# Used to bound when a newly available shift actually opened up.
+lastObservedTimestampByUrl = {}
+
+# Shift statuses.
+STATUS_SIGN_UP = "SIGN UP"
+STATUS_ALREADY_FILLED = "ALREADY FILLED"
+
+# Row number of the first shift of a page.  Row 1 of the shifts table is
+# its header, so the shifts of the JSON API are numbered from 2 as well, and
+# a shift keeps its row number whichever backend it was read from.
+FIRST_SHIFT_ROW_NUMBER = 2
+
+# Elements of a page that are parsed (see findMainTable() and
+# findNavTabs()), as tuples (regex of the start tag of the element, regex
+# of the start and end tags of its kind, to follow nesting).  Everything
+# after the end of both is not needed.
+PARSED_ELEMENT_PATTERNS = [
+    (re.compile(r"<table\b[^>]*\bSUGtableouter\b[^>]*>", re.I),
+     re.compile(r"<(/?)table\b[^>]*>", re.I)),
+    (re.compile(r"<ul\b[^>]*\bnav-tabs\b[^>]*>", re.I),
+     re.compile(r"<(/?)ul\b[^>]*>", re.I)),
+    ]
+
+##############################################################################
+# Classes
+##############################################################################
+
+class HtmlPageEndScanner:
+    """
+    Scans the text of a page as it is received, to tell when the elements
+    that are parsed (the main table and the nav tabs) have both been
+    received in full, so that the rest of the page need not be read.
+    """
+
+    def __init__(self):
+        self.text = ""
+
+        # For each of PARSED_ELEMENT_PATTERNS, the offset in self.text from
+        # which to scan, the int nesting depth of the element once its start
+        # tag has been found (None before), and the offset of the end of
+        # its end tag once found (None before).
+        self.positions = [0] * len(PARSED_ELEMENT_PATTERNS)
+        self.depths = [None] * len(PARSED_ELEMENT_PATTERNS)
+        self.endOffsets = [None] * len(PARSED_ELEMENT_PATTERNS)
+
+    def feed(self, text):
+        """
+        Adds the next part of the page.
+
+        Returns:
+        int offset in the page text of the end of the last of the parsed
+        elements, once they have all been received, or None before.
+        """
+
+        self.text += text
+
+        # Only complete tags are scanned: a tag cut at the end of the text
+        # is scanned once the rest of it is received.
+        scanEnd = self.text.rfind("<")
+        if scanEnd == -1 or self.text.find(">", scanEnd) != -1:
+            scanEnd = len(self.text)
+
+        for i in range(len(PARSED_ELEMENT_PATTERNS)):
+            if self.endOffsets[i] is not None:
+                continue
+            startPattern, tagPattern = PARSED_ELEMENT_PATTERNS[i]
+            if self.depths[i] is None:
+                match = startPattern.search(self.text, self.positions[i],
+                                            scanEnd)
+                if match is None:
+                    self.positions[i] = scanEnd
+                    continue
+                self.depths[i] = 1
+                self.positions[i] = match.end()
+            for match in tagPattern.finditer(self.text, self.positions[i],
+                                             scanEnd):
+                self.positions[i] = match.end()
+                self.depths[i] += -1 if match.group(1) else 1
+                if self.depths[i] == 0:
+                    self.endOffsets[i] = match.end()
+                    break
+            if self.endOffsets[i] is None:
+                self.positions[i] = scanEnd
+
+        if None in self.endOffsets:
+            return None
+        return max(self.endOffsets)
+
+##############################################################################
+# Methods
+##############################################################################
+
+def parseHtml(html):
+    """
+    Returns a BeautifulSoup of the given HTML str, parsed with html5lib.
+    """
+
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, 'html5lib')
+
+
+def findMainTable(soup):
+    """
+    Returns the HTML table with class SUGtableouter, which is our main
+    table which contains all the shifts, or None.
+    """
+
+    return soup.find("table", {"class" : "SUGtableouter"})
+
+
+def findNavTabs(soup):
+    """
+    Returns the <ul> element with class nav-tabs, which links to the other
+    pages of the sheet, or None.
+    """
+
+    return soup.find("ul", {"class" : "nav-tabs"})
+
+
+def getNavTabUrls(navTabs, url, html, baseUrl=None):
+    """
+    Returns a list of str, each str containing the URL of a page linked
+    from the nav tabs, in the order they appear.
+
+    Arguments:
+    navTabs - the nav tabs element, as returned by findNavTabs().
+    url     - str containing the URL of the page, for logging.
+    html    - str containing the HTML text of the page, for logging.
+    baseUrl - str containing the URL the page names are relative to.
+              Defaults to lcplcommon.baseUrl.
+    """
+
+    if baseUrl is None:
+        baseUrl = lcplcommon.baseUrl
+
+    # prettify() is slow, so the elements are only prettified when the
+    # debug messages would actually be logged.
+    isHtmlDebugEnabled = htmlLog.isEnabledFor(logging.DEBUG)
+
+    aElements = []
+    for li in navTabs.findAll("li", recursive=False):
+        if isHtmlDebugEnabled:
+            htmlLog.debug("A <li> of navTabs is: " + li.prettify())
+        for a in li.findAll("a", recursive=False):
+            if isHtmlDebugEnabled:
+                htmlLog.debug("A <a> of <li> is: " + a.prettify())
+            aElements.append(a)
+
+    navTabUrls = []
+    for a in aElements:
+        if isHtmlDebugEnabled:
+            htmlLog.debug("Looking at <a>: " + a.prettify())
+        onClickValue = a["onclick"]
+
+        if onClickValue.find("checkFormChanges") == -1:
+            log.error("Could not find the expected javascript " + \
+                      "method name in the 'onclick' attribute.  " + \
+                      "Please investigate further.  " + \
+                      "Logging HTML to the HTML log.")
+            captureHtml("unexpectedNavTabOnClick", url, html,
+                        logging.ERROR, force=True)
+            shutdown(1)
+
+        splittedValues = onClickValue.split("'")
+        if len(splittedValues) == 3:
+            pageName = splittedValues[1]
+            navTabUrl = baseUrl + pageName
+            log.debug("URL assembled from the nav tab is: " + navTabUrl)
+            navTabUrls.append(navTabUrl)
+
+    return navTabUrls
+
+
+def recordObservedTimestamp(pageTup):
+    """
+    Records the time the page of the given tuple was fetched as the time
+    its URL was last observed.  Call it once per fetched page, before
+    getting its shifts for each sheet sharing it.
+
+    Arguments:
+    pageTup - tuple (URL, page text[, time.time() fetched]).
+
+    Returns:
+    float time.time() the URL was observed before, or None if never.
+    """
+
+    url = pageTup[0]
+    observedTimestamp = time.time()
+    if len(pageTup) > 2:
+        observedTimestamp = pageTup[2]
+    previousObservedTimestamp = lastObservedTimestampByUrl.get(url)
+    lastObservedTimestampByUrl[url] = observedTimestamp
+    return previousObservedTimestamp
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "getShiftsFromHtml"})
+def getShiftsFromHtml(htmlTup, isFirstURL=False, sheetId=DEFAULT_SHEET_ID,
+                      soup=None, previousObservedTimestamp=None):
+    """
+    Reads the input html str, and extracts the shifts.
+
+    Arguments:
+    htmlTup - tuple containing two or three entries.
+        First entry is the URL
+        Second entry is the HTML text to parse.
+        Optional third entry is the time.time() the HTML was fetched.
+    sheetId - str ID of the sheet the page belongs to.
+    soup    - BeautifulSoup of the HTML, as returned by parseHtml(), if
+              already parsed.
+    previousObservedTimestamp - float time.time() the URL was observed
+              before, as returned by recordObservedTimestamp(), or None.
+
+    Returns:
+    list of Shift objects
+    """
+
+    shifts = []
+
+    url = htmlTup[0]
+    html = htmlTup[1]
+
+    observedTimestamp = time.time()
+    if len(htmlTup) > 2:
+        observedTimestamp = htmlTup[2]
+
+    if soup is None:
+        soup = parseHtml(html)
+    mainTable = findMainTable(soup)
+    if mainTable == None:
+        log.warn("Could not find a HTML table with class SUGtableouter, " + \
+                 "which is our main table which contains all the shifts." + \
+                 "  Please see the HTML log for the HTML encountered.")
+        captureHtml("noMainTable", url, html, logging.WARNING,
+                    fetchTimestamp=observedTimestamp)
+        log.warn("Returning an empty list of shifts for this HTML page.")
+        return shifts
+
+    #htmlLog.debug("mainTable is: " + mainTable.prettify())
+    mainTableBody = mainTable.find("tbody")
+
+    lastDateText = None
+    lastLocationText = None
+
+    # Counting the cells and prettifying the rows is slow, so it is only
+    # done when the debug messages would actually be logged.
+    isDebugEnabled = log.isEnabledFor(logging.DEBUG)
+    isHtmlDebugEnabled = htmlLog.isEnabledFor(logging.DEBUG)
+
+    currRow = 0
+    for tr in mainTableBody.findAll("tr", recursive=False):
+        if isHtmlDebugEnabled:
+            htmlLog.debug("A <tr> of mainTableBody is: " + tr.prettify())
+        if isDebugEnabled:
+            log.debug("There are " + str(len(tr.findAll("td"))) + \
+                      " <td> inside this <tr>")
+            log.debug("There are " + str(len(tr.findAll("span"))) + \
+                      " <span> inside this <tr>")
+
+        if currRow == 0:
+            log.debug("Skipping first row.")
+            currRow += 1
+            continue
+        else:
+            log.debug("Not first row.  Parsing...")
+            currRow += 1
+
+        trLowered = tr.prettify().lower()
+
+        # Status.
+        if re.search("already filled", trLowered, re.IGNORECASE):
+            statusText = STATUS_ALREADY_FILLED
+        elif re.search("sign up", trLowered, re.IGNORECASE):
+            statusText = STATUS_SIGN_UP
+        else:
+            log.error("Unexpected status text in row " + str(currRow) + \
+                      " of URL: " + url)
+            htmlLog.error("<tr> contents is: " + tr.prettify())
+            captureHtml("unexpectedStatus", url, html, logging.ERROR,
+                        force=True, fetchTimestamp=observedTimestamp)
+            shutdown(1)
+        if isDebugEnabled:
+            log.debug("statusText == " + statusText)
+
+        shift = Shift()
+        shift.sheetId = sheetId
+        shift.url = url
+        shift.rowNumber = currRow
+        shift.status = statusText
+        shift.observedTimestamp = observedTimestamp
+        shift.previousObservedTimestamp = previousObservedTimestamp
+
+        shifts.append(shift)
+        if isDebugEnabled:
+            log.debug("Created a Shift.  " + \
+                      "There are now " + str(len(shifts)) + " shifts.")
+
+    log.debug("Found " + str(len(shifts)) + " total shifts.")
+    return shifts
+
+
+def parseJson(text):
+    """
+    Returns the dict of a page read from the JSON API, or None if the text
+    is not a valid page.  A valid page looks like the following, where
+    'isOpen' is false (and the lists are empty) once the signup is closed:
+
+      {"pageName": "4090d4aaeaf2ba7f58-page8",
+       "isOpen": true,
+       "tabs": [{"pageName": "4090d4aaeaf2ba7f58-page8",
+                 "label": "Page Shifts - Jan 01 - Jan 14"}, ...],
+       "slots": [{"date": "01/02/2017 (Mon.)", "location": "Ashburn",
+                  "time": "9:00am - 1:00pm", "status": "SIGN UP"}, ...]}
+
+    'status' is 'SIGN UP' or 'ALREADY FILLED'.  This is the layout served
+    by the local stand-in server (see sugsim.py); it has not been checked
+    against the API of SignUpGenius.
+    """
+
+    try:
+        page = json.loads(text)
+    except ValueError as e:
+        log.warning("Could not decode the JSON page: " + str(e))
+        return None
+
+    if not isinstance(page, dict) or \
+            not isinstance(page.get("isOpen"), bool) or \
+            not isinstance(page.get("tabs"), list) or \
+            not isinstance(page.get("slots"), list):
+        log.warning("The JSON page does not have the expected " + \
+                    "'isOpen', 'tabs' and 'slots' fields.")
+        return None
+    for tab in page["tabs"]:
+        if not isinstance(tab, dict) or \
+                not isinstance(tab.get("pageName"), str):
+            log.warning("Unexpected tab in the JSON page: " + str(tab))
+            return None
+    for slot in page["slots"]:
+        if not isinstance(slot, dict) or slot.get("status") not in \
+                [STATUS_SIGN_UP, STATUS_ALREADY_FILLED]:
+            log.warning("Unexpected slot in the JSON page: " + str(slot))
+            return None
+    return page
+
+
+def getNavTabUrlsFromJson(page, baseUrl=None):
+    """
+    Returns a list of str, each str containing the URL of a tab of the
+    given JSON page, in the order they appear.
+
+    Arguments:
+    page    - dict of the page, as returned by parseJson().
+    baseUrl - str containing the URL the page names are relative to.
+              Defaults to lcplcommon.baseUrl.
+    """
+
+    if baseUrl is None:
+        baseUrl = lcplcommon.baseUrl
+
+    return [baseUrl + tab["pageName"] for tab in page["tabs"]]
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "getShiftsFromJson"})
+def getShiftsFromJson(jsonTup, sheetId=DEFAULT_SHEET_ID, page=None,
+                      previousObservedTimestamp=None):
+    """
+    Reads the input JSON page, and extracts the shifts.  Returns the same
+    shifts as getShiftsFromHtml() does for the HTML page of the same URL.
+
+    Arguments:
+    jsonTup - tuple containing two or three entries.
+        First entry is the URL
+        Second entry is the JSON text to parse.
+        Optional third entry is the time.time() the JSON was fetched.
+    sheetId - str ID of the sheet the page belongs to.
+    page    - dict of the page, as returned by parseJson(), if already
+              parsed.
+    previousObservedTimestamp - float time.time() the URL was observed
+              before, as returned by recordObservedTimestamp(), or None.
+
+    Returns:
+    list of Shift objects
+    """
+
+    shifts = []
+
+    url = jsonTup[0]
+
+    observedTimestamp = time.time()
+    if len(jsonTup) > 2:
+        observedTimestamp = jsonTup[2]
+
+    if page is None:
+        page = parseJson(jsonTup[1])
+    if page is None or not page["isOpen"]:
+        log.warn("The JSON page has no shifts.  " + \
+                 "Returning an empty list of shifts for this page.")
+        return shifts
+
+    rowNumber = FIRST_SHIFT_ROW_NUMBER
+    for slot in page["slots"]:
+        shift = Shift()
+        shift.sheetId = sheetId
+        shift.url = url
+        shift.rowNumber = rowNumber
+        shift.status = slot["status"]
+        shift.observedTimestamp = observedTimestamp
+        shift.previousObservedTimestamp = previousObservedTimestamp
+        shifts.append(shift)
+        rowNumber += 1
+
+    log.debug("Found " + str(len(shifts)) + " total shifts.")
+    return shifts
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+##############################################################################
+# Command line tool for the registry of sheets watched by the monitor.
+#
+# Usage:
+#   python3 src/lcplsheets.py --list
+#   python3 src/lcplsheets.py --add=branch2 \
+#       --seed-url="http://www.signupgenius.com/go/XXXXXXXXXX-page1" \
+#       --poll-interval=120 --sms="+1XXXYYYZZZZ" \
+#       --email="user1@example.com,user2@example.com"
+#   python3 src/lcplsheets.py --deactivate=branch2
+#
+# The monitor picks up changes to the registry at its next poll cycle.
+##############################################################################
+
+import sys
+import optparse
+import logging
+import lcplstore
+
+##############################################################################
+# Methods
+##############################################################################
+
+def splitList(valueStr):
+    """
+    Returns a list of str out of the given comma-separated str, or None if
+    the str is None.
+    """
+
+    if valueStr is None:
+        return None
+    return [value.strip() for value in valueStr.split(",") if value.strip()]
+
+
+def printSheets():
+    """
+    Prints the registered sheets, and the number of active URLs of each.
+    """
+
+    for sheet in lcplstore.getSheets(includeInactive=True):
+        numUrls = 0
+        if sheet.isActive:
+            numUrls = len(lcplstore.getUrls(sheet.sheetId))
+        print(sheet.sheetId + ("" if sheet.isActive else " (inactive)"))
+        print("  Seed URL: " + sheet.seedUrl)
+        print("  Base URL: " + sheet.baseUrl)
+        print("  Poll interval seconds: " + str(sheet.pollIntervalSeconds))
+        print("  SMS recipients: " + str(sheet.smsRecipients))
+        print("  Email recipients: " + str(sheet.emailRecipients))
+        print("  Active URLs: " + str(numUrls))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--list", action="store_true", default=False,
+                      help="List the registered sheets")
+    parser.add_option("--add", metavar="SHEET_ID",
+                      help="Register (or update) the sheet with this ID")
+    parser.add_option("--seed-url",
+                      help="URL of the earliest page of the sheet to add")
+    parser.add_option("--base-url",
+                      help="URL the page names of the sheet are relative " +
+                           "to [default: the seed URL up to its last '/']")
+    parser.add_option("--poll-interval", type="float",
+                      help="Seconds between polls of the sheet " +
+                           "[default: LCPL_PAGE_SUBS_POLL_INTERVAL_SECONDS]")
+    parser.add_option("--sms",
+                      help="Comma-separated phone numbers alerted about " +
+                           "the sheet [default: TWILIO_DEST_PHONE_NUMBER]")
+    parser.add_option("--email",
+                      help="Comma-separated email addresses alerted about " +
+                           "the sheet " +
+                           "[default: LCPL_PAGE_SUBS_ALERT_EMAIL_ADDRESSES]")
+    parser.add_option("--deactivate", metavar="SHEET_ID",
+                      help="Stop watching the sheet with this ID")
+    parser.add_option("--database",
+                      help="File path of the database " +
+                           "[default: LCPL_PAGE_SUBS_DATABASE_FILENAME, " +
+                           "or data/lcpl_page_shifts.db]")
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s - %(message)s")
+
+    if options.add is None and options.deactivate is None and \
+            not options.list:
+        parser.print_help()
+        sys.exit(2)
+    if options.add is not None and options.seed_url is None:
+        parser.error("--seed-url is required with --add")
+
+    lcplstore.initializeDatabase(options.database)
+    rc = 0
+    if options.add is not None:
+        lcplstore.addSheet(options.add, options.seed_url, options.base_url,
+                           options.poll_interval, splitList(options.sms),
+                           splitList(options.email))
+    if options.deactivate is not None:
+        if not lcplstore.deactivateSheet(options.deactivate):
+            print("No sheet with ID: " + options.deactivate)
+            rc = 1
+    if options.list:
+        printSheets()
+    lcplstore.closeDatabase()
+    sys.exit(rc)
+
+##############################################################################
+# Main
+##############################################################################
+
+if __name__ == "__main__":
+    main()
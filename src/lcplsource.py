@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+##############################################################################
+# The backends that the pages of the sheets are read from.
+#
+# A backend fetches the pages of a list of URLs, and turns each fetched page
+# into shifts and into updates of the active URLs.  There are two:
+#
+#   html - scrapes the signup pages (see lcplfetch.py and lcplparse.py).
+#   json - reads the slots of each page from a JSON API
+#          (lcplcommon.SOURCE_API_URL + page name + '/slots'), which is
+#          much smaller and cheaper to parse than the HTML page.  Only the
+#          local stand-in server (see sugsim.py) serves this API so far:
+#          its layout has not been checked against SignUpGenius.
+#
+# Both produce the same shifts, with the same row numbers, so the backend
+# can be switched without alerting on every shift again.  The json backend
+# falls back to the HTML page of a URL whenever the API fails for it (an
+# error status, a connection error, or a body that is not a valid page),
+# and keeps reading that URL from HTML for SOURCE_FALLBACK_SECONDS.
+#
+# Each fetched page is processed by the backend that can read its text, so
+# a cycle can mix JSON and HTML pages, and archives recorded with either
+# backend can be replayed (see fetcharchive.py).
+##############################################################################
+
+import time
+from lcplcommon import log, metricsRegistry, shutdown
+from lcplcommon import STAGE_SECONDS_METRIC, SOURCE_BACKEND
+from lcplcommon import SOURCE_API_URL, SOURCE_FALLBACK_SECONDS
+import lcplfetch
+import lcplparse
+import lcplstore
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Dict of URL to the time.time() until which it is read from its HTML page,
+# after the JSON API failed for it.
+htmlFallbackUntilByUrl = {}
+
+##############################################################################
+# Classes
+##############################################################################
+
+class HtmlSource:
+    """
+    Backend reading the signup pages, scraped with html5lib.
+    """
+
+    name = "html"
+
+    def getPages(self, urls, cycle=0):
+        """
+        Returns a list of tuples (URL, page text, time.time() fetched) of
+        the pages of the given URLs that changed since they were last
+        processed.  See lcplfetch.getHtmlPages().
+        """
+
+        return lcplfetch.getHtmlPages(urls, cycle)
+
+    def parsePage(self, pageTup):
+        """
+        Returns the parsed page of the given page tuple, which is passed to
+        getShifts() and updateActiveUrls().
+        """
+
+        return lcplparse.parseHtml(pageTup[1])
+
+    def getShifts(self, pageTup, sheetId, parsedPage=None,
+                  previousObservedTimestamp=None):
+        """
+        Returns the list of Shift objects of the given page tuple.  See
+        lcplparse.recordObservedTimestamp() for previousObservedTimestamp.
+        """
+
+        return lcplparse.getShiftsFromHtml(
+            pageTup, sheetId=sheetId, soup=parsedPage,
+            previousObservedTimestamp=previousObservedTimestamp)
+
+    def updateActiveUrls(self, pageTup, isFirstUrl, sheet, parsedPage=None):
+        """
+        Updates the active URLs of the given sheet from the given page
+        tuple.  See lcplstore.updateActiveUrls().
+        """
+
+        lcplstore.updateActiveUrlsFromHtml(pageTup, isFirstUrl, sheet.sheetId,
+                                           sheet.baseUrl, parsedPage)
+
+
+class JsonSource(HtmlSource):
+    """
+    Backend reading the slots of each page from the JSON API, falling back
+    to the HTML page of a URL when the API fails for it.
+    """
+
+    name = "json"
+
+    @metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "getJsonPages"})
+    def getPages(self, urls, cycle=0):
+        lcplfetch.checkUrls(urls)
+
+        # Replayed pages are returned as recorded, whichever backend
+        # recorded them.
+        if lcplfetch.isReplaying():
+            return lcplfetch.getHtmlPages(urls, cycle)
+
+        pages = []
+        now = time.time()
+        for url in urls:
+            if htmlFallbackUntilByUrl.get(url, 0) > now:
+                pageTup = lcplfetch.fetchPage(url, cycle)
+            else:
+                pageTup = self.fetchJsonPage(url, cycle)
+            if pageTup is not None:
+                pages.append(pageTup)
+        return pages
+
+    def fetchJsonPage(self, url, cycle=0):
+        """
+        Returns a tuple (URL, JSON text, time.time() fetched) of the given
+        URL read from the JSON API, or None if the page is unchanged.  Falls
+        back to the HTML page if the API fails.
+        """
+
+        try:
+            pageTup = lcplfetch.fetchPage(url, cycle, getApiUrl(url),
+                                          isFailureAllowed=True)
+            if pageTup is None or lcplparse.parseJson(pageTup[1]) is not None:
+                htmlFallbackUntilByUrl.pop(url, None)
+                return pageTup
+            error = "Not a valid JSON page."
+        except lcplfetch.FetchFailedError as e:
+            error = str(e)
+
+        log.warning("Could not read the page from the JSON API, so " + \
+                    "reading its HTML page for the next " + \
+                    str(SOURCE_FALLBACK_SECONDS) + " seconds: " + url + \
+                    ": " + error)
+        metricsRegistry.incrementCounter("lcplpagesubs_source_fallbacks_total")
+        htmlFallbackUntilByUrl[url] = time.time() + SOURCE_FALLBACK_SECONDS
+
+        # The validators and fingerprint of the failed response do not
+        # apply to the HTML page.
+        lcplfetch.pendingPageStateByUrl.pop(url, None)
+        lcplfetch.httpValidatorsByUrl.pop(url, None)
+        return lcplfetch.fetchPage(url, cycle)
+
+    def parsePage(self, pageTup):
+        return lcplparse.parseJson(pageTup[1])
+
+    def getShifts(self, pageTup, sheetId, parsedPage=None,
+                  previousObservedTimestamp=None):
+        return lcplparse.getShiftsFromJson(
+            pageTup, sheetId=sheetId, page=parsedPage,
+            previousObservedTimestamp=previousObservedTimestamp)
+
+    def updateActiveUrls(self, pageTup, isFirstUrl, sheet, parsedPage=None):
+        lcplstore.updateActiveUrlsFromJson(pageTup, isFirstUrl, sheet.sheetId,
+                                           sheet.baseUrl, parsedPage)
+
+
+# Backends by name.
+sourcesByName = {
+    HtmlSource.name: HtmlSource(),
+    JsonSource.name: JsonSource(),
+    }
+
+##############################################################################
+# Methods
+##############################################################################
+
+def initializeSource():
+    """
+    Checks and logs the configured backend.
+    """
+
+    if SOURCE_BACKEND not in sourcesByName:
+        log.error("Unknown source backend: " + SOURCE_BACKEND + ".  " + \
+                  "Expected one of: " + ", ".join(sorted(sourcesByName)))
+        shutdown(1)
+    if SOURCE_BACKEND == JsonSource.name and not SOURCE_API_URL:
+        log.error("The '" + JsonSource.name + "' backend needs the " + \
+                  "environment variable LCPL_PAGE_SUBS_SOURCE_API_URL.")
+        shutdown(1)
+    log.info("Reading pages with the '" + SOURCE_BACKEND + "' backend.")
+    if SOURCE_BACKEND == JsonSource.name:
+        log.info("JSON API URL is: " + SOURCE_API_URL)
+
+
+def getApiUrl(url):
+    """
+    Returns the str URL of the JSON API for the page of the given URL.
+    The page name is the last path segment of the URL.
+    """
+
+    pageName = url[url.rfind("/") + 1:]
+    return SOURCE_API_URL + pageName + "/slots"
+
+
+def getPages(urls, cycle=0):
+    """
+    Returns a list of tuples (URL, page text, time.time() fetched) of the
+    pages of the given URLs that changed since they were last processed,
+    read with the configured backend.  Call lcplfetch.commitPage() once a
+    returned page has been processed.
+    """
+
+    return sourcesByName[SOURCE_BACKEND].getPages(urls, cycle)
+
+
+def getSourceForPage(pageTup):
+    """
+    Returns the backend that reads the text of the given page tuple: the
+    json backend for a JSON object, the html backend otherwise.
+    """
+
+    if pageTup[1].lstrip().startswith("{"):
+        return sourcesByName[JsonSource.name]
+    return sourcesByName[HtmlSource.name]
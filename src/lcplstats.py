@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+##############################################################################
+# Incremental rollup of the shift history into hourly and daily statistics.
+#
+# Table 'shift_stats' holds, for each hour and day (UTC), sheet and URL:
+#   - the number of shifts that opened up (became available for signup),
+#   - the number of open shifts that were filled, and the distribution of
+#     how long they stayed open (time to fill), as counts per bucket of
+#     statsbuckets.FILL_SECONDS_BUCKETS,
+#   - the number of open slots of the URL at the end of the period (only
+#     set for periods in which a status of the URL changed),
+#   - the number of alerts sent.
+#
+# Only the rows of tables 'shifts' and 'alert_events' added since the last
+# run are read: the rowid of the last row rolled up of each table is kept
+# in table 'stats_watermarks', and the latest status of each shift in table
+# 'stats_shift_state'.  Each batch of rows is rolled up in one transaction,
+# with the watermark, so an interrupted run resumes where it stopped.
+#
+# The monitor runs the rollup every AGGREGATION_INTERVAL_SECONDS.  It can
+# also be run by hand, e.g. to roll up the history of an existing database:
+#   python3 src/lcplstats.py
+#   python3 src/lcplstats.py --rebuild --database=data/lcpl_page_shifts.db
+#
+# The status server serves the statistics (see serverstatus.py).
+##############################################################################
+
+import sys
+import json
+import time
+import logging
+import optparse
+import datetime
+from lcplcommon import log, metricsRegistry
+from lcplcommon import AGGREGATION_INTERVAL_SECONDS
+from statsbuckets import FILL_SECONDS_BUCKETS, getFillSecondsBucket
+import lcplstore
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Maximum number of rows of each table rolled up per transaction.
+AGGREGATION_BATCH_ROWS = 10000
+
+# Shift status of an open shift.
+STATUS_SIGN_UP = "SIGN UP"
+
+# Periods rolled up, and the number of leading characters of a
+# crte_utc_dttm ('YYYY-MM-DDTHH:MM:SS.ffffff') that identify each.
+PERIOD_PREFIX_LENGTHS = {"hour": 13, "day": 10}
+
+# time.time() of the last rollup run by the monitor.
+# See the method aggregateIfDue() below.
+lastAggregationTimestamp = None
+
+##############################################################################
+# Methods
+##############################################################################
+
+def createStatsTables(cursor):
+    """
+    Creates the tables of the statistics, if needed.
+    """
+
+    cursor.execute("create table if not exists shift_stats " +
+        "(period text, " +
+        "period_start text, " +
+        "sheet_id text, " +
+        "url text, " +
+        "opened_count integer, " +
+        "filled_count integer, " +
+        "fill_seconds_sum real, " +
+        "fill_seconds_count integer, " +
+        "fill_seconds_buckets text, " +
+        "open_slots integer, " +
+        "alert_count integer, " +
+        "primary key (period, period_start, sheet_id, url))")
+    cursor.execute("create table if not exists stats_watermarks " +
+        "(table_name text primary key, " +
+        "last_rowid integer, " +
+        "upd_utc_dttm text)")
+    cursor.execute("create table if not exists stats_shift_state " +
+        "(sheet_id text, " +
+        "url text, " +
+        "row_number integer, " +
+        "status text, " +
+        "open_since_utc_dttm text, " +
+        "primary key (sheet_id, url, row_number))")
+
+
+def getWatermark(cursor, tableName):
+    """
+    Returns the int rowid of the last row of the given table rolled up.
+    """
+
+    cursor.execute("select last_rowid from stats_watermarks " +
+                   "where table_name = ?", (tableName,))
+    tup = cursor.fetchone()
+    if tup is None:
+        return 0
+    return tup[0]
+
+
+def setWatermark(cursor, tableName, lastRowid):
+    cursor.execute("insert or replace into stats_watermarks " +
+                   "(table_name, last_rowid, upd_utc_dttm) " +
+                   "values (?, ?, ?)",
+                   (tableName, lastRowid,
+                    datetime.datetime.utcnow().isoformat()))
+
+
+def getSecondsBetween(startUtcDttm, endUtcDttm):
+    """
+    Returns the float number of seconds between two crte_utc_dttm strs.
+    """
+
+    return (datetime.datetime.fromisoformat(endUtcDttm) -
+            datetime.datetime.fromisoformat(startUtcDttm)).total_seconds()
+
+
+def newStats():
+    return {
+        "openedCount": 0,
+        "filledCount": 0,
+        "fillSecondsSum": 0.0,
+        "fillSecondsCount": 0,
+        "fillSecondsBuckets": [0] * (len(FILL_SECONDS_BUCKETS) + 1),
+        "openSlots": None,
+        "alertCount": 0,
+        }
+
+
+def getPeriodStats(statsByKey, sheetId, url, crteUtcDttm):
+    """
+    Returns a list of the stats dicts of the hour and the day of the given
+    time, for the given sheet and URL, creating them as needed.
+    """
+
+    statsList = []
+    for (period, prefixLength) in PERIOD_PREFIX_LENGTHS.items():
+        key = (period, crteUtcDttm[:prefixLength], sheetId, url)
+        if key not in statsByKey:
+            statsByKey[key] = newStats()
+        statsList.append(statsByKey[key])
+    return statsList
+
+
+def aggregateShiftRows(cursor, statsByKey, batchRows):
+    """
+    Rolls the next rows of table 'shifts' up into statsByKey, and updates
+    table 'stats_shift_state' and the watermark.
+
+    Returns:
+    int number of rows rolled up.
+    """
+
+    watermark = getWatermark(cursor, "shifts")
+    cursor.execute("select rowid, sheet_id, url, row_number, status, " +
+                   "crte_utc_dttm from shifts where rowid > ? " +
+                   "order by rowid limit ?",
+                   (watermark, batchRows))
+    rows = cursor.fetchall()
+    if len(rows) == 0:
+        return 0
+
+    # Latest status of the shifts of the URLs in this batch, and the number
+    # of open shifts of each of these URLs.
+    stateByKey = {}
+    openSlotsByUrlKey = {}
+    for urlKey in set((row[1], row[2]) for row in rows):
+        openSlotsByUrlKey[urlKey] = 0
+        cursor.execute("select row_number, status, open_since_utc_dttm " +
+                       "from stats_shift_state where sheet_id = ? and " +
+                       "url = ?", urlKey)
+        for (rowNumber, status, openSinceUtcDttm) in cursor.fetchall():
+            stateByKey[urlKey + (rowNumber,)] = (status, openSinceUtcDttm)
+            if status == STATUS_SIGN_UP:
+                openSlotsByUrlKey[urlKey] += 1
+
+    changedKeys = set()
+    for (rowid, sheetId, url, rowNumber, status, crteUtcDttm) in rows:
+        urlKey = (sheetId, url)
+        key = urlKey + (int(rowNumber),)
+        previousState = stateByKey.get(key)
+        previousStatus = None
+        if previousState is not None:
+            previousStatus = previousState[0]
+
+        statsList = getPeriodStats(statsByKey, sheetId, url, crteUtcDttm)
+        openSinceUtcDttm = None
+        if status == STATUS_SIGN_UP and previousStatus != STATUS_SIGN_UP:
+            openSlotsByUrlKey[urlKey] += 1
+            for stats in statsList:
+                stats["openedCount"] += 1
+            # When a shift is open the first time it is seen, when it
+            # opened is not known, so its time to fill is not counted.
+            if previousState is not None:
+                openSinceUtcDttm = crteUtcDttm
+        elif status == STATUS_SIGN_UP:
+            openSinceUtcDttm = previousState[1]
+        elif previousStatus == STATUS_SIGN_UP:
+            openSlotsByUrlKey[urlKey] -= 1
+            for stats in statsList:
+                stats["filledCount"] += 1
+            if previousState[1] is not None:
+                numSeconds = getSecondsBetween(previousState[1], crteUtcDttm)
+                bucket = getFillSecondsBucket(numSeconds)
+                for stats in statsList:
+                    stats["fillSecondsSum"] += numSeconds
+                    stats["fillSecondsCount"] += 1
+                    stats["fillSecondsBuckets"][bucket] += 1
+        for stats in statsList:
+            stats["openSlots"] = openSlotsByUrlKey[urlKey]
+
+        stateByKey[key] = (status, openSinceUtcDttm)
+        changedKeys.add(key)
+
+    for key in changedKeys:
+        cursor.execute("insert or replace into stats_shift_state " +
+                       "(sheet_id, url, row_number, status, " +
+                       "open_since_utc_dttm) values (?, ?, ?, ?, ?)",
+                       key + stateByKey[key])
+    setWatermark(cursor, "shifts", rows[-1][0])
+    return len(rows)
+
+
+def aggregateAlertRows(cursor, statsByKey, batchRows):
+    """
+    Rolls the next rows of table 'alert_events' up into statsByKey, and
+    updates the watermark.
+
+    Returns:
+    int number of rows rolled up.
+    """
+
+    watermark = getWatermark(cursor, "alert_events")
+    cursor.execute("select rowid, event_key, crte_utc_dttm " +
+                   "from alert_events where rowid > ? " +
+                   "order by rowid limit ?",
+                   (watermark, batchRows))
+    rows = cursor.fetchall()
+    if len(rows) == 0:
+        return 0
+
+    for (rowid, eventKey, crteUtcDttm) in rows:
+        # The key is 'sheetId|url|rowNumber|...' (see
+        # lcplstore.getNewShiftsAvailableForSignup()).
+        keyParts = eventKey.split("|")
+        if len(keyParts) < 4:
+            continue
+        for stats in getPeriodStats(statsByKey, keyParts[0], keyParts[1],
+                                    crteUtcDttm):
+            stats["alertCount"] += 1
+
+    setWatermark(cursor, "alert_events", rows[-1][0])
+    return len(rows)
+
+
+def writeStats(cursor, statsByKey):
+    """
+    Adds the given stats to the rows of table 'shift_stats'.
+    """
+
+    for (key, stats) in statsByKey.items():
+        cursor.execute("select opened_count, filled_count, " +
+                       "fill_seconds_sum, fill_seconds_count, " +
+                       "fill_seconds_buckets, open_slots, alert_count " +
+                       "from shift_stats where period = ? and " +
+                       "period_start = ? and sheet_id = ? and url = ?",
+                       key)
+        tup = cursor.fetchone()
+        if tup is not None:
+            stats["openedCount"] += tup[0]
+            stats["filledCount"] += tup[1]
+            stats["fillSecondsSum"] += tup[2]
+            stats["fillSecondsCount"] += tup[3]
+            stats["fillSecondsBuckets"] = \
+                [a + b for (a, b) in zip(stats["fillSecondsBuckets"],
+                                         json.loads(tup[4]))]
+            if stats["openSlots"] is None:
+                stats["openSlots"] = tup[5]
+            stats["alertCount"] += tup[6]
+        cursor.execute("insert or replace into shift_stats " +
+                       "(period, period_start, sheet_id, url, " +
+                       "opened_count, filled_count, fill_seconds_sum, " +
+                       "fill_seconds_count, fill_seconds_buckets, " +
+                       "open_slots, alert_count) " +
+                       "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       key + (stats["openedCount"],
+                              stats["filledCount"],
+                              stats["fillSecondsSum"],
+                              stats["fillSecondsCount"],
+                              json.dumps(stats["fillSecondsBuckets"]),
+                              stats["openSlots"],
+                              stats["alertCount"]))
+
+
+def aggregateNewRows(conn, batchRows=AGGREGATION_BATCH_ROWS):
+    """
+    Rolls the rows of tables 'shifts' and 'alert_events' added since the
+    last run up into table 'shift_stats', one batch per transaction.  The
+    write lock is taken before the watermarks are read, so several workers
+    sharing the database never roll up the same rows twice.
+
+    Arguments:
+    conn      - sqlite3 connection to the monitor's database, with no open
+                transaction.
+    batchRows - int maximum number of rows of each table per transaction.
+
+    Returns:
+    tuple (int number of shift rows, int number of alert rows) rolled up.
+    """
+
+    cursor = conn.cursor()
+    createStatsTables(cursor)
+    conn.commit()
+
+    numShiftRows = 0
+    numAlertRows = 0
+    while True:
+        cursor.execute("begin immediate")
+        try:
+            statsByKey = {}
+            numBatchShiftRows = aggregateShiftRows(cursor, statsByKey,
+                                                   batchRows)
+            numBatchAlertRows = aggregateAlertRows(cursor, statsByKey,
+                                                   batchRows)
+            writeStats(cursor, statsByKey)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        numShiftRows += numBatchShiftRows
+        numAlertRows += numBatchAlertRows
+        if numBatchShiftRows < batchRows and numBatchAlertRows < batchRows:
+            break
+    return (numShiftRows, numAlertRows)
+
+
+def resetStats(conn):
+    """
+    Removes the statistics and watermarks, so that the next run rolls up
+    the whole history again.
+    """
+
+    cursor = conn.cursor()
+    for tableName in ["shift_stats", "stats_watermarks", "stats_shift_state"]:
+        cursor.execute("drop table if exists " + tableName)
+    conn.commit()
+
+
+def aggregateIfDue():
+    """
+    Rolls up the new rows of the monitor's database (see
+    lcplstore.initializeDatabase()), at most once per
+    AGGREGATION_INTERVAL_SECONDS.  Failures are only logged.
+    """
+
+    global lastAggregationTimestamp
+
+    if AGGREGATION_INTERVAL_SECONDS <= 0 or lcplstore.conn is None:
+        return
+
+    now = time.time()
+    if lastAggregationTimestamp is not None and \
+            now - lastAggregationTimestamp < AGGREGATION_INTERVAL_SECONDS:
+        return
+    lastAggregationTimestamp = now
+
+    startTime = time.perf_counter()
+    try:
+        numShiftRows, numAlertRows = aggregateNewRows(lcplstore.conn)
+    except lcplstore.sqlite3.Error as e:
+        log.warning("Could not roll up the shift statistics: " + str(e))
+        return
+    metricsRegistry.incrementCounter("lcplpagesubs_stats_rows_total",
+                                     numShiftRows + numAlertRows)
+    log.info("Rolled up " + str(numShiftRows) + " shift rows and " + \
+             str(numAlertRows) + " alert rows into the statistics in " + \
+             "{:.3f} seconds.".format(time.perf_counter() - startTime))
+
+##############################################################################
+# Main
+##############################################################################
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--rebuild", action="store_true", default=False,
+                      help="Roll up the whole history again")
+    parser.add_option("--database",
+                      help="File path of the database " +
+                           "[default: LCPL_PAGE_SUBS_DATABASE_FILENAME, " +
+                           "or data/lcpl_page_shifts.db]")
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s - %(message)s")
+
+    lcplstore.initializeDatabase(options.database)
+    if options.rebuild:
+        resetStats(lcplstore.conn)
+    startTime = time.perf_counter()
+    numShiftRows, numAlertRows = aggregateNewRows(lcplstore.conn)
+    print("Rolled up " + str(numShiftRows) + " shift rows and " +
+          str(numAlertRows) + " alert rows in " +
+          "{:.3f} seconds.".format(time.perf_counter() - startTime))
+    lcplstore.closeDatabase()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
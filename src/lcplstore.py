@@ -0,0 +1,1040 @@
+#!/usr/bin/env python3
+##############################################################################
+# The sqlite database of the monitor.
+#
+# Table 'sheets' holds the registry of the sheets watched, with the seed
+# URL, poll interval and recipients of each.  Table 'urls' holds the pages
+# of each sheet and whether each is still polled, and table 'shifts' holds
+# the history of each shift's status.  Both are namespaced by sheet ID.
+# Table 'current_shifts' holds the latest status of each shift of the active
+# URLs, kept up to date with every write to 'shifts' and 'urls', so that
+# the status server can show what is open now without scanning the history.
+#
+# Several monitor processes ("workers") can share the database.  Table
+# 'workers' holds the heartbeat of each, table 'leases' which worker polls
+# each URL and until when, and table 'alert_events' the status changes
+# already alerted, so that no alert is sent twice.
+##############################################################################
+
+import os
+import re
+import time
+import calendar
+import hashlib
+import logging
+import datetime
+import sqlite3
+from lcplcommon import log, metricsRegistry, shutdown
+from lcplcommon import STAGE_SECONDS_METRIC, captureHtml
+from lcplcommon import DATABASE_BUSY_TIMEOUT_SECONDS
+from lcplcommon import WORKER_ID, URL_LEASE_SECONDS
+from lcplcommon import DEFAULT_SHEET_ID, Sheet
+import lcplcommon
+import lcplparse
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Database connection and cursor.
+# See the method initializeDatabase() below.
+conn = None
+cursor = None
+databaseFilename = None
+
+# Dict of (sheet ID, URL, row number) to a tuple of the latest status of
+# that shift and the crte_utc_dttm of its row in table 'shifts', so that
+# the status of a shift is only read from the database once.
+latestShiftStatusByKey = {}
+
+# List of dicts of the events of the changes of shift statuses found since
+# they were last taken with popStatusChangeEvents(), for the event log (see
+# lcplcommon.publishEvents()).
+statusChangeEvents = []
+
+##############################################################################
+# Methods
+##############################################################################
+
+def addColumnIfMissing(tableName, columnName, columnType, defaultValue):
+    """
+    Adds a column to a table created by an earlier version of the monitor,
+    filling it with the given default value for the existing rows.
+    """
+
+    cursor.execute("pragma table_info(" + tableName + ")")
+    columnNames = [tup[1] for tup in cursor.fetchall()]
+    if columnName not in columnNames:
+        log.info("Adding column '" + columnName + "' to database table '" + \
+                 tableName + "' ...")
+        cursor.execute("alter table " + tableName + " add column " + \
+                       columnName + " " + columnType)
+        cursor.execute("update " + tableName + " set " + columnName + \
+                       " = ?", (defaultValue,))
+        conn.commit()
+
+
+def initializeDatabase(filename=None):
+    """
+    Initializes the database (creating tables as needed).
+    Globals 'conn' and 'cursor' are set for future use.
+
+    On the very first load, the default sheet is registered with
+    lcplcommon.seedUrl, and every active sheet without active URLs is
+    seeded with its seed URL.
+
+    Arguments:
+    filename - str containing the file path of the database.
+               Defaults to lcplcommon.DATABASE_FILENAME.
+    """
+
+    global conn
+    global cursor
+    global databaseFilename
+
+    if filename is None:
+        filename = lcplcommon.DATABASE_FILENAME
+    databaseFilename = filename
+    latestShiftStatusByKey.clear()
+
+    conn = sqlite3.connect(filename, timeout=DATABASE_BUSY_TIMEOUT_SECONDS)
+    cursor = conn.cursor()
+    cursor.execute("create table if not exists shifts " +
+        "(crte_utc_dttm text, " +
+        "url text, " +
+        "row_number text, " +
+        "status text)")
+    conn.commit()
+    cursor.execute("create table if not exists urls " +
+        "(crte_utc_dttm text, " +
+        "upd_utc_dttm text, " +
+        "url text, " +
+        "active_ind text)")
+    conn.commit()
+    cursor.execute("create table if not exists sheets " +
+        "(sheet_id text primary key, " +
+        "crte_utc_dttm text, " +
+        "upd_utc_dttm text, " +
+        "seed_url text, " +
+        "base_url text, " +
+        "poll_interval_seconds real, " +
+        "sms_recipients text, " +
+        "email_recipients text, " +
+        "active_ind text)")
+    conn.commit()
+    addColumnIfMissing("urls", "sheet_id", "text", DEFAULT_SHEET_ID)
+    addColumnIfMissing("shifts", "sheet_id", "text", DEFAULT_SHEET_ID)
+    cursor.execute("create index if not exists shifts_sheet_url_row_idx " +
+        "on shifts (sheet_id, url, row_number, crte_utc_dttm)")
+    cursor.execute("create index if not exists urls_sheet_url_idx " +
+        "on urls (sheet_id, url)")
+    conn.commit()
+    cursor.execute("create table if not exists workers " +
+        "(worker_id text primary key, " +
+        "heartbeat_timestamp real, " +
+        "heartbeat_utc_dttm text)")
+    cursor.execute("create table if not exists leases " +
+        "(url text primary key, " +
+        "worker_id text, " +
+        "expiry_timestamp real, " +
+        "upd_utc_dttm text)")
+    cursor.execute("create table if not exists alert_events " +
+        "(event_key text primary key, " +
+        "crte_utc_dttm text, " +
+        "worker_id text)")
+    conn.commit()
+    cursor.execute("select count(*) from sqlite_master where " +
+                   "type = 'table' and name = 'current_shifts'")
+    isCurrentShiftsNew = cursor.fetchone()[0] == 0
+    cursor.execute("create table if not exists current_shifts " +
+        "(sheet_id text, " +
+        "url text, " +
+        "row_number integer, " +
+        "status text, " +
+        "upd_utc_dttm text, " +
+        "primary key (sheet_id, url, row_number))")
+    cursor.execute("create index if not exists current_shifts_status_idx " +
+        "on current_shifts (status, sheet_id, url, row_number)")
+    conn.commit()
+    if isCurrentShiftsNew:
+        materializeCurrentShifts()
+
+    # If the 'sheets' table is empty, then register the default sheet.
+    cursor.execute("select count(*) from sheets")
+    if cursor.fetchone()[0] == 0:
+        addSheet(DEFAULT_SHEET_ID, lcplcommon.seedUrl, lcplcommon.baseUrl)
+
+    seedSheetUrls()
+
+
+def materializeCurrentShifts(sheetId=None, url=None):
+    """
+    Fills table 'current_shifts' with the latest status of each shift of
+    the active URLs, read from table 'shifts'.  Used when the table is
+    created on an existing database, and when a URL is set to active again.
+
+    Arguments:
+    sheetId - str ID of a sheet, to only fill the shifts of this sheet and
+              URL.  Defaults to all sheets and URLs.
+    url     - str containing the URL, with sheetId.
+    """
+
+    whereSql = ""
+    values = ()
+    if sheetId is not None:
+        whereSql = "s.sheet_id = ? and s.url = ? and "
+        values = (sheetId, url)
+        cursor.execute("delete from current_shifts where " + \
+                       "sheet_id = ? and url = ?", values)
+    else:
+        log.info("Filling database table 'current_shifts' from the " + \
+                 "shift history ...")
+        cursor.execute("delete from current_shifts")
+
+    cursor.execute("insert or replace into current_shifts " + \
+                   "(sheet_id, url, row_number, status, upd_utc_dttm) " + \
+                   "select s.sheet_id, s.url, " + \
+                   "cast(s.row_number as integer), s.status, " + \
+                   "s.crte_utc_dttm from shifts s where " + whereSql + \
+                   "s.crte_utc_dttm = (select max(t.crte_utc_dttm) " + \
+                   "from shifts t where t.sheet_id = s.sheet_id and " + \
+                   "t.url = s.url and t.row_number = s.row_number) and " + \
+                   "exists (select 1 from urls u where " + \
+                   "u.sheet_id = s.sheet_id and u.url = s.url and " + \
+                   "u.active_ind = '1')",
+                   values)
+    conn.commit()
+    if sheetId is None:
+        log.info("Done filling database table 'current_shifts' (" + \
+                 str(cursor.rowcount) + " shifts).")
+
+
+def seedSheetUrls():
+    """
+    Adds the seed URL of every active sheet that has no active URLs.
+    """
+
+    for sheet in getSheets():
+        activeInd = "1"
+        values = (sheet.sheetId, activeInd)
+        cursor.execute("select * from urls where " + \
+                       "sheet_id = ? and active_ind = ?",
+                       values)
+        tups = cursor.fetchall()
+        log.debug("Fetched " + str(len(tups)) + " rows from the database " + \
+                  "for sheet '" + sheet.sheetId + "'.")
+
+        if len(tups) == 0:
+            seedUrl = sheet.seedUrl
+            log.info("Seeding active URLs of sheet '" + sheet.sheetId + \
+                     "' with initial URL: " + seedUrl)
+
+            crteUtcDttm = datetime.datetime.utcnow().isoformat()
+            updUtcDttm = crteUtcDttm
+            activeInd = "1"
+            values = (crteUtcDttm, updUtcDttm, seedUrl, activeInd,
+                      sheet.sheetId)
+            cursor.execute("insert into urls (crte_utc_dttm, " + \
+                           "upd_utc_dttm, url, active_ind, sheet_id) " + \
+                           "values (?, ?, ?, ?, ?)",
+                           values)
+            conn.commit()
+            log.debug("Done.")
+
+
+def closeDatabase():
+    """
+    Closes the database connection, if open.
+    """
+
+    global conn
+    global cursor
+
+    if conn is not None:
+        log.info("Closing database connection ...")
+        conn.close()
+        conn = None
+        cursor = None
+        log.info("Done closing database connection.")
+
+
+def addSheet(sheetId, seedUrl, baseUrl=None, pollIntervalSeconds=None,
+             smsRecipients=None, emailRecipients=None):
+    """
+    Registers a sheet to watch, or updates a registered one (reactivating
+    it if it was deactivated).  Its seed URL is polled from the next cycle.
+
+    Arguments:
+    sheetId             - str short unique name of the sheet.
+    seedUrl             - str containing the URL of the earliest page
+                          (left-most tab) of the sheet.
+    baseUrl             - str containing the URL the page names in the nav
+                          tabs are relative to.  Defaults to the seed URL
+                          up to its last '/'.
+    pollIntervalSeconds - float number of seconds between polls of the
+                          sheet, or None for POLL_INTERVAL_SECONDS.
+    smsRecipients       - list of str phone numbers, or None for the one
+                          in TWILIO_DEST_PHONE_NUMBER.
+    emailRecipients     - list of str email addresses, or None for the
+                          ones in LCPL_PAGE_SUBS_ALERT_EMAIL_ADDRESSES.
+    """
+
+    if baseUrl is None:
+        baseUrl = seedUrl[:seedUrl.rfind("/") + 1]
+
+    def joinRecipients(recipients):
+        if recipients is None:
+            return None
+        return ",".join(recipients)
+
+    log.info("Registering sheet '" + sheetId + "' with seed URL: " + seedUrl)
+    crteUtcDttm = datetime.datetime.utcnow().isoformat()
+    updUtcDttm = crteUtcDttm
+    activeInd = "1"
+    cursor.execute("select crte_utc_dttm from sheets where sheet_id = ?",
+                   (sheetId,))
+    tup = cursor.fetchone()
+    if tup is not None:
+        crteUtcDttm = tup[0]
+    values = (sheetId, crteUtcDttm, updUtcDttm, seedUrl, baseUrl,
+              pollIntervalSeconds, joinRecipients(smsRecipients),
+              joinRecipients(emailRecipients), activeInd)
+    cursor.execute("insert or replace into sheets values " + \
+                   "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   values)
+    conn.commit()
+    seedSheetUrls()
+
+
+def deactivateSheet(sheetId):
+    """
+    Stops watching a sheet.  Its URLs and shifts are kept.
+
+    Returns:
+    bool True if the sheet was registered.
+    """
+
+    log.info("Deactivating sheet '" + sheetId + "'")
+    updUtcDttm = datetime.datetime.utcnow().isoformat()
+    activeInd = "0"
+    cursor.execute("update sheets set upd_utc_dttm = ?, active_ind = ? " + \
+                   "where sheet_id = ?",
+                   (updUtcDttm, activeInd, sheetId))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def getSheets(includeInactive=False):
+    """
+    Returns a list of Sheet objects, for the registered sheets, in the order
+    they were registered.
+
+    Arguments:
+    includeInactive - bool.  If True, deactivated sheets are included.
+    """
+
+    def splitRecipients(recipientsStr):
+        if recipientsStr is None:
+            return None
+        return [r.strip() for r in recipientsStr.split(",") if r.strip()]
+
+    sql = "select sheet_id, seed_url, base_url, poll_interval_seconds, " + \
+        "sms_recipients, email_recipients, active_ind from sheets"
+    values = ()
+    if not includeInactive:
+        sql += " where active_ind = ?"
+        values = ("1",)
+    sql += " order by crte_utc_dttm asc, sheet_id asc"
+    cursor.execute(sql, values)
+
+    sheets = []
+    for tup in cursor.fetchall():
+        sheet = Sheet()
+        sheet.sheetId = tup[0]
+        sheet.seedUrl = tup[1]
+        sheet.baseUrl = tup[2]
+        sheet.pollIntervalSeconds = tup[3]
+        sheet.smsRecipients = splitRecipients(tup[4])
+        sheet.emailRecipients = splitRecipients(tup[5])
+        sheet.isActive = (str(tup[6]) == "1")
+        sheets.append(sheet)
+    return sheets
+
+
+def getUrls(sheetId=None):
+    """
+    Returns a list of str, each str containing an active URL, earliest
+    first.
+
+    Arguments:
+    sheetId - str ID of the sheet whose URLs are returned.  If None, the
+              URLs of all active sheets are returned, each once.
+    """
+
+    urls = []
+
+    # Get list of active URLs from the database.
+    activeInd = "1"
+    if sheetId is None:
+        values = (activeInd, activeInd)
+        cursor.execute("select * from urls where " + \
+                       "active_ind = ? " + \
+                       "and sheet_id in (select sheet_id from sheets " + \
+                       "where active_ind = ?) " + \
+                       "order by crte_utc_dttm asc",
+                       values)
+    else:
+        values = (sheetId, activeInd)
+        cursor.execute("select * from urls where " + \
+                       "sheet_id = ? and active_ind = ? " + \
+                       "order by crte_utc_dttm asc",
+                       values)
+    tups = cursor.fetchall()
+    log.debug("Fetched " + str(len(tups)) + \
+              " rows from the 'urls' database table.")
+
+    if len(tups) == 0 and sheetId is not None:
+        log.warning("No active URLs were found in the database for " + \
+                    "sheet '" + sheetId + "'.  Please investigate.")
+        return urls
+    if len(tups) == 0:
+        log.error("No active URLs were found in the database.  " + \
+                  "Please investigate.")
+        shutdown(1)
+
+    for tup in tups:
+        log.debug("Looking at 'urls' row: " + str(tup))
+        crteUtcDttm = tup[0]
+        updUtcDttm = tup[1]
+        url = tup[2]
+        activeInd = tup[3]
+
+        if url not in urls:
+            urls.append(url)
+
+    #log.debug("List of active URLs is: " + str(urls))
+    return urls
+
+
+def getUrlOwner(url, workerIds):
+    """
+    Returns the str worker ID, out of the given ones, that should poll the
+    given URL.  Each URL goes to the worker with the highest hash of the
+    worker ID and URL (rendezvous hashing), so when a worker joins or
+    leaves, only the URLs it gains or loses move.
+    """
+
+    def score(workerId):
+        return hashlib.sha1((workerId + "|" + url).encode("UTF-8")).digest()
+
+    return max(workerIds, key=score)
+
+
+def claimUrlLeases(urls):
+    """
+    Records the heartbeat of this worker, and leases to it its share of the
+    given URLs.  A URL is only taken over from another worker once that
+    worker's lease has expired, and a URL that now belongs to another
+    worker is released.
+
+    When WORKER_ID is not set, this process polls every URL.
+
+    Arguments:
+    urls - list of str, each str containing an active URL.
+
+    Returns:
+    list of str containing the URLs this worker should poll, in the order
+    given.
+    """
+
+    if WORKER_ID is None:
+        return urls
+
+    now = time.time()
+    nowUtcDttm = datetime.datetime.utcfromtimestamp(now).isoformat()
+    cursor.execute("insert or replace into workers values (?, ?, ?)",
+                   (WORKER_ID, now, nowUtcDttm))
+    cursor.execute("select worker_id from workers where " + \
+                   "heartbeat_timestamp >= ? order by worker_id",
+                   (now - URL_LEASE_SECONDS,))
+    workerIds = [tup[0] for tup in cursor.fetchall()]
+
+    cursor.execute("select url, worker_id, expiry_timestamp from leases")
+    leaseByUrl = {}
+    for tup in cursor.fetchall():
+        leaseByUrl[tup[0]] = tup
+
+    ownedUrls = []
+    for url in urls:
+        lease = leaseByUrl.get(url)
+        if getUrlOwner(url, workerIds) != WORKER_ID:
+            if lease is not None and lease[1] == WORKER_ID:
+                log.info("Releasing URL to another worker: " + url)
+                cursor.execute("delete from leases where url = ? " + \
+                               "and worker_id = ?", (url, WORKER_ID))
+            continue
+
+        if lease is None:
+            cursor.execute("insert into leases values (?, ?, ?, ?)",
+                           (url, WORKER_ID, now + URL_LEASE_SECONDS,
+                            nowUtcDttm))
+        elif lease[1] == WORKER_ID or lease[2] < now:
+            if lease[1] != WORKER_ID:
+                log.info("Taking over URL from worker " + str(lease[1]) + \
+                         ", whose lease expired: " + url)
+            cursor.execute("update leases set worker_id = ?, " + \
+                           "expiry_timestamp = ?, upd_utc_dttm = ? " + \
+                           "where url = ?",
+                           (WORKER_ID, now + URL_LEASE_SECONDS, nowUtcDttm,
+                            url))
+        else:
+            log.debug("URL is still leased to worker " + str(lease[1]) + \
+                      ": " + url)
+            continue
+        ownedUrls.append(url)
+    conn.commit()
+
+    log.info("Worker " + WORKER_ID + " polls " + str(len(ownedUrls)) + \
+             " of " + str(len(urls)) + " URLs (" + str(len(workerIds)) + \
+             " live workers).")
+    return ownedUrls
+
+
+def releaseUrlLeases():
+    """
+    Releases the URL leases and heartbeat of this worker, so that other
+    workers take over its URLs right away instead of when the leases
+    expire.
+    """
+
+    if WORKER_ID is None or conn is None:
+        return
+
+    try:
+        cursor.execute("delete from leases where worker_id = ?",
+                       (WORKER_ID,))
+        cursor.execute("delete from workers where worker_id = ?",
+                       (WORKER_ID,))
+        conn.commit()
+    except sqlite3.Error as e:
+        log.warning("Could not release the URL leases of worker " + \
+                    WORKER_ID + ": " + str(e))
+
+
+def claimAlertEvents(shifts):
+    """
+    Records the alert event of each given shift, and returns the shifts
+    whose event was not recorded before, by this or any other worker.
+    Only those should be alerted.
+
+    Arguments:
+    shifts - list of Shift objects, as returned by
+             getNewShiftsAvailableForSignup().
+
+    Returns:
+    list of Shift objects to alert.
+    """
+
+    crteUtcDttm = datetime.datetime.utcnow().isoformat()
+    claimedShifts = []
+    for shift in shifts:
+        cursor.execute("insert or ignore into alert_events " + \
+                       "values (?, ?, ?)",
+                       (shift.alertEventKey, crteUtcDttm, WORKER_ID))
+        if cursor.rowcount == 1:
+            claimedShifts.append(shift)
+        else:
+            log.info("Alert already sent for: " + str(shift))
+    conn.commit()
+    return claimedShifts
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "updateActiveUrlsFromHtml"})
+def updateActiveUrlsFromHtml(htmlTup, isFirstURL, sheetId=DEFAULT_SHEET_ID,
+                             baseUrl=None, soup=None):
+    """
+    Reads the input html str, and from the contents, does the following:
+
+      - Determines the URLs that should be active.
+      - Determines the URLs that should not be active.
+      - Update the database table 'urls' to be representative of the
+        desired active and inactive URLs.
+
+    Arguments:
+
+    htmlTup - tuple containing two or three entries.
+        First entry is the URL
+        Second entry is the HTML text to parse.
+        Optional third entry is the time.time() the HTML was fetched.
+
+    isFirstURL - bool containing True if it is the
+                 earliest active URL of the sheet.
+
+    sheetId - str ID of the sheet the page belongs to.
+
+    baseUrl - str containing the URL the page names in the nav tabs are
+              relative to.  Defaults to lcplcommon.baseUrl.
+
+    soup - BeautifulSoup of the HTML, as returned by lcplparse.parseHtml(),
+           if already parsed.
+    """
+
+    url = htmlTup[0]
+    html = htmlTup[1]
+    fetchTimestamp = None
+    if len(htmlTup) > 2:
+        fetchTimestamp = htmlTup[2]
+
+    log.debug("URL is: " + url)
+
+    if soup is None:
+        soup = lcplparse.parseHtml(html)
+    mainTable = lcplparse.findMainTable(soup)
+    navTabs = lcplparse.findNavTabs(soup)
+
+    # The nav tab URLs are only needed when the page is still active.
+    navTabUrls = None
+    if mainTable is not None and navTabs is not None:
+        navTabUrls = lcplparse.getNavTabUrls(navTabs, url, html, baseUrl)
+
+    updateActiveUrls(url, html, fetchTimestamp, isFirstURL,
+                     mainTable is not None, navTabUrls, sheetId)
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "updateActiveUrlsFromJson"})
+def updateActiveUrlsFromJson(jsonTup, isFirstURL, sheetId=DEFAULT_SHEET_ID,
+                             baseUrl=None, page=None):
+    """
+    Same as updateActiveUrlsFromHtml(), for a page read from the JSON API
+    (see lcplsource.py).
+
+    Arguments:
+
+    jsonTup - tuple containing two or three entries.
+        First entry is the URL
+        Second entry is the JSON text to parse.
+        Optional third entry is the time.time() the JSON was fetched.
+
+    isFirstURL - bool containing True if it is the
+                 earliest active URL of the sheet.
+
+    sheetId - str ID of the sheet the page belongs to.
+
+    baseUrl - str containing the URL the page names of the tabs are
+              relative to.  Defaults to lcplcommon.baseUrl.
+
+    page - dict of the page, as returned by lcplparse.parseJson(), if
+           already parsed.
+    """
+
+    url = jsonTup[0]
+    text = jsonTup[1]
+    fetchTimestamp = None
+    if len(jsonTup) > 2:
+        fetchTimestamp = jsonTup[2]
+
+    log.debug("URL is: " + url)
+
+    if page is None:
+        page = lcplparse.parseJson(text)
+
+    isOpen = page is not None and page["isOpen"]
+    navTabUrls = None
+    if isOpen:
+        navTabUrls = lcplparse.getNavTabUrlsFromJson(page, baseUrl)
+
+    updateActiveUrls(url, text, fetchTimestamp, isFirstURL, isOpen,
+                     navTabUrls, sheetId)
+
+
+def updateActiveUrls(url, html, fetchTimestamp, isFirstURL, hasShiftsTable,
+                     navTabUrls, sheetId=DEFAULT_SHEET_ID):
+    """
+    Updates the database table 'urls' from what was found in a page:
+    the page's URL is set to inactive if it is the earliest active URL of
+    the sheet and the page no longer has shifts or tabs, and the URLs of
+    the tabs are set to active.
+
+    Arguments:
+
+    url - str containing the URL of the page.
+
+    html - str containing the text of the page, for captures.
+
+    fetchTimestamp - float time.time() the page was fetched, or None.
+
+    isFirstURL - bool containing True if it is the
+                 earliest active URL of the sheet.
+
+    hasShiftsTable - bool containing True if the page has the shifts.
+
+    navTabUrls - list of str URLs of the tabs of the page, or None if the
+                 page has no tabs.
+
+    sheetId - str ID of the sheet the page belongs to.
+    """
+
+    if (not hasShiftsTable or navTabUrls is None) and isFirstURL == True:
+        # URL should be set to inactive.
+        #
+        # Could not find a HTML table with class SUGtableouter
+        # which is our main table which contains all the shifts.
+        # Since this is the first URL for this iteration of
+        # parsing URLs, this URL will be marked as inactive in
+        # future loops.  If further investigation is desired,
+        # please see the HTML log for the HTML encountered.
+        #
+        log.debug("URL is active and should be inactive.")
+        log.info("Setting URL to inactive: " + url)
+        captureHtml("urlDeactivated", url, html, logging.INFO, force=True,
+                    fetchTimestamp=fetchTimestamp)
+        updUtcDttm = datetime.datetime.utcnow().isoformat()
+        activeInd = "0"
+        values = (updUtcDttm, activeInd, sheetId, url)
+        cursor.execute("update urls set upd_utc_dttm = ?, active_ind = ? " + \
+                       "where sheet_id = ? and url = ?",
+                        values)
+        cursor.execute("delete from current_shifts where " + \
+                       "sheet_id = ? and url = ?",
+                       (sheetId, url))
+        conn.commit()
+        metricsRegistry.incrementCounter("lcplpagesubs_db_writes_total",
+                                         labels={"table": "urls"})
+        log.info("Done setting URL to inactive.")
+
+    elif hasShiftsTable:
+        # URL is still active.
+        log.debug("Found mainTable, therefore this URL is still active.")
+        log.debug("Now examining URLs in the nav tabs ...")
+
+        # Get URLs from the page.
+        if navTabUrls is None:
+            log.error("Could not find a <ul> element with CSS class " + \
+                      "'nav-tabs' when one was expected.  " + \
+                      "Please investigate further.  " + \
+                      "HTML will be logged to the HTML log.")
+            captureHtml("noNavTabs", url, html, logging.ERROR, force=True,
+                        fetchTimestamp=fetchTimestamp)
+            shutdown(1)
+        else:
+            for navTabUrl in navTabUrls:
+                values = (sheetId, navTabUrl)
+
+                cursor.execute("select * from urls where " + \
+                               "sheet_id = ? and url = ? " + \
+                               "order by upd_utc_dttm desc limit 1",
+                               values)
+
+                tups = cursor.fetchall()
+
+                if len(tups) == 0:
+                    # Initial time seeing this URL.
+                    log.debug("Initial time seeing this URL.")
+                    log.info("Setting URL to active: " + navTabUrl)
+                    crteUtcDttm = datetime.datetime.utcnow().isoformat()
+                    updUtcDttm = crteUtcDttm
+                    activeInd = "1"
+                    values = (crteUtcDttm, updUtcDttm, navTabUrl, activeInd,
+                              sheetId)
+                    cursor.execute("insert into urls (crte_utc_dttm, " + \
+                                   "upd_utc_dttm, url, active_ind, " + \
+                                   "sheet_id) values (?, ?, ?, ?, ?)",
+                                   values)
+                    conn.commit()
+                    metricsRegistry.incrementCounter(
+                        "lcplpagesubs_db_writes_total",
+                        labels={"table": "urls"})
+                    log.info("Done setting URL to active.")
+
+                elif len(tups) == 1:
+                    # URL was stored previously.
+                    log.debug("URL was stored previously.")
+                    tup = tups[0]
+                    activeIndColumn = 3
+                    activeInd = tup[activeIndColumn]
+                    if str(activeInd) == "1":
+                        log.debug("URL is active and should stay active.")
+                    elif str(activeInd) == "0":
+                        log.debug("URL is inactive and should be active.")
+                        log.info("Setting URL to active: " + navTabUrl)
+
+                        updUtcDttm = datetime.datetime.utcnow().isoformat()
+                        activeInd = "1"
+                        values = (updUtcDttm, activeInd, sheetId, navTabUrl)
+                        cursor.execute("update urls set " + \
+                                        "upd_utc_dttm = ?, " + \
+                                        "active_ind = ? " + \
+                                        "where sheet_id = ? and url = ?",
+                                        values)
+                        conn.commit()
+                        materializeCurrentShifts(sheetId, navTabUrl)
+                        metricsRegistry.incrementCounter(
+                            "lcplpagesubs_db_writes_total",
+                            labels={"table": "urls"})
+                        log.info("Done setting URL to active.")
+                    else:
+                        log.error("Unknown activeInd encountered: " +
+                                    str(activeInd))
+                        shutdown(1)
+                else:
+                    log.error("Unexpected number of rows for urls.  " + \
+                              "len(tups) == " + str(len(tups)))
+                    shutdown(1)
+
+    else:
+        log.debug("After examining the HTML for this page, we determined " + \
+                  "there's no need to take any action updating any URLs " + \
+                  "to active status or to inactive status.")
+
+
+def getSignUpEventTimestamps(lookbackSeconds):
+    """
+    Returns a list of float time.time() timestamps, each when shifts of a
+    page became available for signup, within the last lookbackSeconds.
+    Shifts of the same page found in the same minute count as one event
+    (e.g. a new page with many open shifts).  The first hour of the
+    database is left out, since every open shift is new then.
+    """
+
+    cursor.execute("select min(crte_utc_dttm) from shifts")
+    firstCrteUtcDttm = cursor.fetchone()[0]
+    if firstCrteUtcDttm is None:
+        return []
+    firstTimestamp = calendar.timegm(
+        datetime.datetime.fromisoformat(firstCrteUtcDttm).timetuple())
+    startTimestamp = max(firstTimestamp + 3600, time.time() - lookbackSeconds)
+    startUtcDttm = \
+        datetime.datetime.utcfromtimestamp(startTimestamp).isoformat()
+
+    # 'YYYY-MM-DDTHH:MM' is the first 16 characters of crte_utc_dttm.
+    cursor.execute("select distinct url, " + \
+                   "substr(crte_utc_dttm, 1, 16) from shifts " + \
+                   "where status = ? and crte_utc_dttm >= ?",
+                   ("SIGN UP", startUtcDttm))
+    timestamps = []
+    for tup in cursor.fetchall():
+        timestamps.append(calendar.timegm(
+            datetime.datetime.strptime(tup[1], "%Y-%m-%dT%H:%M").timetuple()))
+    return timestamps
+
+
+def getDatabaseWatermark():
+    """
+    Returns a JSON-serializable dict that changes whenever a row of the
+    'sheets', 'urls' or 'shifts' tables is written.  A checkpoint of cached
+    database state is only valid if the watermark has not changed since.
+    """
+
+    cursor.execute("select max(rowid), count(*) from shifts")
+    (shiftsMaxRowid, numShifts) = cursor.fetchone()
+    cursor.execute("select max(upd_utc_dttm), count(*) from urls")
+    (urlsMaxUpdUtcDttm, numUrls) = cursor.fetchone()
+    cursor.execute("select max(upd_utc_dttm), count(*) from sheets")
+    (sheetsMaxUpdUtcDttm, numSheets) = cursor.fetchone()
+    return {
+        "databaseFilename": os.path.abspath(databaseFilename),
+        "shiftsMaxRowid": shiftsMaxRowid,
+        "numShifts": numShifts,
+        "urlsMaxUpdUtcDttm": urlsMaxUpdUtcDttm,
+        "numUrls": numUrls,
+        "sheetsMaxUpdUtcDttm": sheetsMaxUpdUtcDttm,
+        "numSheets": numSheets,
+        }
+
+
+def getCacheState():
+    """
+    Returns a JSON-serializable dict of the cached latest shift statuses,
+    for a checkpoint (see lcplcheckpoint.py).
+    """
+
+    latestShiftStatuses = []
+    for (key, value) in latestShiftStatusByKey.items():
+        latestShiftStatuses.append(list(key) + list(value))
+    return {"latestShiftStatuses": latestShiftStatuses}
+
+
+def restoreCacheState(state):
+    """
+    Restores the cached latest shift statuses from a dict returned by
+    getCacheState().
+    """
+
+    latestShiftStatusByKey.clear()
+    for entry in state.get("latestShiftStatuses", []):
+        (sheetId, url, rowNumber, status, crteUtcDttm) = entry
+        latestShiftStatusByKey[(sheetId, url, rowNumber)] = \
+            (status, crteUtcDttm)
+
+
+def forgetLatestStatuses(url):
+    """
+    Forgets the cached latest statuses of the shifts of the given URL, e.g.
+    after another worker polled it.
+    """
+
+    for key in [key for key in latestShiftStatusByKey if key[1] == url]:
+        del latestShiftStatusByKey[key]
+
+
+def setCurrentShiftStatus(shift, updUtcDttm):
+    """
+    Sets the status of the given shift in table 'current_shifts', in the
+    transaction that inserts it into table 'shifts'.  The caller commits.
+    """
+
+    cursor.execute("insert or replace into current_shifts " + \
+                   "(sheet_id, url, row_number, status, upd_utc_dttm) " + \
+                   "values (?, ?, ?, ?, ?)",
+                   (shift.sheetId, shift.url, int(shift.rowNumber),
+                    shift.status, updUtcDttm))
+    metricsRegistry.incrementCounter("lcplpagesubs_db_writes_total",
+                                     labels={"table": "current_shifts"})
+
+
+def recordStatusChange(shift, previousStatus, crteUtcDttm):
+    """
+    Adds an event for the change of the status of the given shift to
+    statusChangeEvents.
+
+    Arguments:
+    shift          - Shift object, with its new status.
+    previousStatus - str previous status of the shift, or None if this is
+                     the first status seen for it.
+    crteUtcDttm    - str crte_utc_dttm of the row of the new status in
+                     table 'shifts'.
+    """
+
+    statusChangeEvents.append({
+        "type": "shiftStatusChanged",
+        "utcDttm": crteUtcDttm,
+        "observedTimestamp": shift.observedTimestamp,
+        "workerId": WORKER_ID,
+        "sheetId": shift.sheetId,
+        "url": shift.url,
+        "rowNumber": shift.rowNumber,
+        "previousStatus": previousStatus,
+        "status": shift.status,
+        })
+
+
+def popStatusChangeEvents():
+    """
+    Returns the list of dicts of the events in statusChangeEvents, and
+    clears it.
+    """
+
+    events = list(statusChangeEvents)
+    del statusChangeEvents[:]
+    return events
+
+
+@metricsRegistry.timed(STAGE_SECONDS_METRIC, {"stage": "getNewShiftsAvailableForSignup"})
+def getNewShiftsAvailableForSignup(currShifts):
+    """
+    This method iterates through the current shifts and
+    returns the new shifts that are available for signup.
+
+    Arguments:
+    currShifts - list of Shift objects containing the current shifts.
+
+    Returns:
+    list of Shift objects that are the new shifts available for signup.
+    """
+
+    newShiftsAvailableForSignup = []
+
+    for shift in currShifts:
+
+        key = (shift.sheetId, shift.url, shift.rowNumber)
+        latestShiftStatus = latestShiftStatusByKey.get(key)
+        if latestShiftStatus is not None:
+            # Same layout as the rows selected below.
+            tups = [(latestShiftStatus[1], shift.url, shift.rowNumber,
+                     latestShiftStatus[0])]
+        else:
+            values = (shift.sheetId,
+                      shift.url,
+                      shift.rowNumber)
+
+            cursor.execute("select * from shifts where " + \
+                    "sheet_id = ? " + \
+                    "and url = ? " + \
+                    "and row_number = ? " + \
+                    "order by crte_utc_dttm desc limit 1",
+                    values)
+
+            tups = cursor.fetchall()
+            if len(tups) == 1:
+                latestShiftStatusByKey[key] = (tups[0][3], tups[0][0])
+
+        if len(tups) == 0:
+            # Initial status.
+            log.debug("shift.status is: " + shift.status)
+            if re.search("sign up", shift.status, re.IGNORECASE):
+                shift.alertEventKey = shift.sheetId + "|" + shift.url + \
+                    "|" + str(shift.rowNumber) + "|initial"
+                newShiftsAvailableForSignup.append(shift)
+
+            crteUtcDttm = datetime.datetime.utcnow().isoformat()
+            values = (crteUtcDttm,
+                    shift.url,
+                    shift.rowNumber,
+                    shift.status,
+                    shift.sheetId)
+            cursor.execute("insert into shifts (crte_utc_dttm, url, " + \
+                           "row_number, status, sheet_id) " + \
+                           "values (?, ?, ?, ?, ?)",
+                           values)
+            setCurrentShiftStatus(shift, crteUtcDttm)
+            conn.commit()
+            recordStatusChange(shift, None, crteUtcDttm)
+            latestShiftStatusByKey[key] = (shift.status, crteUtcDttm)
+            shift.persistedTimestamp = time.time()
+            metricsRegistry.incrementCounter("lcplpagesubs_db_writes_total",
+                                             labels={"table": "shifts"})
+
+        elif len(tups) == 1:
+            # Status was stored previously for this shift.
+            # Compare status.
+            tup = tups[0]
+            statusColumn = 3
+            oldStatus = tup[statusColumn]
+            if shift.status != oldStatus:
+                log.info("Status changed from " + oldStatus + \
+                         " to " + shift.status + " for: " + \
+                         str(shift))
+
+                if re.search("sign up", shift.status, re.IGNORECASE):
+                    # Workers that both saw this change read the same
+                    # previous row, so they derive the same key.
+                    crteUtcDttmColumn = 0
+                    shift.alertEventKey = shift.sheetId + "|" + \
+                        shift.url + "|" + str(shift.rowNumber) + "|" + \
+                        tup[crteUtcDttmColumn]
+                    newShiftsAvailableForSignup.append(shift)
+
+                crteUtcDttm = datetime.datetime.utcnow().isoformat()
+                values = (crteUtcDttm,
+                        shift.url,
+                        shift.rowNumber,
+                        shift.status,
+                        shift.sheetId)
+                cursor.execute("insert into shifts (crte_utc_dttm, url, " + \
+                               "row_number, status, sheet_id) " + \
+                               "values (?, ?, ?, ?, ?)",
+                               values)
+                setCurrentShiftStatus(shift, crteUtcDttm)
+                conn.commit()
+                recordStatusChange(shift, oldStatus, crteUtcDttm)
+                latestShiftStatusByKey[key] = (shift.status, crteUtcDttm)
+                shift.persistedTimestamp = time.time()
+                metricsRegistry.incrementCounter(
+                    "lcplpagesubs_db_writes_total",
+                    labels={"table": "shifts"})
+        else:
+            log.error("Unexpected number of rows for shift.  " + \
+                      "numRows == " + str(len(tups)) + ", shift == " + str(shift))
+            shutdown(1)
+
+    return newShiftsAvailableForSignup
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+##############################################################################
+# Sparse offset index over a log file and its rotated backups, for paging
+# through the lcplpagesubs logs without reading them whole.
+#
+# The log files can be up to 50 MB each, with 20 backups (see
+# conf/logging.conf).  Each file is split into blocks of about BLOCK_BYTES,
+# starting at log records, and the index keeps, for each block, the
+# timestamp of its first record, its byte offset and the set of levels of
+# its records.  Jumping to a time reads one block, and filtering on a level
+# skips the blocks without it.
+#
+# Files are indexed by inode, so the index of a file survives its renaming
+# by log rotation, and only the bytes appended to the current log file
+# since the last refresh are read.  The index is saved to a JSON file, so
+# it is built once, and shared by the workers of the status server.
+#
+# Positions in the logs are tuples (file key, byte offset), where the file
+# key is the str 'st_dev:st_ino' of the file.
+#
+# Usage:
+#   python3 src/logindex.py logs/lcplpagesubs.log                (stats)
+#   python3 src/logindex.py --since="2024-05-01 13:00" --level=WARNING \
+#       logs/lcplpagesubs.log
+##############################################################################
+
+import os
+import sys
+import bisect
+import optparse
+import threading
+import monitorstate
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Number of bytes after which a new block is started, at the next record.
+BLOCK_BYTES = 64 * 1024
+
+# Maximum number of rotated backups looked for ('.1' to '.N').
+MAX_BACKUPS = 100
+
+# Maximum number of bytes read by one query, so that a filter that matches
+# nothing does not read every log.  The query stops there and returns the
+# position it reached, to continue from.
+MAX_SCAN_BYTES = 16 * 1024 * 1024
+
+# Number of leading bytes of a file kept in the index, to tell a file from
+# another one that got the inode of a removed file.
+HEAD_BYTES = 64
+
+# Version of the format of the index file.
+INDEX_VERSION = 1
+
+# Bit of each level in the level masks of the blocks.  Records with another
+# level, and lines that do not start a record, have no bit.
+LEVEL_BITS = {
+    "DEBUG": 1,
+    "INFO": 2,
+    "WARNING": 4,
+    "ERROR": 8,
+    "CRITICAL": 16,
+    }
+
+# Length of the timestamp at the start of a record, e.g.
+# '2024-05-01 13:00:00.123', followed by ' - LEVEL - '.
+DTTM_LENGTH = 23
+SEPARATOR = b" - "
+
+##############################################################################
+# Classes
+##############################################################################
+
+class LogIndex:
+    """
+    Sparse index of a log file and its rotated backups.  Thread-safe.
+    """
+
+    def __init__(self, logFilename, indexFilename=None,
+                 blockBytes=BLOCK_BYTES):
+        """
+        Arguments:
+        logFilename   - str path of the current log file.  Its backups are
+                        logFilename + '.1' (the newest) to '.N'.
+        indexFilename - str path of the file the index is saved to, or None
+                        to keep it in memory only.
+        blockBytes    - int number of bytes after which a new block starts.
+        """
+
+        self.logFilename = logFilename
+        self.indexFilename = indexFilename
+        self.blockBytes = blockBytes
+        self.lock = threading.Lock()
+
+        # Dict of file key to a dict with keys:
+        #   'head'          - str of the first HEAD_BYTES bytes of the file.
+        #   'indexedOffset' - int offset of the end of the last complete
+        #                     line indexed.
+        #   'blocks'        - list of lists [dttm, offset, levelMask], by
+        #                     offset.  dttm is None for a block without
+        #                     records.
+        self.entriesByKey = {}
+        self.indexFileMtime = None
+
+        # List of tuples (file key, filename, entry) of the files of the
+        # last refresh, oldest first.
+        self.files = []
+
+    def getFilenames(self):
+        """
+        Returns the list of str paths of the existing log files, oldest
+        first.
+        """
+
+        filenames = []
+        for i in range(MAX_BACKUPS, 0, -1):
+            filename = self.logFilename + "." + str(i)
+            if os.path.isfile(filename):
+                filenames.append(filename)
+        if os.path.isfile(self.logFilename):
+            filenames.append(self.logFilename)
+        return filenames
+
+    def _loadIndexFile(self):
+        """
+        Reloads the saved index, if another process saved it since it was
+        last loaded.
+        """
+
+        if self.indexFilename is None:
+            return
+        try:
+            mtime = os.path.getmtime(self.indexFilename)
+        except OSError:
+            return
+        if mtime == self.indexFileMtime:
+            return
+        saved = monitorstate.readJsonFile(self.indexFilename)
+        self.indexFileMtime = mtime
+        if not isinstance(saved, dict) or \
+                saved.get("version") != INDEX_VERSION or \
+                saved.get("blockBytes") != self.blockBytes:
+            return
+        for (key, entry) in saved.get("files", {}).items():
+            current = self.entriesByKey.get(key)
+            if current is None or \
+                    current["indexedOffset"] < entry["indexedOffset"]:
+                self.entriesByKey[key] = entry
+
+    def _saveIndexFile(self):
+        if self.indexFilename is None:
+            return
+        try:
+            monitorstate.writeJsonFileAtomically(
+                self.indexFilename,
+                {"version": INDEX_VERSION, "blockBytes": self.blockBytes,
+                 "files": self.entriesByKey})
+            self.indexFileMtime = os.path.getmtime(self.indexFilename)
+        except OSError:
+            # The index is rebuilt from the logs if it cannot be saved.
+            pass
+
+    def refresh(self):
+        """
+        Indexes the log files as they are now: new files, and the bytes
+        appended to known ones.  Forgets the files that were removed.
+
+        Returns:
+        list of tuples (file key, filename, entry) of the files, oldest
+        first.
+        """
+
+        with self.lock:
+            self._loadIndexFile()
+            isChanged = False
+            files = []
+            for filename in self.getFilenames():
+                try:
+                    with open(filename, "rb") as f:
+                        st = os.fstat(f.fileno())
+                        key = str(st.st_dev) + ":" + str(st.st_ino)
+                        head = f.read(HEAD_BYTES).decode("UTF-8",
+                                                         errors="replace")
+                        entry = self.entriesByKey.get(key)
+                        if entry is None or \
+                                not head.startswith(entry["head"]) or \
+                                st.st_size < entry["indexedOffset"]:
+                            entry = {"head": "", "indexedOffset": 0,
+                                     "blocks": []}
+                        if entry["indexedOffset"] < st.st_size:
+                            # Extend a copy, since readers may be using the
+                            # entry of the last refresh.
+                            entry = {"head": entry["head"],
+                                     "indexedOffset": entry["indexedOffset"],
+                                     "blocks": [list(block) for block in
+                                                entry["blocks"]]}
+                            self._indexFile(f, entry, st.st_size)
+                            entry["head"] = head
+                            isChanged = True
+                except OSError:
+                    # The file was rotated away while being listed.
+                    continue
+                self.entriesByKey[key] = entry
+                files.append((key, filename, entry))
+
+            keys = set(key for (key, filename, entry) in files)
+            for key in list(self.entriesByKey):
+                if key not in keys:
+                    del self.entriesByKey[key]
+                    isChanged = True
+            if isChanged:
+                self._saveIndexFile()
+            self.files = files
+            return files
+
+    def _indexFile(self, f, entry, size):
+        """
+        Extends the blocks of the given entry with the complete lines of
+        the open file f from entry['indexedOffset'] up to size.
+        """
+
+        blocks = entry["blocks"]
+        offset = entry["indexedOffset"]
+        f.seek(offset)
+        remainder = b""
+        while offset + len(remainder) < size:
+            data = f.read(min(BLOCK_BYTES, size - offset - len(remainder)))
+            if len(data) == 0:
+                break
+            lines = (remainder + data).split(b"\n")
+            remainder = lines.pop()
+            for line in lines:
+                dttm, level = parseRecordStart(line)
+                if dttm is not None:
+                    if len(blocks) == 0 or \
+                            offset - blocks[-1][1] >= self.blockBytes:
+                        blocks.append([dttm, offset, 0])
+                    elif blocks[-1][0] is None:
+                        blocks[-1][0] = dttm
+                    blocks[-1][2] |= LEVEL_BITS.get(level, 0)
+                elif len(blocks) == 0:
+                    # Lines before the first record.
+                    blocks.append([None, offset, 0])
+                offset += len(line) + 1
+        entry["indexedOffset"] = offset
+
+    def getFileIndex(self, files, key):
+        """
+        Returns the int index in the given list of files (see refresh()) of
+        the file with the given key.  Raises ValueError if it is no longer
+        among the log files.
+        """
+
+        for i in range(len(files)):
+            if files[i][0] == key:
+                return i
+        raise ValueError("The log file of the position was removed.")
+
+    def getEndPosition(self):
+        """
+        Returns the position of the end of the indexed logs, or None if
+        there are no log files.
+        """
+
+        files = self.files
+        if len(files) == 0:
+            return None
+        key, filename, entry = files[-1]
+        return (key, entry["indexedOffset"])
+
+    def findPosition(self, dttm):
+        """
+        Returns the position of the start of the block holding the first
+        record at or after the given timestamp str (or a prefix of one,
+        such as '2024-05-01 13'), or None if there are no log files.
+        """
+
+        position = None
+        for (key, filename, entry) in self.files:
+            dttms = [block[0] or "" for block in entry["blocks"]]
+            i = bisect.bisect_left(dttms, dttm)
+            if i == 0:
+                if position is None:
+                    position = (key, 0)
+                return position
+            position = (key, entry["blocks"][i - 1][1])
+            if i < len(dttms):
+                return position
+        return position
+
+    def readRecords(self, position, isForward, maxNumRecords, levelMask=None,
+                    sinceDttm=None, untilDttm=None,
+                    maxScanBytes=MAX_SCAN_BYTES):
+        """
+        Reads the records from the given position, forward or backward.
+        Only the blocks that may hold wanted records are read: blocks
+        without records of the wanted levels are skipped, as are blocks
+        starting after untilDttm when reading backward.
+
+        Arguments:
+        position      - tuple (file key, offset) of a record start, e.g. a
+                        position returned by this method.
+        isForward     - True to read the records after the position, oldest
+                        first, False for the records before it, newest
+                        first.
+        maxNumRecords - int maximum number of records returned.
+        levelMask     - int mask of LEVEL_BITS of the records wanted, or
+                        None for all records.
+        sinceDttm     - str timestamp (prefix) before which records are
+                        skipped, or None.  Reading backward stops there.
+        untilDttm     - str timestamp (prefix) after which records are
+                        skipped, or None.  Reading forward stops there.
+        maxScanBytes  - int maximum number of bytes read.
+
+        Returns:
+        tuple (list of record dicts, position reached).  Reading again from
+        the position reached, in the same direction, continues where this
+        read stopped.  Each record dict has keys 'dttm', 'level', 'text'
+        (the lines of the record, continuation lines included), 'start' and
+        'end' (the positions of the record).
+
+        Raises ValueError if the file of the position was removed.
+        """
+
+        files = self.files
+        records = []
+        key, offset = position
+        fileIndex = self.getFileIndex(files, key)
+        numScanBytes = 0
+        while True:
+            key, filename, entry = files[fileIndex]
+            blocks = entry["blocks"]
+            blockIndexes = range(len(blocks))
+            if not isForward:
+                blockIndexes = reversed(blockIndexes)
+            with open(filename, "rb") as f:
+                for i in blockIndexes:
+                    blockDttm, start, blockMask = blocks[i]
+                    end = entry["indexedOffset"]
+                    if i + 1 < len(blocks):
+                        end = blocks[i + 1][1]
+                    if isForward and end <= offset or \
+                            not isForward and start >= offset:
+                        continue
+                    if isForward:
+                        start = max(start, offset)
+                    else:
+                        end = min(end, offset)
+
+                    if levelMask is not None and blockMask & levelMask == 0 \
+                            or not isForward and untilDttm is not None and \
+                            blockDttm is not None and \
+                            blockDttm[:len(untilDttm)] > untilDttm:
+                        offset = end if isForward else start
+                        continue
+                    if len(records) >= maxNumRecords or \
+                            numScanBytes >= maxScanBytes:
+                        return (records, (key, offset))
+
+                    f.seek(start)
+                    blockRecords = parseRecords(f.read(end - start), key,
+                                                start)
+                    numScanBytes += end - start
+                    if not isForward:
+                        blockRecords.reverse()
+                    for record in blockRecords:
+                        if len(records) >= maxNumRecords:
+                            return (records, (key, offset))
+                        dttm = record["dttm"]
+                        if dttm is not None:
+                            if isForward and untilDttm is not None and \
+                                    dttm[:len(untilDttm)] > untilDttm:
+                                return (records, (key, offset))
+                            if not isForward and sinceDttm is not None and \
+                                    dttm < sinceDttm:
+                                return (records, (key, offset))
+                        offset = record["end"][1] if isForward \
+                            else record["start"][1]
+                        if levelMask is not None and \
+                                LEVEL_BITS.get(record["level"], 0) & \
+                                levelMask == 0:
+                            continue
+                        if dttm is not None and (
+                                sinceDttm is not None and
+                                dttm < sinceDttm or
+                                untilDttm is not None and
+                                dttm[:len(untilDttm)] > untilDttm):
+                            continue
+                        records.append(record)
+
+            nextFileIndex = fileIndex + 1 if isForward else fileIndex - 1
+            if not 0 <= nextFileIndex < len(files):
+                return (records, (key, offset))
+            fileIndex = nextFileIndex
+            key = files[fileIndex][0]
+            offset = 0 if isForward \
+                else files[fileIndex][2]["indexedOffset"]
+
+    def getStats(self):
+        """
+        Returns a dict of stats about the index.
+        """
+
+        files = self.files
+        numBytes = 0
+        numBlocks = 0
+        for (key, filename, entry) in files:
+            numBytes += entry["indexedOffset"]
+            numBlocks += len(entry["blocks"])
+        return {
+            "files": len(files),
+            "bytes": numBytes,
+            "blocks": numBlocks,
+            }
+
+##############################################################################
+# Methods
+##############################################################################
+
+def parseRecordStart(line):
+    """
+    Returns a tuple (dttm str, level str) of the given bytes line if it
+    starts a log record, or (None, None) if it is a continuation line
+    (e.g. of a traceback).
+    """
+
+    if len(line) < DTTM_LENGTH + 4 or \
+            line[DTTM_LENGTH:DTTM_LENGTH + 3] != SEPARATOR or \
+            not line[:4].isdigit():
+        return (None, None)
+    levelEnd = line.find(SEPARATOR, DTTM_LENGTH + 3)
+    if levelEnd == -1:
+        levelEnd = len(line)
+    return (line[:DTTM_LENGTH].decode("ascii", errors="replace"),
+            line[DTTM_LENGTH + 3:levelEnd].decode("ascii", errors="replace"))
+
+
+def parseRecords(data, key, offset):
+    """
+    Returns a list of record dicts (see LogIndex.readRecords()) of the
+    complete lines of the given bytes, read at the given offset of the
+    file with the given key.
+    """
+
+    records = []
+    lines = data.split(b"\n")
+    lines.pop()
+    for line in lines:
+        dttm, level = parseRecordStart(line)
+        text = line.decode("UTF-8", errors="replace")
+        if dttm is None and len(records) > 0:
+            records[-1]["text"] += "\n" + text
+            records[-1]["end"] = (key, offset + len(line) + 1)
+        else:
+            records.append({"dttm": dttm, "level": level, "text": text,
+                            "start": (key, offset),
+                            "end": (key, offset + len(line) + 1)})
+        offset += len(line) + 1
+    return records
+
+
+def getLevelMask(minLevel):
+    """
+    Returns the int mask of LEVEL_BITS of the given level and the levels
+    above it.  Raises ValueError for an unknown level.
+    """
+
+    minLevel = minLevel.upper()
+    if minLevel not in LEVEL_BITS:
+        raise ValueError("Unknown level: " + minLevel + ".  Expected " +
+                         "one of: " + ", ".join(LEVEL_BITS))
+    levelMask = 0
+    for (level, bit) in LEVEL_BITS.items():
+        if bit >= LEVEL_BITS[minLevel]:
+            levelMask |= bit
+    return levelMask
+
+##############################################################################
+# Main
+##############################################################################
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] LOG_FILE")
+    parser.add_option("--since",
+                      help="Print the records from this time on")
+    parser.add_option("--level",
+                      help="Print the records of this level and above")
+    parser.add_option("-n", "--limit", type="int", default=100,
+                      help="Print at most this many records " +
+                           "[default %default]")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 2
+
+    logIndex = LogIndex(args[0])
+    logIndex.refresh()
+    if options.since is None and options.level is None:
+        print(logIndex.getStats())
+        return 0
+
+    levelMask = None
+    if options.level is not None:
+        levelMask = getLevelMask(options.level)
+    if options.since is not None:
+        position = logIndex.findPosition(options.since)
+        records, position = logIndex.readRecords(
+            position, True, options.limit, levelMask, options.since)
+    else:
+        records, position = logIndex.readRecords(
+            logIndex.getEndPosition(), False, options.limit, levelMask)
+        records.reverse()
+    for record in records:
+        print(record["text"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
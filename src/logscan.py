@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+##############################################################################
+# Helpers for scanning the lcplpagesubs log files backwards.
+#
+# The log files can be up to 50 MB each (see conf/logging.conf), so they are
+# read from the end in fixed-size blocks, and scanning stops as soon as the
+# wanted lines are found.
+##############################################################################
+
+import os
+import threading
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Number of bytes read per seek when scanning a file backwards.
+BLOCK_SIZE = 64 * 1024
+
+# Text that identifies the startup log line written by lcplpagesubs.py.
+STARTUP_MARKER = "Starting Page Shifts Monitor For LCPL"
+
+# Text that identifies the shutdown log line written by lcplpagesubs.py.
+SHUTDOWN_MARKER = "Shutdown"
+SHUTDOWN_RC_MARKER = "rc="
+
+# Maximum number of files remembered in the scan cache.
+MAX_CACHE_ENTRIES = 512
+
+# Cache of per-file scan results.
+# Key is the tuple (st_dev, st_ino) so that a result survives the log file
+# being renamed by log rotation.  Value is a dict with keys:
+#   'mtime', 'size', 'scannedOffset', 'startupDttm', 'shutdownDttm'
+_scanCache = {}
+_scanCacheLock = threading.Lock()
+
+##############################################################################
+# Methods
+##############################################################################
+
+def reverseReadLines(filename, startOffset=0, endOffset=None,
+                     blockSize=BLOCK_SIZE):
+    """
+    Generator that yields the lines of a file from the last line to the
+    first line, reading the file backwards in blocks.  Only the blocks
+    needed for the lines consumed by the caller are read from disk.
+
+    Lines are yielded as str without the trailing newline.  If the file
+    ends with a newline, the first line yielded is an empty str.
+
+    Arguments:
+    filename    - str containing the path of the file to read.
+    startOffset - int byte offset at which to stop reading.
+    endOffset   - int byte offset at which to start reading backwards.
+                  None means the end of the file.
+    blockSize   - int number of bytes to read per seek.
+    """
+
+    with open(filename, "rb") as f:
+        if endOffset is None:
+            f.seek(0, os.SEEK_END)
+            endOffset = f.tell()
+
+        pos = endOffset
+        remainder = b""
+        while pos > startOffset:
+            readSize = min(blockSize, pos - startOffset)
+            pos -= readSize
+            f.seek(pos)
+            block = f.read(readSize) + remainder
+            lines = block.split(b"\n")
+            remainder = lines[0]
+            for i in range(len(lines) - 1, 0, -1):
+                yield lines[i].decode("UTF-8", errors="replace")
+
+        yield remainder.decode("UTF-8", errors="replace")
+
+
+def getDttmFromLogLine(line):
+    """
+    Returns the timestamp str at the start of a log line, or None
+    if the line is not in the expected format.
+    """
+
+    firstDashPos = line.find(" - ")
+    if firstDashPos == -1:
+        return None
+    return line[:firstDashPos].strip()
+
+
+def _scanForStartupAndShutdown(filename, startOffset, endOffset):
+    """
+    Scans the given byte range of a file backwards, and returns a tuple
+    (startupDttm, shutdownDttm) of the last startup and shutdown
+    timestamps found in that range.  Either may be None.
+    """
+
+    startupDttm = None
+    shutdownDttm = None
+
+    for line in reverseReadLines(filename, startOffset, endOffset):
+        if startupDttm is not None and shutdownDttm is not None:
+            break
+        if startupDttm is None and line.find(STARTUP_MARKER) != -1:
+            startupDttm = getDttmFromLogLine(line)
+        elif shutdownDttm is None and \
+                line.find(SHUTDOWN_MARKER) != -1 and \
+                line.find(SHUTDOWN_RC_MARKER) != -1:
+            shutdownDttm = getDttmFromLogLine(line)
+
+    return (startupDttm, shutdownDttm)
+
+
+def _endsWithNewline(filename, size):
+    """
+    Returns True if the last byte of the file is a newline.
+    """
+
+    if size == 0:
+        return True
+    with open(filename, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+def getLastStartupAndShutdownInFile(filename):
+    """
+    Returns a tuple (startupDttm, shutdownDttm) containing the timestamps
+    of the last startup and last shutdown log lines in the given file.
+    Either may be None if the file does not contain such a line.
+
+    Results are cached per file, keyed by inode and validated by mtime and
+    size.  If a file has only been appended to since it was last scanned,
+    only the appended bytes are scanned.
+    """
+
+    st = os.stat(filename)
+    key = (st.st_dev, st.st_ino)
+
+    with _scanCacheLock:
+        cached = _scanCache.get(key)
+
+    if cached is not None and \
+            cached["mtime"] == st.st_mtime and \
+            cached["size"] == st.st_size:
+        return (cached["startupDttm"], cached["shutdownDttm"])
+
+    startOffset = 0
+    if cached is not None and st.st_size >= cached["size"]:
+        # The file was appended to.  Only the new bytes need scanning.
+        startOffset = cached["scannedOffset"]
+    else:
+        cached = None
+
+    startupDttm, shutdownDttm = \
+        _scanForStartupAndShutdown(filename, startOffset, st.st_size)
+
+    if cached is not None:
+        if startupDttm is None:
+            startupDttm = cached["startupDttm"]
+        if shutdownDttm is None:
+            shutdownDttm = cached["shutdownDttm"]
+
+    # A partially written last line gets rescanned next time.
+    scannedOffset = startOffset
+    if _endsWithNewline(filename, st.st_size):
+        scannedOffset = st.st_size
+
+    entry = {
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "scannedOffset": scannedOffset,
+        "startupDttm": startupDttm,
+        "shutdownDttm": shutdownDttm,
+        }
+
+    with _scanCacheLock:
+        if key not in _scanCache and len(_scanCache) >= MAX_CACHE_ENTRIES:
+            _scanCache.clear()
+        _scanCache[key] = entry
+
+    return (startupDttm, shutdownDttm)
+
+
+def getLastStartupAndShutdown(filenames):
+    """
+    Returns a tuple (startupDttm, shutdownDttm) containing the timestamps
+    of the last startup and last shutdown log lines across the given
+    log files.  Either may be None if not found.
+
+    Arguments:
+    filenames - list of str, ordered from the newest log file to the oldest.
+    """
+
+    startupDttm = None
+    shutdownDttm = None
+
+    for filename in filenames:
+        if startupDttm is not None and shutdownDttm is not None:
+            break
+        try:
+            fileStartupDttm, fileShutdownDttm = \
+                getLastStartupAndShutdownInFile(filename)
+        except OSError:
+            # File was rotated away between listing and reading it.
+            continue
+        if startupDttm is None:
+            startupDttm = fileStartupDttm
+        if shutdownDttm is None:
+            shutdownDttm = fileShutdownDttm
+
+    return (startupDttm, shutdownDttm)
+
+
+def tailLines(filename, n):
+    """
+    Returns a list of str containing the last n lines of a file, in order,
+    without trailing newlines.  Only the end of the file is read.
+    """
+
+    lines = []
+    isFirstLine = True
+    for line in reverseReadLines(filename):
+        if isFirstLine:
+            isFirstLine = False
+            if line == "":
+                # File ends with a newline.
+                continue
+        if len(lines) >= n:
+            break
+        lines.append(line)
+
+    lines.reverse()
+    return lines
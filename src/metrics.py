@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+##############################################################################
+# Counters, gauges and histograms for instrumenting the monitor.
+#
+# The monitor (lcplpagesubs.py) records metrics in a MetricsRegistry and
+# periodically writes a snapshot of them to a JSON file.  The status server
+# (serverstatus.py) reads that snapshot and renders it in the Prometheus
+# text exposition format on its /metrics route.
+##############################################################################
+
+import time
+import datetime
+import functools
+import monitorstate
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Default histogram bucket upper bounds, in seconds.
+# The upper buckets cover the 60 second retry sleeps in the fetch loop.
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Histogram bucket upper bounds for sizes, in bytes.
+DEFAULT_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 131072, 262144,
+                        524288, 1048576, 4194304)
+
+##############################################################################
+# Classes
+##############################################################################
+
+class MetricsRegistry:
+    """
+    Holds the counters, gauges and histograms of one process.
+
+    Each metric is identified by name, and has one time series per
+    distinct dict of labels.
+    """
+
+    def __init__(self):
+        # Dict of name to (metricType, helpText).
+        self.descriptions = {}
+
+        # Dicts keyed by (name, labelsTuple).
+        self.counters = {}
+        self.gauges = {}
+
+        # Dict keyed by (name, labelsTuple).  Value is a dict with keys
+        # 'buckets' (tuple of upper bounds), 'bucketCounts' (list of int,
+        # non-cumulative), 'sum' and 'count'.
+        self.histograms = {}
+
+    @staticmethod
+    def _labelsTuple(labels):
+        if labels is None:
+            return ()
+        return tuple(sorted((str(k), str(v)) for (k, v) in labels.items()))
+
+    def describe(self, name, metricType, helpText):
+        """
+        Sets the type ('counter', 'gauge' or 'histogram') and help text
+        of a metric.
+        """
+
+        self.descriptions[name] = (metricType, helpText)
+
+    def incrementCounter(self, name, amount=1, labels=None):
+        key = (name, self._labelsTuple(labels))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def setGauge(self, name, value, labels=None):
+        key = (name, self._labelsTuple(labels))
+        self.gauges[key] = value
+
+    def observeHistogram(self, name, value, labels=None,
+                         buckets=DEFAULT_LATENCY_BUCKETS):
+        key = (name, self._labelsTuple(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = {
+                "buckets": tuple(buckets),
+                "bucketCounts": [0] * len(buckets),
+                "sum": 0.0,
+                "count": 0,
+                }
+            self.histograms[key] = histogram
+
+        for i in range(len(histogram["buckets"])):
+            if value <= histogram["buckets"][i]:
+                histogram["bucketCounts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def timed(self, name, labels=None):
+        """
+        Returns a decorator that observes the wall-clock duration of every
+        call of the decorated function in the named histogram.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                startTime = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observeHistogram(name,
+                                          time.perf_counter() - startTime,
+                                          labels)
+            return wrapper
+        return decorator
+
+    def toDict(self):
+        """
+        Returns a JSON-serializable snapshot of all metrics.
+        """
+
+        def series(store):
+            rv = []
+            for ((name, labelsTuple), value) in sorted(store.items()):
+                rv.append({"name": name,
+                           "labels": dict(labelsTuple),
+                           "value": value})
+            return rv
+
+        histograms = []
+        for ((name, labelsTuple), histogram) in \
+                sorted(self.histograms.items()):
+            histograms.append({"name": name,
+                               "labels": dict(labelsTuple),
+                               "buckets": list(histogram["buckets"]),
+                               "bucketCounts": list(histogram["bucketCounts"]),
+                               "sum": histogram["sum"],
+                               "count": histogram["count"]})
+
+        descriptions = {}
+        for (name, (metricType, helpText)) in self.descriptions.items():
+            descriptions[name] = {"type": metricType, "help": helpText}
+
+        return {
+            "updatedUtcDttm": datetime.datetime.utcnow().isoformat(),
+            "updatedTimestamp": time.time(),
+            "descriptions": descriptions,
+            "counters": series(self.counters),
+            "gauges": series(self.gauges),
+            "histograms": histograms,
+            }
+
+    def writeToFile(self, filename):
+        """
+        Atomically writes a snapshot of all metrics to a JSON file.
+        """
+
+        monitorstate.writeJsonFileAtomically(filename, self.toDict())
+
+##############################################################################
+# Methods
+##############################################################################
+
+def _escapeLabelValue(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatLabels(labels, extraLabels=None):
+    items = sorted(labels.items())
+    if extraLabels is not None:
+        items.extend(extraLabels)
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join(k + '="' + _escapeLabelValue(str(v)) + '"'
+                          for (k, v) in items) + "}"
+
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def renderPrometheusText(snapshot):
+    """
+    Returns a str containing the metrics snapshot (as returned by
+    MetricsRegistry.toDict()) in the Prometheus text exposition format.
+    """
+
+    descriptions = snapshot.get("descriptions", {})
+    lines = []
+    describedNames = set()
+
+    def header(name, defaultType):
+        if name in describedNames:
+            return
+        describedNames.add(name)
+        description = descriptions.get(name, {})
+        if "help" in description:
+            lines.append("# HELP " + name + " " + description["help"])
+        lines.append("# TYPE " + name + " " +
+                     description.get("type", defaultType))
+
+    for entry in snapshot.get("counters", []):
+        header(entry["name"], "counter")
+        lines.append(entry["name"] + _formatLabels(entry["labels"]) + " " +
+                     _formatValue(entry["value"]))
+
+    for entry in snapshot.get("gauges", []):
+        header(entry["name"], "gauge")
+        lines.append(entry["name"] + _formatLabels(entry["labels"]) + " " +
+                     _formatValue(entry["value"]))
+
+    for entry in snapshot.get("histograms", []):
+        name = entry["name"]
+        header(name, "histogram")
+        cumulativeCount = 0
+        for (upperBound, bucketCount) in zip(entry["buckets"],
+                                             entry["bucketCounts"]):
+            cumulativeCount += bucketCount
+            lines.append(name + "_bucket" +
+                         _formatLabels(entry["labels"],
+                                       [("le", _formatValue(upperBound))]) +
+                         " " + str(cumulativeCount))
+        lines.append(name + "_bucket" +
+                     _formatLabels(entry["labels"], [("le", "+Inf")]) +
+                     " " + str(entry["count"]))
+        lines.append(name + "_sum" + _formatLabels(entry["labels"]) + " " +
+                     _formatValue(entry["sum"]))
+        lines.append(name + "_count" + _formatLabels(entry["labels"]) + " " +
+                     str(entry["count"]))
+
+    return "\n".join(lines) + "\n"
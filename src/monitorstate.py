@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+##############################################################################
+# Reading and writing of the monitor state file.
+#
+# The monitor (lcplpagesubs.py) publishes a small JSON record describing
+# its health once per poll cycle.  The status server (serverstatus.py)
+# reads it back instead of parsing log files.
+##############################################################################
+
+import os
+import json
+import datetime
+import tempfile
+
+##############################################################################
+# Methods
+##############################################################################
+
+def writeJsonFileAtomically(filename, obj):
+    """
+    Writes the given object as JSON to a file.  The data is written to a
+    temporary file in the same directory, which is then renamed over the
+    destination, so readers never see a partially written file.
+
+    Arguments:
+    filename - str containing the path of the file to write.
+    obj      - JSON-serializable object.
+    """
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpFilename = tempfile.mkstemp(dir=dirname,
+                                       prefix=".tmp-",
+                                       suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="UTF-8") as f:
+            json.dump(obj, f, indent=2, sort_keys=True)
+        os.replace(tmpFilename, filename)
+    except BaseException:
+        try:
+            os.remove(tmpFilename)
+        except OSError:
+            pass
+        raise
+
+
+def readJsonFile(filename):
+    """
+    Returns the object stored as JSON in the given file, or None if the
+    file does not exist or could not be parsed.
+    """
+
+    try:
+        with open(filename, "r", encoding="UTF-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def writeStateFile(filename, state):
+    """
+    Writes the monitor state dict to the state file.
+    """
+
+    writeJsonFileAtomically(filename, state)
+
+
+def readStateFile(filename):
+    """
+    Returns the monitor state dict from the state file, or None if there
+    is no readable state file.
+    """
+
+    state = readJsonFile(filename)
+    if not isinstance(state, dict):
+        return None
+    return state
+
+
+def isProcessAlive(pid):
+    """
+    Returns True if a process with the given pid exists.
+    """
+
+    if pid is None:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Process exists, but is owned by another user.
+        return True
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def getStateHealth(state, graceSeconds=300):
+    """
+    Returns a dict summarizing the health of the monitor from its state.
+
+    Keys are:
+      - 'running': True if the monitor process is alive and has not
+                   recorded a shutdown.
+      - 'stale': True if the monitor is overdue for its next cycle by more
+                 than graceSeconds.
+      - 'heartbeatAgeSeconds': seconds since the last heartbeat, or None.
+
+    Arguments:
+    state        - dict as returned by readStateFile().
+    graceSeconds - int number of seconds past the next expected cycle
+                   before the monitor is considered stale.
+    """
+
+    nowUtc = datetime.datetime.utcnow()
+
+    running = state.get("shutdownUtcDttm") is None and \
+        isProcessAlive(state.get("pid"))
+
+    heartbeatAgeSeconds = None
+    heartbeatUtcDttm = state.get("heartbeatUtcDttm")
+    if heartbeatUtcDttm is not None:
+        heartbeatAgeSeconds = \
+            (nowUtc - datetime.datetime.fromisoformat(heartbeatUtcDttm)
+             ).total_seconds()
+
+    stale = False
+    nextCycleDueUtcDttm = state.get("nextCycleDueUtcDttm")
+    if running and nextCycleDueUtcDttm is not None:
+        overdueSeconds = \
+            (nowUtc - datetime.datetime.fromisoformat(nextCycleDueUtcDttm)
+             ).total_seconds()
+        stale = overdueSeconds > graceSeconds
+
+    return {
+        "running": running,
+        "stale": stale,
+        "heartbeatAgeSeconds": heartbeatAgeSeconds,
+        }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+##############################################################################
+# Release-time-aware poll scheduling.
+#
+# New sheets and freed-up shifts tend to show up at the same times of the
+# week.  This module builds a time-of-week profile of when shifts became
+# available for signup, and turns it into a factor applied to the poll
+# interval: below 1 (a burst of polling) around the times shifts usually
+# show up, and above 1 otherwise.
+#
+# With a fixed number of requests, the mean detection latency is lowest
+# when the poll rate in each window is proportional to the square root of
+# the rate of events in it.  The factors are normalized so that the average
+# poll rate over the week is unchanged, i.e. the total number of requests
+# stays the same.
+##############################################################################
+
+import math
+import datetime
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Width of a time-of-week bucket of the profile, in minutes.
+BUCKET_MINUTES = 15
+
+# Number of buckets in a week.
+BUCKETS_PER_WEEK = 7 * 24 * 60 // BUCKET_MINUTES
+
+##############################################################################
+# Methods
+##############################################################################
+
+def getBucket(timestamp):
+    """
+    Returns the int time-of-week bucket, in local time, of the given
+    time.time() timestamp.  Bucket 0 starts on Monday at 00:00.
+    """
+
+    dt = datetime.datetime.fromtimestamp(timestamp)
+    return (dt.weekday() * 24 * 60 + dt.hour * 60 + dt.minute) // \
+        BUCKET_MINUTES
+
+##############################################################################
+# Classes
+##############################################################################
+
+class ReleaseTimeProfile:
+    """
+    Time-of-week profile of when shifts became available for signup, and
+    the poll interval factor derived from it.
+    """
+
+    def __init__(self, minIntervalFactor=0.25, maxIntervalFactor=4.0,
+                 smoothingBuckets=2, minNumEvents=20):
+        """
+        Arguments:
+        minIntervalFactor - float smallest factor (fastest polling).
+        maxIntervalFactor - float largest factor (slowest polling).
+        smoothingBuckets  - int number of buckets on each side that an
+                            event is spread over, since releases do not
+                            happen at exactly the same minute every week.
+        minNumEvents      - int number of events needed before the
+                            profile is used.  With fewer, the factor is
+                            always 1.
+        """
+
+        self.minIntervalFactor = minIntervalFactor
+        self.maxIntervalFactor = maxIntervalFactor
+        self.smoothingBuckets = smoothingBuckets
+        self.minNumEvents = minNumEvents
+        self.numEvents = 0
+        self.intervalFactors = [1.0] * BUCKETS_PER_WEEK
+
+    def build(self, eventTimestamps):
+        """
+        Rebuilds the profile from the given list of time.time() timestamps,
+        each when a shift became available for signup.
+        """
+
+        self.numEvents = len(eventTimestamps)
+        if self.numEvents < self.minNumEvents:
+            self.intervalFactors = [1.0] * BUCKETS_PER_WEEK
+            return
+
+        counts = [0.0] * BUCKETS_PER_WEEK
+        for timestamp in eventTimestamps:
+            counts[getBucket(timestamp)] += 1
+
+        # Spread each event over its neighbouring buckets (wrapping around
+        # the week), and add a prior so that no bucket has zero intensity.
+        width = 2 * self.smoothingBuckets + 1
+        prior = 0.5 * self.numEvents / BUCKETS_PER_WEEK
+        intensities = []
+        for bucket in range(BUCKETS_PER_WEEK):
+            total = 0.0
+            for offset in range(-self.smoothingBuckets,
+                                self.smoothingBuckets + 1):
+                total += counts[(bucket + offset) % BUCKETS_PER_WEEK]
+            intensities.append(total / width + prior)
+
+        # Poll rates proportional to the square root of the intensities,
+        # normalized to an average of 1, and clamped.  Clamping moves the
+        # average, so normalize and clamp again a few times.
+        minRate = 1.0 / self.maxIntervalFactor
+        maxRate = 1.0 / self.minIntervalFactor
+        rates = [math.sqrt(intensity) for intensity in intensities]
+        for i in range(20):
+            meanRate = sum(rates) / BUCKETS_PER_WEEK
+            rates = [min(maxRate, max(minRate, rate / meanRate))
+                     for rate in rates]
+        self.intervalFactors = [1.0 / rate for rate in rates]
+
+    def getIntervalFactor(self, timestamp):
+        """
+        Returns the float factor to apply to the poll interval at the given
+        time.time() timestamp.
+        """
+
+        return self.intervalFactors[getBucket(timestamp)]
+
+    def getBurstWindows(self, maxNumWindows=5):
+        """
+        Returns a list of str describing the time-of-week windows polled
+        fastest, e.g. 'Mon 09:00-09:15 x0.25', fastest first.
+        """
+
+        dayNames = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+        buckets = sorted(range(BUCKETS_PER_WEEK),
+                         key=lambda bucket: self.intervalFactors[bucket])
+        windows = []
+        for bucket in buckets[:maxNumWindows]:
+            factor = self.intervalFactors[bucket]
+            if factor >= 1.0:
+                break
+            startMinute = bucket * BUCKET_MINUTES
+            endMinute = startMinute + BUCKET_MINUTES
+            windows.append(
+                dayNames[startMinute // (24 * 60)] + " " +
+                "{:02d}:{:02d}-{:02d}:{:02d}".format(
+                    startMinute // 60 % 24, startMinute % 60,
+                    endMinute // 60 % 24, endMinute % 60) +
+                " x{:.2f}".format(factor))
+        return windows
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+##############################################################################
+# Adaptive control of the rate of requests to the web server.
+#
+# Requests are spaced by a delay that adapts to how the web server copes,
+# in the way TCP adapts its sending rate (additive increase, multiplicative
+# decrease, "AIMD"): every successful response raises the request rate by a
+# small constant amount, and every response telling the client to slow
+# down (429 Too Many Requests, 503 Service Unavailable) halves it.  The rate
+# settles just below the highest rate the web server tolerates, and backs
+# off quickly when the web server is busy.
+#
+# A Retry-After header of a response is honored on top of that: no request
+# is made before the time it gives.
+##############################################################################
+
+import time
+import datetime
+import email.utils
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# HTTP status codes of the responses telling the client to slow down.
+PUSHBACK_STATUS_CODES = [429, 503]
+
+##############################################################################
+# Methods
+##############################################################################
+
+def parseRetryAfter(value, now=None):
+    """
+    Returns the float number of seconds to wait given by the value of a
+    Retry-After header, which is either a number of seconds or an HTTP
+    date, or None if the value is missing or invalid.
+
+    Arguments:
+    value - str value of the header, or None.
+    now   - float time.time() the date is relative to (defaults to the
+            current time).
+    """
+
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    if now is None:
+        now = time.time()
+    return max(0.0, dt.timestamp() - now)
+
+##############################################################################
+# Classes
+##############################################################################
+
+class AdaptiveRateController:
+    """
+    Spaces requests by an adaptive delay (see the top of this module).
+    Call waitForTurn() before each request, and recordResponse() after it.
+    """
+
+    def __init__(self, delaySeconds, minDelaySeconds, maxDelaySeconds,
+                 increasePerSuccess=0.01, decreaseFactor=0.5,
+                 minPushbackDelaySeconds=1.0, maxRetryAfterSeconds=3600,
+                 isAdaptive=True):
+        """
+        Arguments:
+        delaySeconds            - float initial number of seconds between
+                                  the end of a response and the next
+                                  request.
+        minDelaySeconds         - float smallest delay (fastest rate).
+        maxDelaySeconds         - float largest delay (slowest rate).
+        increasePerSuccess      - float requests per second added to the
+                                  rate on each successful response.
+        decreaseFactor          - float factor the rate is multiplied by on
+                                  each pushback.
+        minPushbackDelaySeconds - float smallest delay after a pushback, for
+                                  when the delay was 0 (unlimited rate).
+        maxRetryAfterSeconds    - float longest Retry-After honored.
+                                  Longer ones are shortened to it.
+        isAdaptive              - bool.  If False, the delay stays as it is
+                                  set, and only Retry-After is honored.
+        """
+
+        self.minDelaySeconds = min(minDelaySeconds, delaySeconds)
+        self.maxDelaySeconds = max(maxDelaySeconds, delaySeconds)
+        self.delaySeconds = delaySeconds
+        self.increasePerSuccess = increasePerSuccess
+        self.decreaseFactor = decreaseFactor
+        self.minPushbackDelaySeconds = minPushbackDelaySeconds
+        self.maxRetryAfterSeconds = maxRetryAfterSeconds
+        self.isAdaptive = isAdaptive
+
+        # time.monotonic() of the end of the last response, and before
+        # which no request is made (from a Retry-After or a pause).
+        self.lastResponseTime = None
+        self.blockedUntilTime = None
+
+        self.numPushbacks = 0
+
+    def getDelaySeconds(self):
+        return self.delaySeconds
+
+    def setDelaySeconds(self, delaySeconds):
+        """
+        Sets the delay, e.g. from the control interface.  The bounds are
+        widened if needed to include it.
+        """
+
+        self.delaySeconds = delaySeconds
+        self.minDelaySeconds = min(self.minDelaySeconds, delaySeconds)
+        self.maxDelaySeconds = max(self.maxDelaySeconds, delaySeconds)
+
+    def getSecondsUntilNextRequest(self, now=None):
+        """
+        Returns the float number of seconds until the next request may be
+        made, 0 if right away.
+        """
+
+        if now is None:
+            now = time.monotonic()
+        nextRequestTime = now
+        if self.lastResponseTime is not None:
+            nextRequestTime = max(nextRequestTime,
+                                  self.lastResponseTime + self.delaySeconds)
+        if self.blockedUntilTime is not None:
+            nextRequestTime = max(nextRequestTime, self.blockedUntilTime)
+        return nextRequestTime - now
+
+    def isBlocked(self, now=None):
+        """
+        Returns True if no request may be made before a Retry-After or a
+        pause is over.
+        """
+
+        if now is None:
+            now = time.monotonic()
+        return self.blockedUntilTime is not None and \
+            now < self.blockedUntilTime
+
+    def waitForTurn(self):
+        """
+        Sleeps until the next request may be made.
+
+        Returns:
+        float number of seconds slept.
+        """
+
+        numSeconds = self.getSecondsUntilNextRequest()
+        if numSeconds > 0:
+            time.sleep(numSeconds)
+        return max(0.0, numSeconds)
+
+    def pauseFor(self, numSeconds):
+        """
+        Makes no request for the given number of seconds, without changing
+        the rate, e.g. after a server or connection error.
+        """
+
+        now = time.monotonic()
+        self.lastResponseTime = now
+        self.blockUntil(now + numSeconds)
+
+    def blockUntil(self, blockedUntilTime):
+        if self.blockedUntilTime is None or \
+                blockedUntilTime > self.blockedUntilTime:
+            self.blockedUntilTime = blockedUntilTime
+
+    def recordResponse(self, statusCode, retryAfterSeconds=None):
+        """
+        Adapts the rate to a response of the web server.
+
+        Arguments:
+        statusCode        - int HTTP status code of the response.
+        retryAfterSeconds - float number of seconds of the Retry-After
+                            header of the response, or None.
+
+        Returns:
+        bool True if the response was a pushback.
+        """
+
+        now = time.monotonic()
+        self.lastResponseTime = now
+
+        isPushback = statusCode in PUSHBACK_STATUS_CODES
+        if isPushback:
+            self.numPushbacks += 1
+            if self.isAdaptive:
+                self.delaySeconds = \
+                    max(self.delaySeconds / self.decreaseFactor,
+                        self.minPushbackDelaySeconds)
+                self.delaySeconds = min(self.delaySeconds,
+                                        self.maxDelaySeconds)
+        elif 200 <= statusCode < 400 and self.isAdaptive and \
+                self.delaySeconds > 0:
+            rate = 1.0 / self.delaySeconds + self.increasePerSuccess
+            self.delaySeconds = max(1.0 / rate, self.minDelaySeconds)
+
+        if retryAfterSeconds is not None:
+            self.blockUntil(now + min(retryAfterSeconds,
+                                      self.maxRetryAfterSeconds))
+        return isPushback
@@ -2,13 +2,26 @@
 
 import optparse
 import html
+import json
 import datetime
-import sh
-import subprocess
+import hashlib
+import threading
+import time
 import sys
 import os
 import os.path
-from flask import Flask, redirect, url_for
+import base64
+import sqlite3
+import urllib.parse
+import logscan
+import monitorstate
+import metrics
+import cycleprofiler
+import eventlog
+import logindex
+import statsbuckets
+from flask import Flask, redirect, url_for, jsonify
+from flask import request, make_response, Response, stream_with_context
 
 # Location of the source directory, based on this script file.
 SRC_DIR = os.path.abspath(sys.path[0])
@@ -17,13 +30,161 @@ LOG_DIR = \
     os.path.abspath(os.path.join(SRC_DIR,
                                  ".." + os.sep + "logs"))
 
+DATA_DIR = \
+    os.path.abspath(os.path.join(SRC_DIR,
+                                 ".." + os.sep + "data"))
+
+# File path of the state file published by lcplpagesubs.py.
+MONITOR_STATE_FILENAME = \
+    os.path.abspath(os.path.join(DATA_DIR,
+                                 "lcplpagesubs.state.json"))
+
+# File path of the metrics snapshot file published by lcplpagesubs.py.
+METRICS_FILENAME = \
+    os.path.abspath(os.path.join(DATA_DIR,
+                                 "lcplpagesubs.metrics.json"))
+
+# Directory where lcplpagesubs.py writes profiles of its poll cycles.
+PROFILE_DIR = \
+    os.path.abspath(os.path.join(LOG_DIR, "profiles"))
+
+# File path of the sqlite database of lcplpagesubs.py.  Can be overridden
+# with the environment variable LCPL_PAGE_SUBS_DATABASE_FILENAME, as for the
+# monitor.  It is only ever opened read-only here.
+DATABASE_FILENAME = \
+    os.path.abspath(os.environ.get("LCPL_PAGE_SUBS_DATABASE_FILENAME",
+                                   os.path.join(DATA_DIR,
+                                                "lcpl_page_shifts.db")))
+
+# Number of seconds a query waits on the database while the monitor writes.
+DATABASE_READ_TIMEOUT_SECONDS = 5
+
+# Default and maximum number of shifts per page of the availability routes.
+AVAILABILITY_DEFAULT_LIMIT = 100
+AVAILABILITY_MAX_LIMIT = 1000
+
+# Default and maximum number of rows of the statistics route, and the
+# default number of days of statistics returned.
+STATS_DEFAULT_LIMIT = 500
+STATS_MAX_LIMIT = 5000
+STATS_DEFAULT_DAYS = 7
+
+# Directory of the event log written by lcplpagesubs.py.  Can be overridden
+# with the environment variable LCPL_PAGE_SUBS_EVENT_LOG_DIR, as for the
+# monitor.
+EVENT_LOG_DIR = \
+    os.environ.get("LCPL_PAGE_SUBS_EVENT_LOG_DIR",
+                   os.path.join(DATA_DIR, "lcplpagesubs.events"))
+
+# Number of seconds between two checks for new events while streaming.
+EVENT_STREAM_POLL_SECONDS = 0.25
+
+# Maximum number of events read and sent at once.  The next events are only
+# read once the previous ones have been written to the client, so a slow
+# client falls behind in the event log rather than in memory.
+EVENT_STREAM_BATCH_SIZE = 100
+
+# Number of seconds between two keep-alive comments on an idle stream.
+EVENT_STREAM_KEEPALIVE_SECONDS = 15
+
+# Number of seconds after which a stream is closed.  Clients reconnect
+# (after EVENT_STREAM_RETRY_MILLISECONDS) and resume from the last event
+# they got.  Must be shorter than the gunicorn worker timeout.
+EVENT_STREAM_MAX_SECONDS = 45
+EVENT_STREAM_RETRY_MILLISECONDS = 1000
+
+# Number of seconds a rendered status page is served from the cache.
+STATUS_PAGE_CACHE_TTL_SECONDS = 5
+
+# Number of log lines shown on the status page.
+STATUS_PAGE_NUM_TAIL_LINES = 20
+
+# Log files shown by the log viewer, by name, and the files their indexes
+# are saved to (see logindex.py).
+LOG_VIEWER_FILENAMES = {
+    "main": os.path.join(LOG_DIR, "lcplpagesubs.log"),
+    "html": os.path.join(LOG_DIR, "lcplpagesubs.html.log"),
+    }
+LOG_VIEWER_INDEX_FILENAME_FORMAT = \
+    os.path.join(DATA_DIR, "lcplpagesubs.logindex.{}.json")
+
+# Default and maximum number of records per page of the log viewer.
+LOG_VIEWER_DEFAULT_LIMIT = 100
+LOG_VIEWER_MAX_LIMIT = 1000
+
+# Indexes of the log files shown by the log viewer, by name.
+_logIndexesByName = {}
+_logIndexesLock = threading.Lock()
+
+# Cache of the rendered status page.
+_statusPageCache = {"expiresAt": 0.0, "body": None, "etag": None}
+_statusPageCacheLock = threading.Lock()
+
 global app
 app = Flask(__name__)
 
-def tail(filename, n):
-    cmd = ["tail", "-n", str(n), filename]
-    lines = subprocess.check_output(cmd).decode("UTF-8").split("\n")
-    return lines
+def getBootTime():
+    """
+    Returns the system boot time in seconds since the epoch, read from
+    /proc/stat, or None if it is not available.
+    """
+
+    try:
+        with open("/proc/stat", "r") as f:
+            for line in f:
+                if line.startswith("btime "):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def listProcesses(pattern):
+    """
+    Returns a list of tuples (pid, ppid, startDttm, cmdline) for the
+    running processes whose command line contains the given str.
+    Processes are read straight from /proc rather than by running 'ps'.
+    startDttm is a datetime.datetime in local time, or None if unknown.
+    """
+
+    bootTime = getBootTime()
+    clockTicksPerSecond = os.sysconf("SC_CLK_TCK")
+
+    processes = []
+    try:
+        pidNames = os.listdir("/proc")
+    except OSError:
+        return processes
+
+    for pidName in pidNames:
+        if not pidName.isdigit():
+            continue
+        procDir = "/proc/" + pidName
+        try:
+            with open(procDir + "/cmdline", "rb") as f:
+                cmdline = f.read()
+            cmdline = cmdline.replace(b"\0", b" ").decode(
+                "UTF-8", errors="replace").strip()
+            if cmdline == "" or cmdline.find(pattern) == -1:
+                continue
+            with open(procDir + "/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            # Process exited while we were looking at it.
+            continue
+
+        # Fields after the parenthesized command name, starting at 'state'.
+        fields = stat[stat.rfind(")") + 2:].split()
+        ppid = int(fields[1])
+        startDttm = None
+        if bootTime is not None:
+            startTicks = int(fields[19])
+            startDttm = datetime.datetime.fromtimestamp(
+                bootTime + startTicks / clockTicksPerSecond)
+
+        processes.append((int(pidName), ppid, startDttm, cmdline))
+
+    processes.sort()
+    return processes
 
 def toHtmlNbspAndHtmlHyphen(strWithSpacesOrDashes):
     """Returns the string with spaces replaced with HTML non-breaking spaces,
@@ -51,6 +212,410 @@ def getHtmlHead():
     htmlStr += "</head>"
     return htmlStr
 
+def getMonitorStateLines(state, desiredFormat):
+    """
+    Returns a list of HTML-escaped str lines describing the monitor's
+    last poll cycle, taken from the monitor state.
+    """
+
+    if state is None:
+        return [toHtmlNbspAndHtmlHyphen(
+            desiredFormat.format("Monitor state: ") + "Unavailable")]
+
+    health = monitorstate.getStateHealth(state)
+    if health["running"] and health["stale"]:
+        healthText = "Running, but overdue for its next cycle"
+    elif health["running"]:
+        healthText = "Running (" + str(state.get("phase")) + ")"
+    else:
+        healthText = "Not running"
+
+    lastCycleDurationSeconds = state.get("lastCycleDurationSeconds")
+    if lastCycleDurationSeconds is not None:
+        lastCycleDurationSeconds = \
+            "{:.3f} seconds".format(lastCycleDurationSeconds)
+
+    startupSeconds = state.get("startupSeconds")
+    if startupSeconds is not None:
+        startupSeconds = "{:.3f} seconds".format(startupSeconds)
+
+    rows = [
+        ("Monitor state: ", healthText),
+        ("Startup took: ", startupSeconds),
+        ("Cycles completed: ", state.get("cycleCount")),
+        ("Last cycle ended: ", state.get("lastCycleEndUtcDttm")),
+        ("Last cycle took: ", lastCycleDurationSeconds),
+        ("URLs polled: ", len(state.get("lastCycleUrls") or [])),
+        ("Next cycle due: ", state.get("nextCycleDueUtcDttm")),
+        ("Poll interval factor: ", state.get("pollIntervalFactor")),
+        ("Burst windows: ", ", ".join(state.get("burstWindows") or [])),
+        ("Recent errors: ", len(state.get("recentErrors") or [])),
+        ]
+
+    alertLatency = state.get("alertLatency")
+    if alertLatency is not None:
+        rows.append(("Alert latency SLO: ",
+                     "p" + str(alertLatency.get("sloPercentile")) + " <= " +
+                     str(alertLatency.get("sloSeconds")) + " seconds"))
+        for (name, summary) in sorted(
+                (alertLatency.get("summaries") or {}).items()):
+            value = "n=" + str(summary.get("count"))
+            for key in ["p50", "p95", "p99"]:
+                if summary.get(key) is not None:
+                    value += ", " + key + "={:.1f}s".format(summary[key])
+            if name in (alertLatency.get("breachedChannels") or []):
+                value += " (SLO breached)"
+            rows.append(("Latency (" + name + "): ", value))
+
+    lines = []
+    for (label, value) in rows:
+        if value is None:
+            value = "Unknown"
+        line = desiredFormat.format(label) + html.escape(str(value))
+        lines.append(toHtmlNbspAndHtmlHyphen(line))
+    return lines
+
+def openReadOnlyDatabase():
+    """
+    Returns a read-only sqlite3 connection to the monitor's database, or
+    None if the database does not exist.
+    """
+
+    if not os.path.isfile(DATABASE_FILENAME):
+        return None
+    uri = "file:" + urllib.parse.quote(DATABASE_FILENAME) + "?mode=ro"
+    return sqlite3.connect(uri, uri=True,
+                           timeout=DATABASE_READ_TIMEOUT_SECONDS)
+
+def encodeAvailabilityCursor(shift):
+    """
+    Returns the str cursor of the page of shifts after the given shift dict.
+    """
+
+    key = [shift["sheetId"], shift["url"], shift["rowNumber"]]
+    return base64.urlsafe_b64encode(
+        json.dumps(key).encode("UTF-8")).decode("ascii")
+
+def decodeAvailabilityCursor(cursorStr):
+    """
+    Returns the list [sheetId, url, rowNumber] of the given cursor, as
+    returned by encodeAvailabilityCursor().  Raises ValueError if it is not
+    a valid cursor.
+    """
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursorStr.encode("ascii")))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor: " + str(e))
+    if not isinstance(key, list) or len(key) != 3 or \
+            not isinstance(key[2], int):
+        raise ValueError("Invalid cursor.")
+    return key
+
+def queryAvailability(args):
+    """
+    Returns a dict of one page of the current shifts, read from the
+    monitor's table 'current_shifts'.  Pages are read by key, in the order
+    of (sheet ID, URL, row number), so each page costs the same however
+    much history the database holds.
+
+    Arguments:
+    args - dict of the query arguments of the request:
+           status - 'SIGN UP' (the default), 'ALREADY FILLED' or 'all'.
+           sheet  - sheet ID to filter on.
+           url    - page URL to filter on.
+           limit  - int number of shifts per page.
+           cursor - the 'nextCursor' of the previous page.
+
+    Returns:
+    dict with the shifts, and 'nextCursor' if there may be more.
+
+    Raises ValueError on invalid arguments, and sqlite3.Error if the
+    database cannot be read.
+    """
+
+    status = args.get("status", "SIGN UP")
+    limit = int(args.get("limit", AVAILABILITY_DEFAULT_LIMIT))
+    limit = max(1, min(limit, AVAILABILITY_MAX_LIMIT))
+
+    whereSqls = ["sheet_id in (select sheet_id from sheets " +
+                 "where active_ind = '1')"]
+    values = []
+    if status != "all":
+        whereSqls.append("status = ?")
+        values.append(status)
+    if args.get("sheet"):
+        whereSqls.append("sheet_id = ?")
+        values.append(args["sheet"])
+    if args.get("url"):
+        whereSqls.append("url = ?")
+        values.append(args["url"])
+    if args.get("cursor"):
+        whereSqls.append("(sheet_id, url, row_number) > (?, ?, ?)")
+        values.extend(decodeAvailabilityCursor(args["cursor"]))
+
+    conn = openReadOnlyDatabase()
+    if conn is None:
+        raise sqlite3.OperationalError("No database at " + DATABASE_FILENAME)
+    try:
+        rows = conn.execute(
+            "select sheet_id, url, row_number, status, upd_utc_dttm " +
+            "from current_shifts where " + " and ".join(whereSqls) +
+            " order by sheet_id, url, row_number limit ?",
+            values + [limit]).fetchall()
+    finally:
+        conn.close()
+
+    shifts = []
+    for (sheetId, url, rowNumber, shiftStatus, updUtcDttm) in rows:
+        shifts.append({
+            "sheetId": sheetId,
+            "url": url,
+            "rowNumber": rowNumber,
+            "status": shiftStatus,
+            "sinceUtcDttm": updUtcDttm,
+            })
+
+    rv = {"status": status, "limit": limit, "shifts": shifts,
+          "nextCursor": None}
+    if len(shifts) == limit:
+        rv["nextCursor"] = encodeAvailabilityCursor(shifts[-1])
+    return rv
+
+def getFillSecondsPercentile(buckets, fraction):
+    """
+    Returns the int upper bound, in seconds, of the bucket of the time to
+    fill distribution holding the given fraction of the fills, or None if
+    there are no fills or it is the last (unbounded) bucket.
+    """
+
+    total = sum(buckets)
+    if total == 0:
+        return None
+    count = 0
+    for i in range(len(buckets)):
+        count += buckets[i]
+        if count >= fraction * total:
+            if i < len(statsbuckets.FILL_SECONDS_BUCKETS):
+                return statsbuckets.FILL_SECONDS_BUCKETS[i]
+            return None
+    return None
+
+def queryStats(args):
+    """
+    Returns a dict of the hourly or daily statistics of the shifts, read
+    from the monitor's table 'shift_stats' (see lcplstats.py), which is
+    rolled up as the monitor runs, so no history is scanned here.
+
+    Arguments:
+    args - dict of the query arguments of the request:
+           period - 'day' (the default) or 'hour'.
+           sheet  - sheet ID to filter on.
+           url    - page URL to filter on.
+           since  - first period to return, as a UTC 'YYYY-MM-DD' or
+                    'YYYY-MM-DDTHH' [default: STATS_DEFAULT_DAYS ago].
+           until  - last period to return [default: the latest].
+           limit  - int maximum number of rows.
+
+    Returns:
+    dict with the rows, oldest first, and the watermarks of the rollup.
+
+    Raises ValueError on invalid arguments, and sqlite3.Error if the
+    database cannot be read.
+    """
+
+    period = args.get("period", "day")
+    if period not in ("day", "hour"):
+        raise ValueError("Invalid period: " + period)
+    limit = int(args.get("limit", STATS_DEFAULT_LIMIT))
+    limit = max(1, min(limit, STATS_MAX_LIMIT))
+    since = args.get("since")
+    if not since:
+        since = (datetime.datetime.utcnow() -
+                 datetime.timedelta(days=STATS_DEFAULT_DAYS)).isoformat()
+        since = since[:10] if period == "day" else since[:13]
+
+    whereSqls = ["period = ?", "period_start >= ?"]
+    values = [period, since]
+    if args.get("until"):
+        whereSqls.append("period_start <= ?")
+        values.append(args["until"])
+    if args.get("sheet"):
+        whereSqls.append("sheet_id = ?")
+        values.append(args["sheet"])
+    if args.get("url"):
+        whereSqls.append("url = ?")
+        values.append(args["url"])
+
+    conn = openReadOnlyDatabase()
+    if conn is None:
+        raise sqlite3.OperationalError("No database at " + DATABASE_FILENAME)
+    try:
+        rows = conn.execute(
+            "select period_start, sheet_id, url, opened_count, " +
+            "filled_count, fill_seconds_sum, fill_seconds_count, " +
+            "fill_seconds_buckets, open_slots, alert_count " +
+            "from shift_stats where " + " and ".join(whereSqls) +
+            " order by period_start, sheet_id, url limit ?",
+            values + [limit]).fetchall()
+        watermarks = {}
+        for (tableName, lastRowid, updUtcDttm) in conn.execute(
+                "select table_name, last_rowid, upd_utc_dttm " +
+                "from stats_watermarks"):
+            watermarks[tableName] = {"lastRowid": lastRowid,
+                                     "updUtcDttm": updUtcDttm}
+    finally:
+        conn.close()
+
+    stats = []
+    for (periodStart, sheetId, url, openedCount, filledCount,
+         fillSecondsSum, fillSecondsCount, fillSecondsBuckets, openSlots,
+         alertCount) in rows:
+        buckets = json.loads(fillSecondsBuckets)
+        meanFillSeconds = None
+        if fillSecondsCount > 0:
+            meanFillSeconds = round(fillSecondsSum / fillSecondsCount, 1)
+        stats.append({
+            "periodStart": periodStart,
+            "sheetId": sheetId,
+            "url": url,
+            "openedCount": openedCount,
+            "filledCount": filledCount,
+            "openSlots": openSlots,
+            "alertCount": alertCount,
+            "fillSecondsCount": fillSecondsCount,
+            "fillSecondsMean": meanFillSeconds,
+            "fillSecondsP50": getFillSecondsPercentile(buckets, 0.5),
+            "fillSecondsP90": getFillSecondsPercentile(buckets, 0.9),
+            "fillSecondsBuckets": buckets,
+            })
+
+    return {"period": period, "since": since, "limit": limit,
+            "fillSecondsBucketBounds": statsbuckets.FILL_SECONDS_BUCKETS,
+            "watermarks": watermarks, "stats": stats,
+            "isTruncated": len(stats) == limit}
+
+def getLogIndex(name):
+    """
+    Returns the logindex.LogIndex of the log file with the given name of
+    LOG_VIEWER_FILENAMES.  Raises ValueError for an unknown name.
+    """
+
+    if name not in LOG_VIEWER_FILENAMES:
+        raise ValueError("Unknown log: " + name + ".  Expected one of: " +
+                         ", ".join(sorted(LOG_VIEWER_FILENAMES)))
+    with _logIndexesLock:
+        if name not in _logIndexesByName:
+            _logIndexesByName[name] = logindex.LogIndex(
+                LOG_VIEWER_FILENAMES[name],
+                LOG_VIEWER_INDEX_FILENAME_FORMAT.format(name))
+        return _logIndexesByName[name]
+
+def encodeLogCursor(position):
+    """
+    Returns the str cursor of the given log position (see logindex.py).
+    """
+
+    return base64.urlsafe_b64encode(
+        json.dumps(list(position)).encode("UTF-8")).decode("ascii")
+
+def decodeLogCursor(cursorStr):
+    """
+    Returns the log position tuple (file key, offset) of the given cursor,
+    as returned by encodeLogCursor().  Raises ValueError if it is not a
+    valid cursor.
+    """
+
+    try:
+        position = json.loads(
+            base64.urlsafe_b64decode(cursorStr.encode("ascii")))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor: " + str(e))
+    if not isinstance(position, list) or len(position) != 2 or \
+            not isinstance(position[0], str) or \
+            not isinstance(position[1], int):
+        raise ValueError("Invalid cursor.")
+    return tuple(position)
+
+def queryLogs(args):
+    """
+    Returns a dict of one page of log records, read through the sparse
+    index of the log file and its rotated backups, so that only the blocks
+    holding the records of the page are read.
+
+    Arguments:
+    args - dict of the query arguments of the request:
+           log    - name of the log, 'main' (the default) or 'html'.
+           level  - minimum level of the records, e.g. 'WARNING'.
+           since  - local time to jump to, e.g. '2024-05-01 13:00': the
+                    page starts at the first record at or after it.
+           until  - local time to jump to: the page ends at the last record
+                    at or before it (or at the end of the 'since' range).
+           before - the 'olderCursor' of a page, to page back.
+           after  - the 'newerCursor' of a page, to page forward.
+           limit  - int number of records per page.
+           Without any of since, until, before and after, the page holds
+           the latest records.
+
+    Returns:
+    dict with the records, oldest first, and the cursors of the older and
+    newer pages.
+
+    Raises ValueError on invalid arguments.
+    """
+
+    name = args.get("log", "main")
+    logIndex = getLogIndex(name)
+    limit = int(args.get("limit", LOG_VIEWER_DEFAULT_LIMIT))
+    limit = max(1, min(limit, LOG_VIEWER_MAX_LIMIT))
+    level = args.get("level") or None
+    levelMask = None
+    if level is not None:
+        levelMask = logindex.getLevelMask(level)
+    since = args.get("since") or None
+    until = args.get("until") or None
+
+    logIndex.refresh()
+    if args.get("after"):
+        isForward = True
+        position = decodeLogCursor(args["after"])
+        since = None
+        until = None
+    elif args.get("before"):
+        isForward = False
+        position = decodeLogCursor(args["before"])
+        since = None
+        until = None
+    elif since is not None:
+        isForward = True
+        position = logIndex.findPosition(since)
+    else:
+        isForward = False
+        position = logIndex.getEndPosition()
+
+    rv = {"log": name, "level": level, "limit": limit, "records": [],
+          "olderCursor": None, "newerCursor": None}
+    if position is None:
+        return rv
+
+    records, reachedPosition = logIndex.readRecords(
+        position, isForward, limit, levelMask, since, until)
+    if isForward:
+        olderPosition = records[0]["start"] if records else position
+        newerPosition = reachedPosition
+    else:
+        records.reverse()
+        olderPosition = reachedPosition
+        newerPosition = records[-1]["end"] if records else position
+
+    for record in records:
+        rv["records"].append({"dttm": record["dttm"],
+                              "level": record["level"],
+                              "text": record["text"]})
+    rv["olderCursor"] = encodeLogCursor(olderPosition)
+    rv["newerCursor"] = encodeLogCursor(newerPosition)
+    return rv
+
 @app.route("/")
 def index():
     return redirect(url_for("serverstatus"))
@@ -82,26 +647,32 @@ def serverstatus():
     htmlStr += "<a href=" + url + ">" + url + "</a>" + endl
     htmlStr += endl
 
-    htmlStr += "</body>"
+    url = url_for("lcplpagesubs_status_json") 
+    htmlStr += "<a href=" + url + ">" + url + "</a>" + endl
+    htmlStr += endl
 
-    htmlStr += "</html>"
+    url = url_for("lcplpagesubs_profile") 
+    htmlStr += "<a href=" + url + ">" + url + "</a>" + endl
+    htmlStr += endl
 
-    return htmlStr
+    url = url_for("lcplpagesubs_logs")
+    htmlStr += "<a href=" + url + ">" + url + "</a>" + endl
+    htmlStr += endl
 
+    htmlStr += "</body>"
 
-@app.route("/serverstatus/lcplpagesubs/status")
-def lcplpagesubs_status():
-    endl = "<br />"
-    indent = "&nbsp;&nbsp;&nbsp;&nbsp;"
+    htmlStr += "</html>"
 
-    nowLocal = datetime.datetime.now()
+    return htmlStr
 
-    lcplpagesubsLogsPath = LOG_DIR
-    lcplpagesubsLogFilename = lcplpagesubsLogsPath + os.sep + "lcplpagesubs.log"
 
-    startupDttm = None
-    shutdownDttm = None
+def getLcplpagesubsLogFilenames():
+    """
+    Returns the list of file paths of the lcplpagesubs log files that
+    exist, the current one first, then the rotated ones, newest first.
+    """
 
+    lcplpagesubsLogFilename = os.path.join(LOG_DIR, "lcplpagesubs.log")
     filenames = []
     if os.path.isfile(lcplpagesubsLogFilename):
         filenames.append(lcplpagesubsLogFilename)
@@ -109,24 +680,72 @@ def lcplpagesubs_status():
         filename = lcplpagesubsLogFilename + "." + str(i)
         if os.path.isfile(filename):
             filenames.append(filename)
+    return filenames
+
+
+def getStatusPageEtag(processes):
+    """
+    Returns the str ETag of the lcplpagesubs status page, built from what
+    the page is rendered from rather than from the rendered page (which
+    shows the current time): the modification time of the state file, the
+    sizes and modification times of the log files, and the processes.  It
+    is cheap to compute, so a conditional GET of an unchanged page is
+    answered without rendering it.
+
+    Arguments:
+    processes - list of the tuples returned by listProcesses().
+    """
+
+    inputs = []
+    for filename in [MONITOR_STATE_FILENAME] + getLcplpagesubsLogFilenames():
+        try:
+            st = os.stat(filename)
+            inputs.append((filename, st.st_size, st.st_mtime_ns))
+        except OSError:
+            inputs.append((filename, None, None))
+    for (pid, ppid, startDttm, cmdline) in processes:
+        inputs.append((pid, ppid, str(startDttm), cmdline))
+    return hashlib.sha1(repr(inputs).encode("UTF-8")).hexdigest()
+
+
+def renderLcplpagesubsStatusPage(processes):
+    """
+    Returns the HTML str of the lcplpagesubs status page.
+
+    Arguments:
+    processes - list of the tuples returned by listProcesses("python3").
+    """
 
-    for filename in filenames:
-        if startupDttm is not None and shutdownDttm is not None:
-            break
-        with open(filename) as f:
-            lines = f.readlines()
-            lines.reverse()
-            for line in lines:
-                if startupDttm is not None and shutdownDttm is not None:
-                    break
-                if line.find("Starting Page Shifts Monitor For LCPL") != -1:
-                    firstDashPos = line.find(" - ")
-                    if firstDashPos != -1:
-                        startupDttm = line[:firstDashPos].strip()
-                elif line.find("Shutdown") != -1 and line.find("rc=") != -1:
-                    firstDashPos = line.find(" - ")
-                    if firstDashPos != -1:
-                        shutdownDttm = line[:firstDashPos].strip()
+    endl = "<br />"
+
+    nowLocal = datetime.datetime.now()
+
+    lcplpagesubsLogsPath = LOG_DIR
+    lcplpagesubsLogFilename = lcplpagesubsLogsPath + os.sep + "lcplpagesubs.log"
+
+    state = monitorstate.readStateFile(MONITOR_STATE_FILENAME)
+
+    # The logs are scanned if there is no state file (e.g. an older monitor
+    # version), or if it does not record the shutdown before the current
+    # run (the previous run did not shut down cleanly).
+    filenames = getLcplpagesubsLogFilenames()
+
+    if state is not None:
+        startupDttm = state.get("startupUtcDttm")
+        if startupDttm is not None:
+            startupDttm += " UTC"
+        shutdownDttm = state.get("shutdownUtcDttm")
+        if shutdownDttm is not None:
+            shutdownDttm += " UTC (rc=" + str(state.get("shutdownRc")) + ")"
+        elif state.get("previousShutdownUtcDttm") is not None:
+            shutdownDttm = state["previousShutdownUtcDttm"] + " UTC (rc=" + \
+                str(state.get("previousShutdownRc")) + \
+                "), before the last startup"
+        else:
+            shutdownDttm = logscan.getLastStartupAndShutdown(filenames)[1]
+    else:
+        startupDttm, shutdownDttm = \
+            logscan.getLastStartupAndShutdown(filenames)
 
     startupStatusMessage = ""
     if startupDttm is None:
@@ -141,29 +760,20 @@ def lcplpagesubs_status():
         shutdownStatusMessage += html.escape(shutdownDttm)
 
     psInfoLines = []
-    for line in sh.grep(sh.ps('-ef', _piped=True), "--color=none", "python3"):
-        if line.find("grep --color=none") == -1:
-            username = ""
-
-            splitLine = line.split(" ")
-            if len(splitLine) > 0:
-                username = splitLine[0]
-
-            usernameReplacement = ""
-            for i in range(len(username)):
-                usernameReplacement += "&nbsp;"
-
-            escapedLine = html.escape(line[len(username):])
-            psInfoLine = usernameReplacement + \
-                toHtmlNbspAndHtmlHyphen(escapedLine)
-            psInfoLines.append(psInfoLine)
+    psFormat = "{:>7} {:>7} {:<19} {}"
+    psInfoLines.append(toHtmlNbspAndHtmlHyphen(
+        psFormat.format("PID", "PPID", "STIME", "CMD")))
+    for (pid, ppid, startDttm, cmdline) in processes:
+        startDttmStr = "?"
+        if startDttm is not None:
+            startDttmStr = startDttm.strftime("%Y-%m-%d %H:%M:%S")
+        line = psFormat.format(pid, ppid, startDttmStr, cmdline)
+        psInfoLines.append(toHtmlNbspAndHtmlHyphen(html.escape(line)))
 
     tailLines = []
     if os.path.isfile(lcplpagesubsLogFilename):
-        numLines = 20
-        lines = tail(lcplpagesubsLogFilename, numLines)
-        for i in range(len(lines)):
-            line = lines[i]
+        for line in logscan.tailLines(lcplpagesubsLogFilename,
+                                      STATUS_PAGE_NUM_TAIL_LINES):
             escapedLine = html.escape(line)
             tailLine = toHtmlNbspAndHtmlHyphen(escapedLine)
             tailLines.append(tailLine)
@@ -179,37 +789,445 @@ def lcplpagesubs_status():
     line3 = desiredFormat.format("Last shutdown was: ") + shutdownStatusMessage
     line3 = toHtmlNbspAndHtmlHyphen(line3)
 
-    htmlStr = "<html>"
-    htmlStr += getHtmlHead()
-    htmlStr += "<body>"
-    htmlStr += "<hr />"
-    htmlStr += "<h3>Application LCPL Page Subs</h3>"
-    htmlStr += "<hr />"
-    htmlStr += endl
-    htmlStr += line1 + endl
-    htmlStr += endl
-    htmlStr += line2 + endl
-    htmlStr += endl
-    htmlStr += line3 + endl
-    htmlStr += endl
-    htmlStr += "<hr />"
-    htmlStr += endl
-    htmlStr += "Running python3 processes are: " + endl
+    monitorLines = getMonitorStateLines(state, desiredFormat)
+
+    parts = []
+    parts.append("<html>")
+    parts.append(getHtmlHead())
+    parts.append("<body>")
+    parts.append("<hr />")
+    parts.append("<h3>Application LCPL Page Subs</h3>")
+    parts.append("<hr />")
+    parts.append(endl)
+    parts.append(line1 + endl)
+    parts.append(endl)
+    parts.append(line2 + endl)
+    parts.append(endl)
+    parts.append(line3 + endl)
+    parts.append(endl)
+    for line in monitorLines:
+        parts.append(line + endl)
+    parts.append(endl)
+    parts.append("<hr />")
+    parts.append(endl)
+    parts.append("Running python3 processes are: " + endl)
     for line in psInfoLines:
-        htmlStr += line + endl
-    htmlStr += endl
-    htmlStr += "<hr />"
-    htmlStr += endl
-    htmlStr += "The last few lines in the lcplpagesubs logs are: " + endl
-    htmlStr += endl
+        parts.append(line + endl)
+    parts.append(endl)
+    parts.append("<hr />")
+    parts.append(endl)
+    parts.append("The last few lines in the lcplpagesubs logs are: " + endl)
+    parts.append(endl)
     for line in tailLines:
-        htmlStr += line + endl
-    htmlStr += endl
-    htmlStr += "<hr />"
-    htmlStr += "</body>"
-    htmlStr += "</html>"
+        parts.append(line + endl)
+    parts.append(endl)
+    url = url_for("lcplpagesubs_logs")
+    parts.append("Older log lines: <a href=" + url + ">" + url + "</a>" + endl)
+    parts.append(endl)
+    parts.append("<hr />")
+    parts.append("</body>")
+    parts.append("</html>")
 
-    return htmlStr
+    return "".join(parts)
+
+@app.route("/serverstatus/lcplpagesubs/status")
+def lcplpagesubs_status():
+    """
+    Serves the lcplpagesubs status page.  The ETag is computed from the
+    inputs of the page (see getStatusPageEtag()), so clients re-requesting
+    a page whose inputs did not change get a '304 Not Modified' without the
+    page being rendered.  The rendered page is cached for
+    STATUS_PAGE_CACHE_TTL_SECONDS, as long as its inputs do not change.
+    """
+
+    processes = listProcesses("python3")
+    etag = getStatusPageEtag(processes)
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = \
+            "max-age=" + str(STATUS_PAGE_CACHE_TTL_SECONDS)
+        return response
+
+    with _statusPageCacheLock:
+        now = time.time()
+        if _statusPageCache["body"] is None or \
+                _statusPageCache["etag"] != etag or \
+                now >= _statusPageCache["expiresAt"]:
+            _statusPageCache["body"] = renderLcplpagesubsStatusPage(processes)
+            _statusPageCache["etag"] = etag
+            _statusPageCache["expiresAt"] = now + STATUS_PAGE_CACHE_TTL_SECONDS
+        body = _statusPageCache["body"]
+
+    response = make_response(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = \
+        "max-age=" + str(STATUS_PAGE_CACHE_TTL_SECONDS)
+    return response.make_conditional(request)
+
+@app.route("/serverstatus/lcplpagesubs/status.json")
+def lcplpagesubs_status_json():
+    state = monitorstate.readStateFile(MONITOR_STATE_FILENAME)
+    if state is None:
+        return jsonify({"available": False}), 503
+
+    rv = dict(state)
+    rv["available"] = True
+    rv["health"] = monitorstate.getStateHealth(state)
+    return jsonify(rv)
+
+@app.route("/serverstatus/lcplpagesubs/profile")
+def lcplpagesubs_profile():
+    """
+    Shows the hottest functions of the last profiled poll cycle.
+    Profiling is enabled in the monitor with the environment variable
+    LCPL_PAGE_SUBS_PROFILE_EVERY_N_CYCLES.
+    """
+
+    endl = "<br />"
+    summary = cycleprofiler.readSummary(PROFILE_DIR)
+
+    parts = []
+    parts.append("<html>")
+    parts.append(getHtmlHead())
+    parts.append("<body>")
+    parts.append("<hr />")
+    parts.append("<h3>Application LCPL Page Subs - Cycle Profile</h3>")
+    parts.append("<hr />")
+    parts.append(endl)
+
+    if summary is None:
+        parts.append("No profiled cycles are available.  Set " +
+                     "LCPL_PAGE_SUBS_PROFILE_EVERY_N_CYCLES for the " +
+                     "monitor to enable profiling." + endl)
+    else:
+        fixedWidthSize = 22
+        desiredFormat = "{:<" + str(fixedWidthSize) + "s}"
+        rows = [
+            ("Cycle number: ", summary.get("cycleNumber")),
+            ("Profiled at: ", str(summary.get("utcDttm")) + " UTC"),
+            ("Elapsed seconds: ", summary.get("elapsedSeconds")),
+            ("Profile file: ", summary.get("pstatsFilename")),
+            ]
+        for (label, value) in rows:
+            line = desiredFormat.format(label) + html.escape(str(value))
+            parts.append(toHtmlNbspAndHtmlHyphen(line) + endl)
+        parts.append(endl)
+
+        lineFormat = "{:>12} {:>12} {:>10}  {}"
+        parts.append(toHtmlNbspAndHtmlHyphen(lineFormat.format(
+            "tottime", "cumtime", "ncalls", "function")) + endl)
+        for row in summary.get("topFunctions", []):
+            line = lineFormat.format("{:.6f}".format(row["totalSeconds"]),
+                                     "{:.6f}".format(row["cumulativeSeconds"]),
+                                     row["calls"],
+                                     row["function"])
+            parts.append(toHtmlNbspAndHtmlHyphen(html.escape(line)) + endl)
+
+    parts.append(endl)
+    parts.append("<hr />")
+    parts.append("</body>")
+    parts.append("</html>")
+    return "".join(parts)
+
+@app.route("/serverstatus/lcplpagesubs/availability.json")
+def lcplpagesubs_availability_json():
+    """
+    Returns a page of the current shifts as JSON.  See queryAvailability()
+    for the query arguments.
+    """
+
+    try:
+        rv = queryAvailability(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({"error": "Database unavailable: " + str(e)}), 503
+    return jsonify(rv)
+
+@app.route("/serverstatus/lcplpagesubs/stats.json")
+def lcplpagesubs_stats_json():
+    """
+    Returns the hourly or daily statistics of the shifts as JSON.  See
+    queryStats() for the query arguments.
+    """
+
+    try:
+        rv = queryStats(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({"error": "Database unavailable: " + str(e)}), 503
+    return jsonify(rv)
+
+@app.route("/serverstatus/lcplpagesubs/availability")
+def lcplpagesubs_availability():
+    """
+    Shows a page of the current shifts, open ones by default.  See
+    queryAvailability() for the query arguments.
+    """
+
+    endl = "<br />"
+    parts = []
+    parts.append("<html>")
+    parts.append(getHtmlHead())
+    parts.append("<body>")
+    parts.append("<hr />")
+    parts.append("<h3>Application LCPL Page Subs - Current Availability</h3>")
+    parts.append("<hr />")
+    parts.append(endl)
+
+    try:
+        rv = queryAvailability(request.args)
+    except ValueError as e:
+        parts.append("Invalid query: " + html.escape(str(e)) + endl)
+        rv = None
+    except sqlite3.Error as e:
+        parts.append("Database unavailable: " + html.escape(str(e)) + endl)
+        rv = None
+
+    if rv is not None:
+        parts.append(html.escape("Status: " + rv["status"]) + endl + endl)
+        if len(rv["shifts"]) == 0:
+            parts.append("No shifts." + endl)
+        lineFormat = "{:<12} {:>5}  {:<16} {:<26} {}"
+        parts.append(toHtmlNbspAndHtmlHyphen(lineFormat.format(
+            "sheet", "row", "status", "since (UTC)", "url")) + endl)
+        for shift in rv["shifts"]:
+            line = lineFormat.format(shift["sheetId"], shift["rowNumber"],
+                                     shift["status"], shift["sinceUtcDttm"],
+                                     shift["url"])
+            parts.append(toHtmlNbspAndHtmlHyphen(html.escape(line)) + endl)
+        if rv["nextCursor"] is not None:
+            args = request.args.to_dict()
+            args["cursor"] = rv["nextCursor"]
+            parts.append(endl + '<a href="?' +
+                         html.escape(urllib.parse.urlencode(args)) +
+                         '">Next page</a>' + endl)
+
+    parts.append(endl)
+    parts.append("<hr />")
+    parts.append("</body>")
+    parts.append("</html>")
+    return "".join(parts)
+
+@app.route("/serverstatus/lcplpagesubs/logs.json")
+def lcplpagesubs_logs_json():
+    """
+    Returns a page of log records as JSON.  See queryLogs() for the query
+    arguments.
+    """
+
+    try:
+        rv = queryLogs(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OSError as e:
+        return jsonify({"error": "Logs unavailable: " + str(e)}), 503
+    return jsonify(rv)
+
+@app.route("/serverstatus/lcplpagesubs/logs")
+def lcplpagesubs_logs():
+    """
+    Shows a page of log records, the latest ones by default, with links to
+    the older and newer pages.  See queryLogs() for the query arguments.
+    """
+
+    endl = "<br />"
+    parts = []
+    parts.append("<html>")
+    parts.append(getHtmlHead())
+    parts.append("<body>")
+    parts.append("<hr />")
+    parts.append("<h3>Application LCPL Page Subs - Logs</h3>")
+    parts.append("<hr />")
+    parts.append(endl)
+
+    parts.append('<form method="get">')
+    for (argName, label) in [("since", "Since"), ("until", "Until")]:
+        parts.append(label + ': <input name="' + argName + '" value="' +
+                     html.escape(request.args.get(argName, "")) +
+                     '" placeholder="YYYY-MM-DD HH:MM:SS" /> ')
+    parts.append('Level: <select name="level">')
+    for level in [""] + list(logindex.LEVEL_BITS):
+        selected = ""
+        if request.args.get("level", "").upper() == level:
+            selected = ' selected="selected"'
+        parts.append('<option value="' + level + '"' + selected + '>' +
+                     (level or "ALL") + '</option>')
+    parts.append('</select> ')
+    for argName in ["log", "limit"]:
+        if argName in request.args:
+            parts.append('<input type="hidden" name="' + argName +
+                         '" value="' + html.escape(request.args[argName]) +
+                         '" />')
+    parts.append('<input type="submit" value="Go" />')
+    parts.append('</form>')
+
+    try:
+        rv = queryLogs(request.args)
+    except ValueError as e:
+        parts.append("Invalid query: " + html.escape(str(e)) + endl)
+        rv = None
+    except OSError as e:
+        parts.append("Logs unavailable: " + html.escape(str(e)) + endl)
+        rv = None
+
+    if rv is not None:
+        pageLinks = []
+        for (argName, cursorName, label) in \
+                [("before", "olderCursor", "Older"),
+                 ("after", "newerCursor", "Newer")]:
+            if rv[cursorName] is None:
+                continue
+            args = {}
+            for keptArgName in ["log", "level", "limit"]:
+                if request.args.get(keptArgName):
+                    args[keptArgName] = request.args[keptArgName]
+            args[argName] = rv[cursorName]
+            pageLinks.append('<a href="?' +
+                             html.escape(urllib.parse.urlencode(args)) +
+                             '">' + label + '</a>')
+        pageLinks.append('<a href="?' + html.escape(urllib.parse.urlencode(
+            {"log": rv["log"], "level": rv["level"] or ""})) +
+            '">Latest</a>')
+        parts.append(endl + " | ".join(pageLinks) + endl + endl)
+
+        if len(rv["records"]) == 0:
+            parts.append("No log records." + endl)
+        for record in rv["records"]:
+            for line in record["text"].split("\n"):
+                parts.append(toHtmlNbspAndHtmlHyphen(html.escape(line)) +
+                             endl)
+        parts.append(endl + " | ".join(pageLinks) + endl)
+
+    parts.append(endl)
+    parts.append("<hr />")
+    parts.append("</body>")
+    parts.append("</html>")
+    return "".join(parts)
+
+@app.route("/metrics")
+def metrics_route():
+    """
+    Serves the monitor's metrics in the Prometheus text exposition format.
+    """
+
+    snapshot = monitorstate.readJsonFile(METRICS_FILENAME)
+    if not isinstance(snapshot, dict):
+        snapshot = {}
+
+    text = metrics.renderPrometheusText(snapshot)
+    text += "# HELP lcplpagesubs_metrics_available " + \
+        "1 if the monitor has published a metrics snapshot.\n"
+    text += "# TYPE lcplpagesubs_metrics_available gauge\n"
+    if "updatedTimestamp" in snapshot:
+        text += "lcplpagesubs_metrics_available 1\n"
+        text += "# HELP lcplpagesubs_metrics_updated_timestamp_seconds " + \
+            "Time the monitor last published its metrics.\n"
+        text += "# TYPE lcplpagesubs_metrics_updated_timestamp_seconds gauge\n"
+        text += "lcplpagesubs_metrics_updated_timestamp_seconds " + \
+            repr(float(snapshot["updatedTimestamp"])) + "\n"
+    else:
+        text += "lcplpagesubs_metrics_available 0\n"
+
+    response = make_response(text)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+def getEventStreamAfterId(eventLog):
+    """
+    Returns the int id of the last event the client of the current request
+    has seen: the 'Last-Event-ID' header sent by reconnecting clients, or
+    else the 'after' query argument, or else the latest event, so that new
+    clients only get new events.  Ids past the end of the log (e.g. after
+    the log was removed) are brought back to its end.
+    """
+
+    lastId = eventLog.getLastId()
+    afterIdStr = request.headers.get("Last-Event-ID")
+    if afterIdStr is None:
+        afterIdStr = request.args.get("after")
+    try:
+        afterId = int(afterIdStr)
+    except (TypeError, ValueError):
+        return lastId
+    return max(0, min(afterId, lastId))
+
+def formatServerSentEvent(event):
+    """
+    Returns the str server-sent event of the given event dict.
+    """
+
+    return "id: " + str(event["id"]) + "\n" + \
+        "event: " + str(event.get("type", "message")) + "\n" + \
+        "data: " + json.dumps(event, sort_keys=True) + "\n\n"
+
+@app.route("/serverstatus/lcplpagesubs/events")
+def lcplpagesubs_events():
+    """
+    Streams the events published by the monitor (see eventlog.py) as
+    server-sent events, from the event after the 'Last-Event-ID' header or
+    the 'after' query argument.  A client that resumes from an event that
+    was already pruned first gets a 'gap' event with the number of events it
+    missed.
+    """
+
+    eventLog = eventlog.EventLog(EVENT_LOG_DIR)
+    reader = eventlog.EventLogReader(eventLog,
+                                     getEventStreamAfterId(eventLog))
+
+    def generateEvents():
+        yield "retry: " + str(EVENT_STREAM_RETRY_MILLISECONDS) + "\n\n"
+        startTime = time.time()
+        lastSendTime = startTime
+        while time.time() - startTime < EVENT_STREAM_MAX_SECONDS:
+            events = reader.readEvents(EVENT_STREAM_BATCH_SIZE)
+            parts = []
+            if reader.numMissedEvents > 0:
+                parts.append("event: gap\ndata: " + json.dumps(
+                    {"numMissedEvents": reader.numMissedEvents}) + "\n\n")
+                reader.numMissedEvents = 0
+            for event in events:
+                parts.append(formatServerSentEvent(event))
+            if len(parts) > 0:
+                lastSendTime = time.time()
+                yield "".join(parts)
+            elif time.time() - lastSendTime >= \
+                    EVENT_STREAM_KEEPALIVE_SECONDS:
+                lastSendTime = time.time()
+                yield ": keep-alive\n\n"
+            if len(events) < EVENT_STREAM_BATCH_SIZE:
+                time.sleep(EVENT_STREAM_POLL_SECONDS)
+
+    response = Response(stream_with_context(generateEvents()),
+                        mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Ask proxies (e.g. nginx) not to buffer the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/serverstatus/lcplpagesubs/events.json")
+def lcplpagesubs_events_json():
+    """
+    Returns the events after the 'after' query argument (default 0), up to
+    'limit' of them (default and maximum 1000), for clients that poll
+    instead of streaming.
+    """
+
+    eventLog = eventlog.EventLog(EVENT_LOG_DIR)
+    try:
+        afterId = int(request.args.get("after", "0"))
+        limit = min(1000, max(1, int(request.args.get("limit", "1000"))))
+    except ValueError:
+        return jsonify({"error": "'after' and 'limit' must be ints."}), 400
+
+    events = eventLog.read(afterId, limit)
+    return jsonify({
+        "firstId": eventLog.getFirstId(),
+        "lastId": eventLog.getLastId(),
+        "events": events,
+        })
 
 #@app.route('/serverstatus/lcplpagesubs/shutdown')
 #def serverstatus_shutdown():
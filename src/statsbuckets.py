@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+##############################################################################
+# Buckets of the time to fill distribution of the shift statistics.
+#
+# The statistics are rolled up by the monitor (lcplstats.py) and served by
+# the status server (serverstatus.py), which does not import the monitor's
+# modules, so the bounds live here, in a module of their own.
+##############################################################################
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Upper bounds, in seconds, of the buckets of the time to fill distribution.
+# The last bucket has no upper bound.  The rolled up statistics are counted
+# in these buckets, so rebuild them after changing the bounds (run
+# 'python3 src/lcplstats.py --rebuild').
+FILL_SECONDS_BUCKETS = [60, 300, 900, 3600, 4 * 3600, 24 * 3600]
+
+##############################################################################
+# Methods
+##############################################################################
+
+def getFillSecondsBucket(numSeconds):
+    """
+    Returns the int index of the bucket of FILL_SECONDS_BUCKETS of the given
+    time to fill.
+    """
+
+    for i in range(len(FILL_SECONDS_BUCKETS)):
+        if numSeconds <= FILL_SECONDS_BUCKETS[i]:
+            return i
+    return len(FILL_SECONDS_BUCKETS)
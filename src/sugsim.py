@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+##############################################################################
+# Synthetic SignUpGenius pages and a local HTTP stand-in server.
+#
+# Generates pages shaped like the captured page in data/ (a 'SUGtableouter'
+# table of shifts, and 'nav-tabs' links calling checkFormChanges('...')),
+# and serves them under /go/<pageName> so that the monitor can be run and
+# load-tested offline.  The same pages are served as JSON under
+# /api/v1/signups/<pageName>/slots, for the json backend of the monitor
+# (see lcplsource.py).  The server can inject latency and 5xx responses,
+# rate-limit requests (answering 429 with a Retry-After), roll the tabs
+# over to a new page, and churn shift statuses.
+#
+# Usage:
+#   python3 src/sugsim.py --port=8000 --tabs=4 --rows=24
+#
+# Then run the monitor against it with:
+#   export LCPL_PAGE_SUBS_BASE_URL="http://127.0.0.1:8000/go/"
+#   export LCPL_PAGE_SUBS_SEED_URL="http://127.0.0.1:8000/go/simsheet-page1"
+#
+# and, to read the pages from the JSON API:
+#   export LCPL_PAGE_SUBS_SOURCE=json
+#   export LCPL_PAGE_SUBS_SOURCE_API_URL="http://127.0.0.1:8000/api/v1/signups/"
+##############################################################################
+
+import sys
+import os
+import re
+import math
+import time
+import json
+import random
+import hashlib
+import datetime
+import threading
+import optparse
+import http.server
+
+##############################################################################
+# Global variables
+##############################################################################
+
+# Location of the source directory, based on this script file.
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Captured SignUpGenius page used as the template of generated pages.
+TEMPLATE_FILENAME = \
+    os.path.abspath(os.path.join(SRC_DIR,
+                                 ".." + os.sep + "data" + os.sep +
+                                 "4090d4aaeaf2ba7f58-page8"))
+
+# Page name of the captured page, replaced in the template.
+TEMPLATE_PAGE_NAME = "4090d4aaeaf2ba7f58-page8"
+
+# Shift statuses, as parsed by the monitor.
+STATUS_SIGN_UP = "SIGN UP"
+STATUS_ALREADY_FILLED = "ALREADY FILLED"
+
+# Library branches used as shift locations.
+LOCATIONS = ["Ashburn", "Brambleton", "Cascades", "Gum Spring",
+             "Lovettsville", "Middleburg", "Purcellville", "Rust",
+             "Sterling", "Tuscarora"]
+
+# Shift times.
+TIMES = ["9:00am - 1:00pm", "1:00pm - 5:00pm", "5:00pm - 9:00pm"]
+
+# HTTP status codes used for injected server errors.
+ERROR_STATUS_CODES = [500, 502, 503, 504]
+
+# Path prefix of the pages, and of the JSON API.  API URLs are the prefix,
+# the page name and '/slots'.
+PAGE_PATH_PREFIX = "/go/"
+API_PATH_PREFIX = "/api/v1/signups/"
+
+# Cached template page, split around the nav tabs and the shifts table.
+_templateParts = None
+
+##############################################################################
+# Methods
+##############################################################################
+
+def _getTemplateParts():
+    """
+    Returns a tuple (head, middle, tail) of the template page text.
+    The nav tab <li> elements go between head and middle, and the
+    shifts table goes between middle and tail.
+    """
+
+    global _templateParts
+    if _templateParts is not None:
+        return _templateParts
+
+    with open(TEMPLATE_FILENAME, "r", encoding="UTF-8") as f:
+        html = f.read()
+
+    navStart = html.find('<ul class="nav nav-tabs list" id="myTab">')
+    navStart = html.find(">", navStart) + 1
+    navEnd = html.find("</ul>", navStart)
+    tableStart = html.find('<table width="100%" cellspacing="0" ' +
+                           'align="center" class="SUGtableouter">')
+    tableEnd = html.rfind("</table>") + len("</table>")
+
+    _templateParts = (html[:navStart],
+                      html[navEnd:tableStart],
+                      html[tableEnd:])
+    return _templateParts
+
+
+def generateNavTabsHtml(tabs, currentPageName):
+    """
+    Returns the <li> elements of the nav tabs.
+
+    Arguments:
+    tabs            - list of tuples (pageName, label).
+    currentPageName - str containing the page name of the current tab.
+    """
+
+    parts = []
+    for (pageName, label) in tabs:
+        color = "#CF6E0C"
+        if pageName == currentPageName:
+            color = "#6E6E6E"
+        parts.append(
+            '\n\t\t\t\t\t\t<li id="" style="background:#FFFFFF;">\n'
+            '\t\t\t\t\t\t\t<a class="tabItem" href="#" '
+            'onClick="javascript:checkFormChanges(\'' + pageName + '\')" '
+            'style="color:' + color + ' !important; font-weight: bold;">\n'
+            '\t\t\t\t\t\t\t\t<span> ' + label + '</span>\n'
+            '\t\t\t\t\t\t\t</a>\n'
+            '\t\t\t\t\t\t</li>\n')
+    parts.append("\t\t\t\t")
+    return "".join(parts)
+
+
+def generateShiftRowHtml(dateText, locationText, timeText, status):
+    """
+    Returns the <tr> of one shift in the shifts table.
+    """
+
+    if status == STATUS_SIGN_UP:
+        slotHtml = \
+            '<input type="checkbox" name="siid" value="1" ' + \
+            'class="SUGcheckbox" /> ' + \
+            '<span class="SUGbutton rounded">Sign Up</span>'
+    else:
+        slotHtml = \
+            '<div style="padding-top:5px !important;">' + \
+            '<span class="SUGsignups">Already filled</span></div>'
+
+    return \
+        '\n\t<tr>\n' + \
+        '\t\t<td class="SUGtable" valign="top" rowspan="1">' + \
+        '<span class="SUGbigbold">' + dateText + '</span></td>\n' + \
+        '\t\t<td class="SUGtable" valign="top" rowspan="1">' + \
+        '<span class="SUGbigbold">' + locationText + '&nbsp;</span></td>\n' + \
+        '\t\t<td class="SUGtable" valign="top"><span class="SUGbigbold">' + \
+        timeText + ' &nbsp;</span></td>\n' + \
+        '\t\t<td class="SUGtable" valign="top" width="45%">\n' + \
+        '\t\t\t<table width="100%" cellpadding="2" cellspacing="0">\n' + \
+        '\t\t\t\t<tr>\n' + \
+        '\t\t\t\t\t<td valign="top" width="48%">' + \
+        '<span class="SUGbigbold">Morning </span></td>\n' + \
+        '\t\t\t\t\t<td width="4%" valign="top">&nbsp;</td>\n' + \
+        '\t\t\t\t\t<td valign="top" width="48%">' + slotHtml + '</td>\n' + \
+        '\t\t\t\t</tr>\n' + \
+        '\t\t\t</table>\n' + \
+        '\t\t</td>\n' + \
+        '\t</tr>\n'
+
+
+def generateShiftsTableHtml(rows):
+    """
+    Returns the 'SUGtableouter' table containing the given shifts.
+
+    Arguments:
+    rows - list of tuples (dateText, locationText, timeText, status).
+    """
+
+    parts = []
+    parts.append('<table width="100%" cellspacing="0" align="center" '
+                 'class="SUGtableouter">\n'
+                 '\t\t<tr>\n'
+                 '\t\t\t<td class="SUGtableheader">Date '
+                 '<span class="SUGheaddate">(mm/dd/yyyy)</span></td>\n'
+                 '\t\t\t<td class="SUGtableheader">Location</td>\n'
+                 '\t\t\t<td class="SUGtableheader">Time '
+                 '<span class="SUGheaddate">(EDT)</span></td>\n'
+                 '\t\t\t<td class="SUGtableheader">Shifts Available</td>\n'
+                 '\t\t</tr>\n')
+    for (dateText, locationText, timeText, status) in rows:
+        parts.append(generateShiftRowHtml(dateText, locationText,
+                                          timeText, status))
+    parts.append('</table>')
+    return "".join(parts)
+
+
+def generateSignupPageHtml(pageName, tabs, rows):
+    """
+    Returns the HTML of a signup page, modeled on the captured page.
+
+    Arguments:
+    pageName - str containing the page name, e.g. 'simsheet-page3'.
+    tabs     - list of tuples (pageName, label) of the nav tabs.
+    rows     - list of tuples (dateText, locationText, timeText, status).
+    """
+
+    (head, middle, tail) = _getTemplateParts()
+    html = head + generateNavTabsHtml(tabs, pageName) + middle + \
+        generateShiftsTableHtml(rows) + tail
+    return re.sub(re.escape(TEMPLATE_PAGE_NAME), pageName, html,
+                  flags=re.IGNORECASE)
+
+
+def generateClosedPageHtml(pageName):
+    """
+    Returns the HTML of a signup page that is no longer available.
+    It has neither a shifts table nor nav tabs.
+    """
+
+    return "<html><head><title>Sign Up Not Found</title></head><body>" + \
+        "<p>The sign up " + pageName + " is no longer available.</p>" + \
+        "</body></html>"
+
+##############################################################################
+# Classes
+##############################################################################
+
+class SignupSheetSimulator:
+    """
+    Holds the state of a simulated signup sheet: a list of tabs, each with
+    its own page of shifts.  Thread-safe.
+    """
+
+    def __init__(self, sheetId="simsheet", numTabs=4, rowsPerTab=24,
+                 signUpRatio=0.1, randomSeed=None):
+        self.sheetId = sheetId
+        self.rowsPerTab = rowsPerTab
+        self.signUpRatio = signUpRatio
+        self.random = random.Random(randomSeed)
+        self.lock = threading.Lock()
+
+        # Dict of page name to list of (dateText, locationText,
+        # timeText, status) tuples.  Ordered from oldest to newest tab.
+        self.tabRows = {}
+
+        # Dict of page name to the tab's label.
+        self.tabLabels = {}
+
+        # Page names of tabs that were rolled over.
+        self.closedPageNames = set()
+
+        self.nextPageNumber = 1
+        self.nextStartDate = datetime.date.today()
+        for i in range(numTabs):
+            self._addTab()
+
+    def _addTab(self):
+        pageName = self.sheetId + "-page" + str(self.nextPageNumber)
+        self.nextPageNumber += 1
+
+        startDate = self.nextStartDate
+        endDate = startDate + datetime.timedelta(days=13)
+        self.nextStartDate = endDate + datetime.timedelta(days=1)
+
+        rows = []
+        for i in range(self.rowsPerTab):
+            date = startDate + datetime.timedelta(days=(i * 14) //
+                                                  max(1, self.rowsPerTab))
+            status = STATUS_ALREADY_FILLED
+            if self.random.random() < self.signUpRatio:
+                status = STATUS_SIGN_UP
+            rows.append((date.strftime("%m/%d/%Y (%a.)"),
+                         self.random.choice(LOCATIONS),
+                         self.random.choice(TIMES),
+                         status))
+
+        self.tabRows[pageName] = rows
+        self.tabLabels[pageName] = "Page Shifts - " + \
+            startDate.strftime("%b %d") + " - " + endDate.strftime("%b %d")
+        return pageName
+
+    def getPageNames(self):
+        with self.lock:
+            return list(self.tabRows.keys())
+
+    def rollover(self):
+        """
+        Closes the oldest tab and opens a new one.
+
+        Returns:
+        str containing the page name of the new tab.
+        """
+
+        with self.lock:
+            if len(self.tabRows) > 0:
+                oldestPageName = next(iter(self.tabRows))
+                del self.tabRows[oldestPageName]
+                del self.tabLabels[oldestPageName]
+                self.closedPageNames.add(oldestPageName)
+            return self._addTab()
+
+    def churn(self, fraction):
+        """
+        Flips the status of a random fraction of all shifts.
+
+        Returns:
+        int number of shifts whose status was flipped.
+        """
+
+        numFlipped = 0
+        with self.lock:
+            for rows in self.tabRows.values():
+                for i in range(len(rows)):
+                    if self.random.random() >= fraction:
+                        continue
+                    (dateText, locationText, timeText, status) = rows[i]
+                    if status == STATUS_SIGN_UP:
+                        status = STATUS_ALREADY_FILLED
+                    else:
+                        status = STATUS_SIGN_UP
+                    rows[i] = (dateText, locationText, timeText, status)
+                    numFlipped += 1
+        return numFlipped
+
+    def getPageHtml(self, pageName):
+        """
+        Returns the HTML of the given page, or None if the page never
+        existed.
+        """
+
+        with self.lock:
+            if pageName in self.tabRows:
+                tabs = [(name, self.tabLabels[name])
+                        for name in self.tabRows.keys()]
+                rows = list(self.tabRows[pageName])
+            elif pageName in self.closedPageNames:
+                return generateClosedPageHtml(pageName)
+            else:
+                return None
+
+        return generateSignupPageHtml(pageName, tabs, rows)
+
+    def getPageJson(self, pageName):
+        """
+        Returns the JSON text of the given page, as served by the JSON API,
+        or None if the page never existed.  See lcplparse.parseJson() for
+        the layout.
+        """
+
+        with self.lock:
+            if pageName in self.tabRows:
+                tabs = [{"pageName": name, "label": self.tabLabels[name]}
+                        for name in self.tabRows.keys()]
+                slots = [{"date": dateText, "location": locationText,
+                          "time": timeText, "status": status}
+                         for (dateText, locationText, timeText, status)
+                         in self.tabRows[pageName]]
+                isOpen = True
+            elif pageName in self.closedPageNames:
+                tabs = []
+                slots = []
+                isOpen = False
+            else:
+                return None
+
+        return json.dumps({"pageName": pageName, "isOpen": isOpen,
+                           "tabs": tabs, "slots": slots})
+
+
+class SimulatorRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the pages of the simulator under /go/<pageName>.
+    The server instance carries the simulator and the fault injection
+    settings (see SimulatorHttpServer).
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.advanceSchedule()
+
+        delaySeconds = server.latencySeconds
+        if server.latencyJitterSeconds > 0:
+            delaySeconds += server.random.uniform(0,
+                                                  server.latencyJitterSeconds)
+        if delaySeconds > 0:
+            time.sleep(delaySeconds)
+
+        retryAfterSeconds = server.takeRateLimitToken()
+        if retryAfterSeconds is not None:
+            self._sendHtml(429, "<html><body>Too Many Requests</body></html>",
+                           {"Retry-After": str(retryAfterSeconds)})
+            return
+
+        if server.errorRate > 0 and server.random.random() < server.errorRate:
+            self._sendHtml(server.random.choice(ERROR_STATUS_CODES),
+                           "<html><body>Server Error</body></html>")
+            return
+
+        path = self.path.split("?")[0]
+        if path.startswith(API_PATH_PREFIX) and path.endswith("/slots"):
+            if server.apiErrorRate > 0 and \
+                    server.random.random() < server.apiErrorRate:
+                self._sendBody(server.random.choice(ERROR_STATUS_CODES),
+                               '{"error": "Server Error"}',
+                               "application/json")
+                return
+            pageName = path[len(API_PATH_PREFIX):-len("/slots")]
+            body = server.simulator.getPageJson(pageName)
+            contentType = "application/json"
+        elif path.startswith(PAGE_PATH_PREFIX):
+            pageName = path[len(PAGE_PATH_PREFIX):]
+            body = server.simulator.getPageHtml(pageName)
+            contentType = "text/html; charset=UTF-8"
+        else:
+            body = None
+
+        if body is None:
+            self._sendHtml(404, "<html><body>Not Found</body></html>")
+            return
+
+        # Pages carry an ETag, and conditional GETs of an unchanged page
+        # get a 304 without a body.
+        etag = '"' + hashlib.sha1(body.encode("UTF-8")).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._sendBody(200, body, contentType, {"ETag": etag})
+
+    def _sendHtml(self, statusCode, html, headers=None):
+        self._sendBody(statusCode, html, "text/html; charset=UTF-8", headers)
+
+    def _sendBody(self, statusCode, text, contentType, headers=None):
+        body = text.encode("UTF-8")
+        self.send_response(statusCode)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class SimulatorHttpServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server for a SignupSheetSimulator, with fault injection and
+    scheduled tab rollovers and status churn.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, simulator, latencySeconds=0.0,
+                 latencyJitterSeconds=0.0, errorRate=0.0,
+                 rolloverEverySeconds=0.0, churnEverySeconds=0.0,
+                 churnFraction=0.05, quiet=False, randomSeed=None,
+                 apiErrorRate=0.0, rateLimit=0.0):
+        super().__init__(address, SimulatorRequestHandler)
+        self.simulator = simulator
+        self.latencySeconds = latencySeconds
+        self.latencyJitterSeconds = latencyJitterSeconds
+        self.errorRate = errorRate
+        self.apiErrorRate = apiErrorRate
+        self.rolloverEverySeconds = rolloverEverySeconds
+        self.churnEverySeconds = churnEverySeconds
+        self.churnFraction = churnFraction
+        self.quiet = quiet
+        self.random = random.Random(randomSeed)
+
+        self.scheduleLock = threading.Lock()
+        now = time.time()
+        self.nextRolloverTime = now + rolloverEverySeconds
+        self.nextChurnTime = now + churnEverySeconds
+
+        # Token bucket of the rate limit: 'rateLimit' requests per second,
+        # in bursts of up to max(1, rateLimit).
+        self.rateLimit = rateLimit
+        self.rateLimitBurst = max(1.0, rateLimit)
+        self.rateLimitTokens = self.rateLimitBurst
+        self.rateLimitTime = now
+
+    def takeRateLimitToken(self):
+        """
+        Takes a token of the rate limit for a request.
+
+        Returns:
+        None if the request is allowed, or else the int number of seconds
+        until it would be, for the Retry-After of a 429.
+        """
+
+        if self.rateLimit <= 0:
+            return None
+        now = time.time()
+        with self.scheduleLock:
+            self.rateLimitTokens = min(self.rateLimitBurst,
+                                       self.rateLimitTokens +
+                                       (now - self.rateLimitTime) *
+                                       self.rateLimit)
+            self.rateLimitTime = now
+            if self.rateLimitTokens >= 1:
+                self.rateLimitTokens -= 1
+                return None
+            return max(1, math.ceil((1 - self.rateLimitTokens) /
+                                    self.rateLimit))
+
+    def advanceSchedule(self):
+        """
+        Applies any tab rollovers and status churn that are due.
+        """
+
+        now = time.time()
+        with self.scheduleLock:
+            while self.rolloverEverySeconds > 0 and \
+                    now >= self.nextRolloverTime:
+                self.nextRolloverTime += self.rolloverEverySeconds
+                newPageName = self.simulator.rollover()
+                if not self.quiet:
+                    print("Rolled over tabs.  New tab: " + newPageName)
+            while self.churnEverySeconds > 0 and now >= self.nextChurnTime:
+                self.nextChurnTime += self.churnEverySeconds
+                numFlipped = self.simulator.churn(self.churnFraction)
+                if not self.quiet:
+                    print("Churned " + str(numFlipped) + " shift statuses.")
+
+##############################################################################
+# Main
+##############################################################################
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-H", "--host", default="127.0.0.1",
+                      help="Host to listen on [default %default]")
+    parser.add_option("-P", "--port", type="int", default=8000,
+                      help="Port to listen on [default %default]")
+    parser.add_option("--sheet-id", default="simsheet",
+                      help="Prefix of the page names [default %default]")
+    parser.add_option("--tabs", type="int", default=4,
+                      help="Number of tabs [default %default]")
+    parser.add_option("--rows", type="int", default=24,
+                      help="Shift rows per tab [default %default]")
+    parser.add_option("--sign-up-ratio", type="float", default=0.1,
+                      help="Initial fraction of open shifts [default %default]")
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="Seconds of latency per request [default %default]")
+    parser.add_option("--jitter", type="float", default=0.0,
+                      help="Extra random seconds of latency, up to this " +
+                           "[default %default]")
+    parser.add_option("--error-rate", type="float", default=0.0,
+                      help="Fraction of requests answered with a 5xx " +
+                           "[default %default]")
+    parser.add_option("--api-error-rate", type="float", default=0.0,
+                      help="Fraction of JSON API requests answered with a " +
+                           "5xx, on top of --error-rate [default %default]")
+    parser.add_option("--rate-limit", type="float", default=0.0,
+                      help="Requests per second allowed; more are answered " +
+                           "with a 429 and a Retry-After.  0 disables " +
+                           "[default %default]")
+    parser.add_option("--rollover-every", type="float", default=0.0,
+                      help="Seconds between tab rollovers.  0 disables " +
+                           "[default %default]")
+    parser.add_option("--churn-every", type="float", default=0.0,
+                      help="Seconds between status churns.  0 disables " +
+                           "[default %default]")
+    parser.add_option("--churn-fraction", type="float", default=0.05,
+                      help="Fraction of shifts flipped per churn " +
+                           "[default %default]")
+    parser.add_option("--seed", type="int", default=None,
+                      help="Random seed, for reproducible runs")
+    parser.add_option("--write-pages", default=None, metavar="DIR",
+                      help="Write the pages of the sheet to DIR and exit")
+    parser.add_option("-q", "--quiet", action="store_true",
+                      help="Do not log requests")
+    options, _ = parser.parse_args()
+
+    simulator = SignupSheetSimulator(options.sheet_id, options.tabs,
+                                     options.rows, options.sign_up_ratio,
+                                     options.seed)
+
+    if options.write_pages is not None:
+        os.makedirs(options.write_pages, exist_ok=True)
+        for pageName in simulator.getPageNames():
+            filename = os.path.join(options.write_pages, pageName)
+            with open(filename, "w", encoding="UTF-8") as f:
+                f.write(simulator.getPageHtml(pageName))
+            print("Wrote: " + filename)
+        return 0
+
+    server = SimulatorHttpServer((options.host, options.port), simulator,
+                                 options.latency, options.jitter,
+                                 options.error_rate, options.rollover_every,
+                                 options.churn_every, options.churn_fraction,
+                                 options.quiet, options.seed,
+                                 options.api_error_rate, options.rate_limit)
+
+    serverUrl = "http://" + options.host + ":" + str(options.port)
+    baseUrl = serverUrl + PAGE_PATH_PREFIX
+    print("Serving " + str(options.tabs) + " tabs of " +
+          str(options.rows) + " rows at " + baseUrl)
+    print("Run the monitor against this server with:")
+    print('  export LCPL_PAGE_SUBS_BASE_URL="' + baseUrl + '"')
+    print('  export LCPL_PAGE_SUBS_SEED_URL="' + baseUrl +
+          simulator.getPageNames()[0] + '"')
+    print("and, to read the pages from the JSON API:")
+    print("  export LCPL_PAGE_SUBS_SOURCE=json")
+    print('  export LCPL_PAGE_SUBS_SOURCE_API_URL="' + serverUrl +
+          API_PATH_PREFIX + '"')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
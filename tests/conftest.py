@@ -0,0 +1,10 @@
+##############################################################################
+# The modules under test live in src/ and import each other as top-level
+# modules, as when run as scripts.
+##############################################################################
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                ".." + os.sep + "src")))
@@ -0,0 +1,52 @@
+##############################################################################
+# Tests of eventlog.py.
+##############################################################################
+
+import os
+import time
+import eventlog
+
+
+def appendEvents(eventLog, numEvents):
+    return eventLog.append([{"n": i} for i in range(numEvents)])
+
+
+def test_idsContinueAfterPruning(tmp_path):
+    eventLog = eventlog.EventLog(str(tmp_path / "events"), segmentMaxBytes=1)
+
+    # One segment per append, since every segment is over the limit.
+    for i in range(3):
+        appendEvents(eventLog, 2)
+    assert eventLog.getSegmentIds() == [1, 3, 5]
+
+    # Age the first two segments, and prune them.
+    oldTime = time.time() - 3600
+    for segmentId in [1, 3]:
+        os.utime(eventLog.getSegmentFilename(segmentId), (oldTime, oldTime))
+    assert eventLog.prune(60) == 2
+    assert eventLog.getSegmentIds() == [5]
+    assert eventLog.getFirstId() == 5
+    assert eventLog.getLastId() == 6
+
+    # Ids go on from the last one, not from the remaining segments.
+    assert appendEvents(eventLog, 2) == 8
+    assert [event["id"] for event in eventLog.read(0)] == [5, 6, 7, 8]
+
+
+def test_latestSegmentIsNeverPruned(tmp_path):
+    eventLog = eventlog.EventLog(str(tmp_path / "events"))
+    appendEvents(eventLog, 3)
+    assert eventLog.prune(0, now=time.time() + 3600) == 0
+    assert appendEvents(eventLog, 1) == 4
+
+
+def test_readerCountsPrunedEvents(tmp_path):
+    eventLog = eventlog.EventLog(str(tmp_path / "events"), segmentMaxBytes=1)
+    for i in range(3):
+        appendEvents(eventLog, 2)
+    reader = eventlog.EventLogReader(eventLog, 1)
+    os.remove(eventLog.getSegmentFilename(1))
+    os.remove(eventLog.getSegmentFilename(3))
+
+    assert [event["id"] for event in reader.readEvents()] == [5, 6]
+    assert reader.numMissedEvents == 3
@@ -0,0 +1,86 @@
+##############################################################################
+# Tests of lcplexport.py.
+##############################################################################
+
+import os
+import glob
+import sqlite3
+import pytest
+import lcplexport
+
+pytest.importorskip("pyarrow")
+
+URL = "https://www.signupgenius.com/go/test-page1"
+
+
+def createDatabase(filename, numRows):
+    conn = sqlite3.connect(filename)
+    conn.execute("create table shifts (crte_utc_dttm text, url text, " +
+                 "row_number text, status text, sheet_id text)")
+    for i in range(numRows):
+        conn.execute("insert into shifts values (?, ?, ?, ?, ?)",
+                     ("2026-10-01T08:00:{:02d}.000000".format(i), URL,
+                      str(i + 1), "SIGN UP", "default"))
+    conn.commit()
+    return conn
+
+
+def getPartFilenames(exportDir):
+    """
+    Returns the sorted list of the files of the partitions, including the
+    temporary ones.
+    """
+
+    partitionDir = os.path.join(exportDir, lcplexport.DATASET_DIRNAME,
+                                "month=*", "url_key=*")
+    return sorted(glob.glob(os.path.join(partitionDir, "*")) +
+                  glob.glob(os.path.join(partitionDir, ".*")))
+
+
+def readSourceRowids(exportDir):
+    pa = lcplexport.importPyarrow()
+    rowids = []
+    for filename in getPartFilenames(exportDir):
+        rowids.extend(pa.parquet.read_table(filename)
+                      .column("source_rowid").to_pylist())
+    return rowids
+
+
+def test_interruptedRunIsCleanedUp(tmp_path, monkeypatch):
+    conn = createDatabase(str(tmp_path / "shifts.db"), 6)
+    exportDir = str(tmp_path / "export")
+
+    # The run is killed after writing the second batch, before moving the
+    # high-water mark past it, while writing the third.
+    saveExportState = lcplexport.saveExportState
+    numSaves = []
+
+    def interruptedSaveExportState(exportDir, state):
+        numSaves.append(1)
+        if len(numSaves) == 2:
+            partFilename = lcplexport.getPartFilename(
+                exportDir, "2026-10", lcplexport.getUrlKey(URL), 5, 6,
+                "parquet")
+            tmpFilename = os.path.join(os.path.dirname(partFilename),
+                                       "." + os.path.basename(partFilename) +
+                                       ".tmp")
+            with open(tmpFilename, "w") as f:
+                f.write("partial")
+            raise KeyboardInterrupt()
+        saveExportState(exportDir, state)
+
+    monkeypatch.setattr(lcplexport, "saveExportState",
+                        interruptedSaveExportState)
+    with pytest.raises(KeyboardInterrupt):
+        lcplexport.exportNewRows(conn, exportDir, batchRows=2)
+    assert len(getPartFilenames(exportDir)) == 3
+    assert lcplexport.loadExportState(exportDir, "parquet")["lastRowid"] == 2
+
+    # The next run removes the part past the mark and the temporary file,
+    # and exports each row once.
+    monkeypatch.setattr(lcplexport, "saveExportState", saveExportState)
+    assert lcplexport.exportNewRows(conn, exportDir, batchRows=2) == (4, 2)
+    assert not [filename for filename in getPartFilenames(exportDir)
+                if filename.endswith(".tmp")]
+    assert readSourceRowids(exportDir) == [1, 2, 3, 4, 5, 6]
+    assert lcplexport.loadExportState(exportDir, "parquet")["lastRowid"] == 6
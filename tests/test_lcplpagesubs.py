@@ -0,0 +1,110 @@
+##############################################################################
+# Tests of the poll cycle of lcplpagesubs.py.
+##############################################################################
+
+import os
+import pytest
+import fetcharchive
+import lcplcommon
+import lcplfetch
+import lcplparse
+import lcplsource
+import lcplstore
+import lcplpagesubs
+
+BASE_URL = "http://www.signupgenius.com/go/test-"
+
+# Recorded page with shifts.
+PAGE_URL = "http://www.signupgenius.com/go/4090d4aaeaf2ba7f58-page8"
+PAGE_FILENAME = os.path.join(os.path.dirname(__file__), "..", "data",
+                             "4090d4aaeaf2ba7f58-page8")
+
+# Page of a tab that has expired: no shifts table, no tabs.
+EXPIRED_HTML = "<html><body><p>This sign up has expired.</p></body></html>"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Opens a new database whose default sheet has its seed at page1, with
+    no fetch state.
+    """
+
+    monkeypatch.setattr(lcplcommon, "seedUrl", BASE_URL + "page1")
+    monkeypatch.setattr(lcplcommon, "baseUrl", BASE_URL)
+    for name in ["httpValidatorsByUrl", "pageFingerprintByUrl",
+                 "pendingPageStateByUrl"]:
+        monkeypatch.setattr(lcplfetch, name, {})
+    monkeypatch.setattr(lcplparse, "lastObservedTimestampByUrl", {})
+    lcplstore.initializeDatabase(str(tmp_path / "shifts.db"))
+    yield
+    lcplstore.closeDatabase()
+
+
+def replayCycles(monkeypatch, archive, numCycles):
+    monkeypatch.setattr(lcplfetch, "replayArchive", archive)
+    monkeypatch.setattr(lcplfetch, "replayCycles", list(range(numCycles)))
+    monkeypatch.setattr(lcplfetch, "replayCycleIndex", 0)
+
+
+def pollOnce():
+    sheets = lcplstore.getSheets()
+    ownedUrls = set(lcplstore.getUrls())
+    urlsBySheetId, sheetsByUrl, urls = \
+        lcplpagesubs.getUrlsToPoll(sheets, ownedUrls)
+    htmlPages = lcplsource.getPages(urls)
+    lcplpagesubs.processPages(htmlPages, urlsBySheetId, sheetsByUrl)
+
+
+def test_twoExpiredTabsInARowAreDeactivated(database, tmp_path,
+                                            monkeypatch):
+    # page1 is the seed.  page2 was added after it.
+    lcplstore.cursor.execute(
+        "insert into urls (crte_utc_dttm, upd_utc_dttm, url, " +
+        "active_ind, sheet_id) values ('9999', '9999', ?, '1', ?)",
+        (BASE_URL + "page2", lcplstore.DEFAULT_SHEET_ID))
+    lcplstore.conn.commit()
+
+    # Both tabs expired at once, and their pages do not change.
+    archive = fetcharchive.FetchArchive(str(tmp_path / "archive.db"))
+    for cycle in range(3):
+        for page in ["page1", "page2"]:
+            archive.addFetch(cycle, BASE_URL + page, 1000.0 + cycle, 200,
+                             EXPIRED_HTML)
+    replayCycles(monkeypatch, archive, 3)
+
+    # Only the earliest URL is deactivated in a cycle, so page2 is
+    # deactivated in the next one, although its page is unchanged.
+    pollOnce()
+    assert lcplstore.getUrls() == [BASE_URL + "page2"]
+    pollOnce()
+    assert lcplstore.getUrls(lcplstore.DEFAULT_SHEET_ID) == []
+    archive.close()
+
+
+def test_sheetsSharingAPageGetTheSameObservedTimestamps(database,
+                                                        monkeypatch):
+    lcplstore.addSheet("other", BASE_URL + "page1")
+    sheets = lcplstore.getSheets()
+    assert len(sheets) == 2
+
+    shifts = []
+
+    def getNewShiftsAvailableForSignup(sheetShifts):
+        shifts.extend(sheetShifts)
+        return []
+
+    monkeypatch.setattr(lcplstore, "getNewShiftsAvailableForSignup",
+                        getNewShiftsAvailableForSignup)
+    lcplparse.lastObservedTimestampByUrl[PAGE_URL] = 900.0
+    with open(PAGE_FILENAME, "r") as f:
+        htmlPage = (PAGE_URL, f.read(), 1000.0)
+    lcplpagesubs.processPages(
+        [htmlPage], dict((sheet.sheetId, [PAGE_URL]) for sheet in sheets),
+        {PAGE_URL: sheets})
+
+    assert set(shift.sheetId for shift in shifts) == \
+        set(sheet.sheetId for sheet in sheets)
+    assert set((shift.previousObservedTimestamp, shift.observedTimestamp)
+               for shift in shifts) == set([(900.0, 1000.0)])
+    assert lcplparse.lastObservedTimestampByUrl[PAGE_URL] == 1000.0
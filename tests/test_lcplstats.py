@@ -0,0 +1,96 @@
+##############################################################################
+# Tests of lcplstats.py.
+##############################################################################
+
+import sqlite3
+import pytest
+import lcplstats
+
+SHEET_ID = "default"
+URL = "https://www.signupgenius.com/go/test-page1"
+
+# (crte_utc_dttm, row_number, status) of table 'shifts': row 1 opens and is
+# filled 10 minutes later, row 2 opens the next day.
+SHIFT_ROWS = [
+    ("2026-10-01T08:00:00.000000", "1", "Already filled"),
+    ("2026-10-01T08:00:00.000000", "2", "Already filled"),
+    ("2026-10-01T09:00:00.000000", "1", "SIGN UP"),
+    ("2026-10-01T09:10:00.000000", "1", "Already filled"),
+    ("2026-10-02T10:00:00.000000", "2", "SIGN UP"),
+    ]
+
+
+def createDatabase(filename):
+    conn = sqlite3.connect(filename)
+    conn.execute("create table shifts (crte_utc_dttm text, url text, " +
+                 "row_number text, status text, sheet_id text)")
+    conn.execute("create table alert_events (event_key text primary key, " +
+                 "crte_utc_dttm text, worker_id text)")
+    conn.commit()
+    return conn
+
+
+def insertShiftRows(conn, rows):
+    for (crteUtcDttm, rowNumber, status) in rows:
+        conn.execute("insert into shifts values (?, ?, ?, ?, ?)",
+                     (crteUtcDttm, URL, rowNumber, status, SHEET_ID))
+        if status == "SIGN UP":
+            conn.execute("insert into alert_events values (?, ?, ?)",
+                         ("|".join([SHEET_ID, URL, rowNumber, crteUtcDttm]),
+                          crteUtcDttm, None))
+    conn.commit()
+
+
+def getStats(conn):
+    return conn.execute("select * from shift_stats " +
+                        "order by period, period_start").fetchall()
+
+
+def getExpectedStats(tmp_path):
+    conn = createDatabase(str(tmp_path / "expected.db"))
+    insertShiftRows(conn, SHIFT_ROWS)
+    lcplstats.aggregateNewRows(conn)
+    return getStats(conn)
+
+
+def test_rowsAddedLaterAreRolledUpOnce(tmp_path):
+    conn = createDatabase(str(tmp_path / "shifts.db"))
+    insertShiftRows(conn, SHIFT_ROWS[:3])
+    assert lcplstats.aggregateNewRows(conn, batchRows=2) == (3, 1)
+    assert lcplstats.aggregateNewRows(conn, batchRows=2) == (0, 0)
+
+    insertShiftRows(conn, SHIFT_ROWS[3:])
+    assert lcplstats.aggregateNewRows(conn, batchRows=2) == (2, 1)
+    assert getStats(conn) == getExpectedStats(tmp_path)
+
+    dayStats = [row for row in getStats(conn)
+                if row[0] == "day" and row[1] == "2026-10-01"][0]
+    # opened_count, filled_count, fill_seconds_sum, alert_count
+    assert (dayStats[4], dayStats[5], dayStats[6], dayStats[10]) == \
+        (1, 1, 600.0, 1)
+
+
+def test_interruptedRunResumesFromWatermark(tmp_path, monkeypatch):
+    conn = createDatabase(str(tmp_path / "shifts.db"))
+    insertShiftRows(conn, SHIFT_ROWS)
+
+    # The second batch fails half-way: it is rolled back, with its
+    # watermark.
+    writeStats = lcplstats.writeStats
+    numCalls = []
+
+    def failingWriteStats(cursor, statsByKey):
+        numCalls.append(1)
+        writeStats(cursor, statsByKey)
+        if len(numCalls) == 2:
+            raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(lcplstats, "writeStats", failingWriteStats)
+    with pytest.raises(sqlite3.OperationalError):
+        lcplstats.aggregateNewRows(conn, batchRows=2)
+    assert lcplstats.getWatermark(conn.cursor(), "shifts") == 2
+
+    # Both alerts were in the first batch.
+    monkeypatch.setattr(lcplstats, "writeStats", writeStats)
+    assert lcplstats.aggregateNewRows(conn, batchRows=2) == (3, 0)
+    assert getStats(conn) == getExpectedStats(tmp_path)
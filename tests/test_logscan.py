@@ -0,0 +1,89 @@
+##############################################################################
+# Tests of logscan.py.
+##############################################################################
+
+import logscan
+
+STARTUP_LINE = "{} - main - INFO - Starting Page Shifts Monitor For LCPL\n"
+SHUTDOWN_LINE = "{} - main - INFO - Shutdown with rc=0\n"
+OTHER_LINE = "{} - main - INFO - Polled 4 pages.\n"
+
+
+def recordScannedRanges(monkeypatch):
+    """
+    Returns a list that gets the (startOffset, endOffset) of every scan.
+    """
+
+    monkeypatch.setattr(logscan, "_scanCache", {})
+    scannedRanges = []
+    scan = logscan._scanForStartupAndShutdown
+
+    def recordingScan(filename, startOffset, endOffset):
+        scannedRanges.append((startOffset, endOffset))
+        return scan(filename, startOffset, endOffset)
+
+    monkeypatch.setattr(logscan, "_scanForStartupAndShutdown",
+                        recordingScan)
+    return scannedRanges
+
+
+def test_onlyAppendedBytesAreRescanned(tmp_path, monkeypatch):
+    scannedRanges = recordScannedRanges(monkeypatch)
+    filename = str(tmp_path / "lcplpagesubs.log")
+    with open(filename, "w") as f:
+        f.write(STARTUP_LINE.format("2026-10-01 08:00:00,000"))
+        f.write(OTHER_LINE.format("2026-10-01 08:01:00,000"))
+    size = len(open(filename, "rb").read())
+
+    assert logscan.getLastStartupAndShutdownInFile(filename) == \
+        ("2026-10-01 08:00:00,000", None)
+    assert scannedRanges == [(0, size)]
+
+    # Unchanged: answered from the cache.
+    logscan.getLastStartupAndShutdownInFile(filename)
+    assert len(scannedRanges) == 1
+
+    # Appended to: only the new bytes are scanned, and the startup found
+    # before is kept.
+    with open(filename, "a") as f:
+        f.write(SHUTDOWN_LINE.format("2026-10-01 09:00:00,000"))
+    newSize = len(open(filename, "rb").read())
+    assert logscan.getLastStartupAndShutdownInFile(filename) == \
+        ("2026-10-01 08:00:00,000", "2026-10-01 09:00:00,000")
+    assert scannedRanges[-1] == (size, newSize)
+
+
+def test_partialLastLineIsRescanned(tmp_path, monkeypatch):
+    scannedRanges = recordScannedRanges(monkeypatch)
+    filename = str(tmp_path / "lcplpagesubs.log")
+    with open(filename, "w") as f:
+        f.write(STARTUP_LINE.format("2026-10-01 08:00:00,000"))
+    size = len(open(filename, "rb").read())
+    logscan.getLastStartupAndShutdownInFile(filename)
+
+    # The shutdown line is being written.
+    with open(filename, "a") as f:
+        f.write("2026-10-01 09:00:00,000 - main - INFO - Shut")
+    assert logscan.getLastStartupAndShutdownInFile(filename)[1] is None
+    assert scannedRanges[-1][0] == size
+
+    with open(filename, "a") as f:
+        f.write("down with rc=1\n")
+    assert logscan.getLastStartupAndShutdownInFile(filename) == \
+        ("2026-10-01 08:00:00,000", "2026-10-01 09:00:00,000")
+    assert scannedRanges[-1][0] == size
+
+
+def test_truncatedFileIsScannedAgain(tmp_path, monkeypatch):
+    scannedRanges = recordScannedRanges(monkeypatch)
+    filename = str(tmp_path / "lcplpagesubs.log")
+    with open(filename, "w") as f:
+        f.write(STARTUP_LINE.format("2026-10-01 08:00:00,000"))
+        f.write(SHUTDOWN_LINE.format("2026-10-01 09:00:00,000"))
+    logscan.getLastStartupAndShutdownInFile(filename)
+
+    with open(filename, "w") as f:
+        f.write(STARTUP_LINE.format("2026-10-02 08:00:00,000"))
+    assert logscan.getLastStartupAndShutdownInFile(filename) == \
+        ("2026-10-02 08:00:00,000", None)
+    assert scannedRanges[-1][0] == 0